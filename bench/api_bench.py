@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""Dashboard API load test over synthetic history.
+
+Generates months of batches x thousands of devices into a scratch
+data/history/ (same row shapes history_writer.py writes), loads
+dashboard/main.py against it (RETRIEVOS_DATA_DIR) and drives the read
+endpoints through an in-process ASGI client:
+
+  - per-endpoint phase: N requests at concurrency C, one endpoint at a time
+  - mixed phase: all endpoints at once, to show whether heavy history reads
+    (timeline, batch devices/cves) slow down cheap calls like /api/run/status
+
+Reports p50/p99 latency, requests/sec and peak Python heap (tracemalloc) per
+endpoint, as JSON for run-over-run comparison:
+
+  python bench/api_bench.py --batches 90 --devices 2000 --out data/bench/api_base.json
+  python bench/api_bench.py --batches 90 --devices 2000 --compare data/bench/api_base.json
+"""
+from __future__ import annotations
+import os, sys, json, time, random, shutil, asyncio, argparse, tempfile, tracemalloc, importlib.util
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'pipeline'))
+
+import gen_devices  # type: ignore
+import stand_ins  # type: ignore
+import timeline_index  # type: ignore
+
+SEVERITIES = ['Critical', 'High', 'Medium', 'Low']
+
+
+def _cve_lists(platform: str, version: str) -> Dict[str, List[Dict[str, Any]]]:
+    out: Dict[str, List[Dict[str, Any]]] = {s: [] for s in SEVERITIES}
+    for adv in stand_ins.advisories(platform, version):
+        for cve in adv['cves']:
+            out.setdefault(adv['sir'], []).append({
+                'id': cve, 'title': adv['advisoryTitle'], 'advisory_id': adv['advisoryId'],
+                'cisco_url': f"https://tools.cisco.com/security/center/content/CiscoSecurityAdvisory/{adv['advisoryId']}",
+                'nvd_url': f"https://nvd.nist.gov/vuln/detail/{cve}",
+            })
+    return out
+
+
+def gen_history(data_dir: str, batches: int, devices: int, pids: int = 20, versions: int = 12,
+                every_hours: float = 24.0, seed: int = 1, timelines: bool = True) -> List[str]:
+    """Write devices/cves snapshots and batch summaries for `batches` runs; returns batch timestamps (oldest first)."""
+    rnd = random.Random(seed)
+    devices_map, alias = gen_devices.generate(devices, pids, versions, seed)
+    hist = os.path.join(data_dir, 'history')
+    os.makedirs(hist, exist_ok=True)
+    start = datetime(2025, 1, 1, 2, 0, tzinfo=timezone.utc)
+    stamps = [(start + timedelta(hours=every_hours * i)).strftime('%Y-%m-%dT%H:%M:%SZ') for i in range(batches)]
+    with open(os.path.join(hist, 'devices_snapshot.jsonl'), 'w', encoding='utf-8') as fd, \
+            open(os.path.join(hist, 'cves_snapshot.jsonl'), 'w', encoding='utf-8') as fc, \
+            open(os.path.join(hist, 'batches.jsonl'), 'w', encoding='utf-8') as fb:
+        for ts in stamps:
+            summary = {'batch_ts': ts, 'device_count': 0, 'devices_with_upgrade_recommended': 0,
+                       'devices_with_critical_cves': 0, 'devices_eol': 0, 'total_high_cves': 0,
+                       'total_medium_cves': 0}
+            for host, rec in devices_map.items():
+                if rnd.random() < 0.02:  # occasional upgrade between batches
+                    rec['version'] = gen_devices._version(2 if rec['platform'] == 'nxos' else 0,
+                                                          rnd.randrange(max(1, versions)))
+                cves = _cve_lists(rec['platform'], rec['version'])
+                counts = {s: len(cves.get(s, [])) for s in SEVERITIES}
+                upgrade = rnd.random() < 0.4
+                eol = rnd.random() < 0.3
+                fd.write(json.dumps({
+                    'batch_ts': ts, 'host': host, 'alias_name': alias.get(rec['model']),
+                    'model': rec['model'], 'platform': rec['platform'], 'current_version': rec['version'],
+                    'platform_version': rec['version'], 'recommended_version': '15.2.7E13',
+                    'release_designation': 'MD', 'recommendation': 'upgrade suggested' if upgrade else 'same version',
+                    'upgrade_recommended': upgrade,
+                    'final_url': 'https://software.cisco.com/download/home/279963472/type/280805680/release/15.2.7E13',
+                    'scraped_version_raw': '15.2.7E13(MD) (recommended)',
+                    'serial_number': rec['device_info']['serial_number'], 'uptime': rec['device_info']['uptime'],
+                    'connected_ports': [f"Gi1/0/{i}" for i in range(1, 1 + rnd.randrange(24))],
+                    'connected_count': rnd.randrange(48), 'disconnected_count': rnd.randrange(48),
+                    'total_interfaces': 52, 'cpu_usage': f"{rnd.randrange(1, 60)}%",
+                    'vlan_active_count': 4, 'vlans': [['1', 'default'], ['10', 'users'], ['20', 'voice'], ['99', 'mgmt']],
+                    'end_of_sale_date': '31-OCT-2022' if eol else None,
+                    'end_of_support_date': '31-OCT-2027' if eol else None,
+                    'series_release_date': '11-APR-2005', 'status': 'End of Sale' if eol else None,
+                    'cve_counts': counts,
+                }, ensure_ascii=False) + '\n')
+                fc.write(json.dumps({'batch_ts': ts, 'host': host, 'current_version': rec['version'],
+                                     'cve_counts': counts, 'cves': cves}, ensure_ascii=False) + '\n')
+                summary['device_count'] += 1
+                summary['devices_with_upgrade_recommended'] += int(upgrade)
+                summary['devices_with_critical_cves'] += int(counts['Critical'] > 0)
+                summary['devices_eol'] += int(eol)
+                summary['total_high_cves'] += counts['High']
+                summary['total_medium_cves'] += counts['Medium']
+            fb.write(json.dumps(summary) + '\n')
+    with open(os.path.join(data_dir, 'pid_alias.json'), 'w', encoding='utf-8') as f:
+        json.dump(alias, f, indent=2)
+    if timelines:  # what history_writer.py maintains incrementally
+        timeline_index.TIMELINES_DIR = os.path.join(hist, 'timelines')
+        timeline_index.rebuild(os.path.join(hist, 'devices_snapshot.jsonl'))
+    return stamps
+
+
+def load_app(data_dir: str):
+    """Import dashboard/main.py with its data dir pointed at the synthetic history."""
+    os.environ['RETRIEVOS_DATA_DIR'] = data_dir
+    timeline_index.TIMELINES_DIR = os.path.join(data_dir, 'history', 'timelines')  # imported before the env was set
+    spec = importlib.util.spec_from_file_location('dashboard_main_bench', os.path.join(BASE_DIR, 'dashboard', 'main.py'))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)  # type: ignore
+    return mod.app
+
+
+def _pct(vals: List[float], q: float) -> Optional[float]:
+    if not vals:
+        return None
+    vals = sorted(vals)
+    return round(vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))] * 1000, 2)
+
+
+async def _drive(client, paths: Callable[[int], str], requests: int, concurrency: int,
+                 lat: List[float], errors: List[int]) -> None:
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            t0 = time.perf_counter()
+            r = await client.get(paths(i))
+            lat.append(time.perf_counter() - t0)
+            if r.status_code >= 400:
+                errors.append(r.status_code)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def _stats(lat: List[float], errors: List[int], wall: float, peak: Optional[int]) -> Dict[str, Any]:
+    return {
+        'requests': len(lat),
+        'errors': len(errors),
+        'p50_ms': _pct(lat, 0.50),
+        'p99_ms': _pct(lat, 0.99),
+        'max_ms': round(max(lat) * 1000, 2) if lat else None,
+        'rps': round(len(lat) / wall, 1) if wall else None,
+        'peak_heap_mb': round(peak / 1048576, 1) if peak is not None else None,
+    }
+
+
+async def bench(app, stamps: List[str], hosts: List[str], requests: int, concurrency: int,
+                trace_mem: bool = True) -> Dict[str, Any]:
+    import httpx
+    rnd = random.Random(7)
+    endpoints: Dict[str, Callable[[int], str]] = {
+        'batches': lambda i: '/api/batches',
+        'latest': lambda i: '/api/latest',
+        'batch_devices': lambda i: f"/api/batch/{rnd.choice(stamps)}/devices",
+        'batch_cves': lambda i: f"/api/batch/{rnd.choice(stamps)}/cves",
+        'timeline': lambda i: f"/api/device/{rnd.choice(hosts)}/timeline",
+        'run_status': lambda i: '/api/run/status',
+    }
+    out: Dict[str, Any] = {'endpoints': {}, 'mixed': {}}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        await client.get('/api/batches')  # warm-up (imports, first file open)
+        for name, paths in endpoints.items():
+            lat: List[float] = []
+            errors: List[int] = []
+            if trace_mem:
+                tracemalloc.reset_peak()
+            t0 = time.perf_counter()
+            await _drive(client, paths, requests, concurrency, lat, errors)
+            wall = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1] if trace_mem else None
+            out['endpoints'][name] = _stats(lat, errors, wall, peak)
+            print(f"[api-bench] {name:<14} {out['endpoints'][name]}", flush=True)
+
+        # every endpoint concurrently: light calls should not queue behind heavy history reads
+        lats = {name: [] for name in endpoints}
+        errs = {name: [] for name in endpoints}
+        if trace_mem:
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(_drive(client, paths, requests, max(1, concurrency // 2), lats[name], errs[name])
+                               for name, paths in endpoints.items()))
+        wall = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] if trace_mem else None
+        for name in endpoints:
+            out['mixed'][name] = _stats(lats[name], errs[name], wall, peak)
+            print(f"[api-bench] mixed {name:<8} {out['mixed'][name]}", flush=True)
+    return out
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    cols = ['p50_ms', 'p99_ms', 'rps', 'peak_heap_mb', 'errors']
+    print(f"\n[api-bench] {report['params']}")
+    for phase in ('endpoints', 'mixed'):
+        print(f"-- {phase}")
+        print(f"{'endpoint':<16}" + ''.join(f"{c:>20}" for c in cols))
+        for name, res in report[phase].items():
+            base = ((baseline or {}).get(phase) or {}).get(name) or {}
+            cells = []
+            for c in cols:
+                cell = '-' if res.get(c) is None else str(res[c])
+                if isinstance(res.get(c), (int, float)) and isinstance(base.get(c), (int, float)) and base[c]:
+                    cell += f" ({(res[c] - base[c]) / base[c] * 100:+.0f}%)"
+                cells.append(f"{cell:>20}")
+            print(f"{name:<16}" + ''.join(cells))
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Load-test the dashboard read API over synthetic history')
+    ap.add_argument('--batches', type=int, default=90, help='Number of historical batches')
+    ap.add_argument('--devices', type=int, default=1000, help='Devices per batch')
+    ap.add_argument('--every-hours', type=float, default=24.0, help='Spacing between batches')
+    ap.add_argument('--requests', type=int, default=50, help='Requests per endpoint and phase')
+    ap.add_argument('--concurrency', type=int, default=8)
+    ap.add_argument('--no-timelines', action='store_true', help='Skip the per-host timeline index (legacy full scan)')
+    ap.add_argument('--no-trace-mem', action='store_true', help='Skip tracemalloc (lower overhead)')
+    ap.add_argument('--data-dir', help='Reuse/keep this data dir instead of a scratch one')
+    ap.add_argument('--out', help='Write the JSON report here')
+    ap.add_argument('--compare', help='Baseline JSON report to diff against')
+    args = ap.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='retrievos-api-bench-')
+    t0 = time.monotonic()
+    if os.path.exists(os.path.join(data_dir, 'history', 'batches.jsonl')):
+        with open(os.path.join(data_dir, 'history', 'batches.jsonl'), 'r', encoding='utf-8') as f:
+            stamps = [json.loads(l)['batch_ts'] for l in f if l.strip()]
+        print(f"[api-bench] reusing {len(stamps)} batches in {data_dir}")
+    else:
+        stamps = gen_history(data_dir, args.batches, args.devices, every_hours=args.every_hours,
+                             timelines=not args.no_timelines)
+        print(f"[api-bench] generated {len(stamps)} batches x {args.devices} devices in {time.monotonic() - t0:.1f}s")
+    hosts = list(gen_devices.generate(args.devices, 20, 12)[0])
+    try:
+        if not args.no_trace_mem:
+            tracemalloc.start()
+        app = load_app(data_dir)
+        results = asyncio.run(bench(app, stamps, hosts, args.requests, args.concurrency, not args.no_trace_mem))
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    report = {
+        'params': {'batches': len(stamps), 'devices': args.devices, 'requests': args.requests,
+                   'concurrency': args.concurrency},
+        'python': sys.version.split()[0],
+        **results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"[api-bench] report written to {args.out}")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Peak memory of reading and rewriting a large devices.json: whole-file json vs streaming.
+
+Generates a synthetic fleet shaped like the playbook output (bench/gen_devices.py
+--rich: port and VLAN lists per host), then runs each access pattern in its own
+process and reports its wall time and peak RSS (wait4):
+
+  baseline          interpreter + imports only
+  json              json.load, walk the records, json.dump(indent=2)  (how stages used to do it)
+  stream            json_stream.iter_items -> json_stream.write_items
+  registry-import   device registry built from devices.json (streamed; the migration on first connect)
+  registry-iterate  a stage's loop over device_registry.iter_records()
+  registry-export   devices.json exported from the registry (streamed)
+
+  python bench/devices_json_bench.py --devices 50000 --out data/bench/devices_json.json
+"""
+from __future__ import annotations
+import os, sys, json, time, shutil, argparse, tempfile, subprocess
+from typing import Any, Dict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'pipeline'))
+
+import gen_devices  # type: ignore
+
+MODES = ('baseline', 'json', 'stream', 'registry-import', 'registry-iterate', 'registry-export')
+
+
+def _child(mode: str, data_dir: str) -> None:
+    """One access pattern, run inside the measured process."""
+    import json_stream  # type: ignore
+    import device_registry  # type: ignore
+    src = os.path.join(data_dir, 'devices.json')
+    out = os.path.join(data_dir, 'rewritten.json')
+    n = 0
+    if mode == 'json':
+        with open(src, 'r', encoding='utf-8') as f:
+            devices = json.load(f)
+        n = sum(1 for r in devices.values() if r.get('model'))
+        with open(out, 'w', encoding='utf-8') as f:
+            json.dump(devices, f, indent=2, ensure_ascii=False)
+    elif mode == 'stream':
+        def touched():
+            nonlocal n
+            for host, rec in json_stream.iter_items(src):
+                n += bool(rec.get('model'))
+                yield host, rec
+        json_stream.write_items(out, touched())
+    elif mode == 'registry-import':
+        n = device_registry.count()
+    elif mode == 'registry-iterate':
+        n = sum(1 for _, r in device_registry.iter_records() if r.get('model'))
+    elif mode == 'registry-export':
+        device_registry.export()
+        n = device_registry.count()
+    print(n)
+
+
+def _measure(mode: str, data_dir: str) -> Dict[str, Any]:
+    env = dict(os.environ, RETRIEVOS_DATA_DIR=data_dir)
+    t0 = time.monotonic()
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', mode, '--data', data_dir],
+                            env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.stdout.read().decode('utf-8', 'replace').strip() if proc.stdout else ''
+    _, status, usage = os.wait4(proc.pid, 0)
+    rc = os.waitstatus_to_exitcode(status)
+    return {
+        'exit_code': rc,
+        'wall_sec': round(time.monotonic() - t0, 3),
+        'peak_rss_mb': round(usage.ru_maxrss / 1024.0, 1),  # KiB on Linux
+        'devices_seen': int(output.splitlines()[-1]) if rc == 0 and output else None,
+        **({'output': output[-2000:]} if rc != 0 else {}),
+    }
+
+
+def run(devices: int, pids: int, seed: int = 1, keep: bool = False) -> Dict[str, Any]:
+    data_dir = tempfile.mkdtemp(prefix='retrievos-devjson-')
+    try:
+        t0 = time.monotonic()
+        dev_path, _ = gen_devices.write(data_dir, devices, pids, 12, seed, rich=True)
+        result: Dict[str, Any] = {
+            'devices': devices,
+            'file_mb': round(os.path.getsize(dev_path) / 1e6, 1),
+            'generate_sec': round(time.monotonic() - t0, 3),
+            'modes': {},
+        }
+        for mode in MODES:
+            result['modes'][mode] = r = _measure(mode, data_dir)
+            print(f"[bench] {mode:<17} {r['wall_sec']:>8.2f}s  peak RSS {r['peak_rss_mb']:>8.1f} MB"
+                  + ('' if r['exit_code'] == 0 else f"  (exit {r['exit_code']})"), flush=True)
+        if keep:
+            result['data_dir'] = data_dir
+        return result
+    finally:
+        if not keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Peak RSS of devices.json access patterns on a synthetic fleet')
+    ap.add_argument('--devices', type=int, default=50000)
+    ap.add_argument('--pids', type=int, default=40)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--out', help='Write results as JSON here')
+    ap.add_argument('--keep', action='store_true', help='Keep the scratch data directory')
+    ap.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    ap.add_argument('--data', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        _child(args.child, args.data)
+        sys.exit(0)
+    res = run(args.devices, args.pids, args.seed, args.keep)
+    print(f"[bench] {res['devices']} devices, devices.json {res['file_mb']} MB")
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(res, f, indent=2)
+        print(f"[bench] results -> {args.out}")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Synthetic devices.json / pid_alias.json for benchmarks.
+
+Generates N devices shaped like the Ansible playbook output (dict keyed by host)
+with a configurable number of distinct PIDs and versions, so caching and
+per-model deduplication can be measured at realistic cardinalities. --rich adds
+the interface, VLAN and performance sections the playbooks collect (port and
+VLAN lists make up most of a real devices.json). devices.json is written one
+device at a time (pipeline/json_stream.py), so 50k devices fit in little memory.
+
+  python bench/gen_devices.py --out /tmp/bench-data --devices 500 --pids 20 --versions 12
+  python bench/gen_devices.py --out /tmp/bench-data --devices 50000 --rich
+"""
+from __future__ import annotations
+import os, sys, json, random, argparse
+from typing import Any, Dict, Iterator, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pipeline'))
+import json_stream  # type: ignore
+
+# (platform, version pattern) pairs; versions are drawn round-robin within a platform
+PLATFORMS = [
+    ('ios',   '15.2({a})E{b}'),
+    ('iosxe', '17.{a}.{b}'),
+    ('nxos',  '10.{a}({b})'),
+]
+SERIES = ['WS-C2960X', 'WS-C3850', 'C9300', 'N9K-C93180YC', 'WS-C3560CX', 'C9200L']
+
+
+def _pid(i: int) -> Tuple[str, str]:
+    series = SERIES[i % len(SERIES)]
+    pid = f"{series}-{24 + 24 * (i // len(SERIES) % 2)}P{chr(ord('A') + i // (2 * len(SERIES)) % 26)}-L"
+    return pid, f"Catalyst {pid} Switch" if not series.startswith('N9K') else f"Nexus {pid} Switch"
+
+
+def _version(platform_idx: int, i: int) -> str:
+    pattern = PLATFORMS[platform_idx][1]
+    return pattern.format(a=1 + i % 9, b=1 + i // 9)
+
+
+def _rich(rnd: random.Random) -> Dict[str, Any]:
+    """interface_summary / vlan_summary / performance_info as the playbooks record them."""
+    ports = [f"Gi1/0/{p}" for p in range(1, 49)]
+    connected = sorted(rnd.sample(ports, rnd.randrange(8, 48)), key=lambda s: int(s.rsplit('/', 1)[1]))
+    vlans = [[str(v), f"VLAN{v:04d}"] for v in sorted(rnd.sample(range(2, 4000), rnd.randrange(5, 60)))]
+    cpu = rnd.randrange(1, 60)
+    return {
+        'interface_summary': {'total_interfaces': str(len(ports)), 'connected': str(len(connected)),
+                              'disconnected': str(len(ports) - len(connected)), 'connected_ports': connected},
+        'performance_info': {'cpu_5_sec': f"{cpu}%", 'cpu_1_min': f"{cpu}%", 'cpu_5_min': f"{cpu}%"},
+        'vlan_summary': {'total_active_vlans': str(len(vlans)), 'vlans': vlans},
+        'security_info': {'total_login_failures': str(rnd.randrange(0, 20))},
+    }
+
+
+def iter_devices(devices: int, pids: int, versions: int, seed: int = 1,
+                 rich: bool = False) -> Iterator[Tuple[str, dict]]:
+    """(host, record) for each synthetic device. Deterministic for a given seed."""
+    rnd = random.Random(seed)
+    pid_rows = [_pid(i) for i in range(max(1, pids))]
+    for n in range(devices):
+        pid, _ = pid_rows[rnd.randrange(len(pid_rows))]
+        p_idx = 2 if pid.startswith('N9K') else rnd.randrange(2)
+        platform = PLATFORMS[p_idx][0]
+        version = _version(p_idx, rnd.randrange(max(1, versions)))
+        host = f"bench-sw{n:05d}"
+        rec = {
+            'host': host,
+            'model': pid,
+            'platform': platform,
+            'version': version,
+            'device_info': {
+                'ios_version': version,
+                'serial_number': f"FOC{seed:02d}{n:07d}",
+                'uptime': f"{rnd.randrange(1, 900)} days",
+            },
+        }
+        if rich:
+            rec.update(_rich(rnd))
+        yield host, rec
+
+
+def generate(devices: int, pids: int, versions: int, seed: int = 1) -> Tuple[Dict[str, dict], Dict[str, str]]:
+    """Return (devices_map, pid_alias). Deterministic for a given seed."""
+    alias = {pid: name for pid, name in (_pid(i) for i in range(max(1, pids)))}
+    return dict(iter_devices(devices, pids, versions, seed)), alias
+
+
+def write(out_dir: str, devices: int, pids: int, versions: int, seed: int = 1, rich: bool = False) -> Tuple[str, str]:
+    alias = {pid: name for pid, name in (_pid(i) for i in range(max(1, pids)))}
+    os.makedirs(out_dir, exist_ok=True)
+    dev_path = os.path.join(out_dir, 'devices.json')
+    alias_path = os.path.join(out_dir, 'pid_alias.json')
+    json_stream.write_items(dev_path, iter_devices(devices, pids, versions, seed, rich))
+    with open(alias_path, 'w', encoding='utf-8') as f:
+        json.dump(alias, f, indent=2)
+    return dev_path, alias_path
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Generate a synthetic devices.json and pid_alias.json')
+    ap.add_argument('--out', required=True, help='Output data directory')
+    ap.add_argument('--devices', type=int, default=100)
+    ap.add_argument('--pids', type=int, default=10, help='Distinct PIDs (models)')
+    ap.add_argument('--versions', type=int, default=8, help='Distinct versions per platform')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--rich', action='store_true', help='Add interface/VLAN/performance sections like the playbooks')
+    args = ap.parse_args()
+    paths = write(args.out, args.devices, args.pids, args.versions, args.seed, args.rich)
+    print(f"[bench] wrote {args.devices} devices ({args.pids} pids, {args.versions} versions): {', '.join(paths)}")
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Reproducible pipeline benchmark against local stand-ins (no Cisco traffic).
+
+Each run:
+  1) generates a synthetic devices.json / pid_alias.json in a scratch data dir
+  2) starts the stand-in PSIRT/download/support server (bench/stand_ins.py)
+  3) runs each stage as its own process, in orchestrator order, with
+     RETRIEVOS_DATA_DIR pointing at the scratch dir and a fresh RUN_TS
+  4) reports per stage: wall time, devices/sec, per-host p50/p95 (from the
+     run-metrics spans) and peak RSS of the stage process
+
+Results are written as JSON so runs can be compared:
+
+  python bench/run_bench.py --devices 200 --pids 15 --latency-ms 30 --out data/bench/base.json
+  python bench/run_bench.py --devices 200 --pids 15 --latency-ms 30 --compare data/bench/base.json
+
+The download/EoL stages use the HTTP fast path by default; --scrapers browser
+drives the stand-in pages with Selenium instead (needs Chrome), as production does.
+"""
+from __future__ import annotations
+import os, sys, json, time, shutil, argparse, tempfile, subprocess
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'pipeline'))
+
+import gen_devices  # type: ignore
+import stand_ins  # type: ignore
+
+# name -> argv, in orchestrator order (playbooks and e-mail are not part of the benchmark)
+STAGES = {
+    'cves': [os.path.join(BASE_DIR, 'pipeline', 'check_cves_from_devices.py')],
+    'eol': [os.path.join(BASE_DIR, 'scraping', 'eol_details.py'), '--batch', '--write', '--only-missing'],
+    'versions': [os.path.join(BASE_DIR, 'pipeline', 'run_pipeline.py')],
+    'history': [os.path.join(BASE_DIR, 'pipeline', 'history_writer.py')],
+}
+
+
+def _run_stage(name: str, env: Dict[str, str], log_dir: str) -> Dict[str, Any]:
+    """Run one stage to completion; wall time and peak RSS come from wait4()."""
+    log_path = os.path.join(log_dir, f"{name}.log")
+    with open(log_path, 'w', encoding='utf-8') as logf:
+        t0 = time.monotonic()
+        proc = subprocess.Popen([sys.executable] + STAGES[name], cwd=BASE_DIR, env=env,
+                                stdout=logf, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        wall = time.monotonic() - t0
+    return {
+        'exit_code': proc.returncode,
+        'wall_sec': round(wall, 3),
+        'peak_rss_mb': round(usage.ru_maxrss / 1024.0, 1),  # KiB on Linux
+        'cpu_sec': round(usage.ru_utime + usage.ru_stime, 3),
+        'log': log_path,
+    }
+
+
+def run(devices: int, pids: int, versions: int, latency_ms: float, seed: int = 1,
+        stages: Optional[List[str]] = None, keep: bool = False, scrapers: str = 'http') -> Dict[str, Any]:
+    import run_metrics  # type: ignore
+
+    data_dir = tempfile.mkdtemp(prefix='retrievos-bench-')
+    run_ts = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    gen_devices.write(data_dir, devices, pids, versions, seed)
+    server, base_url, srv = stand_ins.start(latency_ms=latency_ms)
+
+    env = dict(os.environ)
+    env.update(stand_ins.env_for(base_url, browser=scrapers == 'browser'))
+    env.update({
+        'RETRIEVOS_DATA_DIR': data_dir,
+        'RUN_TS': run_ts,
+        'SCRAPE_MIN_INTERVAL_SEC': '0',
+        'PYTHONUNBUFFERED': '1',
+    })
+    env.pop('CISCO_HTTP_REPLAY_DIR', None)
+    env.pop('CISCO_HTTP_RECORD_DIR', None)
+
+    results: Dict[str, Any] = {}
+    try:
+        for name in stages or list(STAGES):
+            requests_before = srv.requests
+            print(f"[bench] stage {name} ...", flush=True)
+            res = _run_stage(name, env, data_dir)
+            res['upstream_requests'] = srv.requests - requests_before
+            results[name] = res
+            if res['exit_code'] != 0:
+                print(f"[bench] stage {name} exited {res['exit_code']}; see {res['log']}")
+    finally:
+        server.shutdown()
+
+    # per-host latencies from the spans the stages recorded under RUN_TS
+    run_metrics.METRICS_DIR = os.path.join(data_dir, 'history', 'metrics')
+    summary = run_metrics.summarize(run_ts).get('stages') or {}
+    for name, res in results.items():
+        st = summary.get(name) or {}
+        host = (st.get('spans') or {}).get('host') or {}
+        hosts = st.get('hosts') or 0
+        res.update({
+            'hosts': hosts,
+            'hosts_failed': st.get('hosts_failed'),
+            'devices_per_sec': round(hosts / res['wall_sec'], 2) if hosts and res['wall_sec'] else None,
+            'host_p50': host.get('p50'),
+            'host_p95': host.get('p95'),
+        })
+
+    report = {
+        'run_ts': run_ts,
+        'params': {'devices': devices, 'pids': pids, 'versions': versions, 'latency_ms': latency_ms, 'seed': seed,
+                   'scrapers': scrapers},
+        'python': sys.version.split()[0],
+        'stages': results,
+    }
+    if keep:
+        report['data_dir'] = data_dir
+        print(f"[bench] kept data dir {data_dir}")
+    else:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return report
+
+
+def _fmt(v: Any) -> str:
+    return '-' if v is None else str(v)
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    cols = ['wall_sec', 'devices_per_sec', 'host_p50', 'host_p95', 'peak_rss_mb', 'upstream_requests']
+    print(f"\n[bench] {report['params']}")
+    print(f"{'stage':<10}" + ''.join(f"{c:>20}" for c in cols))
+    for name, res in report['stages'].items():
+        base = ((baseline or {}).get('stages') or {}).get(name) or {}
+        cells = []
+        for c in cols:
+            cell = _fmt(res.get(c))
+            if isinstance(res.get(c), (int, float)) and isinstance(base.get(c), (int, float)) and base[c]:
+                cell += f" ({(res[c] - base[c]) / base[c] * 100:+.0f}%)"
+            cells.append(f"{cell:>20}")
+        print(f"{name:<10}" + ''.join(cells))
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Benchmark pipeline stages against local stand-ins')
+    ap.add_argument('--devices', type=int, default=100)
+    ap.add_argument('--pids', type=int, default=10, help='Distinct PIDs (models)')
+    ap.add_argument('--versions', type=int, default=8, help='Distinct versions per platform')
+    ap.add_argument('--latency-ms', type=float, default=20.0, help='Simulated upstream latency per request')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--stages', help=f"Comma-separated subset of: {','.join(STAGES)}")
+    ap.add_argument('--out', help='Write the JSON report here')
+    ap.add_argument('--compare', help='Baseline JSON report to diff against')
+    ap.add_argument('--keep', action='store_true', help='Keep the scratch data dir for inspection')
+    ap.add_argument('--scrapers', choices=('http', 'browser'), default='http',
+                    help='Download/EoL scrapers: HTTP fast path, or Selenium against the stand-in pages')
+    args = ap.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(',')] if args.stages else None
+    unknown = [s for s in stages or [] if s not in STAGES]
+    if unknown:
+        ap.error(f"unknown stage(s): {', '.join(unknown)}")
+    report = run(args.devices, args.pids, args.versions, args.latency_ms, args.seed, stages, args.keep, args.scrapers)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"[bench] report written to {args.out}")
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""Local stand-ins for the Cisco endpoints the pipeline calls.
+
+One threaded HTTP server answers:
+  POST /oauth2/default/v1/token                      PSIRT OAuth token
+  GET  /security/advisories/v2/OSType/<platform>     advisories (deterministic per platform+version)
+  GET  /download/api/psa/search                      product search  (cisco_http.find_download_url)
+  GET  /download/api/mdf/<id>/softwaretypes          software types  (cisco_http.fetch_latest_version)
+  GET  /download/api/mdf/<id>/type/<tid>/releases    release tree
+  GET  /c/en/us/support/search/suggest.json          support suggest (cisco_http.fetch_eol_details)
+  GET  /c/en/us/support/switches/<slug>/model.html   EoL product page
+
+and, for the Selenium flows production runs (CISCO_HTTP_FASTPATH off), pages a
+browser can drive with the element paths the scrapers use:
+  GET  /download/home                                 search box + typeahead (cisco_url_extractor)
+  GET  /download/home/<id>/type                       software type list (last_version_extract)
+  GET  /download/home/<id>/type/<tid>/release/<v>     release tree, loaded by XHR
+  GET  /c/en/us/support/index.html                    support search + suggestions (eol_details)
+Each page has a cookie banner, and the typeahead/suggest lists are fetched by
+XHR after a debounce, as on the live sites, so the waits (scraping/waits.py)
+have real work to do.
+
+Download and EoL responses are the synthetic fixtures in scraping/fixtures with
+the model name swapped in, so the parsers run against the payload shapes they expect.
+An optional per-request latency simulates the network.
+
+  python bench/stand_ins.py --port 8999 --latency-ms 40
+"""
+from __future__ import annotations
+import os, re, html, json, time, zlib, hashlib, argparse, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from typing import Dict, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(BASE_DIR, 'scraping', 'fixtures')
+FIXTURE_MODEL = 'Catalyst 2960-48TC-L Switch'
+SEVERITIES = ['Critical', 'High', 'High', 'Medium', 'Medium', 'Medium', 'Low']
+
+
+_COOKIES = """<div id="onetrust-banner-sdk">We use cookies.
+<button id="onetrust-accept-btn-handler" onclick="this.parentNode.style.display='none'">Accept All Cookies</button></div>"""
+
+# search box at app-home/div[3]/app-psa/div/div[1]/div/div[2]/form/div/div/input; typeahead from psa/search
+DOWNLOAD_HOME = """<!doctype html><html><head><title>Software Download - Cisco Systems</title></head><body>
+<app-root><div><main><div><div><app-home><div></div><div></div>
+<div><app-psa><div><div><div><div></div><div><form onsubmit="return false"><div><div>
+<input type="text" placeholder="Search Download &amp; Upgrade" autocomplete="off"></div></div></form></div></div></div></div></app-psa></div>
+</app-home></div></div></main></div></app-root>
+""" + _COOKIES + """
+<script>
+var input = document.querySelector('app-psa input'), timer = null;
+input.addEventListener('input', function () {
+  clearTimeout(timer);
+  var q = input.value;
+  timer = setTimeout(function () {
+    fetch('/download/api/psa/search?searchText=' + encodeURIComponent(q)).then(function (r) { return r.json(); }).then(function (d) {
+      var w = document.querySelector('ngb-typeahead-window');
+      if (!w) { w = document.createElement('ngb-typeahead-window'); input.parentNode.appendChild(w); }
+      w.innerHTML = '';
+      (d.products || []).forEach(function (p) {
+        var b = document.createElement('button');
+        b.type = 'button'; b.textContent = p.name;
+        b.onclick = function () { location.href = p.url; };
+        w.appendChild(b);
+      });
+    });
+  }, 300);
+});
+</script></body></html>"""
+
+# #stos-list of software types, each linking to its release page
+TYPE_PAGE = """<!doctype html><html><head><title>{model} - Software Download</title></head><body>
+<app-root><div><main><div><div><app-software-type><h2>{model}</h2><ul id="stos-list">{items}</ul>
+</app-software-type></div></div></main></div></app-root>
+""" + _COOKIES + """</body></html>"""
+
+# tree node span at app-release-details/nav/div[4]/tree-root/.../tree-node[1]/.../span, title at
+# app-image-details/div[1]/h2; both filled from the releases API once the page has loaded
+RELEASE_PAGE = """<!doctype html><html><head><title>Software Download</title></head><body>
+<app-root><div><main><div><div><app-release-page><div>
+<div><app-release-details><nav><div></div><div></div><div></div><div id="tree"></div></nav></app-release-details></div>
+<div><app-image-details><div><h2></h2></div></app-image-details></div>
+</div></app-release-page></div></div></main></div></app-root>
+""" + _COOKIES + """
+<script>
+fetch('{api}').then(function (r) { return r.json(); }).then(function (d) {
+  document.querySelector('app-image-details h2').textContent = d.productName || '';
+  var latest = (d.releases || []).filter(function (r) { return r.name === 'Latest Release'; })[0];
+  var first = latest && latest.children && latest.children[0];
+  if (!first) return;
+  var label = first.version + (first.designation ? '(' + first.designation + ')' : '');
+  var star = first.suggested ? '<span class="icon-software-suggested icon-small suggestedStar"></span>' : '';
+  document.getElementById('tree').innerHTML =
+    '<tree-root><tree-viewport><div><div><tree-node-collection><div><tree-node><div>' +
+    '<tree-node-wrapper><div><div><tree-node-content><div><div><span>Latest Release</span></div></div></tree-node-content></div></div></tree-node-wrapper>' +
+    '<tree-node-children><div><tree-node-collection><div><tree-node><div><tree-node-wrapper><div><div><tree-node-content><div><div>' +
+    '<span></span>' + star + '</div></div></tree-node-content></div></div></tree-node-wrapper></div></tree-node></div></tree-node-collection></div></tree-node-children>' +
+    '</div></tree-node></div></tree-node-collection></div></div></tree-viewport></tree-root>';
+  document.querySelector('#tree tree-node-children span').textContent = label;
+  history.replaceState(null, '', location.pathname.replace(/\/release\/[^/]*$/, '/release/' + first.version));
+});
+</script></body></html>"""
+
+# button at body/div[2]/div/div[3]/div[1]/div[2]/div/section/button, input at section/div/div/form/div[1]/input,
+# suggestions at section/div/div/div[1]/ul (li[1]/div/ul/li[1]/a/span[2]) fetched from suggest.json
+SUPPORT_INDEX = """<!doctype html><html><head><title>Support - Cisco</title></head><body>
+<div>Cisco</div>
+<div><div><div></div><div></div><div><div><div></div><div><div><section>
+<button type="button"><span class="icon-search"></span><span>Search products</span></button>
+<div id="panel" style="display:none"><div>
+<form onsubmit="return false"><div><input type="text" autocomplete="off"></div></form>
+<div></div>
+</div></div>
+</section></div></div></div></div></div></div>
+""" + _COOKIES + """
+<script>
+var panel = document.getElementById('panel'), input = panel.querySelector('input'), timer = null;
+document.querySelector('section > button').onclick = function () { panel.style.display = 'block'; input.focus(); };
+input.addEventListener('input', function () {
+  clearTimeout(timer);
+  var q = input.value;
+  timer = setTimeout(function () {
+    fetch('/c/en/us/support/search/suggest.json?q=' + encodeURIComponent(q)).then(function (r) { return r.json(); }).then(function (d) {
+      var items = (d.suggestions || []).map(function (s) {
+        var a = document.createElement('a'); a.href = s.url;
+        a.innerHTML = '<span class="icon-product"></span><span></span>';
+        a.lastChild.textContent = s.title;
+        var li = document.createElement('li'); li.appendChild(a);
+        return li;
+      });
+      var inner = document.createElement('ul');
+      items.forEach(function (li) { inner.appendChild(li); });
+      var wrap = document.createElement('div'); wrap.appendChild(inner);
+      var li = document.createElement('li'); li.appendChild(wrap);
+      var ul = document.createElement('ul'); ul.appendChild(li);
+      var box = panel.firstElementChild.lastElementChild;
+      box.innerHTML = ''; box.appendChild(ul);
+    });
+  }, 300);
+});
+</script></body></html>"""
+
+
+def _fixture(pattern: str) -> str:
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        if re.search(pattern, name):
+            with open(os.path.join(FIXTURES_DIR, name), 'r', encoding='utf-8') as f:
+                return f.read()
+    raise FileNotFoundError(f"no fixture matching {pattern} in {FIXTURES_DIR}")
+
+
+def _mdf_id(model: str) -> str:
+    return str(280000000 + zlib.crc32(model.encode('utf-8')) % 10000000)
+
+
+def _slug(model: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '-', model.lower()).strip('-')
+
+
+def advisories(platform: str, version: str) -> list:
+    """0-5 advisories per (platform, version), stable across runs."""
+    h = hashlib.sha1(f"{platform}|{version}".encode('utf-8')).digest()
+    out = []
+    for i in range(h[0] % 6):
+        n = int.from_bytes(h[i * 2 + 1:i * 2 + 3], 'big')
+        out.append({
+            'advisoryId': f"cisco-sa-bench-{platform}-{n:05d}",
+            'advisoryTitle': f"Synthetic {platform} advisory {n}",
+            'sir': SEVERITIES[n % len(SEVERITIES)],
+            'cves': [f"CVE-2024-{(n + k) % 90000 + 10000}" for k in range(1 + n % 3)],
+        })
+    return out
+
+
+class StandIns:
+    """Pre-loaded fixture templates; per-model responses are cheap string substitutions."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000.0
+        self.types_tpl = _fixture(r'_softwaretypes__')
+        self.releases_tpl = _fixture(r'_releases__')
+        self.page_tpl = _fixture(r'_model_html__')
+        self.models: Dict[str, str] = {}   # mdf id / slug -> model name
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _remember(self, model: str) -> None:
+        with self._lock:
+            self.models[_mdf_id(model)] = model
+            self.models[_slug(model)] = model
+
+    def route(self, method: str, path: str, query: Dict[str, str]) -> Optional[tuple]:
+        """Return (status, content_type, body) or None for 404."""
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if method == 'POST' and path.endswith('/oauth2/default/v1/token'):
+            return 200, 'application/json', json.dumps({'access_token': 'bench-token', 'expires_in': 3600})
+        m = re.match(r'^/security/advisories/v2/OSType/([^/]+)$', path)
+        if m:
+            return 200, 'application/json', json.dumps({'advisories': advisories(m.group(1), query.get('version', ''))})
+        if path == '/download/home':
+            return 200, 'text/html; charset=utf-8', DOWNLOAD_HOME
+        m = re.match(r'^/download/home/(\d+)/type$', path)
+        if m:
+            model = self.models.get(m.group(1), FIXTURE_MODEL)
+            types = json.loads(self.types_tpl).get('softwareTypes') or []
+            items = ''.join(f'<li><a href="/download/home/{m.group(1)}/type/{t["id"]}/release/latest">{html.escape(t["name"])}</a></li>'
+                            for t in types)
+            return 200, 'text/html; charset=utf-8', TYPE_PAGE.format(model=html.escape(model), items=items)
+        m = re.match(r'^/download/home/(\d+)/type/(\d+)/release/[^/]+$', path)
+        if m:
+            api = f'/download/api/mdf/{m.group(1)}/type/{m.group(2)}/releases'
+            return 200, 'text/html; charset=utf-8', RELEASE_PAGE.replace('{api}', api)
+        if path == '/c/en/us/support/index.html':
+            return 200, 'text/html; charset=utf-8', SUPPORT_INDEX
+        if path == '/download/api/psa/search':
+            model = query.get('searchText', '')
+            self._remember(model)
+            mdf = _mdf_id(model)
+            return 200, 'application/json', json.dumps(
+                {'products': [{'name': model, 'mdfId': mdf, 'url': f"/download/home/{mdf}/type"}]})
+        m = re.match(r'^/download/api/mdf/(\d+)/softwaretypes$', path)
+        if m:
+            model = self.models.get(m.group(1), FIXTURE_MODEL)
+            return 200, 'application/json', self.types_tpl.replace(FIXTURE_MODEL, model)
+        m = re.match(r'^/download/api/mdf/(\d+)/type/(\d+)/releases$', path)
+        if m:
+            model = self.models.get(m.group(1), FIXTURE_MODEL)
+            return 200, 'application/json', self.releases_tpl.replace(FIXTURE_MODEL, model)
+        if path == '/c/en/us/support/search/suggest.json':
+            model = query.get('q', '')
+            self._remember(model)
+            return 200, 'application/json', json.dumps({'suggestions': [
+                {'title': f"Cisco {model}", 'url': f"/c/en/us/support/switches/{_slug(model)}/model.html"}]})
+        m = re.match(r'^/c/en/us/support/switches/([^/]+)/model\.html$', path)
+        if m:
+            model = self.models.get(m.group(1), FIXTURE_MODEL)
+            return 200, 'text/html; charset=utf-8', self.page_tpl.replace(FIXTURE_MODEL, model)
+        return None
+
+
+def _handler(stand_ins: StandIns):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _serve(self, method: str):
+            if method == 'POST':
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            u = urlsplit(self.path)
+            query = {k: v[0] for k, v in parse_qs(u.query).items()}
+            res = stand_ins.route(method, u.path, query)
+            status, ctype, body = res if res else (404, 'text/plain', 'not found')
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._serve('GET')
+
+        def do_POST(self):
+            self._serve('POST')
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start(port: int = 0, latency_ms: float = 0.0):
+    """Start the server on a daemon thread; returns (server, base_url, stand_ins)."""
+    stand_ins = StandIns(latency_ms)
+    server = ThreadingHTTPServer(('127.0.0.1', port), _handler(stand_ins))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", stand_ins
+
+
+def env_for(base_url: str, browser: bool = False) -> Dict[str, str]:
+    """Environment that points every stage at the stand-ins instead of Cisco.
+
+    browser: drive the stand-in pages with Selenium (what production runs)
+    instead of the opt-in HTTP fast path.
+    """
+    return {
+        'CISCO_DOWNLOAD_BASE': base_url + '/download',
+        'CISCO_SUPPORT_BASE': base_url,
+        'CISCO_TOKEN_URL': base_url + '/oauth2/default/v1/token',
+        'CISCO_PSIRT_API': base_url + '/security/advisories/v2/OSType',
+        'CISCO_CLIENT_ID': 'bench',
+        'CISCO_CLIENT_SECRET': 'bench',
+        'CISCO_HTTP_FASTPATH': '0' if browser else '1',
+        'no_proxy': '127.0.0.1,localhost',
+        'NO_PROXY': '127.0.0.1,localhost',
+    }
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Serve local stand-ins for the Cisco endpoints')
+    ap.add_argument('--port', type=int, default=8999)
+    ap.add_argument('--latency-ms', type=float, default=0.0, help='Added latency per request')
+    ap.add_argument('--browser', action='store_true', help='Print env for the Selenium flows instead of the fast path')
+    args = ap.parse_args()
+    server, base, _ = start(args.port, args.latency_ms)
+    print(f"[bench] stand-ins on {base}")
+    for k, v in env_for(base, args.browser).items():
+        print(f"export {k}={v}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -5,36 +5,61 @@ Endpoints:
   GET /api/batches                      → list batch timestamps (newest first)
   GET /api/batch/{ts}/devices          → all device rows for given batch
   GET /api/batch/{ts}/cves             → CVE detailed rows for batch
-  GET /api/device/{host}/timeline      → per-batch condensed timeline for one device
+  GET /api/device/{host}/timeline      → per-batch condensed timeline for one device (?since=&until=)
   GET /api/latest                      → devices for most recent batch
-  GET /api/batch/{ts}/log              → pipeline log text for batch
+  GET /api/search?q=version:17.9*      → hosts matching field:term clauses across history (?since=&until=)
+  GET /api/batch/{ts}/log              → pipeline log text for batch; with ?offset=&limit= or ?tail=&before=
+                                         (and ?grep=&level=) one page of lines as JSON
   GET /api/batch/{ts}/mail             → raw email (if archived) for batch
+  GET /api/batch/{ts}/metrics          → per-stage timing/throughput summary for batch
+  GET /api/batch/{ts}/events           → per-stage event summary; ?stage=&host=&event=&outcome=&level= lists events
+  GET /api/batch/{ts}/diff             → per-host changes vs previous batch (?against=<ts>)
+  GET /api/batch/{ts}/versions         → version histogram, ahead/behind recommended, trains behind
+  GET /api/batch/{ts}/exposure         → top advisories, riskiest hosts, exposure per model/site (?top=)
+  GET /api/batch/{ts}/devices.ndjson   → streamed export (also cves.ndjson, devices.csv, cves.csv; ?fields=, Range)
+  GET /api/jobs                        → queued/running/finished pipeline runs (?status=); /api/jobs/{id} adds the log tail
+  GET /api/run/stream                  → server-sent events: run status/progress (hosts done, failures, ETA) as it changes (?job_id=)
+  GET /api/schedules                   → recurring stage jobs with their next fire time and last outcome
+  GET /metrics                         → Prometheus text exposition (latest batch)
 
 Assumes history_writer.py has produced JSONL snapshot files.
+
+Batch devices/cves/diff/log responses carry a strong ETag and are gzip (or
+brotli, if installed) encoded on request; finalized batches are immutable.
+Finalized batch devices are streamed straight from their byte range in the
+snapshot file (pipeline/snapshot_index.py), never parsed into dicts.
 """
 from __future__ import annotations
-import os, json
+import os, sys, json
 from fastapi import FastAPI, HTTPException, Body, Request, Depends
 from fastapi.responses import PlainTextResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
-from typing import List, Dict, Any
-import subprocess
+from typing import List, Dict, Any, Iterator
 import threading
-import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import shlex
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.responses import JSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 import secrets
 import hmac
 import hashlib
+import gzip
+import zlib
+import csv
+import io
+from collections import OrderedDict
 from email import policy
 from email.parser import Parser
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Load environment from .env if present
 load_dotenv(os.path.join(BASE_DIR, '.env'))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
 HIST_DIR = os.path.join(DATA_DIR, 'history')
 LOGS_DIR = os.path.join(HIST_DIR, 'logs')
 MAILS_DIR = os.path.join(HIST_DIR, 'mails')
@@ -48,6 +73,21 @@ CVES_SNAPSHOT = os.path.join(HIST_DIR, 'cves_snapshot.jsonl')
 BATCHES_JSONL = os.path.join(HIST_DIR, 'batches.jsonl')
 PID_ALIAS_JSON = os.path.join(DATA_DIR, 'pid_alias.json')
 
+sys.path.insert(0, os.path.join(BASE_DIR, 'pipeline'))
+import run_metrics  # type: ignore
+import timeline_index  # type: ignore
+import batch_diff  # type: ignore
+import snapshot_index  # type: ignore
+import search_index  # type: ignore
+import versions  # type: ignore
+import exposure  # type: ignore
+import jobs  # type: ignore
+import scope as run_scope  # type: ignore
+import scheduler  # type: ignore
+import run_logs  # type: ignore
+import events  # type: ignore
+import atomic_io  # type: ignore
+
 STATIC_DIR = os.path.join(os.path.dirname(__file__), 'static')
 FRONTEND_DIST = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'frontend', 'dist')
 os.makedirs(STATIC_DIR, exist_ok=True)
@@ -79,7 +119,31 @@ else:
     def decrypt_inventory_text(x: str) -> str:  # type: ignore
         return x
 
-app = FastAPI(title="retrievos dashboard API", version="0.1.0")
+# === JSON encoding ===
+# orjson (or msgspec) when installed, compact stdlib json otherwise. Heavy
+# endpoints hand back bytes from _json_bytes directly so FastAPI's
+# jsonable_encoder pass is skipped; FastJSONResponse covers the rest.
+try:
+    import orjson  # type: ignore
+except Exception:  # optional
+    orjson = None
+try:
+    import msgspec  # type: ignore
+except Exception:  # optional
+    msgspec = None
+
+def _json_bytes(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    if msgspec is not None:
+        return msgspec.json.encode(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return _json_bytes(content)
+
+app = FastAPI(title="retrievos dashboard API", version="0.1.0", default_response_class=FastJSONResponse)
 # Session middleware for simple cookie-based auth
 SECRET_KEY = os.getenv('SECRET_KEY') or 'dev-insecure-secret-key'
 app.add_middleware(
@@ -89,6 +153,20 @@ app.add_middleware(
     same_site='lax',
     https_only=False,
 )
+_EVENT_STREAMS = ('/api/run/stream',)
+
+class _GZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves byte-range requests alone (ranges address the identity body), and
+    event streams, which must reach the client as each event is written."""
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and (any(k == b'range' for k, _ in scope['headers'])
+                                        or scope['path'] in _EVENT_STREAMS):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Everything not already encoded by _cached_response (below) is gzipped when large enough
+app.add_middleware(_GZipMiddleware, minimum_size=1024)
 app.mount('/static', StaticFiles(directory=STATIC_DIR), name='static')
 if os.path.isdir(FRONTEND_DIST):
     app.mount('/app', StaticFiles(directory=FRONTEND_DIST), name='app')
@@ -96,12 +174,49 @@ if os.path.isdir(FRONTEND_DIST):
     if os.path.isdir(assets_dir):
         app.mount('/assets', StaticFiles(directory=assets_dir), name='assets')
 
-def _read_jsonl(path: str) -> List[Dict[str, Any]]:
+# === History reads: dedicated bounded pool, cancellable on client disconnect ===
+# Full JSONL scans run here instead of on the event loop or Starlette's shared
+# threadpool, so a burst of heavy timeline/batch queries cannot starve
+# /api/run, /api/run/status or auth calls.
+HISTORY_WORKERS = int(os.getenv('DASHBOARD_HISTORY_WORKERS', '4'))
+DISCONNECT_POLL_SEC = 0.25
+_history_pool = ThreadPoolExecutor(max_workers=HISTORY_WORKERS, thread_name_prefix='history')
+
+class _ReadCancelled(Exception):
+    pass
+
+def _abandon(fut: asyncio.Future, cancel: threading.Event) -> None:
+    # tell the reader to stop at its next checkpoint; its result/exception is discarded
+    cancel.set()
+    fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+async def _history(request: Request, fn, *args, **kwargs):
+    """Run a blocking history reader on the history pool; abandon it if the client goes away."""
+    cancel = threading.Event()
+    loop = asyncio.get_running_loop()
+    fut = loop.run_in_executor(_history_pool, functools.partial(fn, *args, cancel=cancel, **kwargs))
+    try:
+        while True:
+            done, _ = await asyncio.wait({fut}, timeout=DISCONNECT_POLL_SEC)
+            if done:
+                return fut.result()
+            if await request.is_disconnected():
+                _abandon(fut, cancel)
+                raise HTTPException(status_code=499, detail='client closed request')
+    except asyncio.CancelledError:
+        _abandon(fut, cancel)
+        raise
+    except _ReadCancelled:
+        raise HTTPException(status_code=499, detail='client closed request')
+
+def _read_jsonl(path: str, cancel: threading.Event | None = None) -> List[Dict[str, Any]]:
     if not os.path.exists(path):
         return []
     out = []
     with open(path, 'r', encoding='utf-8') as f:
-        for line in f:
+        for n, line in enumerate(f):
+            if cancel is not None and not n % 1000 and cancel.is_set():
+                raise _ReadCancelled()
             line = line.strip()
             if not line:
                 continue
@@ -112,26 +227,18 @@ def _read_jsonl(path: str) -> List[Dict[str, Any]]:
     return out
 
 def _load_json(path: str, default):
-    try:
-        if not os.path.exists(path):
-            return default
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return default
+    return atomic_io.read_json(path, default)
 
 def _save_json(path: str, data: Any):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    atomic_io.write_json(path, data)
 
-def _unique_sorted_batches() -> List[str]:
-    rows = _read_jsonl(BATCHES_JSONL)
+def _unique_sorted_batches(cancel: threading.Event | None = None) -> List[str]:
+    rows = _read_jsonl(BATCHES_JSONL, cancel)
     ts = {r.get('batch_ts') for r in rows if r.get('batch_ts')}
     return sorted(ts, reverse=True)
 
-def _batch_summaries(limit: int | None = None) -> List[Dict[str, Any]]:
-    rows = _read_jsonl(BATCHES_JSONL)
+def _batch_summaries(limit: int | None = None, cancel: threading.Event | None = None) -> List[Dict[str, Any]]:
+    rows = _read_jsonl(BATCHES_JSONL, cancel)
     # ensure proper sort newest first
     rows = [r for r in rows if r.get('batch_ts')]
     rows.sort(key=lambda r: r['batch_ts'], reverse=True)
@@ -139,13 +246,22 @@ def _batch_summaries(limit: int | None = None) -> List[Dict[str, Any]]:
         rows = rows[:limit]
     return rows
 
-def _devices_for_batch(ts: str):
-    rows = _read_jsonl(DEVICES_SNAPSHOT)
-    return [r for r in rows if r.get('batch_ts') == ts]
+def _snapshot_range(path: str, ts: str, cancel: threading.Event | None = None):
+    rng = snapshot_index.lookup(path, ts)
+    return rng if rng and rng[2] else None
+
+def _batch_rows(path: str, ts: str, cancel: threading.Event | None = None) -> List[Dict[str, Any]]:
+    # seek to the batch's byte range (snapshot_index); full scan only if it is not indexed
+    rows = snapshot_index.read_rows(path, ts)
+    if rows is not None:
+        return rows
+    return [r for r in _read_jsonl(path, cancel) if r.get('batch_ts') == ts]
 
-def _cves_for_batch(ts: str):
-    rows = _read_jsonl(CVES_SNAPSHOT)
-    result = [r for r in rows if r.get('batch_ts') == ts]
+def _devices_for_batch(ts: str, cancel: threading.Event | None = None):
+    return _batch_rows(DEVICES_SNAPSHOT, ts, cancel)
+
+def _cves_for_batch(ts: str, cancel: threading.Event | None = None):
+    result = _batch_rows(CVES_SNAPSHOT, ts, cancel)
     # Augment CVE entries with URLs for NVD and Cisco advisory/search if missing
     for r in result:
         cves = r.get('cves') or {}
@@ -176,27 +292,14 @@ def _cves_for_batch(ts: str):
         r['cves'] = cves
     return result
 
-def _timeline_for_host(host: str):
-    rows = _read_jsonl(DEVICES_SNAPSHOT)
-    tl = []
-    for r in rows:
-        if r.get('host') == host:
-            tl.append({
-                'batch_ts': r.get('batch_ts'),
-                'version': r.get('current_version'),
-                'recommended_version': r.get('recommended_version'),
-                'release_designation': r.get('release_designation'),
-                'upgrade_recommended': r.get('upgrade_recommended'),
-                'recommendation': r.get('recommendation'),
-                'final_url': r.get('final_url'),
-                'critical_cves': (r.get('cve_counts') or {}).get('Critical'),
-                'high_cves': (r.get('cve_counts') or {}).get('High'),
-                'cpu_usage': r.get('cpu_usage'),
-                'status': r.get('status'),
-                'series_release_date': r.get('series_release_date'),
-                'end_of_sale_date': r.get('end_of_sale_date'),
-                'end_of_support_date': r.get('end_of_support_date'),
-            })
+def _timeline_for_host(host: str, since: str | None = None, until: str | None = None,
+                       cancel: threading.Event | None = None):
+    # keyed lookup in history/timelines/ (maintained by history_writer); full scan only for legacy history
+    if timeline_index.exists():
+        return timeline_index.read(host, since, until)
+    rows = _read_jsonl(DEVICES_SNAPSHOT, cancel)
+    tl = [timeline_index.entry(r) for r in rows
+          if r.get('host') == host and timeline_index.in_window(r.get('batch_ts'), since, until)]
     tl.sort(key=lambda x: x['batch_ts'])
     return tl
 
@@ -254,6 +357,162 @@ async def auth_me(request: Request):
         return JSONResponse({'authenticated': False}, status_code=200)
     return {'authenticated': True, 'user': {'name': user.get('name')}}
 
+# === HTTP caching / compression for batch payloads ===
+# A batch is immutable once its summary is in batches.jsonl and no run is in
+# progress, so its responses get a strong ETag (batch id + content hash) and
+# Cache-Control: immutable. Known ETags are remembered per URL so a matching
+# If-None-Match is answered with 304 without reading history at all. A payload
+# that also depends on a live file (the inventory's site grouping) passes that
+# file's stamp as `variant`: it is part of the ETag and of the remembered key,
+# and such responses are revalidated instead of marked immutable.
+try:
+    import brotli  # type: ignore
+except Exception:  # optional: gzip only
+    brotli = None
+
+COMPRESS_MIN_BYTES = 1024
+CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDATE = 'no-cache'
+_ETAG_CACHE_MAX = 2048
+_etags: 'OrderedDict[str, str]' = OrderedDict()
+_etags_lock = threading.Lock()
+
+_known_lock = threading.Lock()
+_known: Dict[str, Any] = {'stamp': None, 'batches': frozenset()}
+
+def _known_batches(cancel: threading.Event | None = None) -> frozenset:
+    """Batch ids in batches.jsonl; the file is re-read only when its size or mtime changes."""
+    try:
+        st = os.stat(BATCHES_JSONL)
+    except OSError:
+        return frozenset()
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _known_lock:
+        if _known['stamp'] == stamp:
+            return _known['batches']
+    batches = frozenset(_unique_sorted_batches(cancel))
+    with _known_lock:
+        _known.update(stamp=stamp, batches=batches)
+    return batches
+
+def _finalized(*stamps: str | None) -> bool:
+    """Blocking (jobs.db, batches.jsonl): async handlers call it through run_in_threadpool."""
+    if jobs.running_count():
+        return False
+    known = _known_batches()
+    return all(ts in known for ts in stamps if ts)
+
+def _cache_key(request: Request, variant: str = '') -> str:
+    return request.url.path + '?' + request.url.query + ('#' + variant if variant else '')
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    inm = request.headers.get('if-none-match')
+    if not inm:
+        return False
+    base = etag.strip('"')
+    for tag in inm.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        tag = tag[2:] if tag.startswith('W/') else tag
+        tag = tag.strip('"')
+        # encoded variants carry a -br/-gzip suffix
+        if tag == base or tag.rsplit('-', 1)[0] == base:
+            return True
+    return False
+
+def _not_modified(etag: str, immutable: bool) -> Response:
+    return Response(status_code=304, headers={
+        'ETag': etag, 'Cache-Control': CACHE_IMMUTABLE if immutable else CACHE_REVALIDATE, 'Vary': 'Accept-Encoding'})
+
+def _early_304(request: Request, variant: str = '') -> Response | None:
+    """304 for a finalized batch URL whose ETag we already know, before any history is read.
+    Only the in-memory ETag map is consulted, so it is safe on the event loop."""
+    with _etags_lock:
+        etag = _etags.get(_cache_key(request, variant))
+    if etag and _etag_matches(request, etag):
+        return _not_modified(etag, not variant)
+    return None
+
+def _accepted_encodings(request: Request) -> set:
+    return {p.split(';', 1)[0].strip().lower() for p in request.headers.get('accept-encoding', '').split(',')}
+
+def _pick_encoding(request: Request) -> str | None:
+    accepted = _accepted_encodings(request)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+def _make_etag(request: Request, batch_id: str, digest: str, immutable: bool, variant: str = '') -> str:
+    etag = '"%s-%s"' % (hashlib.sha1((batch_id + variant).encode('utf-8')).hexdigest()[:8], digest[:20])
+    if immutable:
+        key = _cache_key(request, variant)
+        with _etags_lock:
+            _etags[key] = etag
+            _etags.move_to_end(key)
+            while len(_etags) > _ETAG_CACHE_MAX:
+                _etags.popitem(last=False)
+    return etag
+
+def _cached_response(request: Request, body: bytes, batch_id: str, immutable: bool,
+                     media_type: str = 'application/json', variant: str = '') -> Response:
+    """Strong ETag + Cache-Control, 304 on If-None-Match, br/gzip by Accept-Encoding."""
+    etag = _make_etag(request, batch_id, hashlib.sha1(body).hexdigest(), immutable, variant)
+    immutable = immutable and not variant
+    if _etag_matches(request, etag):
+        return _not_modified(etag, immutable)
+    headers = {'Cache-Control': CACHE_IMMUTABLE if immutable else CACHE_REVALIDATE, 'Vary': 'Accept-Encoding'}
+    enc = _pick_encoding(request) if len(body) >= COMPRESS_MIN_BYTES else None
+    if enc == 'br':
+        body = brotli.compress(body, quality=5)
+    elif enc == 'gzip':
+        body = gzip.compress(body, compresslevel=6)
+    if enc:
+        headers['Content-Encoding'] = enc
+        etag = etag[:-1] + f'-{enc}"'
+    headers['ETag'] = etag
+    return Response(body, media_type=media_type, headers=headers)
+
+def _encode_chunks(chunks, enc: str | None):
+    if enc == 'br':
+        comp = brotli.Compressor(quality=5)
+        for c in chunks:
+            out = comp.process(c)
+            if out:
+                yield out
+        yield comp.finish()
+    elif enc == 'gzip':
+        comp = zlib.compressobj(6, zlib.DEFLATED, 31)   # wbits 31: gzip container
+        for c in chunks:
+            out = comp.compress(c)
+            if out:
+                yield out
+        yield comp.flush()
+    else:
+        yield from chunks
+
+def _stream_rows(request: Request, path: str, rng: snapshot_index.Range, key: str, ts: str) -> Response:
+    """Serve a finalized batch as stored: its snapshot lines are spliced into the JSON
+    array without being parsed. The byte range of an append-only file identifies the
+    content, so it stands in for the content hash in the ETag."""
+    digest = hashlib.sha1(f'{os.path.basename(path)}:{rng[0]}:{rng[1]}'.encode('utf-8')).hexdigest()
+    etag = _make_etag(request, ts, digest, True)
+    if _etag_matches(request, etag):
+        return _not_modified(etag, True)
+    headers = {'Cache-Control': CACHE_IMMUTABLE, 'Vary': 'Accept-Encoding'}
+    enc = _pick_encoding(request) if rng[1] - rng[0] >= COMPRESS_MIN_BYTES else None
+    if enc:
+        headers['Content-Encoding'] = enc
+        etag = etag[:-1] + f'-{enc}"'
+    headers['ETag'] = etag
+    chunks = snapshot_index.iter_json_array(path, rng, b'{"%s":' % key.encode('ascii'),
+                                            b',"batch_ts":' + _json_bytes(ts) + b'}')
+    return StreamingResponse(_encode_chunks(chunks, enc), media_type='application/json', headers=headers)
+
+# batches.jsonl is one line per run: cheap enough for the shared threadpool, and
+# keeping it off the history pool means it never queues behind full scans.
 @app.get('/api/batches')
 def list_batches():
     return {'batches': _unique_sorted_batches()}
@@ -264,38 +523,152 @@ def batch_summaries(limit: int = 50):
     rows = _batch_summaries(limit=limit)
     return {'summaries': rows}
 
-def _latest_batch():
-    bs = _unique_sorted_batches()
+def _latest_batch(cancel: threading.Event | None = None):
+    bs = _unique_sorted_batches(cancel)
     return bs[0] if bs else None
 
+def _latest_devices(cancel: threading.Event | None = None):
+    lb = _latest_batch(cancel)
+    return (_devices_for_batch(lb, cancel) if lb else []), lb
+
 @app.get('/api/latest')
-def latest_devices():
-    lb = _latest_batch()
+async def latest_devices(request: Request):
+    rows, lb = await _history(request, _latest_devices)
     if not lb:
         return {'devices': [], 'batch_ts': None}
-    return {'devices': _devices_for_batch(lb), 'batch_ts': lb}
+    # the latest batch changes with every run: revalidate, never immutable
+    return _cached_response(request, _json_bytes({'devices': rows, 'batch_ts': lb}), lb, immutable=False)
 
 @app.get('/api/batch/{ts}/devices')
-def batch_devices(ts: str):
-    rows = _devices_for_batch(ts)
+async def batch_devices(ts: str, request: Request):
+    if (r := _early_304(request)) is not None:
+        return r
+    immutable = await run_in_threadpool(_finalized, ts)
+    if immutable:
+        rng = await _history(request, _snapshot_range, DEVICES_SNAPSHOT, ts)
+        if rng:
+            return _stream_rows(request, DEVICES_SNAPSHOT, rng, 'devices', ts)
+    rows = await _history(request, _devices_for_batch, ts)
     if not rows:
         raise HTTPException(status_code=404, detail='batch not found or empty')
-    return {'devices': rows, 'batch_ts': ts}
+    return _cached_response(request, _json_bytes({'devices': rows, 'batch_ts': ts}), ts, immutable)
 
 @app.get('/api/batch/{ts}/cves')
-def batch_cves(ts: str):
-    rows = _cves_for_batch(ts)
+async def batch_cves(ts: str, request: Request):
+    if (r := _early_304(request)) is not None:
+        return r
+    rows = await _history(request, _cves_for_batch, ts)
     if not rows:
         raise HTTPException(status_code=404, detail='batch not found or empty')
-    return {'cves': rows, 'batch_ts': ts}
+    immutable = await run_in_threadpool(_finalized, ts)
+    return _cached_response(request, _json_bytes({'cves': rows, 'batch_ts': ts}), ts, immutable)
 
 @app.get('/api/device/{host}/timeline')
-def device_timeline(host: str):
-    tl = _timeline_for_host(host)
+async def device_timeline(host: str, request: Request, since: str | None = None, until: str | None = None):
+    """Per-batch history of one device; since/until (ISO timestamp or YYYY-MM-DD) bound batch_ts inclusively."""
+    tl = await _history(request, _timeline_for_host, host, since, until)
     if not tl:
         raise HTTPException(status_code=404, detail='device not found')
     return {'host': host, 'timeline': tl}
 
+def _version_histogram(ts: str, cancel: threading.Event | None = None):
+    rows = _devices_for_batch(ts, cancel)
+    return versions.histogram(rows) if rows else None
+
+@app.get('/api/batch/{ts}/versions')
+async def batch_versions(ts: str, request: Request):
+    """Version histogram per platform, position vs recommended and trains-behind distribution."""
+    if (r := _early_304(request)) is not None:
+        return r
+    h = await _history(request, _version_histogram, ts)
+    if h is None:
+        raise HTTPException(status_code=404, detail='batch not found or empty')
+    immutable = await run_in_threadpool(_finalized, ts)
+    return _cached_response(request, _json_bytes(dict(h, batch_ts=ts)), ts, immutable)
+
+def _inventory_stamp() -> str:
+    """Changes whenever inventory.ini does (the exposure payload groups hosts by its sites)."""
+    try:
+        st = os.stat(ANSIBLE_INVENTORY)
+    except OSError:
+        return 'none'
+    return f'{st.st_mtime_ns}-{st.st_size}'
+
+def _host_sites() -> Dict[str, str]:
+    # site = the host's 'site=' inventory var, else its inventory group
+    out: Dict[str, str] = {}
+    for group, hosts in _parse_inventory(ANSIBLE_INVENTORY).items():
+        for h in hosts:
+            out.setdefault(h['host'], h['vars'].get('site') or group)
+    return out
+
+def _exposure(ts: str, top: int, cancel: threading.Event | None = None):
+    exp = exposure.load(ts)
+    if exp is None:
+        # batches written before exposure files existed
+        cve_rows = _batch_rows(CVES_SNAPSHOT, ts, cancel)
+        if not cve_rows:
+            return None
+        exp = exposure.build_for_batch(cve_rows, _batch_rows(DEVICES_SNAPSHOT, ts, cancel))
+    sites = _host_sites()
+    return exp.summary(top, by={'site': [sites.get(h) for h in exp.hosts]})
+
+@app.get('/api/batch/{ts}/exposure')
+async def batch_exposure(ts: str, request: Request, top: int = 20):
+    """Top advisories by affected hosts, riskiest hosts, exposure per model and site."""
+    # sites come from the live inventory, not the batch: its stamp is part of the ETag
+    inv = _inventory_stamp()
+    if (r := _early_304(request, inv)) is not None:
+        return r
+    summary = await _history(request, _exposure, ts, max(1, min(top, 500)))
+    if summary is None:
+        raise HTTPException(status_code=404, detail='batch not found or empty')
+    immutable = await run_in_threadpool(_finalized, ts)
+    return _cached_response(request, _json_bytes(dict(summary, batch_ts=ts)), ts, immutable, variant=inv)
+
+_search_build_lock = threading.Lock()
+
+def _search(q: str, since: str | None, until: str | None, limit: int,
+            cancel: threading.Event | None = None):
+    # history written before the index existed: build it once, on first use
+    if not search_index.exists():
+        with _search_build_lock:
+            if not search_index.exists():
+                search_index.rebuild()
+    return search_index.default().search(q, since, until, limit)
+
+@app.get('/api/search')
+async def search(request: Request, q: str, since: str | None = None, until: str | None = None, limit: int = 100):
+    """Hosts matching every clause of q (field:term, field:prefix*, bare term) within since/until."""
+    try:
+        return await _history(request, _search, q, since, until, max(0, limit))
+    except search_index.QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _batch_diff(ts: str, against: str | None, cancel: threading.Event | None = None):
+    if against is None:
+        written = batch_diff.load_written(ts)  # computed by history_writer at write time
+        if written:
+            return written
+        against = batch_diff.previous_batch(ts)
+        if not against:
+            return None
+    return batch_diff.compute(ts, against)
+
+@app.get('/api/batch/{ts}/diff')
+async def batch_diff_view(ts: str, request: Request, against: str | None = None):
+    """What changed in batch ts: added/removed hosts, field changes, new/resolved CVEs per host."""
+    known = await run_in_threadpool(_known_batches)
+    if ts not in known or (against and against not in known):
+        raise HTTPException(status_code=404, detail='batch not found')
+    if (r := _early_304(request)) is not None:
+        return r
+    d = await _history(request, _batch_diff, ts, against)
+    if d is None:
+        raise HTTPException(status_code=404, detail='no earlier batch to diff against')
+    immutable = await run_in_threadpool(_finalized, ts, against)
+    return _cached_response(request, _json_bytes(d), ts, immutable)
+
 # === PID alias management ===
 @app.get('/api/pid_alias')
 def get_pid_alias():
@@ -308,11 +681,12 @@ def add_pid_alias(pid: str = Body(...), alias: str = Body(...), user: Dict[str,
     alias = (alias or '').strip()
     if not pid or not alias:
         raise HTTPException(status_code=400, detail='pid and alias are required')
-    mapping = _load_json(PID_ALIAS_JSON, {})
-    if not isinstance(mapping, dict):
-        mapping = {}
-    mapping[pid] = alias
-    _save_json(PID_ALIAS_JSON, mapping)
+    with atomic_io.locked(PID_ALIAS_JSON):
+        mapping = _load_json(PID_ALIAS_JSON, {})
+        if not isinstance(mapping, dict):
+            mapping = {}
+        mapping[pid] = alias
+        _save_json(PID_ALIAS_JSON, mapping)
     return {'ok': True, 'pid': pid, 'alias': alias}
 
 @app.get('/api/pid_alias/{pid}')
@@ -324,12 +698,36 @@ def get_pid_alias_one(pid: str):
     return {'pid': pid, 'alias': val}
 
 # === Run pipeline orchestrator ===
-_run_lock = threading.Lock()
-_run_proc: subprocess.Popen | None = None
-_run_mode: str | None = None
-_run_started_at: float | None = None
-_last_run_ts: str | None = None
-_orch_log_path: str | None = None
+# Runs are jobs in the persistent queue (pipeline/jobs.py, data/jobs.db), so
+# state survives restarts and is shared by every uvicorn worker. Orchestrators
+# are executed by job workers: `python pipeline/jobs.py worker`, or with
+# DASHBOARD_RUN_WORKER=1 one embedded in this process. Recurring stage jobs are
+# queued by pipeline/scheduler.py, embedded only with DASHBOARD_SCHEDULER=1:
+# starting the dashboard alone never runs a stage.
+RUN_WORKER = os.getenv('DASHBOARD_RUN_WORKER', '0') == '1'
+RUN_SCHEDULER = os.getenv('DASHBOARD_SCHEDULER', '0') == '1'
+_run_worker: jobs.Worker | None = None
+_scheduler: scheduler.Scheduler | None = None
+
+def _wake_run_worker():
+    if _run_worker is not None:
+        _run_worker.wake()
+
+@app.on_event('startup')
+def _start_run_worker():
+    global _run_worker, _scheduler
+    if RUN_WORKER and _run_worker is None:
+        _run_worker = jobs.Worker().start()
+    if RUN_SCHEDULER and _scheduler is None:
+        _scheduler = scheduler.Scheduler(on_queued=_wake_run_worker).start()
+
+@app.on_event('shutdown')
+def _stop_run_worker():
+    # orchestrators keep running; the next worker adopts them
+    if _run_worker is not None:
+        _run_worker.stop()
+    if _scheduler is not None:
+        _scheduler.stop()
 
 def _tail_file(path: str, max_bytes: int = 4096) -> str | None:
     try:
@@ -344,73 +742,108 @@ def _tail_file(path: str, max_bytes: int = 4096) -> str | None:
     except Exception:
         return None
 
-def _check_proc():
-    global _run_proc, _run_mode, _run_started_at, _last_run_ts
-    if _run_proc is not None:
-        if _run_proc.poll() is not None:
-            # finished
-            _run_proc = None
-            _run_mode = None
-            _run_started_at = None
-            # try detect last run ts from batches file (latest)
-            bs = _unique_sorted_batches()
-            _last_run_ts = bs[0] if bs else None
-
-def _compute_progress(mode: str | None, text: str | None) -> dict:
-    t = (text or '')
-    if mode == 'no-ansible':
-        total = 5
-        if 'Writing history snapshots' in t or 'Done' in t:
-            return {'current': 5, 'total': total, 'label': 'Writing history snapshots'}
-        if 'Mail Notification' in t:
-            return {'current': 4, 'total': total, 'label': 'Mail Notification'}
-        if 'Running scraping pipeline' in t:
-            return {'current': 3, 'total': total, 'label': 'Scraping pipeline'}
-        if 'Checking end of life status' in t:
-            return {'current': 2, 'total': total, 'label': 'End of life check'}
-        if 'Running CVEs check' in t:
-            return {'current': 1, 'total': total, 'label': 'CVE check'}
-        return {'current': 1, 'total': total, 'label': 'Starting…'}
-    else:
-        total = 5
-        if 'Writing history snapshots' in t or 'Done' in t:
-            return {'current': 5, 'total': total, 'label': 'Writing history snapshots'}
-        if 'Running scraping pipeline' in t:
-            return {'current': 4, 'total': total, 'label': 'Scraping pipeline'}
-        if 'Checking end of life status' in t:
-            return {'current': 3, 'total': total, 'label': 'End of life check'}
-        if 'Running CVEs check' in t:
-            return {'current': 2, 'total': total, 'label': 'CVE check'}
-        if 'Running NXOS playbook' in t or 'Running IOS playbook' in t:
-            return {'current': 1, 'total': total, 'label': 'Ansible playbooks'}
-        return {'current': 1, 'total': total, 'label': 'Starting…'}
+def _previous_durations(job: Dict[str, Any]) -> Dict[str, float]:
+    """Stage durations of the last successful job with the same mode and scope (for the run ETA)."""
+    for j in jobs.list_jobs(('succeeded',), limit=50):
+        if j['id'] != job['id'] and j['mode'] == job['mode'] and j['scope'] == job['scope'] and j['run_ts']:
+            return events.durations(j['run_ts'])
+    return {}
+
+def _progress(job: Dict[str, Any] | None) -> dict:
+    """From the job's events (pipeline/events.py): stages done out of the mode's steps, and for the
+    stage in progress its hosts done/total, failures and ETA."""
+    if job is None:
+        return {'current': 0, 'total': 0, 'label': ''}
+    steps = jobs.steps(job)
+    if job['status'] == 'queued':
+        return {'current': 0, 'total': len(steps), 'label': 'Queued'}
+    running = job['status'] == 'running'
+    prog = events.progress(job.get('run_ts'), steps, _previous_durations(job) if running else None,
+                           now=None if running else job.get('finished_at'))
+    if job['status'] == 'succeeded':
+        prog['current'] = prog['total']
+    return prog
+
+def _progress_fields(prog: dict) -> dict:
+    return {'progress_current': prog['current'], 'progress_total': prog['total'], 'progress_label': prog['label'],
+            **{f'progress_{k}': prog.get(k) for k in ('stage', 'hosts_done', 'hosts_total', 'failed',
+                                                       'eta_sec', 'run_eta_sec', 'elapsed_sec')}}
+
+def _job_view(job: Dict[str, Any], tail: bool = False) -> Dict[str, Any]:
+    out = {k: v for k, v in job.items() if k not in ('log_path', 'worker', 'heartbeat')}
+    if tail:
+        out['orch_tail'] = _tail_file(job['log_path'])
+        out.update(_progress_fields(_progress(job)))
+    return out
 
 @app.get('/api/run/status')
 def run_status():
-    _check_proc()
-    running = _run_proc is not None
-    orch_tail = _tail_file(_orch_log_path) if _orch_log_path else None
-    prog = _compute_progress(_run_mode, orch_tail)
+    """Newest running job (else the newest job) in the shape the control panel polls, plus the active queue."""
+    active = jobs.list_jobs(jobs.ACTIVE)
+    running = [j for j in active if j['status'] == 'running']
+    current = running[0] if running else next(iter(jobs.list_jobs(limit=1)), None)
+    orch_tail = _tail_file(current['log_path']) if current else None
+    bs = _unique_sorted_batches()
     return {
-        'running': running,
-        'mode': _run_mode,
-        'started_at': _run_started_at,
-        'last_run_ts': _last_run_ts,
+        'running': bool(running),
+        'mode': current['mode'] if running else None,
+        'started_at': current['started_at'] if running else None,
+        'last_run_ts': bs[0] if bs else None,
         'orch_tail': orch_tail,
-        'progress_current': prog['current'],
-        'progress_total': prog['total'],
-        'progress_label': prog['label'],
+        **_progress_fields(_progress(current)),
+        'job_id': current['id'] if current else None,
+        'queued': sum(1 for j in active if j['status'] == 'queued'),
+        'jobs': [_job_view(j) for j in active],
     }
 
+RUN_STREAM_POLL_SEC = 1.0
+RUN_STREAM_KEEPALIVE_SEC = 15.0
+
+@app.get('/api/run/stream')
+async def run_stream(request: Request, job_id: int | None = None):
+    """Server-sent events: the /api/run/status payload (or /api/jobs/{job_id}'s) each time it changes.
+    A job's stream ends once the job has finished."""
+    if job_id is not None and jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail='job not found')
+
+    def snapshot() -> Dict[str, Any]:
+        if job_id is None:
+            return run_status()
+        job = jobs.get(job_id)
+        return _job_view(job, tail=True)
+
+    async def gen():
+        last, quiet = None, 0.0
+        while not await request.is_disconnected():
+            payload = await asyncio.get_running_loop().run_in_executor(None, snapshot)
+            data = json.dumps(payload, ensure_ascii=False, default=str)
+            if data != last:
+                last, quiet = data, 0.0
+                yield f'event: progress\ndata: {data}\n\n'
+            elif quiet >= RUN_STREAM_KEEPALIVE_SEC:
+                quiet = 0.0
+                yield ': keepalive\n\n'
+            if job_id is not None and payload.get('status') in jobs.DONE:
+                return
+            await asyncio.sleep(RUN_STREAM_POLL_SEC)
+            quiet += RUN_STREAM_POLL_SEC
+
+    return StreamingResponse(gen(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.post('/api/run')
 async def start_run(request: Request, user: Dict[str, Any] = Depends(require_login)):
     """
-    Start a new pipeline run.
-    mode: 'full' (with Ansible) or 'no-ansible'
+    Queue a new pipeline run.
+    mode: 'full' (with Ansible), 'no-ansible', or a single stage: 'cves', 'eol', 'versions'
+    scope: optional {"groups": [...], "hosts": [...], "pids": [...]} (or those keys at the top level);
+           a scoped run writes a partial batch, and runs with disjoint scopes execute concurrently
+    record_batch: a single-stage run also writes a history batch (default false)
     """
-    global _run_proc, _run_mode, _run_started_at
     # Accept either a raw JSON string body ("full") or an object {"mode": "full"}; default to 'full' on parse failure
     raw_mode = None
+    scope = None
+    record_batch = False
     try:
         payload = await request.json()
     except Exception:
@@ -419,36 +852,334 @@ async def start_run(request: Request, user: Dict[str, Any] = Depends(require_log
         raw_mode = payload
     elif isinstance(payload, dict):
         raw_mode = payload.get('mode')
+        scope = payload.get('scope') or {k: payload[k] for k in run_scope.KEYS if payload.get(k)}
+        record_batch = payload.get('record_batch') is True
     m = (raw_mode or 'full').strip().lower()
-    if m not in {'full', 'no-ansible'}:
-        raise HTTPException(status_code=400, detail="mode must be 'full' or 'no-ansible'")
-    with _run_lock:
-        _check_proc()
-        if _run_proc is not None:
-            raise HTTPException(status_code=409, detail='a run is already in progress')
-        script = os.path.join(SCRIPTS_DIR, 'orchestrate.sh' if m == 'full' else 'orchestrate_no_ansible.sh')
-        if not os.path.exists(script):
-            raise HTTPException(status_code=500, detail='orchestrate script not found')
-        try:
-            # route orchestrator output to a log file for live feedback
-            global _orch_log_path
-            _orch_log_path = os.path.join(DATA_DIR, 'orchestrate_current.log')
-            logf = open(_orch_log_path, 'wb')
-            _run_proc = subprocess.Popen(['bash', script], cwd=BASE_DIR, stdout=logf, stderr=logf)
-            _run_mode = m
-            _run_started_at = time.time()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f'failed to start run: {e}')
-    return {'started': True, 'mode': _run_mode, 'pid': _run_proc.pid if _run_proc else None, 'started_at': _run_started_at}
+    if m not in jobs.MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(jobs.MODES)}")
+    try:
+        job = jobs.enqueue(m, scope, requested_by=(user or {}).get('name'), record_batch=record_batch)
+    except jobs.JobError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    _wake_run_worker()
+    return {'queued': True, 'job_id': job['id'], 'mode': m, 'scope': job['scope'], 'status': job['status']}
+
+@app.get('/api/jobs')
+def list_run_jobs(status: str | None = None, limit: int = 50):
+    statuses = tuple(s.strip() for s in status.split(',') if s.strip()) if status else None
+    return {'jobs': [_job_view(j) for j in jobs.list_jobs(statuses, max(1, min(limit, 500)))]}
+
+@app.get('/api/jobs/{job_id}')
+def get_run_job(job_id: int):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='job not found')
+    return _job_view(job, tail=True)
+
+@app.post('/api/jobs/{job_id}/cancel')
+def cancel_run_job(job_id: int, user: Dict[str, Any] = Depends(require_login)):
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='job not found')
+    if job['status'] in jobs.DONE and job['status'] != 'cancelled':
+        raise HTTPException(status_code=409, detail=f"job already {job['status']}")
+    _wake_run_worker()
+    return _job_view(job)
+
+@app.get('/api/schedules')
+def list_schedules():
+    try:
+        return {'schedules': scheduler.status(), 'cdn_gap_sec': scheduler.CDN_GAP_SEC}
+    except (scheduler.CronError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=500, detail=f'bad schedules.json: {e}')
+
+# === Streaming exports: /api/batch/{ts}/devices.ndjson, cves.ndjson, devices.csv, cves.csv ===
+# Rows are read lazily from the batch's byte range and written out in ~64 KB
+# chunks, so memory stays flat whatever the batch size. NDJSON without
+# projection is the stored lines verbatim. Content-Length (needed for Range)
+# comes from one measuring pass per (batch, format, fields), remembered since
+# recorded batches never change.
+EXPORT_SOURCES = {'devices': DEVICES_SNAPSHOT, 'cves': CVES_SNAPSHOT}
+EXPORT_MEDIA = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+EXPORT_CHUNK_BYTES = 64 * 1024
+_export_sizes: 'OrderedDict[tuple, int]' = OrderedDict()
+
+def _export_lines(path: str, ts: str, cancel: threading.Event | None = None) -> Iterator[bytes]:
+    rng = snapshot_index.lookup(path, ts)
+    if rng:
+        for chunk in snapshot_index.iter_lines(path, rng):
+            if cancel is not None and cancel.is_set():
+                raise _ReadCancelled()
+            yield from chunk.split(b'\n')
+        return
+    # not indexed (rows of the batch are not contiguous): filter a full pass
+    with open(path, 'rb') as f:
+        for n, line in enumerate(f):
+            if cancel is not None and not n % 1000 and cancel.is_set():
+                raise _ReadCancelled()
+            try:
+                if json.loads(line).get('batch_ts') == ts:
+                    yield line.rstrip(b'\n')
+            except Exception:
+                continue
+
+def _csv_cell(v: Any) -> Any:
+    if v is None:
+        return ''
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, ensure_ascii=False, separators=(',', ':'))
+    return v
+
+def _export_body(path: str, ts: str, fmt: str, fields: List[str] | None,
+                 cancel: threading.Event | None = None) -> Iterator[bytes]:
+    buf: List[bytes] = []
+    size = 0
+    columns = None   # CSV header: the projection, else the first row's keys
+    for line in _export_lines(path, ts, cancel):
+        if fmt == 'ndjson' and not fields:
+            out = line + b'\n'
+        else:
+            row = json.loads(line)
+            if fmt == 'ndjson':
+                out = _json_bytes({f: row.get(f) for f in fields}) + b'\n'
+            else:
+                sio = io.StringIO()
+                w = csv.writer(sio)
+                if columns is None:
+                    columns = fields or list(row)
+                    w.writerow(columns)
+                w.writerow([_csv_cell(row.get(c)) for c in columns])
+                out = sio.getvalue().encode('utf-8')
+        buf.append(out)
+        size += len(out)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield b''.join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b''.join(buf)
+
+def _export_length(path: str, ts: str, fmt: str, fields: List[str] | None,
+                   cancel: threading.Event | None = None) -> int:
+    key = (path, ts, fmt, tuple(fields or ()), snapshot_index.lookup(path, ts))
+    with _etags_lock:
+        if key in _export_sizes:
+            return _export_sizes[key]
+    n = sum(len(c) for c in _export_body(path, ts, fmt, fields, cancel))
+    with _etags_lock:
+        _export_sizes[key] = n
+        while len(_export_sizes) > _ETAG_CACHE_MAX:
+            _export_sizes.popitem(last=False)
+    return n
+
+def _byte_range(header: str | None, total: int):
+    """(start, end) inclusive for a single 'bytes=' range; None to serve everything; 'invalid' if unsatisfiable."""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None   # multiple ranges are answered with the full body
+    first, _, last = header[6:].strip().partition('-')
+    try:
+        if not first:
+            n = int(last)
+            if n <= 0:
+                return 'invalid'
+            return max(total - n, 0), total - 1
+        start = int(first)
+        end = min(int(last), total - 1) if last else total - 1
+    except ValueError:
+        return None
+    if start >= total or end < start:
+        return 'invalid'
+    return start, end
+
+def _slice_chunks(chunks: Iterator[bytes], start: int, end: int) -> Iterator[bytes]:
+    pos = 0
+    for c in chunks:
+        lo, hi = pos, pos + len(c)
+        pos = hi
+        if hi <= start:
+            continue
+        yield c[max(start - lo, 0):end + 1 - lo]
+        if hi > end:
+            break
+
+@app.get('/api/batch/{ts}/{kind}.{fmt}')
+async def batch_export(ts: str, kind: str, fmt: str, request: Request, fields: str | None = None):
+    """Stream a batch as NDJSON or CSV; ?fields=a,b projects columns; honours Range/If-Range."""
+    path = EXPORT_SOURCES.get(kind)
+    if path is None or fmt not in EXPORT_MEDIA:
+        raise HTTPException(status_code=404, detail='unknown export')
+    if ts not in await run_in_threadpool(_known_batches):
+        raise HTTPException(status_code=404, detail='batch not found')
+    cols = [f.strip() for f in (fields or '').split(',') if f.strip()] or None
+    rng = await _history(request, _snapshot_range, path, ts)
+    digest = hashlib.sha1(repr((kind, fmt, cols, rng)).encode('utf-8')).hexdigest()
+    etag = _make_etag(request, ts, digest, True)
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if range_header and if_range and if_range.strip() != etag:
+        range_header = None   # representation changed: send it whole
+    if _etag_matches(request, etag) and not range_header:
+        return _not_modified(etag, True)
+    headers = {'ETag': etag, 'Cache-Control': CACHE_IMMUTABLE, 'Accept-Ranges': 'bytes',
+               'Content-Disposition': f'attachment; filename="{kind}_{ts.replace(":", "")}.{fmt}"'}
+    media = EXPORT_MEDIA[fmt]
+    enc = None if range_header else _pick_encoding(request)
+    if enc:
+        # compressed full download: no length needed, ranges apply to the identity body
+        headers.update({'Content-Encoding': enc, 'Vary': 'Accept-Encoding', 'ETag': etag[:-1] + f'-{enc}"'})
+        return StreamingResponse(_encode_chunks(_export_body(path, ts, fmt, cols), enc), media_type=media, headers=headers)
+    total = await _history(request, _export_length, path, ts, fmt, cols)
+    span = _byte_range(range_header, total)
+    if span == 'invalid':
+        return Response(status_code=416, headers={'Content-Range': f'bytes */{total}', 'Accept-Ranges': 'bytes'})
+    if span is None:
+        headers['Content-Length'] = str(total)
+        return StreamingResponse(_export_body(path, ts, fmt, cols), media_type=media, headers=headers)
+    start, end = span
+    headers.update({'Content-Range': f'bytes {start}-{end}/{total}', 'Content-Length': str(end - start + 1)})
+    return StreamingResponse(_slice_chunks(_export_body(path, ts, fmt, cols), start, end),
+                             status_code=206, media_type=media, headers=headers)
+
+def _log_page(ts: str, cancel: threading.Event | None = None, **kwargs):
+    return run_logs.read(ts, **kwargs)
 
 @app.get('/api/batch/{ts}/log')
-def batch_log(ts: str):
-    log_path = os.path.join(LOGS_DIR, f'run_pipeline_{ts}.log')
-    if not os.path.exists(log_path):
+async def batch_log(ts: str, request: Request, offset: int | None = None, limit: int = 500,
+                    tail: int | None = None, before: int | None = None, grep: str | None = None,
+                    level: str | None = None):
+    """Whole log as text, or one page of (filtered) lines as JSON when any paging/filter parameter is given.
+    Archived logs are gzip files: a gzip-accepting client gets the stored bytes as they are."""
+    if (r := _early_304(request)) is not None:
+        return r
+    path = run_logs.find(ts)
+    if path is None:
         raise HTTPException(status_code=404, detail='log not found')
-    with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
-        content = f.read()
-    return PlainTextResponse(content)
+    st = os.stat(path)
+    immutable = await run_in_threadpool(_finalized, ts)
+    if offset is None and tail is None and not grep and not level:
+        digest = hashlib.sha1(f'{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}'.encode('utf-8')).hexdigest()
+        etag = _make_etag(request, ts, digest, immutable)
+        if _etag_matches(request, etag):
+            return _not_modified(etag, immutable)
+        headers = {'Cache-Control': CACHE_IMMUTABLE if immutable else CACHE_REVALIDATE, 'Vary': 'Accept-Encoding'}
+        media = 'text/plain; charset=utf-8'
+        if run_logs.is_compressed(path) and 'gzip' in _accepted_encodings(request):
+            headers.update({'Content-Encoding': 'gzip', 'ETag': etag[:-1] + '-gzip"'})
+            return FileResponse(path, media_type=media, headers=headers)
+        enc = _pick_encoding(request)
+        if enc:
+            headers.update({'Content-Encoding': enc, 'ETag': etag[:-1] + f'-{enc}"'})
+        else:
+            headers['ETag'] = etag
+        return StreamingResponse(_encode_chunks(run_logs.iter_bytes(path), enc), media_type=media, headers=headers)
+    try:
+        run_logs.parse_level(level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    page = await _history(request, _log_page, ts, offset=offset or 0, limit=limit, tail=tail, before=before,
+                          grep=grep, level=level)
+    if page is None:
+        raise HTTPException(status_code=404, detail='log not found')
+    return _cached_response(request, json.dumps(page, ensure_ascii=False).encode('utf-8'), ts, immutable)
+
+def _metrics_summary(ts: str, cancel: threading.Event | None = None):
+    return run_metrics.summarize(ts)
+
+def _events_page(ts: str, cancel: threading.Event | None = None, **kwargs):
+    idx = events.index(ts)
+    if idx is None:
+        return None
+    if not any(kwargs.get(k) for k in ('stage', 'host', 'event', 'outcome', 'level')):
+        return idx.summary()
+    return events.query(ts, **kwargs)
+
+@app.get('/api/batch/{ts}/events')
+async def batch_events(ts: str, request: Request, stage: str | None = None, host: str | None = None,
+                       event: str | None = None, outcome: str | None = None, level: str | None = None,
+                       offset: int = 0, limit: int = 500):
+    """Per-stage summary of a batch's events (live while its run is in progress), or the events matching the filters."""
+    try:
+        run_logs.parse_level(level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    page = await _history(request, _events_page, ts, stage=stage, host=host, event=event, outcome=outcome,
+                          level=level, offset=max(0, offset), limit=limit)
+    if page is None:
+        raise HTTPException(status_code=404, detail='events not found')
+    return page
+
+@app.get('/api/batch/{ts}/metrics')
+async def batch_metrics(ts: str, request: Request):
+    if not os.path.exists(run_metrics.metrics_path(ts)):
+        raise HTTPException(status_code=404, detail='metrics not found')
+    return await _history(request, _metrics_summary, ts)
+
+def _prom_labels(**labels) -> str:
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+        parts.append(f'{k}="{v}"')
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _prom_ts(ts: str) -> float | None:
+    try:
+        from datetime import datetime
+        return datetime.fromisoformat(ts.replace('Z', '+00:00')).timestamp()
+    except Exception:
+        return None
+
+@app.get('/metrics')
+def prometheus_metrics():
+    """Prometheus text format: latest batch summary plus per-stage timings from its run-metrics file."""
+    lines: List[str] = []
+
+    def metric(name: str, mtype: str, help_text: str, samples: List[tuple]):
+        """samples: (labels, value) or (labels, value, suffix), e.g. '_sum'/'_count' under a summary."""
+        if not samples:
+            return
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {mtype}')
+        for labels, value, *suffix in samples:
+            if value is None:
+                continue
+            lines.append(f'{name}{suffix[0] if suffix else ""}{_prom_labels(**labels)} {value}')
+
+    summaries = _batch_summaries()
+    metric('retrievos_batches', 'gauge', 'Number of recorded batches', [({}, len(summaries))])
+    job_counts = jobs.counts()
+    metric('retrievos_run_in_progress', 'gauge', 'Whether a pipeline run is in progress',
+           [({}, 1 if job_counts.get('running') else 0)])
+    metric('retrievos_jobs', 'gauge', 'Pipeline run jobs by status',
+           [({'status': st}, job_counts.get(st, 0)) for st in jobs.ACTIVE + jobs.DONE])
+    if summaries:
+        last = summaries[0]
+        ts = last['batch_ts']
+        metric('retrievos_last_batch_timestamp_seconds', 'gauge', 'Unix time of the latest batch',
+               [({}, _prom_ts(ts))])
+        for key in ('device_count', 'devices_with_upgrade_recommended', 'devices_with_critical_cves', 'devices_eol',
+                    'total_high_cves', 'total_medium_cves'):
+            metric(f'retrievos_last_batch_{key}', 'gauge', f'{key} in the latest batch', [({}, last.get(key))])
+        stages = run_metrics.summarize(ts).get('stages') or {}
+        metric('retrievos_stage_wall_seconds', 'gauge', 'Stage wall time in the latest batch',
+               [({'stage': st}, v.get('wall_sec')) for st, v in stages.items()])
+        metric('retrievos_stage_hosts', 'gauge', 'Hosts processed per stage in the latest batch',
+               [({'stage': st}, v.get('hosts')) for st, v in stages.items()])
+        metric('retrievos_stage_hosts_failed', 'gauge', 'Hosts that failed per stage in the latest batch',
+               [({'stage': st}, v.get('hosts_failed')) for st, v in stages.items()])
+        metric('retrievos_stage_hosts_per_second', 'gauge', 'Stage throughput in the latest batch',
+               [({'stage': st}, v.get('hosts_per_sec')) for st, v in stages.items()])
+        spans, upstream = [], []
+        for st, v in stages.items():
+            for name, d in (v.get('spans') or {}).items():
+                spans.append(({'stage': st, 'span': name, 'quantile': '0.5'}, d.get('p50')))
+                spans.append(({'stage': st, 'span': name, 'quantile': '0.95'}, d.get('p95')))
+                spans.append(({'stage': st, 'span': name}, d.get('total_sec'), '_sum'))
+                spans.append(({'stage': st, 'span': name}, d.get('count'), '_count'))
+            for endpoint, row in ((v.get('counters') or {}).get('upstream') or {}).items():
+                for counter, value in (row or {}).items():
+                    upstream.append(({'stage': st, 'endpoint': endpoint, 'counter': counter}, value))
+        metric('retrievos_span_seconds', 'summary', 'Span latency in the latest batch (quantiles, total time, count)', spans)
+        metric('retrievos_upstream', 'gauge', 'Upstream retry/circuit-breaker counters in the latest batch', upstream)
+    return PlainTextResponse('\n'.join(lines) + '\n', media_type='text/plain; version=0.0.4')
 
 @app.get('/api/batch/{ts}/mail')
 def batch_mail(ts: str, decoded: bool = False):
@@ -515,7 +1246,6 @@ def _parse_inventory(path: str) -> Dict[str, List[Dict[str, Any]]]:
     return groups
 
 def _write_inventory(path: str, groups: Dict[str, List[Dict[str, Any]]]):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
     lines: List[str] = []
     # Write groups in a stable order, but keep ios/nxos first if present
     ordered = []
@@ -544,8 +1274,7 @@ def _write_inventory(path: str, groups: Dict[str, List[Dict[str, Any]]]):
             lines.append(line)
         lines.append('')  # blank line between groups
     content = '\n'.join(lines).rstrip() + '\n'
-    with open(path, 'w', encoding='utf-8') as f:
-        f.write(content)
+    atomic_io.write_text(path, content)
 
 @app.get('/api/inventory')
 def get_inventory():
@@ -577,33 +1306,34 @@ def upsert_inventory_host(group: str = Body(...), host: str = Body(...), vars: D
     host = (host or '').strip()
     if not group or not host:
         raise HTTPException(status_code=400, detail='group and host are required')
-    groups = _parse_inventory(ANSIBLE_INVENTORY)
-    arr = groups.setdefault(group, [])
-    # Build merged vars if host exists
-    idx = next((i for i,e in enumerate(arr) if (e.get('host') or '') == host), None)
-    incoming = vars or {}
-    if idx is not None:
-        current_vars = dict(arr[idx].get('vars') or {})
-        # If UI sent masked or empty password, keep existing
-        pw_in = str(incoming.get('ansible_password', '') or '')
-        if not pw_in or pw_in == '********':
-            if 'ansible_password' in incoming:
-                incoming = dict(incoming)
+    with atomic_io.locked(ANSIBLE_INVENTORY):   # concurrent edits must not drop each other
+        groups = _parse_inventory(ANSIBLE_INVENTORY)
+        arr = groups.setdefault(group, [])
+        # Build merged vars if host exists
+        idx = next((i for i,e in enumerate(arr) if (e.get('host') or '') == host), None)
+        incoming = vars or {}
+        if idx is not None:
+            current_vars = dict(arr[idx].get('vars') or {})
+            # If UI sent masked or empty password, keep existing
+            pw_in = str(incoming.get('ansible_password', '') or '')
+            if not pw_in or pw_in == '********':
+                if 'ansible_password' in incoming:
+                    incoming = dict(incoming)
+                    incoming.pop('ansible_password', None)
+            merged = current_vars
+            merged.update(incoming)
+            arr[idx]['vars'] = merged
+        else:
+            # New entry: accept as is; if password empty/masked, omit field
+            incoming = dict(incoming)
+            pw_in = str(incoming.get('ansible_password', '') or '')
+            if not pw_in or pw_in == '********':
                 incoming.pop('ansible_password', None)
-        merged = current_vars
-        merged.update(incoming)
-        arr[idx]['vars'] = merged
-    else:
-        # New entry: accept as is; if password empty/masked, omit field
-        incoming = dict(incoming)
-        pw_in = str(incoming.get('ansible_password', '') or '')
-        if not pw_in or pw_in == '********':
-            incoming.pop('ansible_password', None)
-        arr.append({'host': host, 'vars': incoming})
-    try:
-        _write_inventory(ANSIBLE_INVENTORY, groups)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f'failed to write inventory: {e}')
+            arr.append({'host': host, 'vars': incoming})
+        try:
+            _write_inventory(ANSIBLE_INVENTORY, groups)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f'failed to write inventory: {e}')
     # Do not echo back the password
     if vars and 'ansible_password' in vars:
         vars = dict(vars)
@@ -616,17 +1346,18 @@ def delete_inventory_host(group: str = Body(...), host: str = Body(...), user: D
     host = (host or '').strip()
     if not group or not host:
         raise HTTPException(status_code=400, detail='group and host are required')
-    groups = _parse_inventory(ANSIBLE_INVENTORY)
-    if group not in groups:
-        raise HTTPException(status_code=404, detail='group not found')
-    prior = len(groups[group])
-    groups[group] = [e for e in (groups[group] or []) if (e.get('host') or '') != host]
-    if len(groups[group]) == prior:
-        raise HTTPException(status_code=404, detail='host not found')
-    try:
-        _write_inventory(ANSIBLE_INVENTORY, groups)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f'failed to write inventory: {e}')
+    with atomic_io.locked(ANSIBLE_INVENTORY):   # concurrent edits must not drop each other
+        groups = _parse_inventory(ANSIBLE_INVENTORY)
+        if group not in groups:
+            raise HTTPException(status_code=404, detail='group not found')
+        prior = len(groups[group])
+        groups[group] = [e for e in (groups[group] or []) if (e.get('host') or '') != host]
+        if len(groups[group]) == prior:
+            raise HTTPException(status_code=404, detail='host not found')
+        try:
+            _write_inventory(ANSIBLE_INVENTORY, groups)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f'failed to write inventory: {e}')
     return {'ok': True, 'group': group, 'host': host}
 
 @app.get('/')
@@ -304,7 +304,7 @@ function drawUpgradePie(){ if(!upgradePie) return; const ctx=upgradePie.getConte
 function persistState(){ const state={ batch:currentBatch, filters:{host:filterHost.value, model:filterModel.value, rec:filterRec.value, sev:Array.from(sevFilters).filter(c=>c.checked).map(c=>c.value)}, sort:sortState, theme:document.body.classList.contains('light'), density:document.body.classList.contains('density-condensed')}; localStorage.setItem('dashState', JSON.stringify(state)); const params=new URLSearchParams(); if(currentBatch) params.set('batch', currentBatch); if(filterHost.value) params.set('host', filterHost.value); if(filterModel.value) params.set('model', filterModel.value); if(filterRec.value) params.set('rec', filterRec.value); history.replaceState(null,'','?'+params.toString()); }
 function restoreState(){ try{ const s=JSON.parse(localStorage.getItem('dashState')||'{}'); if(s.theme) document.body.classList.add('light'); if(s.density) document.body.classList.add('density-condensed'); if(s.filters){ filterHost.value=s.filters.host||''; filterModel.value=s.filters.model||''; filterRec.value=s.filters.rec||''; const set=new Set(s.filters.sev||[]); sevFilters.forEach(c=> c.checked=set.has(c.value)); } if(s.sort) sortState=s.sort; if(s.batch) currentBatch=s.batch; }catch(e){} const urlParams=new URLSearchParams(location.search); ['host','model','rec'].forEach(k=>{ if(urlParams.get(k)){ if(k==='host') filterHost.value=urlParams.get(k); if(k==='model') filterModel.value=urlParams.get(k); if(k==='rec') filterRec.value=urlParams.get(k); }}); if(urlParams.get('batch')) currentBatch=urlParams.get('batch'); }
 function initLegend(){ sevLegend.innerHTML=['Critical','High','Medium','Low'].map(sev=>`<span><i style='background:var(--${sev.toLowerCase()})'></i>${sev}</span>`).join(''); }
-viewLogBtn.onclick=async ()=>{ if(!currentBatch) return; try{ const raw=await fetchText(`/api/batch/${currentBatch}/log`); const esc= s=>s.replace(/[&<>]/g,c=>({'&':'&amp;','<':'&lt;','>':'&gt;'}[c])); const lines=raw.split(/\r?\n/).map(l=>{ const safe=esc(l); if(/\bWARN(ING)?\b/i.test(l)) return `<span class='log-warn'>${safe}</span>`; return safe; }); openModal('Log '+currentBatch, `<pre class='log-output'>${lines.join('\n')}</pre>`);}catch(err){ openModal('Error', `<pre>${err}</pre>`);} };
+viewLogBtn.onclick=async ()=>{ if(!currentBatch) return; try{ const page=await fetchJSON(`/api/batch/${encodeURIComponent(currentBatch)}/log?tail=2000`); const esc= s=>s.replace(/[&<>]/g,c=>({'&':'&amp;','<':'&lt;','>':'&gt;'}[c])); const lines=(page.lines||[]).map(l=>{ const safe=esc(l.text); if(l.level==='WARNING') return `<span class='log-warn'>${safe}</span>`; if(l.level==='ERROR'||l.level==='CRITICAL') return `<span class='log-error'>${safe}</span>`; return safe; }); const more=page.prev_before!=null?`<p style='color:var(--muted)'>Last ${lines.length} lines. <a href='/api/batch/${encodeURIComponent(currentBatch)}/log' target='_blank' rel='noopener'>Open the full log</a></p>`:''; openModal('Log '+currentBatch, `${more}<pre class='log-output'>${lines.join('\n')}</pre>`);}catch(err){ openModal('Error', `<pre>${err}</pre>`);} };
 viewMailBtn.onclick=async ()=>{ if(!currentBatch) return; try{ const txt=await fetchText(`/api/batch/${currentBatch}/mail`); openModal('Mail '+currentBatch, `<pre>${txt.replace(/[&<>]/g,c=>({'&':'&amp;','<':'&lt;','>':'&gt;'}[c]))}</pre>`);}catch(err){ openModal('Error', `<pre>${err}</pre>`);} };
 // Fallback: open CVE URL if user clicks the list item (in case anchor click is blocked by extensions)
 modalBody.addEventListener('click', (e)=>{
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-import os, json, smtplib
+import os, sys, smtplib
 from datetime import datetime, timezone
 from email.message import EmailMessage
 from dotenv import load_dotenv
@@ -15,20 +15,30 @@ MAIL_TO = os.getenv("MAIL_TO", "ali.dridi@insat.ucar.tn").split(",")
 
 # ===== Paths & Files =====
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
 SUGG_FILE = os.path.join(DATA_DIR, "upgrade-suggestions.json")   # append-only list
 CVES_FILE = os.path.join(DATA_DIR, "device_cve_check.json")      # dict keyed by host
+DEVICES_FILE = os.path.join(DATA_DIR, "devices.json")             # dict keyed by host
 RAW_EMAIL_LAST = os.path.join(DATA_DIR, "email_last.eml")        # always overwritten
 
 # Optional RUN_TS (exported by orchestrator) for stable batch identity
 RUN_TS = os.getenv("RUN_TS")  # may be None if script run standalone
 
+sys.path.insert(0, os.path.join(BASE_DIR, 'pipeline'))
+import batch_diff  # type: ignore
+import exposure  # type: ignore
+import events  # type: ignore
+import atomic_io  # type: ignore
+import json_stream  # type: ignore
+import models  # type: ignore
+
+events.configure('mail')
+
+MAX_CVES_LISTED = 10  # per host, in the changes section
+TOP_ADVISORIES = 5     # fleet-wide, by affected hosts
+
 def load_json(path, default):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return default
+    return atomic_io.read_json(path, default)
 
 def parse_iso(s: str) -> datetime:
     # supports "2025-08-19T11:24:52Z" or with offset
@@ -36,7 +46,17 @@ def parse_iso(s: str) -> datetime:
         s = s.replace("Z", "+00:00")
     return datetime.fromisoformat(s)
 
-def find_latest_batch(suggestions: list[dict]) -> tuple[str, list[dict]]:
+def load_devices() -> dict[str, models.Device]:
+    """devices.json as compact device records, read one host at a time ({} if missing or invalid)."""
+    try:
+        return {h: models.Device.from_record(h, r) for h, r in json_stream.iter_items(DEVICES_FILE)}
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        events.log(f"{DEVICES_FILE} is not a JSON object keyed by host ({e}); devices ignored", level="WARNING")
+        return {}
+
+def find_latest_batch(suggestions: list[dict]) -> tuple[str, list[models.Suggestion]]:
     """Return (checked_at, entries_with_that_checked_at)."""
     if not suggestions:
         return "", []
@@ -53,24 +73,106 @@ def find_latest_batch(suggestions: list[dict]) -> tuple[str, list[dict]]:
         return "", []
     latest_dt = max(timestamps)
     latest_iso = latest_dt.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
-    batch = [e for e in suggestions if e.get("checked_at") and
+    batch = [models.Suggestion.from_dict(e) for e in suggestions if e.get("checked_at") and
              parse_iso(e["checked_at"]) == latest_dt]
     return latest_iso, batch
 
-def build_cve_index(cve_data: dict) -> dict:
+def build_exposure(cve_data: dict, devices: dict[str, models.Device]) -> exposure.Exposure:
+    """Hosts x advisories matrix for this run (same as history_writer.py records)."""
+    cves = {h: rec.get("cves") or {} for h, rec in (cve_data or {}).items()
+            if isinstance(rec, dict) and isinstance(rec.get("cves") or {}, dict)}
+    return exposure.Exposure.build(cves, {"model": {h: d.model for h, d in (devices or {}).items()}})
+
+def build_cve_index(exp: exposure.Exposure) -> dict:
     """Return {host: {"Critical": int, "High": int, "Medium": int, "Low": int}}"""
+    return exp.severity_counts()
+
+def format_exposure(exp: exposure.Exposure) -> list[str]:
+    top = exp.top_advisories(TOP_ADVISORIES)
+    if not top:
+        return []
+    lines = ["Top advisories by affected hosts:"]
+    for a in top:
+        cves = ", ".join(a["cves"][:3]) + (" ..." if len(a["cves"]) > 3 else "")
+        lines.append(f"- {a['id']} [{a['severity']}] {a['affected_hosts']} hosts  {a.get('title') or ''}")
+        if cves:
+            lines.append(f"    CVEs: {cves}")
+    riskiest = exp.by(exp.attrs.get("model") or [None] * len(exp.hosts))[:3]
+    if riskiest:
+        lines.append("Most exposed models (severity-weighted risk): " +
+                     "; ".join(f"{g['group']} {g['risk']:g} ({g['exposed_hosts']}/{g['hosts']} hosts)" for g in riskiest))
+    lines.append("")
+    return lines
+
+def current_rows(batch: list[models.Suggestion], devices: dict[str, models.Device]) -> dict:
+    """This run as host -> snapshot-shaped row (same fields/fallbacks history_writer.py records)."""
+    by_host = {e.host: e for e in batch if e.host}
     out = {}
-    for host, rec in (cve_data or {}).items():
-        sev = rec.get("cves", {}) if isinstance(rec, dict) else {}
+    for host in (devices or by_host):
+        e = by_host.get(host) or models.Suggestion(host)
+        dev = (devices or {}).get(host) or models.Device(host)
+        eol = models.Eol.pick(e.eol, dev.eol)
         out[host] = {
-            "Critical": len(sev.get("Critical", [])) if isinstance(sev, dict) else 0,
-            "High":     len(sev.get("High", []))     if isinstance(sev, dict) else 0,
-            "Medium":   len(sev.get("Medium", []))   if isinstance(sev, dict) else 0,
-            "Low":      len(sev.get("Low", []))      if isinstance(sev, dict) else 0,
+            "model": dev.model or e.pid,
+            "platform": dev.platform or e.platform,
+            "current_version": dev.version or e.current_version,
+            "recommended_version": e.recommended_version,
+            "release_designation": e.release_designation,
+            "recommendation": e.recommendation,
+            "upgrade_recommended": e.upgrade_recommended,
+            "end_of_sale_date": eol.end_of_sale_date,
+            "end_of_support_date": eol.end_of_support_date,
+            "status": eol.status,
         }
     return out
 
-def format_email_body(latest_iso: str , batch: list[dict], cve_idx: dict) -> str:
+def compute_delta(batch: list[models.Suggestion], cves: dict, devices: dict[str, models.Device], batch_ts: str) -> dict | None:
+    """Diff this run against the last batch recorded in history (history is written after the email)."""
+    prev_ts = batch_diff.previous_batch(batch_ts) if batch_ts else None
+    if not prev_ts:
+        return None
+    old_devices, old_cves = batch_diff.load_batches([prev_ts])[prev_ts]
+    new_cves = {h: (rec or {}).get("cves") or {} for h, rec in (cves or {}).items() if isinstance(rec, dict)}
+    return batch_diff.diff(old_devices, current_rows(batch, devices), old_cves, new_cves,
+                           batch_ts=batch_ts, against=prev_ts)
+
+def format_delta(delta: dict) -> list[str]:
+    s = delta["summary"]
+    lines = [f"Changes since {delta['against']}:",
+             f"  Hosts added: {s['hosts_added']}, removed: {s['hosts_removed']}, "
+             f"changed: {s['hosts_changed']} (unchanged: {s['hosts_unchanged']})",
+             f"  Version changes: {s['version_changes']} | EoL changes: {s['eol_changes']} | "
+             f"New CVEs: {s['new_cves']} | Resolved CVEs: {s['resolved_cves']}",
+             ""]
+    if delta["added"]:
+        lines.append("New hosts:")
+        for a in delta["added"]:
+            c = a.get("cve_counts") or {}
+            lines.append(f"- {a['host']} PID: {a.get('model')} Version: {a.get('current_version')}  "
+                         f"(Critical: {c.get('Critical', 0)}, High: {c.get('High', 0)})")
+        lines.append("")
+    if delta["removed"]:
+        lines.append("Hosts no longer reported:")
+        for r in delta["removed"]:
+            lines.append(f"- {r['host']} PID: {r.get('model')} Version: {r.get('current_version')}")
+        lines.append("")
+    if delta["changed"]:
+        lines.append("Changed hosts:")
+        for ch in delta["changed"]:
+            lines.append(f"- {ch['host']}")
+            for field, v in ch["fields"].items():
+                lines.append(f"    {field}: {v['from']}  ->  {v['to']}")
+            if ch["new_cves"]:
+                shown = ", ".join(f"{c['id']} ({c['severity']})" for c in ch["new_cves"][:MAX_CVES_LISTED])
+                more = len(ch["new_cves"]) - MAX_CVES_LISTED
+                lines.append(f"    New CVEs: {shown}{f' ... and {more} more' if more > 0 else ''}")
+            if ch["resolved_cves"]:
+                lines.append(f"    Resolved CVEs: {len(ch['resolved_cves'])}")
+        lines.append("")
+    return lines
+
+def format_email_body(latest_iso: str , batch: list[models.Suggestion], cve_idx: dict, delta: dict | None = None,
+                      exp: exposure.Exposure | None = None) -> str:
     total = len(batch)
     crit_devices = 0
     rec_counts = {}
@@ -78,27 +180,36 @@ def format_email_body(latest_iso: str , batch: list[dict], cve_idx: dict) -> str
     lines.append(f"Latest upgrade suggestion batch: {latest_iso}")
     lines.append(f"Devices in this batch: {total}")
     lines.append("")
+    # delta-focused when there is a previous batch: full details only for changed or critical hosts
+    focus = None
+    if delta:
+        lines.extend(format_delta(delta))
+        focus = {h["host"] for h in delta["added"]} | {h["host"] for h in delta["changed"]}
+    if exp is not None:
+        lines.extend(format_exposure(exp))
 
     # sort: Critical CVEs first, then by recommendation severity
     def sort_key(e):
-        host = e.get("host")
+        host = e.host
         crit = cve_idx.get(host, {}).get("Critical", 0)
-        rec  = (e.get("recommendation") or "").lower()
+        rec  = (e.recommendation or "").lower()
         rank = {"upgrade obligatory":0, "critical upgrade suggested":1,
-                "upgrade suggested":2, "upgrade optional":3, "same version":4}.get(rec, 5)
-        return (-crit, rank, e.get("host",""))
+                "upgrade suggested":2, "upgrade optional":3, "same version":4,
+                "newer than recommended":4}.get(rec, 5)
+        return (-crit, rank, e.host or "")
 
     batch_sorted = sorted(batch, key=sort_key)
 
-    lines.append("Per-device details (latest run):")
+    lines.append("Per-device details (latest run):" if focus is None else
+                 "Per-device details (changed hosts and hosts with Critical CVEs):")
     for e in batch_sorted:
-        host = e.get("host")
-        pid  = e.get("pid")
-        plat = e.get("platform")
-        cur  = e.get("current_version")
-        recv = e.get("recommended_version")
-        rec  = e.get("recommendation")
-        url  = e.get("final_url")
+        host = e.host
+        pid  = e.pid
+        plat = e.platform
+        cur  = e.current_version
+        recv = e.recommended_version
+        rec  = e.recommendation
+        url  = e.final_url
         crit = cve_idx.get(host, {}).get("Critical", 0)
         high = cve_idx.get(host, {}).get("High", 0)
         med  = cve_idx.get(host, {}).get("Medium", 0)
@@ -108,6 +219,8 @@ def format_email_body(latest_iso: str , batch: list[dict], cve_idx: dict) -> str
             crit_devices += 1
 
         rec_counts[rec] = rec_counts.get(rec, 0) + 1
+        if focus is not None and host not in focus and crit == 0:
+            continue
 
         badge = " [CRITICAL]" if crit > 0 else ""
         lines.append(f"- {host} [{plat}] PID: {pid}")
@@ -127,20 +240,30 @@ def format_email_body(latest_iso: str , batch: list[dict], cve_idx: dict) -> str
 def send_notification():
     suggestions = load_json(SUGG_FILE, [])
     cves = load_json(CVES_FILE, {})
+    devices = load_devices()
 
     latest_iso, batch = find_latest_batch(suggestions)
     if not batch:
         print("No latest batch found in upgrade-suggestions.json; nothing to notify.")
         return
 
-    cve_idx = build_cve_index(cves)
-    body = format_email_body(latest_iso, batch, cve_idx)
-
+    exp = build_exposure(cves, devices)
+    cve_idx = build_cve_index(exp)
     # Prefer RUN_TS for subject/batch identity when present
     subject_ts = RUN_TS or latest_iso
+    try:
+        delta = compute_delta(batch, cves, devices, subject_ts)
+    except Exception as e:
+        events.log(f"could not diff against previous batch: {e}", level="WARNING")
+        delta = None
+    body = format_email_body(latest_iso, batch, cve_idx, delta, exp)
 
     msg = EmailMessage()
-    msg["Subject"] = f"[retrievos] Upgrade suggestions (batch {subject_ts})"
+    subject = f"[retrievos] Upgrade suggestions (batch {subject_ts})"
+    if delta:
+        s = delta["summary"]
+        subject += f": {s['hosts_changed'] + s['hosts_added'] + s['hosts_removed']} hosts changed, {s['new_cves']} new CVEs"
+    msg["Subject"] = subject
     msg["From"] = MAIL_FROM
     msg["To"] = ", ".join(MAIL_TO)
     ascii_body = ("Hi,\n\n" + body + "\n\n-- retrievos bot\n").encode('ascii', 'ignore').decode('ascii')
@@ -148,19 +271,17 @@ def send_notification():
     msg.set_content(ascii_body, cte='7bit')
     # Save raw email before sending (so even if send fails we retain content)
     try:
-        with open(RAW_EMAIL_LAST, "w", encoding="utf-8") as f:
-            f.write(msg.as_string())
+        atomic_io.write_text(RAW_EMAIL_LAST, msg.as_string())
     except Exception as e:
-        print(f"[email] Warning: could not write {RAW_EMAIL_LAST}: {e}")
+        events.log(f"could not write {RAW_EMAIL_LAST}: {e}", level="WARNING")
 
     # Also write a batch-stamped copy if RUN_TS known
     if subject_ts:
         stamped = os.path.join(DATA_DIR, f"email_{subject_ts}.eml")
         try:
-            with open(stamped, "w", encoding="utf-8") as f:
-                f.write(msg.as_string())
+            atomic_io.write_text(stamped, msg.as_string())
         except Exception as e:
-            print(f"[email] Warning: could not write {stamped}: {e}")
+            events.log(f"could not write {stamped}: {e}", level="WARNING")
 
     # send (best-effort)
     try:
@@ -171,8 +292,9 @@ def send_notification():
             server.login(SMTP_USER, SMTP_PASS)
             server.send_message(msg)
         print(f"✅ Notification sent to {', '.join(MAIL_TO)} for batch {subject_ts} ({len(batch)} devices)")
+        events.emit('mail_sent', recipients=len(MAIL_TO), devices=len(batch))
     except Exception as e:
-        print(f"[email] ERROR sending mail: {e}")
+        events.log(f"ERROR sending mail: {e}", level="ERROR")
 
 if __name__ == "__main__":
     send_notification()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Crash-safe writes and tolerant reads for the pipeline's JSON (and text) artifacts.
+
+A write goes to a temp file next to the target, is fsynced and then renamed over
+it, so a reader sees either the old or the new content, never a truncated file,
+and a crash leaves the previous version in place. Writers of the same file take
+an advisory lock (fcntl.flock on a hidden .<name>.lock beside it) for the rename;
+readers take no lock, so a dashboard request never waits on a running stage.
+
+  atomic_io.write_json(path, data)              # indent=2, ensure_ascii=False by default
+  atomic_io.write_text(path, text)
+  with atomic_io.open_atomic(path) as f:        # stream a large file; replaced when the block succeeds
+      f.write(...)
+  atomic_io.read_json(path, default)            # default if missing; retries a partial file
+  with atomic_io.locked(path):                  # read-modify-write without losing updates
+      d = atomic_io.read_json(path, {}); d[k] = v; atomic_io.write_json(path, d)
+
+Files written by other tools (or by a version of the pipeline before this
+module) can still be caught mid-write; read_json retries those a few times
+before it gives up and returns the default.
+"""
+from __future__ import annotations
+import os, json, time, fcntl, threading
+from contextlib import contextmanager
+from typing import IO, Any, Iterator
+
+READ_RETRIES = 5
+READ_RETRY_SEC = 0.05
+
+_held = threading.local()
+
+
+def lock_path(path: str) -> str:
+    d, name = os.path.split(os.path.abspath(path))
+    return os.path.join(d, f'.{name}.lock')
+
+
+@contextmanager
+def locked(path: str) -> Iterator[None]:
+    """Hold the advisory write lock of `path`; re-entrant within a thread."""
+    key = lock_path(path)
+    held = _held.__dict__.setdefault('paths', set())
+    if key in held:
+        yield
+        return
+    os.makedirs(os.path.dirname(key), exist_ok=True)
+    with open(key, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _fsync_dir(d: str) -> None:
+    try:
+        fd = os.open(d, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def open_atomic(path: str, mode: str = 'w', encoding: str = 'utf-8') -> Iterator[IO]:
+    """A file to stream the new content of `path` into; it replaces `path` when the block ends without error."""
+    path = os.path.abspath(path)
+    d, name = os.path.split(path)
+    os.makedirs(d, exist_ok=True)
+    tmp = os.path.join(d, f'.{name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with locked(path):
+        try:
+            with open(tmp, mode, encoding=None if 'b' in mode else encoding) as f:
+                yield f
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.chmod(tmp, os.stat(path).st_mode & 0o7777)   # keep the target's permissions
+            except OSError:
+                pass
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        _fsync_dir(d)
+
+
+def write_bytes(path: str, data: bytes) -> None:
+    """Replace `path` with `data` atomically and durably."""
+    with open_atomic(path, 'wb') as f:
+        f.write(data)
+
+
+def write_text(path: str, text: str, encoding: str = 'utf-8') -> None:
+    write_bytes(path, text.encode(encoding))
+
+
+def write_json(path: str, data: Any, indent: Any = 2, ensure_ascii: bool = False, **kw: Any) -> None:
+    """json.dump `data` to `path` atomically; extra keywords go to json.dumps."""
+    write_text(path, json.dumps(data, indent=indent, ensure_ascii=ensure_ascii, **kw))
+
+
+def read_json(path: str, default: Any = None, retries: int = READ_RETRIES) -> Any:
+    """Parsed JSON of `path`; `default` if it is missing, unreadable or stays invalid.
+
+    Invalid JSON is retried after a short pause, since it is usually a file still
+    being written in place by something that does not use write_json.
+    """
+    for attempt in range(retries + 1):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+        except OSError as e:
+            print(f'[atomic_io] cannot read {path}: {e}')
+            return default
+        except ValueError as e:
+            if attempt == retries:
+                print(f'[atomic_io] {path} is not valid JSON ({e}); using default')
+                return default
+            time.sleep(READ_RETRY_SEC * (attempt + 1))
+    return default
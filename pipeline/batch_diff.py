@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Per-host deltas between two batches: added/removed hosts, version and EoL changes, new/resolved CVEs.
+
+history_writer.py writes the diff against the previous batch to
+data/history/diffs/diff_<RUN_TS>.json; the dashboard serves those and
+computes other pairs on demand (cached in-process). The notification email
+diffs the current run against the last recorded batch.
+
+  python pipeline/batch_diff.py <ts> [--against <ts>]
+"""
+from __future__ import annotations
+import os, json
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import atomic_io
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+HIST_DIR = os.path.join(DATA_DIR, 'history')
+DIFFS_DIR = os.path.join(HIST_DIR, 'diffs')
+DEVICES_SNAPSHOT = os.path.join(HIST_DIR, 'devices_snapshot.jsonl')
+CVES_SNAPSHOT = os.path.join(HIST_DIR, 'cves_snapshot.jsonl')
+BATCHES_JSONL = os.path.join(HIST_DIR, 'batches.jsonl')
+
+# snapshot fields compared per host
+TRACKED = ('model', 'platform', 'current_version', 'recommended_version', 'release_designation',
+           'recommendation', 'upgrade_recommended', 'end_of_sale_date', 'end_of_support_date', 'status')
+EOL_FIELDS = ('end_of_sale_date', 'end_of_support_date', 'status')
+SEVERITIES = ('Critical', 'High', 'Medium', 'Low')
+
+Rows = Dict[str, Dict[str, Any]]   # host -> row
+
+
+def diff_path(ts: str) -> str:
+    return os.path.join(DIFFS_DIR, f'diff_{ts}.json')
+
+
+def cve_ids(cves: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """{cve_id: severity} from a {severity: [entry, ...]} map (entries may be ids or dicts)."""
+    out: Dict[str, str] = {}
+    for sev, items in (cves or {}).items():
+        for item in items or []:
+            cid = item.get('id') if isinstance(item, dict) else item
+            if cid:
+                out.setdefault(str(cid).strip(), sev)
+    return out
+
+
+def _sev_rank(sev: str) -> int:
+    return SEVERITIES.index(sev) if sev in SEVERITIES else len(SEVERITIES)
+
+
+class Diff:
+    """diff() fed one host at a time, in any order: add() each host of either batch once, then result() or write().
+
+    Entries are kept JSON-encoded (a fleet-wide change is most of a batch) and
+    sorted by host only when the diff is produced.
+    """
+    LISTS = ('added', 'removed', 'changed')
+
+    def __init__(self, batch_ts: Optional[str] = None, against: Optional[str] = None):
+        self.batch_ts, self.against = batch_ts, against
+        self.entries: Dict[str, Dict[str, str]] = {name: {} for name in Diff.LISTS}   # list -> host -> JSON
+        self.common = self.version_changes = self.eol_changes = self.new_total = self.resolved_total = 0
+
+    def _keep(self, name: str, host: str, entry: Dict[str, Any]) -> None:
+        self.entries[name][host] = json.dumps(entry, ensure_ascii=False)
+
+    def add(self, host: str, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]],
+            old_cves: Optional[Dict[str, Any]] = None, new_cves: Optional[Dict[str, Any]] = None) -> None:
+        """One host's rows in the older and newer batch (None where it is missing) and its CVE maps."""
+        if old is None and new is None:
+            return
+        if old is None:
+            ids = cve_ids(new_cves)
+            self._keep('added', host, {'host': host, 'model': new.get('model'), 'current_version': new.get('current_version'),
+                                       'cve_counts': {s: sum(1 for v in ids.values() if v == s) for s in SEVERITIES}})
+            return
+        if new is None:
+            self._keep('removed', host, {'host': host, 'model': old.get('model'), 'current_version': old.get('current_version')})
+            return
+        self.common += 1
+        fields = {f: {'from': old.get(f), 'to': new.get(f)} for f in TRACKED if old.get(f) != new.get(f)}
+        before, after = cve_ids(old_cves), cve_ids(new_cves)
+        new_c = sorted(({'id': c, 'severity': s} for c, s in after.items() if c not in before),
+                       key=lambda e: (_sev_rank(e['severity']), e['id']))
+        resolved = sorted(({'id': c, 'severity': s} for c, s in before.items() if c not in after),
+                          key=lambda e: (_sev_rank(e['severity']), e['id']))
+        if not (fields or new_c or resolved):
+            return
+        self.version_changes += 'current_version' in fields
+        self.eol_changes += any(f in fields for f in EOL_FIELDS)
+        self.new_total += len(new_c)
+        self.resolved_total += len(resolved)
+        self._keep('changed', host, {'host': host, 'fields': fields, 'new_cves': new_c, 'resolved_cves': resolved})
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            'hosts_added': len(self.entries['added']),
+            'hosts_removed': len(self.entries['removed']),
+            'hosts_changed': len(self.entries['changed']),
+            'hosts_unchanged': self.common - len(self.entries['changed']),
+            'version_changes': self.version_changes,
+            'eol_changes': self.eol_changes,
+            'new_cves': self.new_total,
+            'resolved_cves': self.resolved_total,
+        }
+
+    def _head(self) -> Dict[str, Any]:
+        return {'batch_ts': self.batch_ts, 'against': self.against, 'summary': self.summary()}
+
+    def result(self) -> Dict[str, Any]:
+        out = self._head()
+        for name in Diff.LISTS:
+            kept = self.entries[name]
+            out[name] = [json.loads(kept[h]) for h in sorted(kept)]
+        return out
+
+    def write(self) -> str:
+        """diffs/diff_<batch_ts>.json, entry by entry (the bytes write(self.result()) would produce)."""
+        path = diff_path(self.batch_ts)
+        with atomic_io.open_atomic(path) as f:
+            f.write(json.dumps(self._head(), ensure_ascii=False)[:-1])
+            for name in Diff.LISTS:
+                kept = self.entries[name]
+                f.write(f', "{name}": [')
+                for i, h in enumerate(sorted(kept)):
+                    f.write((', ' if i else '') + kept[h])
+                f.write(']')
+            f.write('}')
+        return path
+
+
+def diff(old_devices: Rows, new_devices: Rows, old_cves: Rows, new_cves: Rows,
+         batch_ts: Optional[str] = None, against: Optional[str] = None) -> Dict[str, Any]:
+    """Compare two batches given as host-keyed device rows and host-keyed {severity: [...]} CVE maps."""
+    d = Diff(batch_ts, against)
+    for host in set(old_devices) | set(new_devices):
+        d.add(host, old_devices.get(host), new_devices.get(host), old_cves.get(host), new_cves.get(host))
+    return d.result()
+
+
+def load_batches(stamps: Iterable[str]) -> Dict[str, Tuple[Rows, Rows]]:
+    """{ts: (devices_by_host, cves_by_host)} for the given batches, one pass over each snapshot file."""
+    wanted = set(stamps)
+    out: Dict[str, Tuple[Rows, Rows]] = {ts: ({}, {}) for ts in wanted}
+    for idx, path in ((0, DEVICES_SNAPSHOT), (1, CVES_SNAPSHOT)):
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except Exception:
+                    continue
+                ts = row.get('batch_ts') if isinstance(row, dict) else None
+                if ts in wanted and row.get('host'):
+                    out[ts][idx][row['host']] = row if idx == 0 else (row.get('cves') or {})
+    return out
+
+
+def batch_stamps() -> List[str]:
+    stamps = set()
+    if os.path.exists(BATCHES_JSONL):
+        with open(BATCHES_JSONL, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    ts = json.loads(line).get('batch_ts')
+                except Exception:
+                    continue
+                if ts:
+                    stamps.add(ts)
+    return sorted(stamps)
+
+
+def previous_batch(ts: str, stamps: Optional[List[str]] = None) -> Optional[str]:
+    older = [s for s in (stamps if stamps is not None else batch_stamps()) if s < ts]
+    return older[-1] if older else None
+
+
+@lru_cache(maxsize=32)
+def compute(ts: str, against: str) -> Dict[str, Any]:
+    """Diff two recorded batches. Cached: recorded batches never change."""
+    both = load_batches((ts, against))
+    (new_d, new_c), (old_d, old_c) = both[ts], both[against]
+    return diff(old_d, new_d, old_c, new_c, batch_ts=ts, against=against)
+
+
+def load_written(ts: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(diff_path(ts), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def write(d: Dict[str, Any]) -> str:
+    path = diff_path(d['batch_ts'])
+    atomic_io.write_json(path, d, indent=None)
+    return path
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Diff two history batches')
+    ap.add_argument('ts')
+    ap.add_argument('--against', help='Older batch (default: the one before ts)')
+    args = ap.parse_args()
+    against = args.against or previous_batch(args.ts)
+    if not against:
+        ap.error(f'no batch before {args.ts}')
+    print(json.dumps(compute(args.ts, against), indent=2))
@@ -1,13 +1,24 @@
-import json
 import requests
 import os
-import re
-import time
+import sys
 from dotenv import load_dotenv
 
 # Adjust working directory awareness so script can be run from repo root or pipeline/
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+sys.path.insert(0, os.path.join(BASE_DIR, 'scraping'))
+
+from retry_policy import RetryPolicy, CircuitOpenError, METRICS as RETRY_METRICS, endpoint_of  # type: ignore
+import run_metrics
+import events
+import atomic_io
+import device_registry
+import json_stream
+import models
+import scope as run_scope
+
+run_metrics.configure('cves')
+events.configure('cves')
 DEVICES_JSON = os.path.join(DATA_DIR, 'devices.json')
 OUTPUT_JSON = os.path.join(DATA_DIR, 'device_cve_check.json')
 proxies = {
@@ -22,56 +33,35 @@ load_dotenv()
 CLIENT_ID = os.getenv("CISCO_CLIENT_ID")
 CLIENT_SECRET = os.getenv("CISCO_CLIENT_SECRET")
 
-TOKEN_URL = "https://id.cisco.com/oauth2/default/v1/token"
-ADVISORY_URL = "https://apix.cisco.com/security/advisories/v2/OSType"
+TOKEN_URL = os.getenv('CISCO_TOKEN_URL', "https://id.cisco.com/oauth2/default/v1/token")
+ADVISORY_URL = os.getenv('CISCO_PSIRT_API', "https://apix.cisco.com/security/advisories/v2/OSType").rstrip('/')
 REQ_TIMEOUT = int(os.getenv('CISCO_API_TIMEOUT', '20'))  # seconds
 MAX_RETRIES = int(os.getenv('CISCO_API_RETRIES', '2'))
 
-# --- Version normalization (mirror of pipeline) ---
-RE_IOS_PAREN = re.compile(r"^(\d+)\.(\d+)\((\d+)\)([A-Za-z]+)?(\d+)?$")
-RE_IOS_DASH = re.compile(r"^(\d+)\.(\d+)\.(\d+)-([A-Za-z]+)(\d+)$")
-RE_IOS_DASH_SHORT = re.compile(r"^(\d+)\.(\d+)\.(\d+)([A-Za-z]+)(\d+)$")
-
-def to_ios_canonical(v: str) -> str:
-    s = (v or '').strip()
-    if not s:
-        return s
-    m = RE_IOS_PAREN.match(s)
-    if m:
-        return s
-    m = RE_IOS_DASH.match(s)
-    if m:
-        a,b,c,sfx,n = m.groups(); return f"{a}.{b}({c}){sfx}{n}"
-    m = RE_IOS_DASH_SHORT.match(s)
-    if m:
-        a,b,c,sfx,n = m.groups(); return f"{a}.{b}({c}){sfx}{n}"
-    return s
-
-def version_variants(platform: str, v: str):
-    p = (platform or '').lower()
-    s = (v or '').strip()
-    if not s:
-        return []
-    if p in ('ios','iosxe','ios-xe'):
-        # generate a few reasonable variants to improve match rate
-        out = []
-        can = to_ios_canonical(s)
-        out.append(can)
-        m = RE_IOS_PAREN.match(can)
-        if m:
-            a,b,c,sfx,n = m.groups()
-            if sfx and n:
-                out.append(f"{a}.{b}.{c}-{sfx}{n}")  # 15.0.2-SE11
-                out.append(f"{a}.{b}.{c}{sfx}{n}")   # 15.0.2SE11
-        if s not in out:
-            out.append(s)
-        return out
-    return [s]
+# Shared jittered backoff + per-endpoint circuit breaker (403/429 count as blocks)
+API_POLICY = RetryPolicy(max_attempts=MAX_RETRIES + 1, base=2.0, cap=10.0)
+
+def _api_ok(r) -> bool:
+    # 404/empty are answers, not failures; only transport errors, 5xx and blocks are retried
+    return r is not None and r.status_code < 500 and r.status_code not in (403, 429)
+
+def _api_blocked(r) -> bool:
+    return r is not None and r.status_code in (403, 429)
+
+def _timed_get(url, **kwargs):
+    # one 'http' span per attempt so retries show up as separate latencies
+    with run_metrics.span('http', endpoint=endpoint_of(url)) as sp:
+        r = requests.get(url, **kwargs)
+        sp['status'] = r.status_code
+        return r
+
+# --- Version normalization (shared with run_pipeline.py) ---
+from versions import variants as version_variants  # noqa: E402
 
 # 1. Get Token
 def get_token():
     if not CLIENT_ID or not CLIENT_SECRET:
-        print("[cves] CISCO_CLIENT_ID/SECRET not set; skipping CVE fetch.")
+        events.log("CISCO_CLIENT_ID/SECRET not set; skipping CVE fetch.", level="WARNING")
         return None
     data = {
         "grant_type": "client_credentials",
@@ -79,18 +69,21 @@ def get_token():
         "client_secret": CLIENT_SECRET
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    last_err = None
-    for attempt in range(1, MAX_RETRIES + 2):
-        try:
-            r = requests.post(TOKEN_URL, data=data, headers=headers, timeout=REQ_TIMEOUT)
-            r.raise_for_status()
-            return r.json().get("access_token")
-        except Exception as e:
-            last_err = e
-            print(f"[cves] token attempt {attempt} failed: {e}")
-            time.sleep(min(2 * attempt, 5))
-    print(f"[cves] giving up obtaining token: {last_err}")
-    return None
+
+    def _post():
+        r = requests.post(TOKEN_URL, data=data, headers=headers, timeout=REQ_TIMEOUT)
+        r.raise_for_status()
+        return r.json().get("access_token")
+
+    try:
+        with run_metrics.span('token'):
+            token = API_POLICY.call(_post, endpoint=endpoint_of(TOKEN_URL), label="[cves] token")
+    except CircuitOpenError as e:
+        events.log(f"giving up obtaining token: {e}", level="ERROR")
+        return None
+    if not token:
+        events.log("giving up obtaining token", level="ERROR")
+    return token
 
 # 2. Get advisories for platform + version
 def get_advisories(token, platform, version):
@@ -99,13 +92,18 @@ def get_advisories(token, platform, version):
         "Accept": "application/json"
     }
     url = f"{ADVISORY_URL}/{platform}"
+    endpoint = endpoint_of(ADVISORY_URL)
+
+    def _get(ver):
+        return API_POLICY.call(_timed_get, url, endpoint=endpoint, ok=_api_ok, blocked=_api_blocked,
+                               label=f"[cves] {platform} {ver}",
+                               headers=headers, params={"version": ver}, timeout=REQ_TIMEOUT)
+
     # Try canonical and alternative variants for better match
     for ver in version_variants(platform, version):
-        params = {"version": ver}
-        try:
-            r = requests.get(url, headers=headers, params=params, timeout=REQ_TIMEOUT)
-        except Exception as e:
-            print(f"[cves] request error for {platform} {ver}: {e}")
+        r = _get(ver)
+        if r is None:
+            events.log(f"request failed for {platform} {ver}", level="WARNING")
             continue
         if r.status_code == 200:
             adv = r.json().get("advisories", [])
@@ -113,13 +111,12 @@ def get_advisories(token, platform, version):
                 return adv
         # Continue trying other variants on failure or empty result
     # Final attempt with original version
-    try:
-        r = requests.get(url, headers=headers, params={"version": version}, timeout=REQ_TIMEOUT)
-    except Exception as e:
-        print(f"[cves] final request error for {platform} {version}: {e}")
+    r = _get(version)
+    if r is None:
+        events.log(f"final request failed for {platform} {version}", level="ERROR")
         return []
     if r.status_code != 200:
-        print(f"⚠️ Error for {platform} {version}: {r.status_code}")
+        events.log(f"error for {platform} {version}: HTTP {r.status_code}", level="WARNING")
         return []
     return r.json().get("advisories", [])
 
@@ -161,46 +158,63 @@ def organize_by_severity(advisories):
                 result.setdefault(severity, []).append(entry)
     return result
 # 4. Main
-def main():
-    # Load devices.json
-    if not os.path.exists(DEVICES_JSON):
-        print(f"[cves] {DEVICES_JSON} not found; nothing to check.")
-        with open(OUTPUT_JSON, "w") as f:
-            json.dump({}, f)
-        return
-    with open(DEVICES_JSON) as f:
-        devices = json.load(f)
-    if not isinstance(devices, dict):
-        print("[cves] devices.json is not an object; skipping CVE check.")
-        with open(OUTPUT_JSON, "w") as f:
-            json.dump({}, f)
+def main(sc=None):
+    sc = sc or run_scope.from_env()
+    # Device records from the registry (pipeline/device_registry.py)
+    if not device_registry.count():
+        events.log(f"device registry is empty ({DEVICES_JSON} not found); nothing to check.", level="WARNING")
+        atomic_io.write_json(OUTPUT_JSON, {}, indent=None)
         return
+    hosts = device_registry.scope_hosts(sc)
+
+    # a scoped run re-checks its hosts only and keeps everyone else's results
+    output = {}
+    if not sc.whole:
+        events.log(f"scope {sc.describe()}: {len(hosts)} device(s)")
+        previous = atomic_io.read_json(OUTPUT_JSON, {})
+        in_scope = set(hosts)
+        output = {h: r for h, r in previous.items() if h not in in_scope}
 
     token = get_token()
     if not token:
-        print("[cves] no token; writing empty CVE results.")
-        with open(OUTPUT_JSON, "w") as f:
-            json.dump({}, f)
+        events.log("no token; writing empty CVE results.", level="ERROR")
+        atomic_io.write_json(OUTPUT_JSON, output, indent=None)
         return
-    output = {}
 
-    for name, device in devices.items():
-        platform = device["platform"]
-        version = device["version"]
-        print(f"[cves] querying {name} ({platform} {version})…")
-        advisories = get_advisories(token, platform, version)
-        output[name] = {
-            "model": device["model"],
-            "version": version,
-            "cves": organize_by_severity(advisories)
-        }
-        print(f"✅ Checked {name} ({platform} {version})")
+    events.plan(len(hosts))
+    with run_metrics.span('stage'):
+        # records are read a page at a time, and only the fields used here
+        for name, rec in device_registry.iter_records(hosts, fields=("model", "platform", "version")):
+            device = models.Device.from_record(name, rec)
+            platform = device.platform
+            version = device.version
+            print(f"[cves] querying {name} ({platform} {version})…")
+            with run_metrics.host_scope(name), run_metrics.span('host') as sp, events.host(name) as ev:
+                try:
+                    advisories = get_advisories(token, platform, version)
+                except CircuitOpenError as e:
+                    events.log(f"{e}; skipping {name}", level="WARNING", host=name)
+                    sp['outcome'] = ev['outcome'] = 'circuit_open'
+                    # keep the host in the results, marked as not checked (its cves are unknown, not empty)
+                    output[name] = {"model": device.model, "version": version, "cves": {},
+                                    "skipped": "circuit open"}
+                    continue
+            output[name] = {
+                "model": device.model,
+                "version": version,
+                "cves": organize_by_severity(advisories)
+            }
+            print(f"✅ Checked {name} ({platform} {version})")
 
+    events.log(f"upstream: {RETRY_METRICS.summary_line()}")
+    run_metrics.record_counters('upstream', RETRY_METRICS.snapshot())
     # Save results
-    with open(OUTPUT_JSON, "w") as f:
-        json.dump(output, f, indent=4)
+    json_stream.write_items(OUTPUT_JSON, output.items(), indent=4)
 
     print(f"📂 Results saved in {OUTPUT_JSON}")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    ap = argparse.ArgumentParser(description='Check Cisco PSIRT advisories for every device in devices.json')
+    run_scope.add_arguments(ap)
+    main(run_scope.from_args(ap.parse_args()))
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""Device registry: the fleet's device records in SQLite, one row per host and field.
+
+devices.json used to be the shared blackboard: the playbooks, eol_details.py
+and eolcheck.py each read the whole fleet and rewrote the whole file. The
+registry (data/devices.db, WAL) stores every top-level field of a device record
+as its own row, tagged with the stage that owns it, so a stage writes only the
+hosts and fields it produces and concurrent stages never overwrite each other:
+
+  ansible   host, model, platform, version, device_info, ...   (playbooks, via import-records)
+  eol       eol_details                                         (eol_details.py --write, eolcheck.py)
+
+devices.json stays, as an export for everything that reads the file (dashboard,
+mail, history): stages call export() once they are done. It is only read back
+once, to migrate a data directory from before the registry: the first connect
+to an empty registry imports it. After that the registry is the only source of
+truth, and edits to the file are ignored (and overwritten by the next export)
+unless they are imported on purpose with `import`, which replaces everything.
+Both directions stream the file (json_stream.py), and stages iterate the
+registry page by page, so no step holds the whole fleet in memory.
+
+  device_registry.load(hosts=None, fields=None)        # {host: record}, like devices.json
+  device_registry.iter_records(hosts=None)              # (host, record), a page of hosts at a time
+  device_registry.scope_hosts(sc)                       # the registry's hosts in a scope.Scope
+  device_registry.load_scope(sc)                        # only the hosts of a scope
+  device_registry.update(host, {'eol_details': {...}}, 'eol')
+  device_registry.replace(host, record, 'ansible')      # the stage's fields become exactly these
+  device_registry.export()                              # rewrite devices.json
+
+  python pipeline/device_registry.py import-records <dir> [--stage ansible]   # one <host>.json per device
+  python pipeline/device_registry.py show [host] | export | import <devices.json>
+"""
+from __future__ import annotations
+import os, sys, json, time, sqlite3
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import atomic_io
+import json_stream
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+DEVICES_DB = os.path.join(DATA_DIR, 'devices.db')
+
+# fields owned by a stage other than the playbooks (used when importing devices.json)
+FIELD_STAGES = {'eol_details': 'eol'}
+DEFAULT_STAGE = 'ansible'
+_CHUNK = 500   # hosts per IN (...) query
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fields (
+    host TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    pos INTEGER NOT NULL DEFAULT 0,
+    run_ts TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (host, field)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS fields_stage ON fields (stage, host);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+_UPSERT = """
+INSERT INTO fields (host, field, value, stage, pos, run_ts, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (host, field) DO UPDATE SET
+    value = excluded.value, stage = excluded.stage, run_ts = excluded.run_ts, updated_at = excluded.updated_at
+"""
+_schema_ready: Set[str] = set()
+_migrated: Set[str] = set()
+
+
+def json_path(path: Optional[str] = None) -> str:
+    """The devices.json exported next to a registry."""
+    return os.path.join(os.path.dirname(path or DEVICES_DB), 'devices.json')
+
+
+@contextmanager
+def connect(path: Optional[str] = None) -> Iterator[sqlite3.Connection]:
+    """Autocommit connection to the registry; the schema is created (and devices.json migrated) on first use."""
+    path = path or DEVICES_DB
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        if path not in _schema_ready:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            _schema_ready.add(path)
+        if path not in _migrated:
+            _migrate_json(conn, path)
+            _migrated.add(path)
+        yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection) -> Iterator[None]:
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    r = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return r[0] if r else None
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value: Optional[str]) -> None:
+    conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+
+def _migrate_json(conn: sqlite3.Connection, path: str) -> None:
+    """One-time import of devices.json into a registry that has never held devices.
+
+    Runs at most once per registry (meta 'migrated'), in one write transaction,
+    and never touches a registry that already has rows: a stage's fields are
+    only ever written by that stage (or an explicit `import`).
+    """
+    if _meta(conn, 'migrated'):
+        return
+    src = json_path(path)
+    with _transaction(conn):
+        if _meta(conn, 'migrated'):
+            return
+        if os.path.exists(src) and conn.execute('SELECT 1 FROM fields LIMIT 1').fetchone() is None:
+            try:
+                n = _import(conn, json_stream.iter_items(src))
+                print(f'[registry] migrated {n} device(s) from {src}')
+            except ValueError as e:
+                print(f'[registry] {src} is not a valid JSON object keyed by host ({e}); not migrated')
+                conn.execute('DELETE FROM fields')
+        _set_meta(conn, 'migrated', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()))
+
+
+def _import(conn: sqlite3.Connection, items: Iterable[Tuple[str, Any]]) -> int:
+    """Replace every row with (host, record) pairs; returns the number of devices."""
+    now = time.time()
+    n = 0
+
+    def rows():
+        nonlocal n
+        for host, rec in items:
+            if isinstance(rec, dict):
+                n += 1
+                for pos, (k, v) in enumerate(rec.items()):
+                    yield host, k, json.dumps(v, ensure_ascii=False), FIELD_STAGES.get(k, DEFAULT_STAGE), pos, None, now
+
+    conn.execute('DELETE FROM fields')
+    conn.executemany(_UPSERT, rows())
+    return n
+
+
+def _chunks(hosts: Sequence[str]) -> Iterator[Sequence[str]]:
+    for i in range(0, len(hosts), _CHUNK):
+        yield hosts[i:i + _CHUNK]
+
+
+def _records(rows: Iterable[Sequence[Any]]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """(host, record) from rows ordered by host."""
+    host, rec = None, {}
+    for h, field, value in rows:
+        if h != host:
+            if host is not None:
+                yield host, rec
+            host, rec = h, {}
+        rec[field] = json.loads(value)
+    if host is not None:
+        yield host, rec
+
+
+def iter_records(hosts: Optional[Iterable[str]] = None, fields: Optional[Iterable[str]] = None,
+                 path: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """(host, record) for the given hosts (all without) in host order, optionally only some fields.
+
+    Hosts are read a page at a time and no read transaction stays open between
+    pages, so a stage can iterate while it (or another stage) writes.
+    """
+    cond, args = '', []
+    if fields is not None:
+        fields = list(fields)
+        cond = f" AND field IN ({','.join('?' * len(fields))})"
+        args = fields
+    with connect(path) as conn:
+        if hosts is None:
+            pages = _host_pages(conn)
+        else:
+            pages = _chunks(sorted(set(hosts)))
+        for chunk in pages:
+            rows = conn.execute(f"SELECT host, field, value FROM fields WHERE host IN ({','.join('?' * len(chunk))}){cond} "
+                                'ORDER BY host, pos', [*chunk, *args]).fetchall()
+            yield from _records(rows)
+
+
+def _host_pages(conn: sqlite3.Connection) -> Iterator[List[str]]:
+    last = ''
+    while True:
+        page = [r[0] for r in conn.execute('SELECT DISTINCT host FROM fields WHERE host > ? ORDER BY host LIMIT ?',
+                                           (last, _CHUNK))]
+        if not page:
+            return
+        yield page
+        last = page[-1]
+
+
+def load(hosts: Optional[Iterable[str]] = None, fields: Optional[Iterable[str]] = None,
+         path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """{host: record} for the given hosts (all without), optionally only some fields of each record."""
+    return dict(iter_records(hosts, fields, path))
+
+
+def scope_hosts(sc, path: Optional[str] = None) -> List[str]:
+    """The registry's hosts in a scope.Scope, sorted (PIDs are matched against the model field)."""
+    if sc.whole:
+        return hosts(path)
+    return sorted(sc.filter(load(fields=('model',), path=path)))
+
+
+def load_scope(sc, path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """The records of a scope.Scope's hosts."""
+    return load(scope_hosts(sc, path), path=path)
+
+
+def hosts(path: Optional[str] = None) -> List[str]:
+    with connect(path) as conn:
+        return [r[0] for r in conn.execute('SELECT DISTINCT host FROM fields ORDER BY host')]
+
+
+def count(path: Optional[str] = None) -> int:
+    with connect(path) as conn:
+        return conn.execute('SELECT COUNT(DISTINCT host) FROM fields').fetchone()[0]
+
+
+def _write(conn: sqlite3.Connection, host: str, fields: Dict[str, Any], stage: str, now: float) -> None:
+    run_ts = os.getenv('RUN_TS')
+    base = conn.execute('SELECT COALESCE(MAX(pos) + 1, 0) FROM fields WHERE host = ?', (host,)).fetchone()[0]
+    conn.executemany(_UPSERT, [(host, k, json.dumps(v, ensure_ascii=False), stage, base + i, run_ts, now)
+                               for i, (k, v) in enumerate(fields.items())])
+
+
+def update(host: str, fields: Dict[str, Any], stage: str, path: Optional[str] = None) -> None:
+    """Set some fields of one device (created if new); the stage becomes their owner."""
+    with connect(path) as conn, _transaction(conn):
+        _write(conn, host, fields, stage, time.time())
+
+
+def replace(host: str, record: Dict[str, Any], stage: str, path: Optional[str] = None) -> None:
+    """Make a stage's fields of one device exactly `record`; other stages' fields are kept."""
+    replace_many({host: record}, stage, path)
+
+
+def replace_many(records: Dict[str, Dict[str, Any]], stage: str, path: Optional[str] = None) -> None:
+    now = time.time()
+    with connect(path) as conn, _transaction(conn):
+        for host, record in records.items():
+            keep = list(record)
+            conn.execute(f"DELETE FROM fields WHERE host = ? AND stage = ? AND field NOT IN ({','.join('?' * len(keep))})",
+                         [host, stage, *keep])
+            _write(conn, host, record, stage, now)
+
+
+def remove(hosts: Iterable[str], path: Optional[str] = None) -> None:
+    with connect(path) as conn, _transaction(conn):
+        for chunk in _chunks(sorted(set(hosts))):
+            conn.execute(f"DELETE FROM fields WHERE host IN ({','.join('?' * len(chunk))})", chunk)
+
+
+def export(path: Optional[str] = None) -> str:
+    """Write devices.json from the registry (atomically); returns its path."""
+    dst = json_path(path)
+    with atomic_io.locked(dst):
+        json_stream.write_items(dst, iter_records(path=path))
+    return dst
+
+
+def import_json(src: str, path: Optional[str] = None) -> int:
+    """Replace the whole registry with a devices.json-shaped file (ValueError if it is not one).
+
+    Explicit only (the `import` command): every field is re-owned by FIELD_STAGES
+    and whatever a stage wrote since the file was exported is lost.
+    """
+    with connect(path) as conn, _transaction(conn):
+        return _import(conn, json_stream.iter_items(src))
+
+
+def import_records(src_dir: str, stage: str = DEFAULT_STAGE, path: Optional[str] = None) -> int:
+    """Replace a stage's fields of every device that has a <host>.json record in src_dir."""
+    records = {}
+    for name in sorted(os.listdir(src_dir)) if os.path.isdir(src_dir) else []:
+        if name.endswith('.json'):
+            rec = atomic_io.read_json(os.path.join(src_dir, name), None)
+            if isinstance(rec, dict):
+                records[str(rec.get('host') or name[:-len('.json')])] = rec
+            else:
+                print(f'[registry] {name}: not a device record; skipped')
+    replace_many(records, stage, path)
+    return len(records)
+
+
+def copy(dst: str, path: Optional[str] = None) -> None:
+    """Snapshot the registry into another database file (a job's private data directory)."""
+    with connect(path) as conn:
+        out = sqlite3.connect(dst)
+        try:
+            conn.backup(out)
+        finally:
+            out.close()
+
+
+def merge(src: str, hosts: Iterable[str], path: Optional[str] = None) -> int:
+    """Replace the given hosts' rows with those of another registry; returns hosts copied."""
+    hosts = sorted(set(hosts))
+    rows: List[Sequence[Any]] = []
+    with connect(src) as conn:
+        for chunk in _chunks(hosts):
+            rows += conn.execute('SELECT host, field, value, stage, pos, run_ts, updated_at FROM fields '
+                                 f"WHERE host IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+    with connect(path) as conn, _transaction(conn):
+        for chunk in _chunks(hosts):
+            conn.execute(f"DELETE FROM fields WHERE host IN ({','.join('?' * len(chunk))})", chunk)
+        conn.executemany(_UPSERT, rows)
+    return len({r[0] for r in rows})
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Device registry (data/devices.db)')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('import-records', help='Import one <host>.json record per device (the playbooks write these)')
+    p.add_argument('dir')
+    p.add_argument('--stage', default=DEFAULT_STAGE)
+    p = sub.add_parser('import', help='Replace the whole registry with a devices.json-shaped file (e.g. after a hand edit)')
+    p.add_argument('file')
+    sub.add_parser('export', help='Rewrite devices.json from the registry')
+    p = sub.add_parser('show', help='Print device records')
+    p.add_argument('host', nargs='*')
+    args = ap.parse_args()
+    if args.cmd == 'import-records':
+        n = import_records(args.dir, args.stage)
+        print(f'[registry] {args.stage}: {n} device record(s) from {args.dir}; exported {export()}')
+    elif args.cmd == 'import':
+        try:
+            n = import_json(args.file)
+        except ValueError as e:
+            sys.exit(str(e))
+        print(f'[registry] imported {n} device(s); exported {export()}')
+    elif args.cmd == 'export':
+        print(f'[registry] {count()} device(s) exported to {export()}')
+    else:
+        print(json.dumps(load(args.host or None), indent=2, ensure_ascii=False))
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-import json, os, sys, re, requests
+import os, sys, re, requests
 from datetime import datetime
 from typing import Dict, Any
 proxies = {
@@ -15,37 +15,36 @@ try:
     from eol_details import get_eol_details  # type: ignore
 except Exception:
     get_eol_details = None  # fallback if selenium not available
+import atomic_io
+import device_registry
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
 
 DEVICES_JSON = os.path.join(DATA_DIR, "devices.json")
 PID_ALIAS_JSON = os.path.join(DATA_DIR, "pid_alias.json")  # optional
 
 def load_json(path, default):
-    if not os.path.exists(path):
-        return default
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return atomic_io.read_json(path, default)
 
 def _log(msg: str):
     print(msg, flush=True)
 
 def main():
     _log("[eolcheck] Start")
-    devices = load_json(DEVICES_JSON, {})
-    if not isinstance(devices, dict) or not devices:
-        _log(f"[eolcheck] [!] {DEVICES_JSON} is missing or empty.")
+    total = device_registry.count()
+    if not total:
+        _log(f"[eolcheck] [!] device registry is empty ({DEVICES_JSON} missing or empty).")
         sys.exit(1)
 
     pid_alias = load_json(PID_ALIAS_JSON, {})  # dict: PID -> marketing name (alias)
-    _log(f"[eolcheck] Loaded {len(devices)} devices; {len(pid_alias)} PID aliases")
+    _log(f"[eolcheck] {total} devices; {len(pid_alias)} PID aliases")
 
     _log("[eolcheck] Using Selenium details only (no legacy listing match)")
 
     updated = 0
     cache: Dict[str, Any] = {}
-    for host, rec in devices.items():
+    for host, rec in device_registry.iter_records(fields=("model",)):
         _log(f"[eolcheck] --- Device: {host} ---")
         pid = (rec.get("model") or "").strip()
         alias = (pid_alias.get(pid) or "").strip()
@@ -74,7 +73,7 @@ def main():
                 _log(f"[eolcheck]    Series Release Date: {details.get('series_release_date')}")
                 _log(f"[eolcheck]    End-of-Sale:    {details.get('end_of_sale_date')}")
                 _log(f"[eolcheck]    End-of-Support: {details.get('end_of_support_date')}")
-                rec["eol_details"] = {
+                device_registry.update(host, {"eol_details": {
                     "end_of_sale_date": details.get("end_of_sale_date"),
                     "end_of_support_date": details.get("end_of_support_date"),
                     "series_release_date": details.get("series_release_date"),
@@ -83,7 +82,8 @@ def main():
                     "nav_url": details.get("nav_url"),
                     "nav_steps": details.get("nav_steps"),
                     "alias_used": alias or None,
-                }
+                }}, "eol")
+                updated += 1
             else:
                 _log(f"[eolcheck] [{host}] Selenium details: NOT FOUND")
         elif q and not get_eol_details:
@@ -91,12 +91,8 @@ def main():
         else:
             _log(f"[eolcheck] [{host}] No alias/model to query for detailed dates")
 
-        devices[host] = rec
-        updated += 1
-
-    with open(DEVICES_JSON, "w", encoding="utf-8") as f:
-        json.dump(devices, f, indent=2, ensure_ascii=False)
-    _log(f"[eolcheck] [✓] Updated {updated} records in {DEVICES_JSON}")
+    device_registry.export()
+    _log(f"[eolcheck] [✓] Updated {updated} records; exported {DEVICES_JSON}")
     _log("[eolcheck] Done")
 
 if __name__ == "__main__":
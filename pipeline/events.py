@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""Structured pipeline events: one JSON object per line, one file per batch (RUN_TS).
+
+Stages and orchestrators append to data/history/events/events_<RUN_TS>.jsonl:
+  {"at": 1760000000.123, "stage": "cves", "event": "host_done", "host": "sw1",
+   "duration": 1.42, "outcome": "ok", "level": "INFO", "pid": 4242}
+
+Events go through a logging QueueHandler: the emitting thread only enqueues
+the line and a QueueListener thread writes it, so a slow disk never stalls a
+scrape. Without RUN_TS (script run by hand) events are not recorded.
+
+Orchestrators mark stage boundaries (stage_start; stage_end with duration,
+exit code and outcome), stages report their work:
+
+  python3 pipeline/events.py start cves / end cves --rc $?
+  events.configure('cves')
+  events.plan(len(devices))                      # hosts this stage will process
+  with events.host(name) as ev:                  # host_start / host_done with duration
+      ...; ev['outcome'] = 'circuit_open'
+  events.log('no token; writing empty CVE results', level='WARNING')   # printed as "[cves] ..." too
+  events.capture_logging()                       # warnings/errors of `logging` become events
+
+Reading: index(ts) aggregates a batch per stage and remembers where each
+stage's and host's events are in the file. It is kept in memory and only
+reads lines appended since the last call, so polling a live run is cheap.
+query() reads matching events through it. progress() is the run progress the
+dashboard shows: the stage, its hosts done and failed, and an ETA from the
+rolling per-host throughput. The events file is the progress channel: any
+process can follow a run by reading it.
+
+  python pipeline/events.py show <ts> [--stage cves] [--host sw1] [--event host_done]
+"""
+from __future__ import annotations
+import os, sys, json, time, queue, atexit, logging, threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import run_logs
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+EVENTS_DIR = os.path.join(DATA_DIR, 'history', 'events')
+
+STAGE_LABELS = {
+    'ansible': 'Ansible playbooks',
+    'cves': 'CVE check',
+    'eol': 'End of life check',
+    'versions': 'Scraping pipeline',
+    'mail': 'Mail notification',
+    'history': 'Writing history snapshots',
+}
+OK_OUTCOMES = ('ok', 'skipped')
+RATE_WINDOW = 20   # host completions the throughput (and so the ETA) is measured over
+
+_stage = os.getenv('PIPELINE_STAGE') or 'adhoc'
+_logger = logging.getLogger('retrievos.events')
+_logger.propagate = False
+_logger.setLevel(logging.DEBUG)
+_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+
+
+def events_path(run_ts: str) -> str:
+    return os.path.join(EVENTS_DIR, f'events_{run_ts}.jsonl')
+
+
+def configure(stage: str) -> None:
+    global _stage
+    _stage = stage
+
+
+def _ensure_listener() -> bool:
+    global _listener
+    run_ts = os.getenv('RUN_TS')
+    if not run_ts:
+        return False
+    if _listener is None:
+        with _lock:
+            if _listener is None:
+                os.makedirs(EVENTS_DIR, exist_ok=True)
+                q: queue.SimpleQueue = queue.SimpleQueue()
+                fh = logging.FileHandler(events_path(run_ts), mode='a', encoding='utf-8')
+                fh.setFormatter(logging.Formatter('%(message)s'))
+                _listener = QueueListener(q, fh)
+                _listener.start()
+                _logger.addHandler(QueueHandler(q))
+                atexit.register(flush)
+    return True
+
+
+def flush() -> None:
+    """Write out queued events (called at exit)."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for h in list(_logger.handlers):
+                _logger.removeHandler(h)
+            for h in _listener.handlers:
+                h.close()
+            _listener = None
+
+
+def emit(event: str, host: Optional[str] = None, duration: Optional[float] = None, outcome: Optional[str] = None,
+         level: str = 'INFO', stage: Optional[str] = None, **fields) -> None:
+    if not _ensure_listener():
+        return
+    obj: Dict[str, Any] = {'at': round(time.time(), 3), 'stage': stage or _stage, 'event': event}
+    if host is not None:
+        obj['host'] = host
+    if duration is not None:
+        obj['duration'] = round(duration, 3)
+    if outcome is not None:
+        obj['outcome'] = outcome
+    obj['level'] = level
+    obj['pid'] = os.getpid()
+    obj.update(fields)
+    try:
+        _logger.log(logging.getLevelName(level) if level in run_logs.LEVELS else logging.INFO,
+                    json.dumps(obj, ensure_ascii=False, default=str))
+    except Exception:
+        pass
+
+
+def log(msg: str, level: str = 'INFO', host: Optional[str] = None, **fields) -> None:
+    """Print "[stage] msg" and record it as a 'log' event."""
+    print(f'[{_stage}] {msg}', flush=True)
+    emit('log', host=host, level=level, msg=msg, **fields)
+
+
+def plan(hosts: int, **fields) -> None:
+    emit('plan', hosts=hosts, **fields)
+
+
+@contextmanager
+def host(name: str, **fields) -> Iterator[Dict[str, Any]]:
+    """host_start / host_done around a host's work. The yielded dict can be updated (ev['outcome'] = 'failed')."""
+    info: Dict[str, Any] = {'outcome': 'ok'}
+    emit('host_start', host=name, **fields)
+    t0 = time.monotonic()
+    try:
+        yield info
+    except BaseException:
+        info['outcome'] = 'error'
+        raise
+    finally:
+        outcome = info.pop('outcome')
+        emit('host_done', host=name, duration=time.monotonic() - t0, outcome=outcome,
+             level='INFO' if outcome in OK_OUTCOMES else 'WARNING', **info, **fields)
+
+
+def host_done(name: str, duration: float, outcome: str = 'ok', **fields) -> None:
+    emit('host_done', host=name, duration=duration, outcome=outcome,
+         level='INFO' if outcome in OK_OUTCOMES else 'WARNING', **fields)
+
+
+class _LoggingBridge(logging.Handler):
+    def emit(self, record: logging.LogRecord) -> None:
+        emit('log', level=record.levelname if record.levelname in run_logs.LEVELS else 'INFO', msg=record.getMessage())
+
+
+def capture_logging(level: int = logging.WARNING) -> None:
+    """Record the root logger's records at `level` and above as 'log' events."""
+    bridge = _LoggingBridge(level)
+    logging.getLogger().addHandler(bridge)
+
+
+# --- reading ---
+
+class Index:
+    """Per-stage aggregates and line offsets of one batch's events file, advanced incrementally."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pos = 0
+        self.offsets: List[int] = []                 # every event line
+        self.by_stage: Dict[str, List[int]] = {}
+        self.by_host: Dict[str, List[int]] = {}
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+        self._done_at: Dict[str, deque] = {}         # stage -> recent host_done times
+
+    def refresh(self) -> 'Index':
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return self
+        if size < self.pos:   # replaced: start over
+            self.__init__(self.path)
+        if size == self.pos:
+            return self
+        with open(self.path, 'rb') as f:
+            f.seek(self.pos)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break   # a line still being written
+                off = self.pos
+                self.pos += len(raw)
+                try:
+                    ev = json.loads(raw)
+                except ValueError:
+                    continue
+                self._add(off, ev)
+        return self
+
+    def _add(self, off: int, ev: Dict[str, Any]) -> None:
+        self.offsets.append(off)
+        stage, name, at = ev.get('stage') or 'adhoc', ev.get('event'), ev.get('at')
+        self.by_stage.setdefault(stage, []).append(off)
+        if ev.get('host'):
+            self.by_host.setdefault(ev['host'], []).append(off)
+        if at is not None:
+            self.first_at = at if self.first_at is None else min(self.first_at, at)
+            self.last_at = at if self.last_at is None else max(self.last_at, at)
+        st = self.stages.get(stage)
+        if st is None:
+            st = self.stages[stage] = {'started': None, 'ended': None, 'duration': None, 'outcome': None,
+                                       'hosts_total': None, 'hosts_done': 0, 'outcomes': {},
+                                       'failed': 0, 'warnings': 0, 'errors': 0, 'events': 0}
+        st['events'] += 1
+        if name == 'stage_start':
+            st.update(started=at, ended=None, duration=None, outcome=None)
+        elif name == 'stage_end':
+            st.update(ended=at, duration=ev.get('duration'), outcome=ev.get('outcome'))
+        elif name == 'plan':
+            st['hosts_total'] = (st['hosts_total'] or 0) + int(ev.get('hosts') or 0)
+        elif name == 'host_done':
+            st['hosts_done'] += 1
+            o = ev.get('outcome') or 'ok'
+            st['outcomes'][o] = st['outcomes'].get(o, 0) + 1
+            if o not in OK_OUTCOMES:
+                st['failed'] += 1
+            if at is not None:
+                self._done_at.setdefault(stage, deque(maxlen=RATE_WINDOW)).append(at)
+        lvl = ev.get('level')
+        if lvl == 'WARNING':
+            st['warnings'] += 1
+        elif lvl in ('ERROR', 'CRITICAL'):
+            st['errors'] += 1
+        if st['started'] is None and at is not None:
+            st['started'] = at
+
+    def rate(self, stage: str) -> Optional[float]:
+        """Hosts per second over the stage's last RATE_WINDOW completions (from its start while there are few)."""
+        times = self._done_at.get(stage)
+        if not times:
+            return None
+        first = times[0] if len(times) > 1 else (self.stages.get(stage) or {}).get('started')
+        n = len(times) - 1 if len(times) > 1 else 1
+        span = times[-1] - first if first is not None else 0
+        return n / span if span > 0 else None
+
+    def summary(self) -> Dict[str, Any]:
+        return {'events': len(self.offsets), 'first_at': self.first_at, 'last_at': self.last_at,
+                'stages': self.stages, 'hosts': len(self.by_host)}
+
+    def read(self, offsets: Sequence[int]) -> Iterator[Dict[str, Any]]:
+        with open(self.path, 'rb') as f:
+            for off in offsets:
+                f.seek(off)
+                try:
+                    yield json.loads(f.readline())
+                except ValueError:
+                    continue
+
+
+_indexes: Dict[str, Index] = {}
+_INDEXES_MAX = 16
+_indexes_lock = threading.Lock()
+
+
+def index(ts: str) -> Optional[Index]:
+    """The batch's index, brought up to date; None if it has no events."""
+    path = events_path(ts)
+    if not os.path.exists(path):
+        return None
+    with _indexes_lock:
+        idx = _indexes.pop(path, None) or Index(path)
+        _indexes[path] = idx   # most recently used last
+        while len(_indexes) > _INDEXES_MAX:
+            _indexes.pop(next(iter(_indexes)))
+        return idx.refresh()
+
+
+def _intersect(a: List[int], b: List[int]) -> List[int]:
+    small, big = (a, b) if len(a) <= len(b) else (b, a)
+    out = []
+    for x in small:
+        i = bisect_left(big, x)
+        if i < len(big) and big[i] == x:
+            out.append(x)
+    return out
+
+
+def query(ts: str, stage: Optional[str] = None, host: Optional[str] = None, event: Optional[str] = None,
+          outcome: Optional[str] = None, level: Optional[str] = None, offset: int = 0,
+          limit: int = 500) -> Optional[Dict[str, Any]]:
+    """Matching events in file order; `offset` skips matches (next page: next_offset). None without events."""
+    idx = index(ts)
+    if idx is None:
+        return None
+    min_level = run_logs.parse_level(level)
+    cand = idx.offsets
+    if stage:
+        cand = idx.by_stage.get(stage, [])
+    if host:
+        cand = _intersect(cand, idx.by_host.get(host, []))
+    limit = max(1, min(int(limit), run_logs.MAX_LIMIT))
+    out: List[Dict[str, Any]] = []
+    matched = 0
+    next_offset = None
+    for ev in idx.read(cand):
+        if event and ev.get('event') != event:
+            continue
+        if outcome and ev.get('outcome') != outcome:
+            continue
+        if min_level is not None and run_logs.LEVELS.index(ev.get('level') if ev.get('level') in run_logs.LEVELS
+                                                            else 'INFO') < min_level:
+            continue
+        matched += 1
+        if matched <= offset:
+            continue
+        if len(out) == limit:
+            next_offset = offset + limit
+            break
+        out.append(ev)
+    return {'ts': ts, 'events': out, 'offset': offset, 'next_offset': next_offset}
+
+
+def progress(ts: Optional[str], stages: Sequence[str], durations: Optional[Dict[str, float]] = None,
+             now: Optional[float] = None) -> Dict[str, Any]:
+    """Stages completed out of `stages`; for the one in progress its host counts, failures and ETA.
+
+    The stage ETA is its remaining hosts at the rolling throughput. `durations`
+    (stage -> seconds, e.g. from the previous run) adds the stages still to come
+    to make the run ETA.
+    """
+    now = time.time() if now is None else now
+    idx = index(ts) if ts else None
+    st = idx.stages if idx else {}
+    done = sum(1 for s in stages if (st.get(s) or {}).get('ended'))
+    active = [s for s in stages if (st.get(s) or {}).get('started')]
+    cur = next((s for s in reversed(active) if not st[s].get('ended')), active[-1] if active else None)
+    out: Dict[str, Any] = {'current': done, 'total': len(stages), 'stage': cur,
+                           'label': STAGE_LABELS.get(cur, cur) if cur else 'Starting…',
+                           'hosts_done': None, 'hosts_total': None, 'failed': None, 'rate': None,
+                           'eta_sec': None, 'run_eta_sec': None, 'elapsed_sec': None}
+    if idx is not None and idx.first_at is not None:
+        out['elapsed_sec'] = round(now - idx.first_at, 1)
+    if cur is None:
+        return out
+    cst = st[cur]
+    eta = 0.0 if cst.get('ended') else None
+    if cst.get('hosts_total'):
+        out.update(hosts_done=cst['hosts_done'], hosts_total=cst['hosts_total'], failed=cst['failed'])
+        out['label'] += f" ({cst['hosts_done']}/{cst['hosts_total']} hosts)"
+        rate = idx.rate(cur)
+        if rate:
+            out['rate'] = round(rate, 4)
+            if not cst.get('ended'):
+                eta = max(0, cst['hosts_total'] - cst['hosts_done']) / rate
+    if eta is None and durations and durations.get(cur) is not None and cst.get('started'):
+        eta = max(0.0, durations[cur] - (now - cst['started']))
+    if eta is not None:
+        out['eta_sec'] = round(eta, 1)
+        later = [s for s in stages[stages.index(cur) + 1:] if not (st.get(s) or {}).get('started')]
+        if durations is not None and all(durations.get(s) is not None for s in later):
+            out['run_eta_sec'] = round(eta + sum(durations[s] for s in later), 1)
+    return out
+
+
+def durations(ts: Optional[str]) -> Dict[str, float]:
+    """stage -> seconds the stages of a finished batch took."""
+    idx = index(ts) if ts else None
+    if idx is None:
+        return {}
+    return {s: v['duration'] for s, v in idx.stages.items() if v.get('duration') is not None}
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Pipeline events')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('start', help='Record the start of an orchestrator stage')
+    p.add_argument('stage')
+    p = sub.add_parser('end', help='Record the end of an orchestrator stage')
+    p.add_argument('stage')
+    p.add_argument('--rc', type=int, default=0)
+    p = sub.add_parser('show', help="Print a batch's stage summary, or its events matching the filters")
+    p.add_argument('ts')
+    for k in ('stage', 'host', 'event', 'outcome', 'level'):
+        p.add_argument(f'--{k}')
+    args = ap.parse_args()
+    if args.cmd == 'start':
+        emit('stage_start', stage=args.stage)
+    elif args.cmd == 'end':
+        idx = index(os.getenv('RUN_TS') or '')
+        started = ((idx.stages.get(args.stage) or {}).get('started') if idx else None)
+        emit('stage_end', stage=args.stage, duration=time.time() - started if started else None,
+             outcome='ok' if args.rc == 0 else 'failed', level='INFO' if args.rc == 0 else 'ERROR', rc=args.rc)
+    elif any(getattr(args, k) for k in ('stage', 'host', 'event', 'outcome', 'level')):
+        page = query(args.ts, args.stage, args.host, args.event, args.outcome, args.level, limit=run_logs.MAX_LIMIT)
+        if page is None:
+            sys.exit(f'no events for batch {args.ts}')
+        for ev in page['events']:
+            print(json.dumps(ev, ensure_ascii=False))
+    else:
+        idx = index(args.ts)
+        if idx is None:
+            sys.exit(f'no events for batch {args.ts}')
+        print(json.dumps(idx.summary(), indent=2))
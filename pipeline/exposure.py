@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Fleet vulnerability exposure as a sparse hosts x advisories matrix, one per batch.
+
+Stored CSR-style in arrays: row h lists the advisory columns
+indices[indptr[h]:indptr[h+1]]. A column is a Cisco advisory (or a bare CVE id
+when the advisory is unknown) carrying its severity, title and CVE ids.
+Aggregates (affected hosts per advisory, severity counts and risk per host,
+exposure per model/site) are single passes over the arrays.
+
+history_writer.py writes data/history/exposure/exposure_<RUN_TS>.json; the
+dashboard serves it and the notification email builds one for the current run.
+
+  python pipeline/exposure.py <ts> [--top 20]
+"""
+from __future__ import annotations
+import os, json
+from array import array
+from typing import Any, Dict, Iterable, List, Optional
+
+import atomic_io
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+EXPOSURE_DIR = os.path.join(DATA_DIR, 'history', 'exposure')
+
+SEVERITIES = ('Critical', 'High', 'Medium', 'Low')
+# risk score of a host = sum of the weights of the advisories it is exposed to
+SEVERITY_WEIGHTS = {'Critical': 10.0, 'High': 5.0, 'Medium': 2.0, 'Low': 1.0}
+
+
+def exposure_path(ts: str) -> str:
+    return os.path.join(EXPOSURE_DIR, f'exposure_{ts}.json')
+
+
+class Exposure:
+    def __init__(self, hosts: List[str], advisories: List[Dict[str, Any]], indptr: array, indices: array,
+                 attrs: Optional[Dict[str, List[Optional[str]]]] = None):
+        self.hosts = hosts
+        self.advisories = advisories          # column metadata: id, severity, title, cves, url
+        self.indptr = indptr                  # len(hosts) + 1
+        self.indices = indices                # advisory column per non-zero
+        self.attrs = attrs or {}              # e.g. {'model': [per host]}
+        self._sev = array('B', (SEVERITIES.index(a['severity']) if a['severity'] in SEVERITIES else len(SEVERITIES)
+                                for a in advisories))
+        self._weight = array('d', (SEVERITY_WEIGHTS.get(a['severity'], 0.0) for a in advisories))
+        self._affected: Optional[array] = None
+        self._risk: Optional[array] = None
+
+    # --- construction / storage ---
+
+    @classmethod
+    def build(cls, cves_by_host: Dict[str, Dict[str, Any]],
+              attrs: Optional[Dict[str, Dict[str, Optional[str]]]] = None) -> 'Exposure':
+        """From host -> {severity: [entry, ...]} (entries: check_cves dicts or bare ids); attrs: name -> host -> value."""
+        b = Builder(tuple(attrs or ()))
+        for host in sorted(cves_by_host):
+            b.add(host, cves_by_host.get(host), **{name: (values or {}).get(host) for name, values in (attrs or {}).items()})
+        return b.build()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'hosts': self.hosts, 'advisories': self.advisories, 'attrs': self.attrs,
+                'indptr': self.indptr.tolist(), 'indices': self.indices.tolist()}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> 'Exposure':
+        return cls(d['hosts'], d['advisories'], array('I', d['indptr']), array('I', d['indices']), d.get('attrs'))
+
+    def write(self, ts: str) -> str:
+        path = exposure_path(ts)
+        atomic_io.write_json(path, self.to_dict(), indent=None, separators=(',', ':'))
+        return path
+
+    # --- aggregates ---
+
+    def affected(self) -> array:
+        """Hosts exposed to each advisory."""
+        if self._affected is None:
+            counts = array('I', bytes(4 * len(self.advisories)))
+            for j in self.indices:
+                counts[j] += 1
+            self._affected = counts
+        return self._affected
+
+    def risk(self) -> array:
+        """Severity-weighted risk score per host."""
+        if self._risk is None:
+            w, ind, ptr = self._weight, self.indices, self.indptr
+            self._risk = array('d', (sum(w[j] for j in ind[ptr[h]:ptr[h + 1]]) for h in range(len(self.hosts))))
+        return self._risk
+
+    def severity_counts(self) -> Dict[str, Dict[str, int]]:
+        """host -> CVE count per severity (what build_cve_index / cve_counts_for produced)."""
+        out = {}
+        adv, ind, ptr = self.advisories, self.indices, self.indptr
+        for h, host in enumerate(self.hosts):
+            c = dict.fromkeys(SEVERITIES, 0)
+            for j in ind[ptr[h]:ptr[h + 1]]:
+                sev = adv[j]['severity']
+                if sev in c:
+                    c[sev] += max(1, len(adv[j]['cves']))
+            out[host] = c
+        return out
+
+    def top_advisories(self, n: int = 20, severity: Optional[str] = None) -> List[Dict[str, Any]]:
+        aff = self.affected()
+        cols = [j for j in range(len(self.advisories)) if aff[j] and (not severity or self.advisories[j]['severity'] == severity)]
+        cols.sort(key=lambda j: (-aff[j], self._sev[j], self.advisories[j]['id']))
+        return [dict(self.advisories[j], affected_hosts=aff[j]) for j in cols[:n]]
+
+    def top_hosts(self, n: int = 20) -> List[Dict[str, Any]]:
+        risk = self.risk()
+        order = sorted((h for h in range(len(self.hosts)) if risk[h]), key=lambda h: (-risk[h], self.hosts[h]))[:n]
+        out = []
+        for h in order:
+            row = {'host': self.hosts[h], 'risk': risk[h], 'advisories': self.indptr[h + 1] - self.indptr[h]}
+            row.update({name: vals[h] for name, vals in self.attrs.items()})
+            out.append(row)
+        return out
+
+    def by(self, values: List[Optional[str]]) -> List[Dict[str, Any]]:
+        """Exposure per group, values[h] being host h's group (model, site, ...)."""
+        groups: Dict[str, Dict[str, Any]] = {}
+        risk, ind, ptr, sev = self.risk(), self.indices, self.indptr, self._sev
+        for h in range(len(self.hosts)):
+            g = groups.setdefault(values[h] or 'unknown', {'hosts': 0, 'exposed_hosts': 0, 'risk': 0.0,
+                                                            'cols': set(), 'by_severity': dict.fromkeys(SEVERITIES, 0)})
+            g['hosts'] += 1
+            cols = ind[ptr[h]:ptr[h + 1]]
+            if cols:
+                g['exposed_hosts'] += 1
+                g['risk'] += risk[h]
+                g['cols'].update(cols)
+        out = []
+        for name, g in groups.items():
+            for j in g['cols']:
+                if sev[j] < len(SEVERITIES):
+                    g['by_severity'][SEVERITIES[sev[j]]] += 1
+            out.append({'group': name, 'hosts': g['hosts'], 'exposed_hosts': g['exposed_hosts'],
+                        'advisories': len(g['cols']), 'by_severity': g['by_severity'], 'risk': g['risk'],
+                        'avg_risk': round(g['risk'] / g['hosts'], 2)})
+        out.sort(key=lambda g: (-g['risk'], g['group']))
+        return out
+
+    def summary(self, top: int = 20, by: Optional[Dict[str, List[Optional[str]]]] = None) -> Dict[str, Any]:
+        aff = self.affected()
+        groupings = dict(self.attrs)
+        groupings.update(by or {})
+        return {
+            'hosts': len(self.hosts),
+            'exposed_hosts': sum(1 for h in range(len(self.hosts)) if self.indptr[h + 1] > self.indptr[h]),
+            'advisories': sum(1 for c in aff if c),
+            'exposures': len(self.indices),
+            'severity_weights': SEVERITY_WEIGHTS,
+            'top_advisories': self.top_advisories(top),
+            'top_hosts': self.top_hosts(top),
+            'by': {name: self.by(vals) for name, vals in groupings.items()},
+        }
+
+
+class Builder:
+    """An Exposure fed one host at a time, in any order (history_writer.py, while it writes the batch).
+
+    Only the sparse row of each host is kept; build() orders the rows by host.
+    """
+
+    def __init__(self, attr_names: Iterable[str] = ()):
+        self.hosts: List[str] = []
+        self.attrs: Dict[str, List[Optional[str]]] = {name: [] for name in attr_names}
+        self.advisories: List[Dict[str, Any]] = []
+        self.col: Dict[str, int] = {}
+        self.indptr, self.indices = array('I', [0]), array('I')
+
+    def add(self, host: str, cves: Optional[Dict[str, Any]], **attrs: Optional[str]) -> None:
+        """host's {severity: [entry, ...]}; attrs by name (those not given to __init__ are ignored)."""
+        col, advisories = self.col, self.advisories
+        row = set()
+        for sev, items in (cves or {}).items():
+            for item in items or []:
+                cid = (item.get('id') if isinstance(item, dict) else item) or ''
+                adv = item.get('advisory_id') if isinstance(item, dict) else None
+                k = adv or str(cid).strip()
+                if not k:
+                    continue
+                j = col.get(k)
+                if j is None:
+                    j = col[k] = len(advisories)
+                    advisories.append({'id': k, 'severity': sev,
+                                       'title': item.get('title') if isinstance(item, dict) else None,
+                                       'url': item.get('cisco_url') if isinstance(item, dict) else None,
+                                       'cves': []})
+                cid = str(cid).strip()
+                if cid and cid not in advisories[j]['cves']:
+                    advisories[j]['cves'].append(cid)
+                row.add(j)
+        self.hosts.append(host)
+        for name, values in self.attrs.items():
+            values.append(attrs.get(name))
+        self.indices.extend(sorted(row))
+        self.indptr.append(len(self.indices))
+
+    def build(self) -> Exposure:
+        order = sorted(range(len(self.hosts)), key=self.hosts.__getitem__)
+        if order == list(range(len(order))):
+            return Exposure(self.hosts, self.advisories, self.indptr, self.indices, self.attrs)
+        indptr, indices = array('I', [0]), array('I')
+        for h in order:
+            indices.extend(self.indices[self.indptr[h]:self.indptr[h + 1]])
+            indptr.append(len(indices))
+        return Exposure([self.hosts[h] for h in order], self.advisories, indptr, indices,
+                        {name: [values[h] for h in order] for name, values in self.attrs.items()})
+
+
+def severity_counts_for(cves: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """CVE count per severity of one host's {severity: [entry, ...]}, counted as severity_counts() does."""
+    b = Builder()
+    b.add('', cves)
+    return b.build().severity_counts()['']
+
+
+def build_for_batch(cve_rows: Iterable[Dict[str, Any]], device_rows: Iterable[Dict[str, Any]] = ()) -> Exposure:
+    """From cves_snapshot / devices_snapshot rows of one batch."""
+    models = {r['host']: r.get('model') for r in device_rows if r.get('host')}
+    cves = {r['host']: r.get('cves') or {} for r in cve_rows if r.get('host')}
+    return Exposure.build(cves, {'model': models})
+
+
+_loaded: Dict[str, Exposure] = {}
+_LOADED_MAX = 16
+
+
+def load(ts: str) -> Optional[Exposure]:
+    """The matrix written for a batch (kept in memory: recorded batches never change)."""
+    exp = _loaded.get(ts)
+    if exp is not None:
+        return exp
+    try:
+        with open(exposure_path(ts), 'r', encoding='utf-8') as f:
+            exp = Exposure.from_dict(json.load(f))
+    except Exception:
+        return None
+    if len(_loaded) >= _LOADED_MAX:
+        _loaded.pop(next(iter(_loaded)))
+    _loaded[ts] = exp
+    return exp
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Fleet exposure matrix of a history batch')
+    ap.add_argument('ts')
+    ap.add_argument('--top', type=int, default=20)
+    args = ap.parse_args()
+    exp = load(args.ts)
+    if exp is None:
+        import batch_diff
+        devices, cves = batch_diff.load_batches([args.ts])[args.ts]
+        exp = Exposure.build(cves, {'model': {h: r.get('model') for h, r in devices.items()}})
+    print(json.dumps(exp.summary(args.top), indent=2))
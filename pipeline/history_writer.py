@@ -5,17 +5,42 @@ Requires RUN_TS environment variable (UTC ISO) exported by orchestrator.
 Generates/updates these append-only JSONL files under data/history/:
   devices_snapshot.jsonl  (one line per device per batch)
   cves_snapshot.jsonl     (one line per device per batch including full CVE lists)
-  batches.jsonl           (one line per batch summary)
+  batches.jsonl           (one line per batch summary, incl. compact per-stage timings)
+  timelines/<host>.jsonl  (condensed per-host timeline entry, one line per batch)
+  diffs/diff_<RUN_TS>.json (per-host deltas against the previous batch)
+  snapshot_offsets.jsonl  (byte range of this batch in each snapshot file)
+  search/postings.jsonl   (inverted index: field -> term -> hosts, one line per batch)
+  exposure/exposure_<RUN_TS>.json (hosts x advisories matrix, see exposure.py)
 
-Also copies the run_pipeline.log to data/history/logs/run_pipeline_<RUN_TS>.log
+A scoped run (RUN_SCOPE or --hosts/--groups/--pids, see scope.py) writes a
+partial batch: hosts outside the scope are carried forward from the previous
+batch (rows marked carried_from) and the summary records the scope.
+
+Also archives the run_pipeline.log gzipped as data/history/logs/run_pipeline_<RUN_TS>.log.gz
+(run_logs.py reads it back).
 If an email raw file is produced (email_last.eml), it will be copied/renamed similarly.
 """
 from __future__ import annotations
-import os, json, sys, shutil
-from typing import Dict, Any
+import os, json, sys, shutil, time, fcntl, tempfile
+from typing import Any, Dict, Optional
+
+import run_metrics
+import timeline_index
+import batch_diff
+import snapshot_index
+import search_index
+import exposure
+import run_logs
+import events
+import json_stream
+import models
+import scope as run_scope
+
+run_metrics.configure('history')
+events.configure('history')
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
 HIST_DIR = os.path.join(DATA_DIR, 'history')
 LOGS_DIR = os.path.join(HIST_DIR, 'logs')
 MAILS_DIR = os.path.join(HIST_DIR, 'mails')
@@ -29,20 +54,123 @@ DEVICES_SNAPSHOT = os.path.join(HIST_DIR, 'devices_snapshot.jsonl')
 CVES_SNAPSHOT = os.path.join(HIST_DIR, 'cves_snapshot.jsonl')
 BATCHES_JSONL = os.path.join(HIST_DIR, 'batches.jsonl')
 
-def load_json(path, default):
-    if not os.path.exists(path):
-        return default
+def iter_devices():
+    """(host, record) from devices.json, parsed one device at a time; nothing if the file is missing."""
     try:
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return default
+        for host, rec in json_stream.iter_items(DEVICES_JSON):
+            if isinstance(rec, dict):
+                yield host, rec
+    except FileNotFoundError:
+        return
+    except ValueError as e:
+        events.log(f'{DEVICES_JSON} is not a valid JSON object ({e}); devices after the error are missing', level='WARNING')
+
+class _OnDisk:
+    """host -> one JSON value kept in a file and read back by offset; only the offsets stay in memory.
+
+    Either a spill (a temp file filled by put()) or rows already in a file (path + offsets).
+    """
+
+    def __init__(self, path: Optional[str] = None, offsets: Optional[Dict[str, int]] = None):
+        self.path = path
+        self.offsets: Dict[str, int] = offsets if offsets is not None else {}
+        self.f = None
+
+    def _file(self):
+        if self.f is None:
+            self.f = open(self.path, 'rb') if self.path else tempfile.TemporaryFile(dir=HIST_DIR)
+        return self.f
+
+    def put(self, host: str, value: Any) -> None:
+        f = self._file()
+        self.offsets[host] = f.seek(0, os.SEEK_END)
+        f.write(json.dumps(value, ensure_ascii=False).encode('utf-8') + b'\n')
+
+    def _read(self, off: Optional[int]) -> Any:
+        if off is None:
+            return None
+        f = self._file()
+        f.seek(off)
+        return json.loads(f.readline())
+
+    def get(self, host: str) -> Any:
+        return self._read(self.offsets.get(host))
+
+    def pop(self, host: str) -> Any:
+        return self._read(self.offsets.pop(host, None))
+
+    def close(self) -> None:
+        if self.f is not None:
+            self.f.close()
+
+def spill_cves() -> _OnDisk:
+    """host -> {severity: [...]} from device_cve_check.json, streamed into a temp file."""
+    out = _OnDisk()
+    try:
+        for host, rec in json_stream.iter_items(CVE_JSON):
+            if isinstance(rec, dict):
+                out.put(host, rec.get('cves') or {})
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        events.log(f'{CVE_JSON} is not a valid JSON object ({e}); CVEs of hosts after the error are missing', level='WARNING')
+    return out
+
+def spill_upgrades(run_ts: str) -> _OnDisk:
+    """host -> its upgrade-suggestions.json row for this batch, streamed into a temp file.
+
+    The row checked at run_ts when there is one, else the host's latest row
+    (the list is append-only chronological, so the last one wins).
+    """
+    out, exact = _OnDisk(), set()
+    try:
+        for row in json_stream.iter_array(UPGRADE_JSON):
+            host = row.get('host') if isinstance(row, dict) else None
+            if not host:
+                continue
+            this_batch = row.get('checked_at') == run_ts
+            if host in exact and not this_batch:
+                continue
+            out.put(host, row)
+            if this_batch:
+                exact.add(host)
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        events.log(f'{UPGRADE_JSON} is not a valid JSON array ({e}); suggestions after the error are missing', level='WARNING')
+    return out
+
+def previous_rows(path: str, ts: Optional[str]) -> _OnDisk:
+    """host -> its row of batch ts in a snapshot file, found through the batch's byte range."""
+    if not ts or not os.path.exists(path):
+        return _OnDisk()
+    offsets = snapshot_index.host_offsets(path, ts)
+    if offsets is None:
+        events.log(f'batch {ts} has no byte range in {os.path.basename(path)}; scanning the whole file', level='WARNING')
+        offsets = {row['host']: off for off, row in snapshot_index.iter_rows(path, (0, os.path.getsize(path), 0))
+                   if row.get('batch_ts') == ts and row.get('host')}
+    return _OnDisk(path, offsets)
 
 def write_jsonl_line(path: str, obj: Dict[str, Any]):
     with open(path, 'a', encoding='utf-8') as f:
         f.write(json.dumps(obj, ensure_ascii=False) + '\n')
 
-def main():
+def tally(rows, out=None) -> Dict[str, Any]:
+    """Batch summary counts over devices_snapshot rows (added to out when given)."""
+    if out is None:
+        out = {'device_count': 0, 'devices_with_upgrade_recommended': 0, 'devices_with_critical_cves': 0,
+               'devices_eol': 0, 'total_high_cves': 0, 'total_medium_cves': 0}
+    for row in rows:
+        counts = row.get('cve_counts') or {}
+        out['device_count'] += 1
+        out['devices_with_upgrade_recommended'] += 1 if row.get('upgrade_recommended') else 0
+        out['devices_with_critical_cves'] += 1 if (counts.get('Critical') or 0) > 0 else 0
+        out['devices_eol'] += 1 if ('end of sale' in (row.get('status') or '').lower() or row.get('end_of_support_date')) else 0
+        out['total_high_cves'] += counts.get('High') or 0
+        out['total_medium_cves'] += counts.get('Medium') or 0
+    return out
+
+def main(sc=None):
     run_ts = os.getenv('RUN_TS')
     if not run_ts:
         print('[history] RUN_TS not set; aborting to avoid untagged snapshot.', file=sys.stderr)
@@ -52,147 +180,170 @@ def main():
         print('[history] RUN_TS format unexpected; continue anyway.', file=sys.stderr)
 
     os.makedirs(HIST_DIR, exist_ok=True)
+    # concurrent jobs share these files: one batch at a time keeps its rows contiguous
+    with open(os.path.join(HIST_DIR, '.writer.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        write_batch(run_ts, sc or run_scope.from_env())
+
+def write_batch(run_ts: str, sc: run_scope.Scope):
+    stage_t0 = time.monotonic()
     os.makedirs(LOGS_DIR, exist_ok=True)
     os.makedirs(MAILS_DIR, exist_ok=True)
 
-    devices = load_json(DEVICES_JSON, {})
-    cve_map = load_json(CVE_JSON, {})
-    upgrades = load_json(UPGRADE_JSON, [])
-
-    # Build upgrade suggestion mapping:
-    #  1. collect latest entry per host (fallback_latest)
-    #  2. collect exact batch matches (checked_at == run_ts)
-    upgrades_for_batch = {}
-    fallback_latest = {}
-    if isinstance(upgrades, list):
-        for row in upgrades:
-            if not isinstance(row, dict):
-                continue
-            host = row.get('host')
-            if not host:
-                continue
-            fallback_latest[host] = row  # last one wins (list is append-only chronological)
-            if row.get('checked_at') == run_ts:
-                upgrades_for_batch[host] = row
-    # Fill any host lacking an exact batch row with its latest fallback
-    for h, r in fallback_latest.items():
-        upgrades_for_batch.setdefault(h, r)
-
-    device_count = 0
-    devices_with_upgrade = 0
-    devices_with_critical = 0
-    devices_eol = 0
-    total_high = 0
-    total_medium = 0
-
-    def cve_counts_for(host: str):
-        rec = cve_map.get(host) or {}
-        severities = rec.get('cves') or {}
-        counts = {s: len(severities.get(s, [])) for s in ['Critical','High','Medium','Low']}
-        return counts, severities
-
-    for host, rec in (devices or {}).items():
-        if not isinstance(rec, dict):
-            continue
-        device_count += 1
-        upg = upgrades_for_batch.get(host)
-        alias_name = upg.get('switch_name') if upg else None
-        if upg and upg.get('upgrade_recommended'):
-            devices_with_upgrade += 1
-        counts, severities_map = cve_counts_for(host)
-        if counts['Critical'] > 0:
-            devices_with_critical += 1
-        total_high += counts['High']
-        total_medium += counts['Medium']
-        # Prefer EoL fields from the upgrade suggestion row for this batch (written by run_pipeline.py),
-        # then fall back to devices.json eol_details if not present.
-        eol_details = {}
-        if upg:
-            eol_details = {
-                'end_of_sale_date': upg.get('end_of_sale_date'),
-                'end_of_support_date': upg.get('end_of_support_date'),
-                'series_release_date': upg.get('series_release_date'),
-                'status': upg.get('status'),
-            }
-        if not (eol_details.get('end_of_sale_date') or eol_details.get('end_of_support_date') or eol_details.get('status') or eol_details.get('series_release_date')):
-            eol_details = rec.get('eol_details') or {}
-        status_txt = (eol_details.get('status') or '').lower()
-        eos_date = eol_details.get('end_of_sale_date')
-        eosup_date = eol_details.get('end_of_support_date')
-        if ('end of sale' in status_txt) or eosup_date:
-            devices_eol += 1
-
-        dev_info = rec.get('device_info') or {}
-        iface = rec.get('interface_summary') or {}
-        vlan = rec.get('vlan_summary') or {}
-        perf = rec.get('performance_info') or {}
-
-        # Normalize some numeric-like fields that arrived as strings
-        def _as_int(x):
-            try:
-                return int(str(x))
-            except Exception:
-                return None
-        cpu_val = perf.get('cpu_usage') or perf.get('cpu_5_sec') or perf.get('cpu_1_min') or perf.get('cpu_5_min')
-        row = {
-                'batch_ts': run_ts,
-                'host': host,
-                'alias_name': alias_name,
-                'model': rec.get('model'),
-                'platform': rec.get('platform'),
-                'current_version': rec.get('version'),
-                'platform_version': dev_info.get('nxos_version') or dev_info.get('ios_version') or rec.get('version'),
-                'recommended_version': upg.get('recommended_version') if upg else None,
-                'release_designation': upg.get('release_designation') if upg else None,
-                'recommendation': upg.get('recommendation') if upg else None,
-                'upgrade_recommended': upg.get('upgrade_recommended') if upg else None,
-                'final_url': upg.get('final_url') if upg else None,
-                'scraped_version_raw': upg.get('scraped_version_raw') if upg else None,
-                'serial_number': dev_info.get('serial_number'),
-                'uptime': dev_info.get('uptime'),
-                'connected_ports': iface.get('connected_ports'),
-                'connected_count': _as_int(iface.get('connected')),
-                'disconnected_count': _as_int(iface.get('disconnected')),
-                'total_interfaces': _as_int(iface.get('total_interfaces')),
-                'cpu_usage': str(cpu_val) if cpu_val is not None else None,
-                'vlan_active_count': vlan.get('total_active_vlans'),
-                'vlans': vlan.get('vlans'),
-                'end_of_sale_date': eol_details.get('end_of_sale_date'),
-                'end_of_support_date': eol_details.get('end_of_support_date'),
-                'series_release_date': eol_details.get('series_release_date'),
-                'status': eol_details.get('status'),
-                'cve_counts': counts,
+    # Every input is streamed and each row is written as it is produced. device_cve_check.json and
+    # upgrade-suggestions.json wait in temp files and the previous batch stays in its snapshot range,
+    # all found by host through byte offsets; the timeline, search postings, exposure matrix, diff and
+    # tally are fed from each row as it is written. Only offsets and per-batch aggregates are held.
+    cves_of = spill_cves()
+    upgrades = spill_upgrades(run_ts)
+
+    # a scoped run refreshes its hosts only; the others are carried forward from the previous batch
+    prev_ts = batch_diff.previous_batch(run_ts)
+    old_devices, old_cves = previous_rows(DEVICES_SNAPSHOT, prev_ts), previous_rows(CVES_SNAPSHOT, prev_ts)
+
+    timelines = timeline_index.exists()
+    terms = search_index.Postings() if search_index.exists() else None
+    exp = exposure.Builder(('model',))
+    changes = batch_diff.Diff(run_ts, prev_ts)
+    totals = tally(())
+    rows = carried = 0
+    # a batch's rows are appended contiguously; remember where they start
+    starts = {p: (os.path.getsize(p) if os.path.exists(p) else 0) for p in (DEVICES_SNAPSHOT, CVES_SNAPSHOT)}
+
+    for host, rec in iter_devices():
+        old = old_devices.pop(host)
+        old_host_cves = (old_cves.pop(host) or {}).get('cves') or {}
+        if old is not None and not sc.whole and not sc.matches(host, {'model': rec.get('model')}):
+            row = dict(old, batch_ts=run_ts, carried_from=prev_ts)
+            severities_map = old_host_cves
+            cve_row = {'batch_ts': run_ts, 'host': host, 'current_version': row.get('current_version'),
+                       'cve_counts': row.get('cve_counts'), 'cves': severities_map}
+            carried += 1
+        else:
+            row_upg = upgrades.get(host)
+            upg = models.Suggestion.from_dict(row_upg) if isinstance(row_upg, dict) else models.Suggestion(host)
+            severities_map = cves_of.get(host) or {}
+            counts = exposure.severity_counts_for(severities_map)
+            # Prefer EoL fields from the upgrade suggestion row for this batch (written by run_pipeline.py),
+            # then fall back to devices.json eol_details if not present.
+            eol = models.Eol.pick(upg.eol, models.Eol.from_dict(rec.get('eol_details')))
+
+            dev_info = rec.get('device_info') or {}
+            iface = rec.get('interface_summary') or {}
+            vlan = rec.get('vlan_summary') or {}
+            perf = rec.get('performance_info') or {}
+
+            # Normalize some numeric-like fields that arrived as strings
+            def _as_int(x):
+                try:
+                    return int(str(x))
+                except Exception:
+                    return None
+            cpu_val = perf.get('cpu_usage') or perf.get('cpu_5_sec') or perf.get('cpu_1_min') or perf.get('cpu_5_min')
+            row = {
+                    'batch_ts': run_ts,
+                    'host': host,
+                    'alias_name': upg.switch_name,
+                    'model': models.intern(rec.get('model')),
+                    'platform': models.intern(rec.get('platform')),
+                    'current_version': models.intern(rec.get('version')),
+                    'platform_version': models.intern(dev_info.get('nxos_version') or dev_info.get('ios_version') or rec.get('version')),
+                    'recommended_version': upg.recommended_version,
+                    'release_designation': upg.release_designation,
+                    'recommendation': upg.recommendation,
+                    'upgrade_recommended': upg.upgrade_recommended,
+                    'version_position': upg.version_position,
+                    'trains_behind': upg.trains_behind,
+                    'final_url': upg.final_url,
+                    'scraped_version_raw': upg.scraped_version_raw,
+                    'serial_number': dev_info.get('serial_number'),
+                    'uptime': dev_info.get('uptime'),
+                    'connected_ports': iface.get('connected_ports'),
+                    'connected_count': _as_int(iface.get('connected')),
+                    'disconnected_count': _as_int(iface.get('disconnected')),
+                    'total_interfaces': _as_int(iface.get('total_interfaces')),
+                    'cpu_usage': str(cpu_val) if cpu_val is not None else None,
+                    'vlan_active_count': vlan.get('total_active_vlans'),
+                    'vlans': vlan.get('vlans'),
+                    'end_of_sale_date': eol.end_of_sale_date,
+                    'end_of_support_date': eol.end_of_support_date,
+                    'series_release_date': eol.series_release_date,
+                    'status': eol.status,
+                    'cve_counts': counts,
+                }
+            cve_row = {
+                    'batch_ts': run_ts,
+                    'host': host,
+                    'current_version': rec.get('version'),
+                    'cve_counts': counts,
+                    'cves': severities_map,
             }
         write_jsonl_line(DEVICES_SNAPSHOT, row)
-
-        cve_row = {
-                'batch_ts': run_ts,
-                'host': host,
-                'current_version': rec.get('version'),
-                'cve_counts': counts,
-                'cves': severities_map,
-        }
         write_jsonl_line(CVES_SNAPSHOT, cve_row)
+        rows += 1
+
+        if timelines:
+            timeline_index.append((row,))
+        if terms is not None:
+            terms.add(row, severities_map)
+        exp.add(host, severities_map, model=row.get('model'))
+        tally((row,), totals)
+        if prev_ts:
+            changes.add(host, old, row, old_host_cves, severities_map)
+
+    # hosts of the previous batch that are gone (still in old_devices once this batch's are popped)
+    for host in list(old_devices.offsets):
+        changes.add(host, old_devices.pop(host), None)
+    for r in (cves_of, upgrades, old_devices, old_cves):
+        r.close()
+
+    for p, start in starts.items():
+        if rows:
+            snapshot_index.record(p, run_ts, start, os.path.getsize(p), rows)
+
+    if carried:
+        events.log(f'partial batch ({sc.describe()}): {carried} host(s) carried forward from {prev_ts}')
+
+    # first run with the index: build it from the full snapshot (which already holds this batch)
+    if not timelines:
+        print(f'[history] building per-host timelines ({timeline_index.rebuild()} hosts)')
+
+    exp.build().write(run_ts)
+
+    if terms is not None:
+        search_index.append(run_ts, terms.fields())
+    else:
+        print(f'[history] building search index ({search_index.rebuild()} batches)')
+
+    # what changed since the previous batch (this batch is not in batches.jsonl yet)
+    diff_summary = None
+    if prev_ts:
+        changes.write()
+        diff_summary = dict(changes.summary(), against=prev_ts)
+        events.log(f"diff vs {prev_ts}: {changes.summary()}")
 
+    run_metrics.record('stage', time.monotonic() - stage_t0)
     batch_summary = {
         'batch_ts': run_ts,
-        'device_count': device_count,
-        'devices_with_upgrade_recommended': devices_with_upgrade,
-        'devices_with_critical_cves': devices_with_critical,
-        'devices_eol': devices_eol,
-        'total_high_cves': total_high,
-        'total_medium_cves': total_medium,
+        **totals,
+        'metrics': run_metrics.compact(run_metrics.summarize(run_ts)),
+        'diff': diff_summary,
     }
+    if not sc.whole:
+        batch_summary.update(scope=sc.spec, carried_forward=carried)
     write_jsonl_line(BATCHES_JSONL, batch_summary)
 
     if os.path.exists(PIPELINE_LOG):
-        shutil.copy2(PIPELINE_LOG, os.path.join(LOGS_DIR, f'run_pipeline_{run_ts}.log'))
+        run_logs.archive(PIPELINE_LOG, run_ts)
 
     last_mail = os.path.join(DATA_DIR, 'email_last.eml')
     if os.path.exists(last_mail):
         shutil.copy2(last_mail, os.path.join(MAILS_DIR, f'notification_{run_ts}.eml'))
 
-    print(f'[history] Snapshot written for batch {run_ts}')
+    events.log(f'Snapshot written for batch {run_ts}')
 
 if __name__ == '__main__':
-    main()
+    import argparse
+    ap = argparse.ArgumentParser(description='Append the current run to the history snapshots')
+    run_scope.add_arguments(ap)
+    main(run_scope.from_args(ap.parse_args()))
@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""Persistent queue of orchestrator runs, shared by the dashboard and workers.
+
+Jobs live in data/jobs.db (SQLite, WAL), so the queue survives restarts and
+every uvicorn worker sees the same state:
+
+  queued -> running -> succeeded | failed | cancelled
+
+A job runs scripts/orchestrate.sh (mode 'full'), orchestrate_no_ansible.sh
+('no-ansible') or a single stage via run_stage.sh ('cves', 'eol', 'versions';
+scheduler.py queues these), optionally scoped to hosts, groups or PIDs (scope.py). A
+single-stage job refreshes the stage's outputs and records a history batch only
+when queued with record_batch (RUN_RECORD_BATCH=1). Jobs whose
+scopes share no host run side by side (up to RUN_MAX_CONCURRENT); a job
+without scope is the whole fleet and runs alone. Queued jobs start in order:
+a job never overtakes an earlier one it conflicts with.
+
+Each job gets data/jobs/<id>/ with its orchestrator log. A scoped job also runs
+in its own data directory there (RETRIEVOS_DATA_DIR): run outputs are copied
+in, everything else (history, caches) is linked to the shared data/. When it
+succeeds, its hosts' results are merged back into the shared run outputs. The
+orchestrator gets RUN_TS (unique per job), RUN_JOB_ID and RUN_SCOPE (JSON).
+
+Workers heartbeat the jobs they run; a job whose worker disappeared is adopted
+by another worker while its orchestrator is still alive, else marked failed.
+
+  python pipeline/jobs.py worker                      # run queued jobs until interrupted
+  python pipeline/jobs.py enqueue no-ansible --groups ios --hosts sw01
+  python pipeline/jobs.py list
+  python pipeline/jobs.py cancel 12
+"""
+from __future__ import annotations
+import os, sys, json, time, fcntl, shutil, signal, socket, sqlite3, subprocess, threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import atomic_io
+import device_registry
+import json_stream
+import scope as run_scope
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+JOBS_DB = os.path.join(DATA_DIR, 'jobs.db')
+JOBS_DIR = os.path.join(DATA_DIR, 'jobs')
+SCRIPTS_DIR = os.path.join(BASE_DIR, 'scripts')
+
+# mode -> script (+ args) under scripts/, and the pipeline stages it runs
+MODES = {
+    'full': ('orchestrate.sh',),
+    'no-ansible': ('orchestrate_no_ansible.sh',),
+    'cves': ('run_stage.sh', 'cves'),
+    'eol': ('run_stage.sh', 'eol'),
+    'versions': ('run_stage.sh', 'versions'),
+}
+MODE_STAGES = {
+    'full': ('ansible', 'cves', 'eol', 'versions'),
+    'no-ansible': ('cves', 'eol', 'versions'),
+    'cves': ('cves',),
+    'eol': ('eol',),
+    'versions': ('versions',),
+}
+# the steps a job's orchestrator records as stage events (events.py), in order; see steps()
+MODE_STEPS = {
+    'full': MODE_STAGES['full'] + ('mail', 'history'),
+    'no-ansible': MODE_STAGES['no-ansible'] + ('mail', 'history'),
+    'cves': ('cves',),
+    'eol': ('eol',),
+    'versions': ('versions',),
+}
+ACTIVE = ('queued', 'running')
+DONE = ('succeeded', 'failed', 'cancelled')
+
+MAX_CONCURRENT = int(os.getenv('RUN_MAX_CONCURRENT', '2'))
+POLL_SEC = 1.0
+STALE_SEC = 30.0          # a running job's worker is gone after this long without a heartbeat
+KILL_GRACE_SEC = 10.0     # SIGTERM -> SIGKILL on cancel
+
+# files a run writes into its data directory; a scoped job gets private copies
+RUN_OUTPUTS = ('devices.json', 'device_cve_check.json', 'upgrade-suggestions.json', 'email_last.eml')
+# never linked into a job's data directory (a scoped job gets a snapshot of the device registry)
+_PRIVATE = ('jobs', 'jobs.db', 'jobs.db-wal', 'jobs.db-shm', 'devices.db', 'devices.db-wal', 'devices.db-shm',
+            'device_records', 'run_pipeline.log', 'orchestrate_current.log')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mode TEXT NOT NULL,
+    scope TEXT,
+    status TEXT NOT NULL,
+    requested_by TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat REAL,
+    worker TEXT,
+    pid INTEGER,
+    run_ts TEXT,
+    exit_code INTEGER,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    record_batch INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE TABLE IF NOT EXISTS schedules (
+    name TEXT PRIMARY KEY,
+    spec TEXT NOT NULL,
+    next_at REAL,
+    last_at REAL,
+    last_job_id INTEGER,
+    last_outcome TEXT
+);
+"""
+_schema_ready: Set[str] = set()
+
+
+class JobError(ValueError):
+    pass
+
+
+@contextmanager
+def connect() -> Iterator[sqlite3.Connection]:
+    """Autocommit connection to jobs.db (also holds scheduler.py's state); the schema is created on first use."""
+    os.makedirs(os.path.dirname(JOBS_DB), exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        if JOBS_DB not in _schema_ready:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            # jobs.db from before record_batch
+            if 'record_batch' not in {r['name'] for r in conn.execute('PRAGMA table_info(jobs)')}:
+                conn.execute('ALTER TABLE jobs ADD COLUMN record_batch INTEGER NOT NULL DEFAULT 0')
+            _schema_ready.add(JOBS_DB)
+        yield conn
+    finally:
+        conn.close()
+
+
+def _row(r: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    if r is None:
+        return None
+    job = dict(r)
+    job['scope'] = json.loads(job['scope']) if job['scope'] else None
+    job['cancel_requested'] = bool(job['cancel_requested'])
+    job['log_path'] = log_path(job['id'])
+    return job
+
+
+def job_dir(job_id: int) -> str:
+    return os.path.join(JOBS_DIR, str(job_id))
+
+
+def log_path(job_id: int) -> str:
+    return os.path.join(job_dir(job_id), 'orchestrate.log')
+
+
+# --- queue ---
+
+def enqueue(mode: str, scope: Any = None, requested_by: Optional[str] = None,
+            db: Optional[sqlite3.Connection] = None, record_batch: bool = False) -> Dict[str, Any]:
+    """Queue a run; db: a connection already inside a transaction (the scheduler's).
+
+    record_batch: a single-stage job also writes a history batch (full runs always do).
+    """
+    if mode not in MODES:
+        raise JobError(f"mode must be one of: {', '.join(MODES)}")
+    try:
+        scope = run_scope.normalize(scope)
+    except run_scope.ScopeError as e:
+        raise JobError(str(e))
+    if db is None:
+        with connect() as db:
+            return enqueue(mode, scope, requested_by, db, record_batch)
+    cur = db.execute('INSERT INTO jobs (mode, scope, status, requested_by, created_at, record_batch) '
+                     'VALUES (?, ?, ?, ?, ?, ?)',
+                     (mode, json.dumps(scope) if scope else None, 'queued', requested_by, time.time(),
+                      int(bool(record_batch))))
+    return _row(db.execute('SELECT * FROM jobs WHERE id = ?', (cur.lastrowid,)).fetchone())
+
+
+def steps(job: Dict[str, Any]) -> tuple:
+    """MODE_STEPS of the job's mode, plus the history batch a single-stage job records with record_batch."""
+    out = MODE_STEPS.get(job['mode'], ())
+    if job.get('record_batch') and 'history' not in out:
+        out += ('history',)
+    return out
+
+
+def get(job_id: int) -> Optional[Dict[str, Any]]:
+    with connect() as db:
+        return _row(db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+
+def list_jobs(statuses: Optional[tuple] = None, limit: int = 50,
+              db: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    """Newest first."""
+    if db is None:
+        with connect() as db:
+            return list_jobs(statuses, limit, db)
+    q, args = 'SELECT * FROM jobs', []
+    if statuses:
+        q += f" WHERE status IN ({','.join('?' * len(statuses))})"
+        args.extend(statuses)
+    q += ' ORDER BY id DESC LIMIT ?'
+    args.append(limit)
+    return [_row(r) for r in db.execute(q, args).fetchall()]
+
+
+def running_count() -> int:
+    with connect() as db:
+        return db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+
+
+def counts() -> Dict[str, int]:
+    with connect() as db:
+        return {r[0]: r[1] for r in db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')}
+
+
+def last_success(stage: str) -> Optional[float]:
+    """When the newest successful whole-fleet job running this stage finished."""
+    modes = [m for m, stages in MODE_STAGES.items() if stage in stages]
+    with connect() as db:
+        r = db.execute(f"SELECT MAX(finished_at) FROM jobs WHERE status = 'succeeded' AND scope IS NULL "
+                       f"AND mode IN ({','.join('?' * len(modes))})", modes).fetchone()
+    return r[0] if r else None
+
+
+def cancel(job_id: int) -> Optional[Dict[str, Any]]:
+    """Queued jobs are cancelled at once; running ones are stopped by their worker."""
+    with connect() as db:
+        db.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                   (time.time(), job_id))
+        db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        return _row(db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+
+def _unique_run_ts(db: sqlite3.Connection) -> str:
+    # two jobs started in the same second must still be two batches
+    t = int(time.time())
+    while True:
+        ts = datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        if not db.execute('SELECT 1 FROM jobs WHERE run_ts = ?', (ts,)).fetchone():
+            return ts
+        t += 1
+
+
+def claim(worker: str, groups: Optional[Dict[str, Set[str]]] = None) -> Optional[Dict[str, Any]]:
+    """Atomically move the first startable queued job to running for this worker."""
+    if groups is None:
+        groups = run_scope.inventory_groups()
+    with connect() as db:
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = [_row(r) for r in db.execute("SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY id")]
+            busy = [run_scope.Scope(j['scope'], groups) for j in rows if j['status'] == 'running']
+            if len(busy) >= MAX_CONCURRENT:
+                db.execute('COMMIT')
+                return None
+            # PID selectors need the device records; read them only when some job uses one
+            devices = run_scope.load_devices() if any((j['scope'] or {}).get('pids') for j in rows) else {}
+            for j in rows:
+                if j['status'] != 'queued':
+                    continue
+                sc = run_scope.Scope(j['scope'], groups)
+                if not any(sc.conflicts(other, devices) for other in busy):
+                    now = time.time()
+                    db.execute("UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat = ?, "
+                               "run_ts = ? WHERE id = ?", (worker, now, now, _unique_run_ts(db), j['id']))
+                    job = _row(db.execute('SELECT * FROM jobs WHERE id = ?', (j['id'],)).fetchone())
+                    db.execute('COMMIT')
+                    return job
+                busy.append(sc)   # later jobs must not overtake this one
+            db.execute('COMMIT')
+            return None
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+
+def _update(job_id: int, **fields: Any) -> None:
+    cols = ', '.join(f'{k} = ?' for k in fields)
+    with connect() as db:
+        db.execute(f'UPDATE jobs SET {cols} WHERE id = ?', (*fields.values(), job_id))
+
+
+def finish(job_id: int, status: str, exit_code: Optional[int] = None, error: Optional[str] = None) -> None:
+    with connect() as db:
+        db.execute("UPDATE jobs SET status = ?, exit_code = ?, error = ?, finished_at = ?, heartbeat = NULL "
+                   "WHERE id = ? AND status = 'running'", (status, exit_code, error, time.time(), job_id))
+
+
+# --- running ---
+
+def _prepare_data_dir(job: Dict[str, Any]) -> Optional[str]:
+    """Private data directory for a scoped job (None: the job runs in the shared one)."""
+    if job['scope'] is None:
+        return None
+    ws = os.path.join(job_dir(job['id']), 'data')
+    shutil.rmtree(ws, ignore_errors=True)
+    os.makedirs(ws)
+    for name in os.listdir(DATA_DIR):
+        src = os.path.join(DATA_DIR, name)
+        if name in _PRIVATE:
+            continue
+        if name in RUN_OUTPUTS:
+            if os.path.isfile(src):
+                shutil.copy2(src, os.path.join(ws, name))
+        else:
+            os.symlink(src, os.path.join(ws, name))
+    device_registry.copy(os.path.join(ws, 'devices.db'))
+    os.makedirs(os.path.join(DATA_DIR, 'history'), exist_ok=True)
+    if not os.path.exists(os.path.join(ws, 'history')):
+        os.symlink(os.path.join(DATA_DIR, 'history'), os.path.join(ws, 'history'))
+    return ws
+
+
+def _rc_path(job_id: int) -> str:
+    return os.path.join(job_dir(job_id), 'exit_code')
+
+
+def _read_rc(job_id: int) -> Optional[int]:
+    try:
+        with open(_rc_path(job_id), 'r') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'   # exited, not yet reaped
+    except (OSError, IndexError):
+        return True
+
+
+def _load(path: str, default: Any) -> Any:
+    data = atomic_io.read_json(path, default)
+    return data if isinstance(data, type(default)) else default
+
+
+def _save(path: str, data: Any) -> None:
+    atomic_io.write_json(path, data)
+
+
+def publish(job: Dict[str, Any]) -> int:
+    """Copy a scoped job's results for its hosts into the shared data directory; returns hosts updated.
+
+    The history batch is already shared; this keeps the device registry (and
+    devices.json), device_cve_check.json and upgrade-suggestions.json current
+    for the next run.
+    """
+    ws = os.path.join(job_dir(job['id']), 'data')
+    if job['scope'] is None or not os.path.isdir(ws):
+        return 0
+    sc = run_scope.Scope(job['scope'])
+    ws_db = os.path.join(ws, 'devices.db')
+    hosts = set(sc.filter(run_scope.load_devices(ws_db)))
+    # two scoped jobs can finish together
+    with open(os.path.join(DATA_DIR, '.publish.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if hosts:
+            device_registry.merge(ws_db, hosts)
+            device_registry.export()
+        src = _load(os.path.join(ws, 'device_cve_check.json'), {})
+        if any(h in src for h in hosts):
+            dst = _load(os.path.join(DATA_DIR, 'device_cve_check.json'), {})
+            dst.update({h: src[h] for h in hosts if h in src})
+            _save(os.path.join(DATA_DIR, 'device_cve_check.json'), dst)
+        # upgrade-suggestions.json is append-only and grows with every run: stream it, never load it
+        ws_rows = os.path.join(ws, 'upgrade-suggestions.json')
+        rows = [r for r in (json_stream.iter_array(ws_rows) if os.path.exists(ws_rows) else ())
+                if isinstance(r, dict) and r.get('checked_at') == job['run_ts'] and r.get('host') in hosts]
+        if rows:
+            json_stream.append_array(os.path.join(DATA_DIR, 'upgrade-suggestions.json'), rows)
+    return len(hosts)
+
+
+def complete(job: Dict[str, Any], rc: Optional[int]) -> None:
+    """Record how a job's orchestrator ended; a successful scoped job publishes its results first."""
+    if job['cancel_requested']:
+        finish(job['id'], 'cancelled', rc)
+    elif rc is None:
+        finish(job['id'], 'failed', None, 'orchestrator exit code unknown')
+    elif rc != 0:
+        finish(job['id'], 'failed', rc)
+    else:
+        try:
+            publish(job)
+        except Exception as e:
+            finish(job['id'], 'failed', rc, f'publishing results failed: {e}')
+        else:
+            finish(job['id'], 'succeeded', rc)
+
+
+def launch(job: Dict[str, Any]) -> subprocess.Popen:
+    """Start the orchestrator for a claimed job in its own process group."""
+    script, *script_args = MODES[job['mode']]
+    script = os.path.join(SCRIPTS_DIR, script)
+    if not os.path.exists(script):
+        raise FileNotFoundError(f'orchestrate script not found: {script}')
+    os.makedirs(job_dir(job['id']), exist_ok=True)
+    env = dict(os.environ, RUN_TS=job['run_ts'], RUN_JOB_ID=str(job['id']), RUN_SCOPE=json.dumps(job['scope'] or {}),
+               RUN_RECORD_BATCH='1' if job.get('record_batch') else '0')
+    ws = _prepare_data_dir(job)
+    if ws:
+        env['RETRIEVOS_DATA_DIR'] = ws
+    try:
+        os.remove(_rc_path(job['id']))
+    except OSError:
+        pass
+    # the exit code also goes to a file, so a worker that adopts the job can read it
+    wrapper = 'rc_file="$1"; shift; bash "$@"; rc=$?; echo "$rc" > "$rc_file"; exit "$rc"'
+    logf = open(log_path(job['id']), 'ab')
+    try:
+        return subprocess.Popen(['bash', '-c', wrapper, 'orchestrate', _rc_path(job['id']), script, *script_args],
+                                cwd=BASE_DIR, env=env, stdout=logf, stderr=subprocess.STDOUT,
+                                start_new_session=True)
+    finally:
+        logf.close()
+
+
+class Worker:
+    """Claims queued jobs and supervises their orchestrators; run() blocks, start() runs it in a thread."""
+
+    def __init__(self, name: Optional[str] = None, poll_sec: float = POLL_SEC):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.poll_sec = poll_sec
+        self._procs: Dict[int, Dict[str, Any]] = {}   # job id -> {'proc': Popen | None, 'pid', 'kill_at'}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self) -> 'Worker':
+        self._thread = threading.Thread(target=self.run, name='jobs-worker', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop claiming; running orchestrators keep going and are adopted by the next worker."""
+        self._stop.set()
+        self._wake.set()
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                print(f'[jobs] worker {self.name}: {e}', file=sys.stderr)
+            self._wake.wait(self.poll_sec)
+            self._wake.clear()
+
+    def tick(self) -> None:
+        now = time.time()
+        self._adopt_stale(now)
+        for job_id in list(self._procs):
+            self._supervise(job_id, now)
+        groups = run_scope.inventory_groups()
+        while not self._stop.is_set():
+            job = claim(self.name, groups)
+            if job is None:
+                break
+            try:
+                proc = launch(job)
+            except Exception as e:
+                finish(job['id'], 'failed', error=f'failed to start: {e}')
+                continue
+            _update(job['id'], pid=proc.pid)
+            self._procs[job['id']] = {'proc': proc, 'pid': proc.pid, 'kill_at': None}
+            print(f"[jobs] started job {job['id']} ({job['mode']}, scope={job['scope']}) RUN_TS={job['run_ts']}")
+
+    def _supervise(self, job_id: int, now: float) -> None:
+        st = self._procs[job_id]
+        if st['proc'] is not None:
+            rc = st['proc'].poll()
+            exited = rc is not None
+        else:   # adopted: not our child, so only the pid and the exit code file tell
+            exited = not _alive(st['pid'])
+            rc = _read_rc(job_id) if exited else None
+        job = get(job_id)
+        if exited or job is None or job['status'] != 'running':
+            if job is not None and job['status'] == 'running':
+                complete(job, rc)
+            self._cleanup(job_id)
+            return
+        _update(job_id, heartbeat=now)
+        if job['cancel_requested']:
+            if st['kill_at'] is None:
+                self._signal(st['pid'], signal.SIGTERM)
+                st['kill_at'] = now + KILL_GRACE_SEC
+            elif now >= st['kill_at']:
+                self._signal(st['pid'], signal.SIGKILL)
+
+    @staticmethod
+    def _signal(pid: int, sig: int) -> None:
+        try:
+            os.killpg(pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _cleanup(self, job_id: int) -> None:
+        self._procs.pop(job_id, None)
+        shutil.rmtree(os.path.join(job_dir(job_id), 'data'), ignore_errors=True)
+        job = get(job_id)
+        if job:
+            print(f"[jobs] job {job_id} {job['status']} (exit {job['exit_code']})")
+
+    def _adopt_stale(self, now: float) -> None:
+        """Take over running jobs whose worker stopped heartbeating."""
+        with connect() as db:
+            stale = db.execute("SELECT id, pid FROM jobs WHERE status = 'running' AND heartbeat < ?",
+                               (now - STALE_SEC,)).fetchall()
+            for r in stale:
+                if r['id'] in self._procs:
+                    continue
+                if _alive(r['pid']):
+                    taken = db.execute("UPDATE jobs SET worker = ?, heartbeat = ? WHERE id = ? AND heartbeat < ?",
+                                       (self.name, now, r['id'], now - STALE_SEC)).rowcount
+                    if taken:
+                        self._procs[r['id']] = {'proc': None, 'pid': r['pid'], 'kill_at': None}
+                        print(f"[jobs] adopted job {r['id']} (pid {r['pid']})")
+                else:
+                    rc = _read_rc(r['id'])
+                    if rc is None:
+                        finish(r['id'], 'failed', None, 'worker lost')
+                    else:
+                        complete(get(r['id']), rc)
+                    shutil.rmtree(os.path.join(job_dir(r['id']), 'data'), ignore_errors=True)
+
+
+def _print_jobs(rows: List[Dict[str, Any]]) -> None:
+    for j in rows:
+        started = datetime.fromtimestamp(j['started_at']).strftime('%Y-%m-%d %H:%M:%S') if j['started_at'] else '-'
+        print(f"{j['id']:>5}  {j['status']:<10} {j['mode']:<11} {started:<20} {j['run_ts'] or '-':<21} "
+              f"{json.dumps(j['scope']) if j['scope'] else 'all'}")
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Queue of pipeline orchestrator runs')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    w = sub.add_parser('worker', help='Run queued jobs until interrupted')
+    w.add_argument('--name')
+    e = sub.add_parser('enqueue', help='Queue a run')
+    e.add_argument('mode', choices=sorted(MODES))
+    e.add_argument('--record-batch', action='store_true', help='Single-stage mode: also write a history batch')
+    run_scope.add_arguments(e)
+    ls = sub.add_parser('list', help='Recent jobs, newest first')
+    ls.add_argument('--active', action='store_true')
+    ls.add_argument('--limit', type=int, default=20)
+    c = sub.add_parser('cancel', help='Cancel a queued or running job')
+    c.add_argument('id', type=int)
+    args = ap.parse_args()
+
+    if args.cmd == 'worker':
+        worker = Worker(args.name)
+        signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+        print(f'[jobs] worker {worker.name} polling {JOBS_DB}')
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            worker.stop()
+    elif args.cmd == 'enqueue':
+        try:
+            job = enqueue(args.mode, {'groups': args.groups, 'hosts': args.hosts, 'pids': args.pids},
+                          requested_by=os.getenv('USER'), record_batch=args.record_batch)
+        except JobError as ex:
+            ap.error(str(ex))
+        print(f"[jobs] queued job {job['id']}")
+    elif args.cmd == 'list':
+        _print_jobs(list_jobs(ACTIVE if args.active else None, args.limit))
+    elif args.cmd == 'cancel':
+        job = cancel(args.id)
+        if job is None:
+            ap.error(f'no job {args.id}')
+        print(f"[jobs] job {args.id}: {job['status']}{' (stop requested)' if job['cancel_requested'] and job['status'] == 'running' else ''}")
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Incremental reads and writes of large JSON objects keyed by host (devices.json).
+
+json.load holds the whole fleet at once, and json.dump(..., indent=2) builds
+all of its text again. With tens of thousands of devices, each with VLAN and
+port lists, that is the largest allocation of a stage. Here the top-level
+object is read one member at a time and written from an iterator, so memory is
+bounded by the largest single record:
+
+  for host, rec in json_stream.iter_items(path):        # ('sw01', {...}), ...
+      ...
+  json_stream.write_items(path, ((h, r) for ...))        # the bytes json.dump(dict, indent=2) writes, atomically
+  for row in json_stream.iter_array(path):               # elements of a top-level array (upgrade-suggestions.json)
+      ...
+  json_stream.append_array(path, rows)                   # existing elements streamed back out, then rows
+
+Only the top level is streamed: each member's value is parsed by the json
+module once its text is complete in the buffer.
+
+  python pipeline/json_stream.py <file.json>            # count members, parsed incrementally
+"""
+from __future__ import annotations
+import os, sys, json
+from typing import IO, Any, Iterable, Iterator, Optional, Tuple
+
+import atomic_io
+
+CHUNK = 64 * 1024
+_WS = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    def __init__(self, f: IO[str]):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Append the next chunk (dropping what was consumed); False at the end of the file."""
+        if self.eof:
+            return False
+        chunk = self.f.read(CHUNK)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """The next non-blank character ('' at the end), not consumed."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, ch: str) -> None:
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f'expected {ch!r}, found {got or "end of file"!r}')
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                v, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # a number near the end of the buffer may go on in the next chunk ('12' + '.5e-3')
+            if isinstance(v, (int, float)) and end + 2 >= len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return v
+
+
+def iter_items(path: str) -> Iterator[Tuple[str, Any]]:
+    """(key, value) for each member of the JSON object in `path`, in file order.
+
+    Raises ValueError when the file is not an object or is malformed; members
+    before the error have already been yielded.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        r = _Reader(f)
+        r.expect('{')
+        if r.peek() == '}':
+            return
+        while True:
+            key = r.value()
+            if not isinstance(key, str):
+                raise ValueError(f'object key expected, found {key!r}')
+            r.expect(':')
+            yield key, r.value()
+            sep = r.peek()
+            r.pos += 1
+            if sep == '}':
+                return
+            if sep != ',':
+                raise ValueError(f"expected ',' or '}}', found {sep or 'end of file'!r}")
+
+
+def iter_array(path: str) -> Iterator[Any]:
+    """Each element of the JSON array in `path`, in file order (errors as for iter_items)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        r = _Reader(f)
+        r.expect('[')
+        if r.peek() == ']':
+            return
+        while True:
+            yield r.value()
+            sep = r.peek()
+            r.pos += 1
+            if sep == ']':
+                return
+            if sep != ',':
+                raise ValueError(f"expected ',' or ']', found {sep or 'end of file'!r}")
+
+
+def is_array(path: str) -> bool:
+    """True when the file's top-level value starts as a JSON array (only the first character is read)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return _Reader(f).peek() == '['
+
+
+def write_items(path: str, items: Iterable[Tuple[str, Any]], indent: Optional[int] = 2) -> int:
+    """Write a JSON object from (key, value) pairs, atomically; returns the member count.
+
+    The bytes are those of json.dump(dict(items), indent=indent, ensure_ascii=False).
+    """
+    n = 0
+    with atomic_io.open_atomic(path) as f:
+        if indent is None:
+            for k, v in items:
+                f.write(('{' if not n else ', ') + json.dumps(k, ensure_ascii=False) + ': '
+                        + json.dumps(v, ensure_ascii=False))
+                n += 1
+        else:
+            pad = ' ' * indent
+            for k, v in items:
+                text = json.dumps(v, indent=indent, ensure_ascii=False).replace('\n', '\n' + pad)
+                f.write(('{\n' if not n else ',\n') + pad + json.dumps(k, ensure_ascii=False) + ': ' + text)
+                n += 1
+        f.write('{}' if not n else ('}' if indent is None else '\n}'))
+    return n
+
+
+def write_array(path: str, items: Iterable[Any], indent: Optional[int] = 2) -> int:
+    """Write a JSON array from an iterable, atomically; returns the element count.
+
+    The bytes are those of json.dump(list(items), indent=indent, ensure_ascii=False).
+    """
+    n = 0
+    with atomic_io.open_atomic(path) as f:
+        if indent is None:
+            for v in items:
+                f.write(('[' if not n else ', ') + json.dumps(v, ensure_ascii=False))
+                n += 1
+        else:
+            pad = ' ' * indent
+            for v in items:
+                text = json.dumps(v, indent=indent, ensure_ascii=False).replace('\n', '\n' + pad)
+                f.write(('[\n' if not n else ',\n') + pad + text)
+                n += 1
+        f.write('[]' if not n else (']' if indent is None else '\n]'))
+    return n
+
+
+def append_array(path: str, items: Iterable[Any], indent: Optional[int] = 2) -> int:
+    """Rewrite the JSON array in `path` with `items` appended, streaming both; returns the new length.
+
+    A missing file counts as empty. Raises ValueError when it is not a valid
+    array, and the file is then left as it was.
+    """
+    def _all() -> Iterator[Any]:
+        if os.path.exists(path):
+            yield from iter_array(path)
+        yield from items
+    return write_array(path, _all(), indent)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or not os.path.exists(sys.argv[1]):
+        sys.exit('usage: json_stream.py <file.json>')
+    count = sum(1 for _ in iter_items(sys.argv[1]))
+    print(f'[json_stream] {count} member(s) in {sys.argv[1]}')
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Typed records passed between the stages: a device, its EoL details and an upgrade suggestion.
+
+Records from devices.json and upgrade-suggestions.json are plain dicts with
+the same dozen strings (platform, model, version, recommendation,
+designation, dates, the batch timestamp) repeated on every host. These
+classes hold them in slots, with those strings interned, so a fleet-sized
+list shares one copy of each; to_dict()/from_dict() are the JSON shape.
+
+  dev = models.Device.from_record(host, rec)           # model/platform/version stripped, '' -> None
+  s = models.Suggestion(host, pid=dev.model, recommendation='no url', eol=dev.eol, ...)
+  s.to_dict()                                          # the upgrade-suggestions.json row
+  s = models.Suggestion.from_dict(row)                 # unknown keys ignored
+  models.Eol.pick(s.eol, dev.eol)                      # the suggestion's EoL, else the device's
+"""
+from __future__ import annotations
+import sys
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, Optional
+
+EOL_FIELDS = ('end_of_sale_date', 'end_of_support_date', 'series_release_date', 'status')
+
+
+def intern(v: Any) -> Any:
+    """sys.intern for strings; anything else is returned as is."""
+    return sys.intern(v) if type(v) is str else v
+
+
+def _clean(v: Any) -> Optional[str]:
+    s = str(v).strip() if v is not None else ''
+    return sys.intern(s) if s else None
+
+
+def _intern_fields(obj: Any, names: tuple) -> None:
+    for name in names:
+        v = getattr(obj, name)
+        if type(v) is str:
+            setattr(obj, name, sys.intern(v))
+
+
+@dataclass(slots=True)
+class Eol:
+    end_of_sale_date: Optional[str] = None
+    end_of_support_date: Optional[str] = None
+    series_release_date: Optional[str] = None
+    status: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        _intern_fields(self, EOL_FIELDS)
+
+    @classmethod
+    def from_dict(cls, d: Any) -> 'Eol':
+        d = d if isinstance(d, dict) else {}
+        return cls(*(d.get(k) for k in EOL_FIELDS))
+
+    def __bool__(self) -> bool:
+        return any(getattr(self, k) for k in EOL_FIELDS)
+
+    def to_dict(self) -> Dict[str, Optional[str]]:
+        return {k: getattr(self, k) for k in EOL_FIELDS}
+
+    @staticmethod
+    def pick(*candidates: Optional['Eol']) -> 'Eol':
+        """The first candidate with any EoL field set (an empty Eol if none has)."""
+        for e in candidates:
+            if e:
+                return e
+        return Eol()
+
+
+@dataclass(slots=True)
+class Device:
+    """The fields of a device record the stages decide on (the registry keeps the full record)."""
+    host: str
+    model: Optional[str] = None
+    platform: Optional[str] = None
+    version: Optional[str] = None
+    eol: Eol = field(default_factory=Eol)
+
+    @classmethod
+    def from_record(cls, host: str, rec: Any) -> 'Device':
+        rec = rec if isinstance(rec, dict) else {}
+        return cls(host, _clean(rec.get('model')), _clean(rec.get('platform')), _clean(rec.get('version')),
+                   Eol.from_dict(rec.get('eol_details')))
+
+    def to_record(self) -> Dict[str, Any]:
+        rec: Dict[str, Any] = {'model': self.model, 'platform': self.platform, 'version': self.version}
+        if self.eol:
+            rec['eol_details'] = self.eol.to_dict()
+        return rec
+
+
+@dataclass(slots=True)
+class Suggestion:
+    """One row of upgrade-suggestions.json: the recommended version for a device in one run."""
+    host: str
+    pid: Optional[str] = None
+    switch_name: Optional[str] = None
+    platform: Optional[str] = None
+    current_version: Optional[str] = None
+    recommended_version: Optional[str] = None
+    release_designation: Optional[str] = None
+    explicit_recommendation: Optional[bool] = None
+    recommendation: Optional[str] = None
+    upgrade_recommended: Optional[bool] = None
+    version_position: Optional[str] = None
+    trains_behind: Optional[int] = None
+    final_url: Optional[str] = None
+    selected_label: Optional[str] = None
+    screenshot_file: Optional[str] = None
+    checked_at: Optional[str] = None
+    scraped_version_raw: Optional[str] = None
+    notes: Optional[str] = None
+    alias_used: Optional[str] = None
+    # EoL details mirrored into upgrade-suggestions for batch-level access (flat in the JSON row)
+    eol: Eol = field(default_factory=Eol)
+
+    # values shared across hosts; host, URLs and screenshot paths are not worth interning
+    _SHARED = ('pid', 'switch_name', 'platform', 'current_version', 'recommended_version', 'release_designation',
+               'recommendation', 'version_position', 'selected_label', 'checked_at', 'scraped_version_raw',
+               'notes', 'alias_used')
+
+    def __post_init__(self) -> None:
+        _intern_fields(self, Suggestion._SHARED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {f.name: getattr(self, f.name) for f in fields(self) if f.name != 'eol'}
+        d.update(self.eol.to_dict())
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> 'Suggestion':
+        return cls(**{k: d.get(k) for k in _SUGGESTION_KEYS}, eol=Eol.from_dict(d))
+
+
+_SUGGESTION_KEYS = tuple(f.name for f in fields(Suggestion) if f.name != 'eol')
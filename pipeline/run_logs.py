@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Archived pipeline logs: gzip storage and paged, filtered reads.
+
+history_writer.py archives data/run_pipeline.log as
+data/history/logs/run_pipeline_<RUN_TS>.log.gz; logs archived before that stay
+plain .log and are read the same way. Reads stream the file line by line, so a
+page of a many-MB log costs one pass and a bounded amount of memory.
+
+Lines are addressed by their 0-based index in the log. A line's level is the
+[LEVEL] tag written by the logging format; untagged lines (tracebacks, print
+output) take the level of the line above, so a traceback stays with its ERROR.
+
+  read(ts, offset=0, limit=500)                 # lines offset.. (next page: next_offset)
+  read(ts, tail=500)                            # last 500 lines (earlier page: before=<first line>)
+  read(ts, grep='timeout', level='WARNING')     # only matching lines, either mode
+
+  python pipeline/run_logs.py <ts> [--tail N] [--grep RE] [--level WARNING]
+  python pipeline/run_logs.py --compress-all   # gzip logs archived as plain text
+"""
+from __future__ import annotations
+import os, re, io, sys, gzip, shutil
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+LOGS_DIR = os.path.join(DATA_DIR, 'history', 'logs')
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+MAX_LIMIT = 5000
+CHUNK = 64 * 1024
+_LEVEL_RE = re.compile(r'\[(DEBUG|INFO|WARNING|WARN|ERROR|CRITICAL)\]')
+
+
+def log_path(ts: str, compressed: bool = True) -> str:
+    return os.path.join(LOGS_DIR, f"run_pipeline_{ts}.log{'.gz' if compressed else ''}")
+
+
+def find(ts: str) -> Optional[str]:
+    """The archived log of a batch (compressed or legacy plain), None if there is none."""
+    for path in (log_path(ts), log_path(ts, compressed=False)):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def archive(src: str, ts: str) -> str:
+    """Compress a run log into the history; written under a temp name, then renamed."""
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    dst = log_path(ts)
+    tmp = dst + '.tmp'
+    with open(src, 'rb') as fin, gzip.open(tmp, 'wb', compresslevel=6) as fout:
+        shutil.copyfileobj(fin, fout, CHUNK)
+    os.replace(tmp, dst)
+    return dst
+
+
+def is_compressed(path: str) -> bool:
+    return path.endswith('.gz')
+
+
+def open_text(path: str) -> io.TextIOBase:
+    if is_compressed(path):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def iter_bytes(path: str) -> Iterator[bytes]:
+    """The log text in chunks, decompressed."""
+    opener = gzip.open if is_compressed(path) else open
+    with opener(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+
+def parse_level(name: Optional[str]) -> Optional[int]:
+    """Minimum level index for a filter name (WARN accepted), None for no filter."""
+    if not name:
+        return None
+    name = name.strip().upper()
+    name = 'WARNING' if name == 'WARN' else name
+    if name not in LEVELS:
+        raise ValueError(f"level must be one of: {', '.join(LEVELS)}")
+    return LEVELS.index(name)
+
+
+def compile_grep(pattern: Optional[str]) -> Optional[re.Pattern]:
+    """Case-insensitive regex; a pattern that does not compile is matched literally."""
+    if not pattern:
+        return None
+    try:
+        return re.compile(pattern, re.IGNORECASE)
+    except re.error:
+        return re.compile(re.escape(pattern), re.IGNORECASE)
+
+
+def _lines(path: str) -> Iterator[Tuple[int, str, str]]:
+    """(index, level, text) for every line."""
+    level = 'INFO'
+    with open_text(path) as f:
+        for n, line in enumerate(f):
+            m = _LEVEL_RE.search(line, 0, 64)
+            if m:
+                level = 'WARNING' if m.group(1) == 'WARN' else m.group(1)
+            yield n, level, line.rstrip('\r\n')
+
+
+def read(ts: str, offset: int = 0, limit: int = 500, tail: Optional[int] = None, before: Optional[int] = None,
+         grep: Optional[str] = None, level: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """One page of matching lines, None if the batch has no log.
+
+    Forward (default): up to `limit` matching lines from line `offset`; the next page
+    starts at `next_offset` (None at the end of the log).
+    Tail (`tail` given): the last `tail` matching lines before line `before` (default:
+    the end); `prev_before` pages further back (None when nothing earlier matches).
+    """
+    path = find(ts)
+    if path is None:
+        return None
+    min_level = parse_level(level)
+    rx = compile_grep(grep)
+    limit = max(1, min(int(limit), MAX_LIMIT))
+
+    def wanted(lvl: str, text: str) -> bool:
+        if min_level is not None and LEVELS.index(lvl) < min_level:
+            return False
+        return rx is None or rx.search(text) is not None
+
+    out: Dict[str, Any] = {'ts': ts, 'compressed': is_compressed(path),
+                           'filter': {'grep': grep or None, 'level': level or None}}
+    if tail is not None:
+        tail = max(1, min(int(tail), MAX_LIMIT))
+        page: deque = deque(maxlen=tail)
+        matched = 0
+        for n, lvl, text in _lines(path):
+            if before is not None and n >= before:
+                break
+            if wanted(lvl, text):
+                page.append({'n': n, 'level': lvl, 'text': text})
+                matched += 1
+        lines: List[Dict[str, Any]] = list(page)
+        out.update(lines=lines, prev_before=lines[0]['n'] if matched > len(lines) else None)
+        return out
+    offset = max(0, int(offset))
+    lines = []
+    next_offset = None
+    for n, lvl, text in _lines(path):
+        if n < offset:
+            continue
+        if len(lines) == limit:
+            next_offset = n
+            break
+        if wanted(lvl, text):
+            lines.append({'n': n, 'level': lvl, 'text': text})
+    out.update(lines=lines, offset=offset, next_offset=next_offset)
+    return out
+
+
+def compress_all() -> int:
+    """gzip every plain archived log (the plain file is removed once its .gz exists)."""
+    done = 0
+    for name in sorted(os.listdir(LOGS_DIR)) if os.path.isdir(LOGS_DIR) else []:
+        if name.startswith('run_pipeline_') and name.endswith('.log'):
+            ts = name[len('run_pipeline_'):-len('.log')]
+            archive(os.path.join(LOGS_DIR, name), ts)
+            os.remove(os.path.join(LOGS_DIR, name))
+            done += 1
+    return done
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Read archived pipeline logs')
+    ap.add_argument('ts', nargs='?')
+    ap.add_argument('--offset', type=int, default=0)
+    ap.add_argument('--limit', type=int, default=MAX_LIMIT)
+    ap.add_argument('--tail', type=int)
+    ap.add_argument('--grep')
+    ap.add_argument('--level', choices=LEVELS)
+    ap.add_argument('--compress-all', action='store_true', help='gzip logs archived as plain text')
+    args = ap.parse_args()
+    if args.compress_all:
+        print(f'[logs] compressed {compress_all()} log(s)')
+    elif args.ts:
+        page = read(args.ts, args.offset, args.limit, args.tail, None, args.grep, args.level)
+        if page is None:
+            sys.exit(f'no log for batch {args.ts}')
+        for ln in page['lines']:
+            print(ln['text'])
+    else:
+        ap.error('ts or --compress-all required')
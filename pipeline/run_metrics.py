@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Per-run timing spans and counters, one JSONL file per batch (RUN_TS).
+
+Every stage process appends to data/history/metrics/run_metrics_<RUN_TS>.jsonl:
+  {"type": "span", "stage": "versions", "name": "scrape", "host": "sw1", "sec": 4.21, "outcome": "ok", ...}
+  {"type": "counters", "stage": "versions", "name": "upstream", "data": {...}}
+
+Lines are small single appends, so concurrent stages can share the file.
+Without RUN_TS (script run by hand) recording is a no-op.
+
+  run_metrics.configure('eol')                 # default stage for this process
+  with run_metrics.host_scope(host):           # nested spans inherit the host
+      with run_metrics.span('navigate') as sp:
+          ...; sp['outcome'] = 'blocked'
+  run_metrics.summarize(ts)                    # aggregate for batches.jsonl / dashboard
+"""
+from __future__ import annotations
+import os, json, time, threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+METRICS_DIR = os.path.join(DATA_DIR, 'history', 'metrics')
+
+_stage = os.getenv('PIPELINE_STAGE') or 'adhoc'
+_local = threading.local()
+_lock = threading.Lock()
+_fh = None
+_fh_ts: Optional[str] = None
+
+
+def metrics_path(run_ts: str) -> str:
+    return os.path.join(METRICS_DIR, f'run_metrics_{run_ts}.jsonl')
+
+
+def configure(stage: str) -> None:
+    global _stage
+    _stage = stage
+
+
+def current_host() -> Optional[str]:
+    return getattr(_local, 'host', None)
+
+
+@contextmanager
+def host_scope(host: Optional[str]) -> Iterator[None]:
+    prev = current_host()
+    _local.host = host
+    try:
+        yield
+    finally:
+        _local.host = prev
+
+
+def _write(obj: Dict[str, Any]) -> None:
+    global _fh, _fh_ts
+    run_ts = os.getenv('RUN_TS')
+    if not run_ts:
+        return
+    line = json.dumps(obj, ensure_ascii=False) + '\n'
+    with _lock:
+        try:
+            if _fh is None or _fh_ts != run_ts:
+                os.makedirs(METRICS_DIR, exist_ok=True)
+                _fh = open(metrics_path(run_ts), 'a', encoding='utf-8')
+                _fh_ts = run_ts
+            _fh.write(line)
+            _fh.flush()
+        except Exception:
+            pass
+
+
+def record(name: str, seconds: float, host: Optional[str] = None, stage: Optional[str] = None,
+           outcome: str = 'ok', **attrs) -> None:
+    obj = {
+        'type': 'span', 'stage': stage or _stage, 'name': name,
+        'host': host if host is not None else current_host(),
+        'sec': round(seconds, 4), 'outcome': outcome, 'at': round(time.time(), 3),
+    }
+    obj.update(attrs)
+    _write(obj)
+
+
+@contextmanager
+def span(name: str, host: Optional[str] = None, stage: Optional[str] = None, **attrs) -> Iterator[Dict[str, Any]]:
+    """Time a block. The yielded dict can be updated (e.g. sp['outcome'] = 'failed')."""
+    info: Dict[str, Any] = {'outcome': 'ok'}
+    info.update(attrs)
+    t0 = time.monotonic()
+    try:
+        yield info
+    except BaseException:
+        info['outcome'] = 'error'
+        raise
+    finally:
+        record(name, time.monotonic() - t0, host=host, stage=stage, **info)
+
+
+def record_counters(name: str, data: Dict[str, Any], stage: Optional[str] = None) -> None:
+    _write({'type': 'counters', 'stage': stage or _stage, 'name': name, 'data': data, 'at': round(time.time(), 3)})
+
+
+def load(run_ts: str) -> List[Dict[str, Any]]:
+    path = metrics_path(run_ts)
+    out: List[Dict[str, Any]] = []
+    if not os.path.exists(path):
+        return out
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                out.append(json.loads(line))
+            except Exception:
+                pass  # tolerate a torn last line from a killed stage
+    return out
+
+
+def _pct(vals: List[float], q: float) -> float:
+    if not vals:
+        return 0.0
+    return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))]
+
+
+def _dist(vals: List[float]) -> Dict[str, float]:
+    vals = sorted(vals)
+    return {
+        'count': len(vals),
+        'total_sec': round(sum(vals), 3),
+        'p50': round(_pct(vals, 0.50), 3),
+        'p95': round(_pct(vals, 0.95), 3),
+        'max': round(vals[-1], 3) if vals else 0.0,
+    }
+
+
+def summarize(run_ts: str, events: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Aggregate spans per stage: wall time, hosts, throughput and latency distributions.
+
+    The 'stage' span is the whole-stage wall clock; 'host' spans are per-host end-to-end.
+    """
+    events = load(run_ts) if events is None else events
+    stages: Dict[str, Dict[str, Any]] = {}
+    for ev in events:
+        st = stages.setdefault(ev.get('stage') or 'adhoc', {'_spans': {}, '_hosts': set(), '_failed': set(),
+                                                             'counters': {}})
+        if ev.get('type') == 'counters':
+            st['counters'][ev.get('name')] = ev.get('data')
+            continue
+        name = ev.get('name')
+        st['_spans'].setdefault(name, []).append(float(ev.get('sec') or 0))
+        if name == 'host' and ev.get('host'):
+            st['_hosts'].add(ev['host'])
+            if ev.get('outcome') not in ('ok', 'skipped'):
+                st['_failed'].add(ev['host'])
+    out: Dict[str, Any] = {}
+    for stage, st in stages.items():
+        spans = {name: _dist(vals) for name, vals in st['_spans'].items()}
+        wall = (spans.get('stage') or {}).get('total_sec') or 0.0
+        hosts = len(st['_hosts'])
+        out[stage] = {
+            'wall_sec': wall,
+            'hosts': hosts,
+            'hosts_failed': len(st['_failed']),
+            'hosts_per_sec': round(hosts / wall, 3) if wall and hosts else None,
+            'spans': spans,
+            'counters': st['counters'],
+        }
+    return {'batch_ts': run_ts, 'stages': out}
+
+
+def compact(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """Small per-stage view stored in batches.jsonl."""
+    out = {}
+    for stage, st in (summary.get('stages') or {}).items():
+        host = (st.get('spans') or {}).get('host') or {}
+        retries = sum(int((row or {}).get('retries') or 0)
+                      for row in ((st.get('counters') or {}).get('upstream') or {}).values())
+        out[stage] = {
+            'wall_sec': st.get('wall_sec'),
+            'hosts': st.get('hosts'),
+            'hosts_failed': st.get('hosts_failed'),
+            'hosts_per_sec': st.get('hosts_per_sec'),
+            'host_p50': host.get('p50'),
+            'host_p95': host.get('p95'),
+            'retries': retries,
+        }
+    return out
+
+
+if __name__ == '__main__':
+    import sys
+    ts = sys.argv[1] if len(sys.argv) > 1 else os.getenv('RUN_TS')
+    if not ts:
+        print('usage: run_metrics.py <RUN_TS>', file=sys.stderr)
+        sys.exit(2)
+    print(json.dumps(summarize(ts), indent=2))
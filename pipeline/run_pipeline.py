@@ -1,25 +1,30 @@
 #!/usr/bin/env python3
-import os, json, sys, re, logging, time
-from typing import Tuple, Optional
-import re
-
-# ✅ use your headless versions
-import os, sys, json, logging, time, re
+import os, sys, re, logging
 from typing import Tuple, Optional
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SCRAPING_DIR = os.path.join(BASE_DIR, 'scraping')
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
 
 sys.path.insert(0, SCRAPING_DIR)
 
 from cisco_url_extractor import extract_url_for_model  # type: ignore
 from last_version_extract import scrape_latest_version  # type: ignore
+from waits import Pacer  # type: ignore
+from retry_policy import RetryPolicy, CircuitOpenError, METRICS as RETRY_METRICS  # type: ignore
 from datetime import datetime, timezone
+import run_metrics
+import events
+import atomic_io
+import json_stream
+import device_registry
+import models
+
+run_metrics.configure('versions')
+events.configure('versions')
 
 
 # ==== CONFIG ====
-DEVICES_JSON = os.path.join(DATA_DIR, "devices.json")                 # input
 PID_ALIAS_JSON = os.path.join(DATA_DIR, "pid_alias.json")             # input
 OUT_JSON = os.path.join(DATA_DIR, "upgrade-suggestions.json")         # output
 LOG_FILE = os.path.join(DATA_DIR, "run_pipeline.log")
@@ -29,6 +34,10 @@ MAX_RETRIES_URL = 3
 MAX_RETRIES_SCRAPE = 3
 BACKOFF_BASE_SEC = 2.0  # exponential backoff: base^attempt (1,2,4,...)
 
+# Minimum spacing between the starts of two hosts (CDN politeness). A host whose
+# scrape already took longer than this proceeds immediately, so there is no per-device floor.
+MIN_HOST_INTERVAL_SEC = float(os.getenv('SCRAPE_MIN_INTERVAL_SEC', '1.0'))
+
 # ==== LOGGING ====
 logging.basicConfig(
     filename=LOG_FILE,
@@ -40,63 +49,23 @@ console = logging.StreamHandler(sys.stdout)
 console.setLevel(logging.INFO)
 console.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
 logging.getLogger("").addHandler(console)
+# warnings and errors also become structured events (pipeline/events.py)
+events.capture_logging()
 
 # ==== REGEX ====
 RE_REC_SUFFIX = re.compile(r"\(\s*rec+omm?ended\s*\)\s*$", re.IGNORECASE)
 RE_DESIG_SUFFIX = re.compile(r"\(\s*(MD|GD|ED|LD|DF|F|M)\s*\)\s*$", re.IGNORECASE)
 
-# Version normalization helpers
-RE_IOS_PAREN = re.compile(r"^(\d+)\.(\d+)\((\d+)\)([A-Za-z]+)?(\d+)?$")
-RE_IOS_DASH = re.compile(r"^(\d+)\.(\d+)\.(\d+)-([A-Za-z]+)(\d+)$")
-RE_IOS_DASH_SHORT = re.compile(r"^(\d+)\.(\d+)\.(\d+)([A-Za-z]+)(\d+)$")
-
-def to_ios_canonical(v: str) -> str:
-    """Convert common IOS forms like '15.0.2-SE11' or '15.2.7E9' to '15.0(2)SE11'/'15.2(7)E9'.
-    If already canonical, return as-is. Best-effort; returns input on unknowns.
-    """
-    s = (v or "").strip()
-    if not s:
-        return s
-    # already canonical
-    m = RE_IOS_PAREN.match(s)
-    if m:
-        return s
-    # dotted-dash: 15.0.2-SE11 -> 15.0(2)SE11
-    m = RE_IOS_DASH.match(s)
-    if m:
-        a,b,c,sfx,n = m.groups()
-        return f"{a}.{b}({c}){sfx}{n}"
-    # dotted with no dash: 15.2.7E9 -> 15.2(7)E9
-    m = RE_IOS_DASH_SHORT.match(s)
-    if m:
-        a,b,c,sfx,n = m.groups()
-        return f"{a}.{b}({c}){sfx}{n}"
-    return s
-
-def normalize_version_by_platform(v: str, platform: Optional[str]) -> str:
-    if not v:
-        return v
-    p = (platform or '').lower()
-    if p == 'ios' or p == 'iosxe' or p == 'ios-xe':
-        return to_ios_canonical(v)
-    # NX-OS and others: leave as-is (already standard like 10.3(3))
-    return v
+# Version normalization helpers (shared with check_cves_from_devices.py)
+from versions import normalize as normalize_version_by_platform  # noqa: E402
+import versions
+import scope as run_scope
 
 def load_json(path, default):
     if not os.path.exists(path):
         logging.warning(f"{path} not found. Using default.")
         return default
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        logging.warning(f"{path} is not valid JSON. Using default.")
-        return default
-
-def save_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-    logging.info(f"Saved updates to {path}")
+    return atomic_io.read_json(path, default)
 
 def parse_version_meta(raw: str) -> Tuple[str, bool, Optional[str]]:
     """
@@ -116,7 +85,7 @@ def parse_version_meta(raw: str) -> Tuple[str, bool, Optional[str]]:
 def decide_recommendation(current: str, latest: str, is_explicit_rec: bool, designation: Optional[str], platform: Optional[str] = None):
     """
     Return (recommendation_text, upgrade_bool).
-      1) same version
+      1) same version (or newer than recommended → no upgrade)
       2) explicit '(recommended)' → 'upgrade obligatory'
       3) DF → 'critical upgrade suggested'
       4) MD/GD → 'upgrade suggested'
@@ -128,8 +97,11 @@ def decide_recommendation(current: str, latest: str, is_explicit_rec: bool, desi
     cur = normalize_version_by_platform(current.strip(), platform)
     lat = normalize_version_by_platform(latest.strip(), platform)
 
-    if cur == lat:
+    if cur == lat or versions.compare(cur, lat, platform) == 0:
         return "same version", False
+    if versions.compare(cur, lat, platform) == 1:
+        # running something newer than the recommended release: never suggest a downgrade
+        return "newer than recommended", False
     if is_explicit_rec:
         return "upgrade obligatory", True
     if designation == "DF":
@@ -138,48 +110,120 @@ def decide_recommendation(current: str, latest: str, is_explicit_rec: bool, desi
         return "upgrade suggested", True
     return "upgrade optional", False
 
-def backoff_sleep(attempt: int, base: float = BACKOFF_BASE_SEC):
-    delay = min(base ** attempt, 30.0)
-    time.sleep(delay)
+# Jittered backoff; the download site shares one circuit breaker across both steps
+DOWNLOAD_ENDPOINT = "software.cisco.com"
+URL_POLICY = RetryPolicy(max_attempts=MAX_RETRIES_URL, base=BACKOFF_BASE_SEC)
+SCRAPE_POLICY = RetryPolicy(max_attempts=MAX_RETRIES_SCRAPE, base=BACKOFF_BASE_SEC)
 
 def get_url_with_retry(model_name: str) -> Optional[str]:
-    for attempt in range(1, MAX_RETRIES_URL + 1):
-        url = extract_url_for_model(model_name)
-        if url:
-            return url
-        logging.warning(f"[retry url] attempt {attempt}/{MAX_RETRIES_URL} failed for model '{model_name}'")
-        if attempt < MAX_RETRIES_URL:
-            backoff_sleep(attempt)
-    return None
+    """Resolve the download URL; raises CircuitOpenError when the CDN keeps blocking us."""
+    url = URL_POLICY.call(extract_url_for_model, model_name, endpoint=DOWNLOAD_ENDPOINT,
+                          label=f"url '{model_name}'")
+    if not url:
+        logging.warning(f"[retry url] all {MAX_RETRIES_URL} attempts failed for model '{model_name}'")
+    return url
 
 def scrape_with_retry(url: str) -> Optional[dict]:
-    for attempt in range(1, MAX_RETRIES_SCRAPE + 1):
-        info = scrape_latest_version(url)
-        if info:
-            return info
-        logging.warning(f"[retry scrape] attempt {attempt}/{MAX_RETRIES_SCRAPE} failed for url '{url}'")
-        if attempt < MAX_RETRIES_SCRAPE:
-            backoff_sleep(attempt)
-    return None
-
-def main():
+    """Scrape the latest version; raises CircuitOpenError when the CDN keeps blocking us."""
+    info = SCRAPE_POLICY.call(scrape_latest_version, url, endpoint=DOWNLOAD_ENDPOINT,
+                              label=f"scrape '{url}'")
+    if not info:
+        logging.warning(f"[retry scrape] all {MAX_RETRIES_SCRAPE} attempts failed for url '{url}'")
+    return info
+
+def process_host(dev: models.Device, pid_alias: dict, now_iso: str, pacer: Pacer,
+                 trains: Optional[dict] = None) -> models.Suggestion:
+    """Build the upgrade suggestion for one device (network work happens here).
+    trains: platform -> known release trains (versions.fleet_trains) for trains_behind."""
+    host, pid, platform = dev.host, dev.model, dev.platform
+    current = dev.version or ""
+    # every outcome carries the device's identity and EoL details (populated earlier by eol_details.py)
+    row = models.Suggestion(host, pid=pid, platform=platform, current_version=dev.version,
+                            checked_at=now_iso, eol=dev.eol)
+    if not pid:
+        logging.warning(f"Host {host}: 'model' (PID) missing, skipping.")
+        row.recommendation, row.notes = "missing pid", "device missing PID (model)"
+        return row
+
+    logging.info(f"Processing host={host} pid={pid} platform={platform or 'n/a'} current={current or 'n/a'}")
+
+    model_name = pid_alias.get(pid)
+    if not model_name:
+        logging.warning(f"Host {host}: No alias for PID {pid}.")
+        row.recommendation = row.notes = "missing alias"
+        return row
+    row.switch_name = models.intern(model_name)
+
+    # gentle pacing to reduce CDN suspicion (only sleeps if the previous host was quick)
+    pacer.wait()
+
+    # 1) Resolve URL using headless extractor from test01.py
+    try:
+        with run_metrics.span('resolve_url'):
+            url = get_url_with_retry(model_name)
+        url_note = "no url"
+    except CircuitOpenError as e:
+        logging.error(f"Host {host}: {e}; failing fast")
+        url, url_note = None, "circuit open"
+    if not url:
+        logging.error(f"Host {host}: Could not get URL for model {model_name}")
+        row.recommendation, row.notes = "no url", models.intern(url_note)
+        return row
+
+    # 2) Scrape latest version using headless scraper from test02.py
+    try:
+        with run_metrics.span('scrape'):
+            info = scrape_with_retry(url)
+        scrape_note = "scrape failed"
+    except CircuitOpenError as e:
+        logging.error(f"Host {host}: {e}; failing fast")
+        info, scrape_note = None, "circuit open"
+    if not info:
+        logging.error(f"Host {host}: Scrape failed for model {model_name}")
+        row.recommendation, row.notes, row.final_url = "scrape failed", models.intern(scrape_note), url
+        return row
+
+    raw_latest = (info.get("latest_version") or "").strip()
+    clean_latest, is_explicit_rec, designation = parse_version_meta(raw_latest)
+    logging.info(f"Host {host}: scraped='{raw_latest}' → clean='{clean_latest}', explicit={is_explicit_rec}, desig={designation}")
+
+    rec_text, rec_bool = decide_recommendation(current, clean_latest, is_explicit_rec, designation, platform)
+    behind = versions.trains_behind(current, clean_latest, platform, (trains or {}).get((platform or '').lower()))
+    logging.info(f"Host {host}: recommendation='{rec_text}' upgrade={rec_bool} trains_behind={behind}")
+
+    return models.Suggestion(
+        host, pid=pid, switch_name=model_name, platform=platform, current_version=dev.version,
+        recommended_version=clean_latest or None,
+        release_designation=designation,
+        explicit_recommendation=is_explicit_rec,
+        recommendation=rec_text,
+        upgrade_recommended=rec_bool,
+        version_position=versions.position(current, clean_latest, platform),
+        trains_behind=behind,
+        final_url=info.get("final_url") or url,
+        selected_label=info.get("selected_label"),
+        screenshot_file=info.get("screenshot_file"),
+        checked_at=now_iso,
+        scraped_version_raw=raw_latest or None,
+        alias_used=model_name,
+        eol=dev.eol,
+    )
+
+def main(sc=None):
     logging.info("=== Starting pipeline ===")
+    sc = sc or run_scope.from_env()
 
-    devices_map = load_json(DEVICES_JSON, {})          # dict keyed by hostname
     pid_alias   = load_json(PID_ALIAS_JSON, {})
-    out_list    = load_json(OUT_JSON, [])
 
-    if not isinstance(devices_map, dict):
-        logging.error(f"{DEVICES_JSON} must be a JSON object keyed by hostname.")
-        sys.exit(1)
     if not isinstance(pid_alias, dict):
         logging.error(f"{PID_ALIAS_JSON} must be a JSON object mapping PID -> model name.")
         sys.exit(1)
-    if not isinstance(out_list, list):
+    # checked up front so a bad file fails before the scrape; the rows are appended by streaming at the end
+    if os.path.exists(OUT_JSON) and not json_stream.is_array(OUT_JSON):
         logging.error(f"{OUT_JSON} must be a JSON list (append-only).")
         sys.exit(1)
 
-    appended = 0
+    rows = []   # models.Suggestion, serialized only as they are written out
     # Prefer externally provided batch timestamp (RUN_TS) so snapshots can correlate
     env_ts = os.getenv('RUN_TS')
     if env_ts:
@@ -187,138 +231,43 @@ def main():
     else:
         now_iso = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
-    for host, dev in devices_map.items():
-        pid       = (dev.get("model") or "").strip()
-        platform  = (dev.get("platform") or "").strip() or None
-        current   = (dev.get("version") or "").strip()
-        eol_details = dev.get('eol_details') or {}
-        # Extract new EoL fields (populated earlier by eol_details.py in orchestrator)
-        eos_date   = eol_details.get('end_of_sale_date')
-        eosup_date = eol_details.get('end_of_support_date')
-        series_rel = eol_details.get('series_release_date')
-        status_txt = eol_details.get('status')
-        if not pid:
-            logging.warning(f"Host {host}: 'model' (PID) missing, skipping.")
-            out_list.append({
-                "host": host, "pid": None, "switch_name": None,
-                "platform": platform, "current_version": current or None,
-                "recommended_version": None, "release_designation": None,
-                "explicit_recommendation": None, "recommendation": "missing pid",
-                "upgrade_recommended": None, "final_url": None,
-                "selected_label": None, "screenshot_file": None,
-                "checked_at": now_iso, "notes": "device missing PID (model)",
-                # EoL details mirrored into upgrade-suggestions for batch-level access
-                "end_of_sale_date": eos_date,
-                "end_of_support_date": eosup_date,
-                "series_release_date": series_rel,
-                "status": status_txt,
-            })
-            appended += 1
-            continue
-
-        logging.info(f"Processing host={host} pid={pid} platform={platform or 'n/a'} current={current or 'n/a'}")
-
-        model_name = pid_alias.get(pid)
-        if not model_name:
-            logging.warning(f"Host {host}: No alias for PID {pid}.")
-            out_list.append({
-                "host": host, "pid": pid, "switch_name": None,
-                "platform": platform, "current_version": current or None,
-                "recommended_version": None, "release_designation": None,
-                "explicit_recommendation": None, "recommendation": "missing alias",
-                "upgrade_recommended": None, "final_url": None,
-                "selected_label": None, "screenshot_file": None,
-                "checked_at": now_iso, "notes": "missing alias",
-                "end_of_sale_date": eos_date,
-                "end_of_support_date": eosup_date,
-                "series_release_date": series_rel,
-                "status": status_txt,
-            })
-            appended += 1
-            continue
-
-        # 1) Resolve URL using headless extractor from test01.py
-        url = get_url_with_retry(model_name)
-        if not url:
-            logging.error(f"Host {host}: Could not get URL for model {model_name}")
-            out_list.append({
-                "host": host, "pid": pid, "switch_name": model_name,
-                "platform": platform, "current_version": current or None,
-                "recommended_version": None, "release_designation": None,
-                "explicit_recommendation": None, "recommendation": "no url",
-                "upgrade_recommended": None, "final_url": None,
-                "selected_label": None, "screenshot_file": None,
-                "checked_at": now_iso, "notes": "no url",
-                "end_of_sale_date": eos_date,
-                "end_of_support_date": eosup_date,
-                "series_release_date": series_rel,
-                "status": status_txt,
-            })
-            appended += 1
-            continue
-
-        # 2) Scrape latest version using headless scraper from test02.py
-        info = scrape_with_retry(url)
-        if not info:
-            logging.error(f"Host {host}: Scrape failed for model {model_name}")
-            out_list.append({
-                "host": host, "pid": pid, "switch_name": model_name,
-                "platform": platform, "current_version": current or None,
-                "recommended_version": None, "release_designation": None,
-                "explicit_recommendation": None, "recommendation": "scrape failed",
-                "upgrade_recommended": None, "final_url": url,
-                "selected_label": None, "screenshot_file": None,
-                "checked_at": now_iso, "notes": "scrape failed",
-                "end_of_sale_date": eos_date,
-                "end_of_support_date": eosup_date,
-                "series_release_date": series_rel,
-                "status": status_txt,
-            })
-            appended += 1
-            continue
-
-        raw_latest = (info.get("latest_version") or "").strip()
-        clean_latest, is_explicit_rec, designation = parse_version_meta(raw_latest)
-        logging.info(f"Host {host}: scraped='{raw_latest}' → clean='{clean_latest}', explicit={is_explicit_rec}, desig={designation}")
-
-        rec_text, rec_bool = decide_recommendation(current, clean_latest, is_explicit_rec, designation, platform)
-        logging.info(f"Host {host}: recommendation='{rec_text}' upgrade={rec_bool}")
-
-        out_list.append({
-            "host": host,
-            "pid": pid,
-            "switch_name": model_name,
-            "platform": platform,
-            "current_version": current or None,
-            "recommended_version": clean_latest or None,
-            "release_designation": designation,
-            "explicit_recommendation": is_explicit_rec,
-            "recommendation": rec_text,
-            "upgrade_recommended": rec_bool,
-            "final_url": info.get("final_url") or url,
-            "selected_label": info.get("selected_label"),
-            "screenshot_file": info.get("screenshot_file"),
-            "checked_at": now_iso,
-            "scraped_version_raw": raw_latest or None,
-            # EoL details mirrored into upgrade-suggestions for batch-level access
-            "end_of_sale_date": eos_date,
-            "end_of_support_date": eosup_date,
-            "series_release_date": series_rel,
-            "status": status_txt,
-            "alias_used": model_name,
-        })
-        appended += 1
-
-        # gentle pacing to reduce CDN suspicion
-        time.sleep(1.0)
-
-    if appended:
-        save_json(OUT_JSON, out_list)
-        logging.info(f"Appended {appended} new entries to {OUT_JSON}. Total entries: {len(out_list)}")
+    pacer = Pacer(MIN_HOST_INTERVAL_SEC)
+    # trains come from the whole fleet so trains_behind means the same in partial runs
+    trains = versions.fleet_trains(r for _, r in device_registry.iter_records(fields=('platform', 'version')))
+    selected = device_registry.scope_hosts(sc)
+    if not sc.whole:
+        logging.info(f"Scope {sc.describe()}: {len(selected)} of {device_registry.count()} devices")
+    events.plan(len(selected))
+    with run_metrics.span('stage'):
+        for host, rec in device_registry.iter_records(selected, fields=('model', 'platform', 'version', 'eol_details')):
+            with run_metrics.host_scope(host), run_metrics.span('host') as sp, events.host(host) as ev:
+                row = process_host(models.Device.from_record(host, rec), pid_alias, now_iso, pacer, trains)
+                if row.recommended_version:
+                    sp['outcome'] = ev['outcome'] = 'ok'
+                elif row.recommendation in ("missing pid", "missing alias"):
+                    sp['outcome'] = ev['outcome'] = 'skipped'
+                else:
+                    sp['outcome'] = ev['outcome'] = row.notes or 'failed'
+            rows.append(row)
+
+    run_metrics.record_counters('upstream', RETRY_METRICS.snapshot())
+
+    logging.info(f"Upstream retry metrics: {RETRY_METRICS.summary_line()}")
+    if rows:
+        try:
+            total = json_stream.append_array(OUT_JSON, (r.to_dict() for r in rows))
+        except ValueError as e:
+            logging.error(f"{OUT_JSON} is not a valid JSON list ({e}); {len(rows)} new entries not saved.")
+            sys.exit(1)
+        logging.info(f"Saved updates to {OUT_JSON}")
+        logging.info(f"Appended {len(rows)} new entries to {OUT_JSON}. Total entries: {total}")
     else:
         logging.info("No new entries appended.")
 
     logging.info("=== Pipeline finished ===")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    ap = argparse.ArgumentParser(description='Recommended-version pipeline over the device registry')
+    run_scope.add_arguments(ap)
+    main(run_scope.from_args(ap.parse_args()))
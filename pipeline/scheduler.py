@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""Recurring stage jobs: cron schedules with jitter, freshness and CDN spacing.
+
+Each schedule queues a job (jobs.py) when its cron expression fires:
+
+  {"name": "cves", "mode": "cves", "cron": "0 * * * *", "jitter": 600, "fresh": 1800}
+
+  cron    5 fields (minute hour day-of-month month day-of-week; *, a-b, */n, a,b,
+          mon..sun, jan..dec) or @hourly/@daily/@weekly/@monthly, server local time
+  jitter  seconds added to each occurrence (stable per occurrence), so schedules
+          sharing a cron expression do not start together
+  fresh   skip the occurrence if a whole-fleet job ran this stage successfully that
+          recently (e.g. a full run an hour ago covers the hourly CVE check)
+  cdn     the stage scrapes Cisco's sites (default for eol/versions): it is postponed while another cdn job
+          is queued or running, and until SCHEDULE_CDN_GAP_SEC after the last one started
+  scope   optional host/group/PID selector (scope.py)
+  batch   also write a history batch after the stage (default false: the stage only
+          refreshes its outputs, and batches and their diffs stay one per full run)
+
+Nothing is scheduled unless a scheduler runs: the dashboard embeds one only
+with DASHBOARD_SCHEDULER=1. Defaults: CVEs hourly, versions daily, EoL weekly.
+data/schedules.json (a list of schedules, "enabled": false to turn one off)
+replaces them. State (next fire time, last outcome) is kept in jobs.db, and
+each tick runs in one transaction, so any number of dashboard processes can
+run the scheduler without queueing an occurrence twice.
+
+  python pipeline/scheduler.py            # schedules with their next fire times
+  python pipeline/scheduler.py --tick     # fire what is due now
+"""
+from __future__ import annotations
+import os, sys, json, time, hashlib, threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+import jobs
+import scope as run_scope
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+SCHEDULES_JSON = os.path.join(DATA_DIR, 'schedules.json')
+
+CDN_GAP_SEC = float(os.getenv('SCHEDULE_CDN_GAP_SEC', '1800'))
+TICK_SEC = 30.0
+POSTPONE_SEC = 300.0   # retry interval for an occurrence held back by CDN spacing
+CDN_STAGES = {'eol', 'versions'}   # stages that scrape Cisco's web sites
+
+DEFAULT_SCHEDULES: List[Dict[str, Any]] = [
+    {'name': 'cves', 'mode': 'cves', 'cron': '@hourly', 'jitter': 600, 'fresh': 1800},
+    {'name': 'versions', 'mode': 'versions', 'cron': '30 2 * * *', 'jitter': 3600, 'fresh': 20 * 3600},
+    {'name': 'eol', 'mode': 'eol', 'cron': '0 4 * * sun', 'jitter': 3600, 'fresh': 6 * 86400},
+]
+
+_ALIASES = {'@hourly': '0 * * * *', '@daily': '0 0 * * *', '@weekly': '0 0 * * 0', '@monthly': '0 0 1 * *'}
+_NAMES = {
+    3: {m: i + 1 for i, m in enumerate(('jan', 'feb', 'mar', 'apr', 'may', 'jun',
+                                        'jul', 'aug', 'sep', 'oct', 'nov', 'dec'))},
+    4: {d: i for i, d in enumerate(('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'))},
+}
+_BOUNDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+class CronError(ValueError):
+    pass
+
+
+class Cron:
+    """A parsed 5-field cron expression."""
+
+    def __init__(self, expr: str):
+        self.expr = expr
+        fields = _ALIASES.get(expr.strip().lower(), expr).split()
+        if len(fields) != 5:
+            raise CronError(f"'{expr}': expected 5 fields")
+        self.minutes, self.hours, self.days, self.months, dows = (
+            self._field(f, i) for i, f in enumerate(fields))
+        self.dows = {d % 7 for d in dows}   # 7 is Sunday too
+        # standard cron: when both day fields are restricted, either may match
+        self._dom_any, self._dow_any = fields[2].startswith('*'), fields[4].startswith('*')
+
+    @staticmethod
+    def _value(tok: str, idx: int) -> int:
+        tok = tok.lower()
+        if tok in _NAMES.get(idx, {}):
+            return _NAMES[idx][tok]
+        try:
+            return int(tok)
+        except ValueError:
+            raise CronError(f"bad value '{tok}'")
+
+    def _field(self, text: str, idx: int) -> Set[int]:
+        lo, hi = _BOUNDS[idx]
+        out: Set[int] = set()
+        for part in text.split(','):
+            rng, _, step = part.partition('/')
+            if rng == '*':
+                a, b = lo, hi
+            elif '-' in rng:
+                a, b = (self._value(x, idx) for x in rng.split('-', 1))
+            else:
+                a = b = self._value(rng, idx)
+                if step:
+                    b = hi
+            n = int(step) if step else 1
+            if not (lo <= a <= b <= hi) or n < 1:
+                raise CronError(f"'{part}' out of range {lo}-{hi}")
+            out.update(range(a, b + 1, n))
+        return out
+
+    def _day_ok(self, dt: datetime) -> bool:
+        dom = dt.day in self.days
+        dow = (dt.weekday() + 1) % 7 in self.dows
+        if self._dom_any or self._dow_any:
+            return dom and dow
+        return dom or dow
+
+    def next_after(self, dt: datetime) -> datetime:
+        """First matching minute strictly after dt."""
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_ok(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise CronError(f"'{self.expr}' never fires")
+
+
+class Schedule:
+    def __init__(self, spec: Dict[str, Any]):
+        self.name = str(spec['name'])
+        self.mode = spec.get('mode') or self.name
+        if self.mode not in jobs.MODES:
+            raise CronError(f"schedule {self.name}: unknown mode '{self.mode}'")
+        self.cron = Cron(spec['cron'])
+        self.jitter = float(spec.get('jitter') or 0)
+        self.fresh = float(spec.get('fresh') or 0)
+        self.cdn = bool(spec.get('cdn', _is_cdn(self.mode)))
+        self.scope = run_scope.normalize(spec.get('scope'))
+        self.enabled = spec.get('enabled', True) is not False
+        self.batch = spec.get('batch') is True
+        self.spec = json.dumps({k: spec.get(k) for k in ('mode', 'cron', 'jitter', 'scope')}, sort_keys=True)
+
+    def _offset(self, occurrence: datetime) -> float:
+        if not self.jitter:
+            return 0.0
+        h = hashlib.sha1(f'{self.name}|{occurrence.isoformat()}'.encode()).digest()
+        return int.from_bytes(h[:4], 'big') / 2 ** 32 * self.jitter
+
+    def fire_at(self, after: float) -> float:
+        """Next fire time (epoch) after `after`, jitter included."""
+        occ = self.cron.next_after(datetime.fromtimestamp(after - self.jitter))
+        while occ.timestamp() + self._offset(occ) <= after:
+            occ = self.cron.next_after(occ)
+        return occ.timestamp() + self._offset(occ)
+
+    def stages(self):
+        return jobs.MODE_STAGES[self.mode]
+
+
+def load() -> List[Schedule]:
+    specs = DEFAULT_SCHEDULES
+    if os.path.exists(SCHEDULES_JSON):
+        with open(SCHEDULES_JSON, 'r', encoding='utf-8') as f:
+            specs = json.load(f)
+    return [Schedule(s) for s in specs]
+
+
+def _decide(sc: Schedule, now: float, active: List[Dict[str, Any]], last_cdn_start: Optional[float]) -> Optional[str]:
+    """Why a due occurrence should not be queued now: 'skip: ...' (dropped) or 'postpone: ...' (retried)."""
+    if any(j['mode'] == sc.mode and j['scope'] == sc.scope for j in active):
+        return 'skip: already queued'
+    if sc.fresh:
+        done = [jobs.last_success(st) for st in sc.stages()]
+        if all(d and now - d < sc.fresh for d in done):
+            return f'skip: fresh (ran {int(now - min(done))}s ago)'
+    if sc.cdn:
+        if any(_is_cdn(j['mode']) for j in active):
+            return 'postpone: another CDN job is queued or running'
+        if last_cdn_start and now - last_cdn_start < CDN_GAP_SEC:
+            return f'postpone: CDN gap ({int(CDN_GAP_SEC - (now - last_cdn_start))}s left)'
+    return None
+
+
+def _is_cdn(mode: str) -> bool:
+    return bool(CDN_STAGES & set(jobs.MODE_STAGES.get(mode, ())))
+
+
+def tick(now: Optional[float] = None, schedules: Optional[List[Schedule]] = None) -> List[Dict[str, Any]]:
+    """Queue the due occurrences; returns what was decided for each due schedule."""
+    now = time.time() if now is None else now
+    schedules = load() if schedules is None else schedules
+    out = []
+    with jobs.connect() as db:
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            state = {r['name']: dict(r) for r in db.execute('SELECT * FROM schedules')}
+            active = jobs.list_jobs(jobs.ACTIVE, limit=1000, db=db)
+            cdn_modes = [m for m in jobs.MODES if _is_cdn(m)]
+            last_cdn_start = db.execute(f"SELECT MAX(started_at) FROM jobs WHERE mode IN "
+                                        f"({','.join('?' * len(cdn_modes))})", cdn_modes).fetchone()[0]
+            # longest-overdue first, so a postponed CDN occurrence is not overtaken by the next one due
+            for sc in sorted(schedules, key=lambda s: (state.get(s.name) or {}).get('next_at') or now):
+                if not sc.enabled:
+                    continue
+                st = state.get(sc.name)
+                if st is None or st['spec'] != sc.spec or st['next_at'] is None:
+                    db.execute('INSERT OR REPLACE INTO schedules (name, spec, next_at, last_at, last_job_id, last_outcome) '
+                               'VALUES (?, ?, ?, ?, ?, ?)', (sc.name, sc.spec, sc.fire_at(now),
+                                                             st and st['last_at'], st and st['last_job_id'],
+                                                             st and st['last_outcome']))
+                    continue
+                if now < st['next_at']:
+                    continue
+                reason = _decide(sc, now, active, last_cdn_start)
+                job_id = None
+                if reason and reason.startswith('postpone'):
+                    next_at = now + POSTPONE_SEC
+                elif reason:
+                    next_at = sc.fire_at(now)
+                else:
+                    job = jobs.enqueue(sc.mode, sc.scope, requested_by=f'scheduler:{sc.name}', db=db,
+                                       record_batch=sc.batch)
+                    job_id = job['id']
+                    active.append(job)
+                    if sc.cdn:
+                        last_cdn_start = now   # the next CDN schedule keeps its distance
+                    reason = f'queued job {job_id}'
+                    next_at = sc.fire_at(now)
+                db.execute('UPDATE schedules SET next_at = ?, last_at = ?, last_job_id = COALESCE(?, last_job_id), '
+                           'last_outcome = ? WHERE name = ?', (next_at, now, job_id, reason, sc.name))
+                out.append({'name': sc.name, 'outcome': reason, 'next_at': next_at})
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+    for d in out:
+        print(f"[scheduler] {d['name']}: {d['outcome']}")
+    return out
+
+
+def status(now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Schedules with their stored state (next fire time, last outcome)."""
+    now = time.time() if now is None else now
+    with jobs.connect() as db:
+        state = {r['name']: dict(r) for r in db.execute('SELECT * FROM schedules')}
+    out = []
+    for sc in load():
+        st = state.get(sc.name) or {}
+        next_at = st.get('next_at') if st.get('spec') == sc.spec else None
+        out.append({'name': sc.name, 'mode': sc.mode, 'cron': sc.cron.expr, 'jitter': sc.jitter, 'fresh': sc.fresh,
+                    'cdn': sc.cdn, 'scope': sc.scope, 'batch': sc.batch, 'enabled': sc.enabled,
+                    'next_at': (next_at or sc.fire_at(now)) if sc.enabled else None,
+                    'last_at': st.get('last_at'), 'last_job_id': st.get('last_job_id'),
+                    'last_outcome': st.get('last_outcome')})
+    return out
+
+
+class Scheduler:
+    """tick() every TICK_SEC in a daemon thread."""
+
+    def __init__(self, tick_sec: float = TICK_SEC, on_queued=None):
+        self.tick_sec = tick_sec
+        self.on_queued = on_queued
+        self._stop = threading.Event()
+
+    def start(self) -> 'Scheduler':
+        threading.Thread(target=self.run, name='scheduler', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if any(d['outcome'].startswith('queued') for d in tick()) and self.on_queued:
+                    self.on_queued()
+            except Exception as e:
+                print(f'[scheduler] {e}', file=sys.stderr)
+            self._stop.wait(self.tick_sec)
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Recurring stage jobs')
+    ap.add_argument('--tick', action='store_true', help='Queue the schedules that are due now')
+    args = ap.parse_args()
+    if args.tick:
+        tick()
+    for s in status():
+        nxt = datetime.fromtimestamp(s['next_at']).strftime('%Y-%m-%d %H:%M:%S') if s['next_at'] else 'disabled'
+        print(f"{s['name']:<10} {s['mode']:<10} {s['cron']:<14} next {nxt}  last: {s['last_outcome'] or '-'}")
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""Host/group/PID selectors for partial runs.
+
+A scope selects hosts by inventory group, host name or PID (the device model
+in the device registry); a host is in scope when any selector matches it. No scope
+means the whole fleet. The job queue passes it to the orchestrator as RUN_SCOPE
+(JSON), and every stage reads it from there or from its own flags:
+
+  --hosts sw01,sw02 --groups ios --pids C9300-48P
+
+Stages only touch hosts in scope. history_writer.py turns a scoped run into a
+partial batch: hosts outside the scope are carried forward from the previous
+batch.
+
+  python pipeline/scope.py --limit-for ios    # ansible --limit pattern for the playbook's group
+"""
+from __future__ import annotations
+import os, sys, json
+from typing import Any, Dict, List, Optional, Set
+
+import device_registry
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANSIBLE_INVENTORY = os.path.join(BASE_DIR, 'ansible', 'inventory.ini')
+
+ENV = 'RUN_SCOPE'
+KEYS = ('groups', 'hosts', 'pids')
+
+Spec = Dict[str, List[str]]
+
+
+class ScopeError(ValueError):
+    pass
+
+
+def normalize(spec: Any) -> Optional[Spec]:
+    """{'groups': [...], 'hosts': [...], 'pids': [...]} with sorted unique names; None for the whole fleet."""
+    if spec in (None, '', {}):
+        return None
+    if isinstance(spec, str):
+        try:
+            spec = json.loads(spec)
+        except ValueError:
+            raise ScopeError('scope must be JSON')
+    if not isinstance(spec, dict):
+        raise ScopeError("scope must be an object like {'groups': [...], 'hosts': [...], 'pids': [...]}")
+    unknown = set(spec) - set(KEYS)
+    if unknown:
+        raise ScopeError(f"unknown scope keys: {', '.join(sorted(unknown))}")
+    out = {}
+    for k in KEYS:
+        v = spec.get(k) or []
+        if isinstance(v, str):
+            v = v.split(',')
+        if not isinstance(v, list):
+            raise ScopeError(f'scope.{k} must be a list of names')
+        names = sorted({str(x).strip() for x in v if str(x).strip()})
+        if names:
+            out[k] = names
+    return out or None
+
+
+def inventory_groups(path: str = ANSIBLE_INVENTORY) -> Dict[str, Set[str]]:
+    """group -> hosts from the Ansible INI inventory."""
+    groups: Dict[str, Set[str]] = {}
+    current = None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for raw in f:
+                line = raw.strip()
+                if not line or line[0] in '#;':
+                    continue
+                if line.startswith('[') and line.endswith(']'):
+                    current = line[1:-1].strip()
+                    groups.setdefault(current, set())
+                elif current:
+                    groups[current].add(line.split()[0])
+    except OSError:
+        pass
+    return groups
+
+
+def load_devices(path: Optional[str] = None) -> Dict[str, Any]:
+    """{host: {'model': ...}} from a device registry (default: the data directory's), enough to match PIDs."""
+    return device_registry.load(fields=('model',), path=path)
+
+
+class Scope:
+    """A normalized selector plus what it needs to resolve groups (inventory) and PIDs (device models)."""
+
+    def __init__(self, spec: Any = None, groups: Optional[Dict[str, Set[str]]] = None):
+        self.spec = normalize(spec)
+        self._groups = groups
+        self._named: Optional[Set[str]] = None
+
+    @property
+    def whole(self) -> bool:
+        return self.spec is None
+
+    def get(self, key: str) -> List[str]:
+        return (self.spec or {}).get(key) or []
+
+    @property
+    def groups(self) -> Dict[str, Set[str]]:
+        if self._groups is None:
+            self._groups = inventory_groups()
+        return self._groups
+
+    def named_hosts(self) -> Set[str]:
+        """Hosts selected by name or group (PIDs need the device records)."""
+        if self._named is None:
+            hosts = set(self.get('hosts'))
+            for g in self.get('groups'):
+                hosts |= self.groups.get(g, set())
+            self._named = hosts
+        return self._named
+
+    def matches(self, host: str, rec: Optional[Dict[str, Any]] = None) -> bool:
+        if self.spec is None or host in self.named_hosts():
+            return True
+        pids = self.get('pids')
+        return bool(pids) and isinstance(rec, dict) and (rec.get('model') or '').strip() in pids
+
+    def filter(self, devices: Dict[str, Any]) -> Dict[str, Any]:
+        """The device records in scope (all of them without a scope)."""
+        if self.spec is None:
+            return devices
+        return {h: r for h, r in devices.items() if self.matches(h, r)}
+
+    def hosts(self, devices: Optional[Dict[str, Any]] = None) -> Optional[Set[str]]:
+        """Every host in scope (None for the whole fleet); PIDs are resolved against the device registry."""
+        if self.spec is None:
+            return None
+        out = set(self.named_hosts())
+        if self.get('pids'):
+            out |= set(self.filter(devices if devices is not None else load_devices()))
+        return out
+
+    def limit_for(self, group: str, devices: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """ansible --limit pattern for a playbook targeting group: '' for no limit, None if nothing in scope."""
+        if self.spec is None or group in self.get('groups'):
+            return ''
+        members = self.groups.get(group, set())
+        hosts = sorted(h for h in self.hosts(devices) if h in members)
+        return ':'.join(hosts) if hosts else None
+
+    def conflicts(self, other: 'Scope', devices: Optional[Dict[str, Any]] = None) -> bool:
+        """Whether two runs could touch the same host."""
+        if self.spec is None or other.spec is None:
+            return True
+        if set(self.get('groups')) & set(other.get('groups')):
+            return True
+        return bool(self.hosts(devices) & other.hosts(devices))
+
+    def describe(self) -> str:
+        if self.spec is None:
+            return 'all hosts'
+        return ' '.join(f"{k}={','.join(v)}" for k, v in self.spec.items())
+
+
+def from_env(groups: Optional[Dict[str, Set[str]]] = None) -> Scope:
+    return Scope(os.getenv(ENV), groups)
+
+
+def add_arguments(ap) -> None:
+    g = ap.add_argument_group('scope', f'Limit the run to some hosts (default: ${ENV}, else all hosts)')
+    g.add_argument('--hosts', help='Comma-separated host names')
+    g.add_argument('--groups', help='Comma-separated inventory groups')
+    g.add_argument('--pids', help='Comma-separated PIDs (device models)')
+
+
+def from_args(args) -> Scope:
+    """Scope from add_arguments() flags when any is given, else from RUN_SCOPE."""
+    spec = {k: getattr(args, k, None) for k in KEYS if getattr(args, k, None)}
+    return Scope(spec) if spec else from_env()
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Resolve the run scope')
+    ap.add_argument('--limit-for', metavar='GROUP',
+                    help='Print the ansible --limit pattern for a playbook on GROUP; exit 3 when no host is in scope')
+    add_arguments(ap)
+    args = ap.parse_args()
+    try:
+        sc = from_args(args)
+    except ScopeError as e:
+        ap.error(str(e))
+    if args.limit_for:
+        pattern = sc.limit_for(args.limit_for)
+        if pattern is None:
+            sys.exit(3)
+        print(pattern)
+    else:
+        hosts = sc.hosts()
+        print(json.dumps({'scope': sc.spec, 'hosts': sorted(hosts) if hosts is not None else None}, indent=2))
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Inverted index over device snapshots, for fleet-wide search across history.
+
+history_writer.py appends one line per batch to data/history/search/postings.jsonl:
+{"batch_ts": ..., "fields": {field: {term: [host, ...]}}}. Readers load it
+once into memory (then only lines appended since) and answer term/prefix
+queries without touching the snapshots.
+
+Query syntax (clauses are ANDed per host and batch):
+  version:17.9.4          exact term in a field
+  serial:FOC21*           prefix
+  host:sw01 severity:critical
+  C9300                   bare term: any field
+
+  python pipeline/search_index.py --rebuild
+  python pipeline/search_index.py 'version:17.9.4'
+"""
+from __future__ import annotations
+import os, sys, json, bisect, threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import timeline_index
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+HIST_DIR = os.path.join(DATA_DIR, 'history')
+SEARCH_DIR = os.path.join(HIST_DIR, 'search')
+POSTINGS_JSONL = os.path.join(SEARCH_DIR, 'postings.jsonl')
+DEVICES_SNAPSHOT = os.path.join(HIST_DIR, 'devices_snapshot.jsonl')
+CVES_SNAPSHOT = os.path.join(HIST_DIR, 'cves_snapshot.jsonl')
+
+# searchable field -> snapshot row keys it is taken from
+FIELDS = {
+    'host': ('host',),
+    'alias': ('alias_name',),
+    'model': ('model',),
+    'serial': ('serial_number',),
+    'version': ('current_version', 'platform_version'),
+    'recommended': ('recommended_version',),
+    'recommendation': ('recommendation',),
+}
+# plus 'cve' (advisory ids, any severity) and 'severity' (severities with at least one CVE)
+ALL_FIELDS = tuple(FIELDS) + ('cve', 'severity')
+
+
+class QueryError(ValueError):
+    pass
+
+
+def norm(v: Any) -> str:
+    return str(v).strip().lower()
+
+
+class Postings:
+    """One batch's {field: {term: [hosts]}}, fed one snapshot row (and its host's CVE map) at a time."""
+
+    def __init__(self) -> None:
+        self.terms: Dict[str, Dict[str, Set[str]]] = {f: {} for f in ALL_FIELDS}
+
+    def add(self, row: Dict[str, Any], cves: Optional[Dict[str, Any]]) -> None:
+        host = row.get('host')
+        if not host:
+            return
+        out = self.terms
+        for field, keys in FIELDS.items():
+            for k in keys:
+                if row.get(k) not in (None, ''):
+                    out[field].setdefault(norm(row[k]), set()).add(host)
+        for sev, n in (row.get('cve_counts') or {}).items():
+            if n:
+                out['severity'].setdefault(norm(sev), set()).add(host)
+        for sev, items in (cves or {}).items():
+            for item in items or []:
+                cid = item.get('id') if isinstance(item, dict) else item
+                if cid:
+                    out['cve'].setdefault(norm(cid), set()).add(host)
+
+    def fields(self) -> Dict[str, Dict[str, List[str]]]:
+        return {f: {t: sorted(h) for t, h in terms.items()} for f, terms in self.terms.items() if terms}
+
+
+def postings(rows: Iterable[Dict[str, Any]], cves_by_host: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, List[str]]]:
+    """{field: {term: [hosts]}} for one batch of snapshot rows and host -> {severity: [cve, ...]}."""
+    p = Postings()
+    for row in rows:
+        p.add(row, cves_by_host.get(row.get('host')))
+    return p.fields()
+
+
+def append(batch_ts: str, fields: Dict[str, Dict[str, List[str]]]) -> None:
+    """Record one batch's postings (postings() or Postings.fields())."""
+    os.makedirs(SEARCH_DIR, exist_ok=True)
+    with open(POSTINGS_JSONL, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'batch_ts': batch_ts, 'fields': fields}, ensure_ascii=False) + '\n')
+
+
+def exists() -> bool:
+    return os.path.exists(POSTINGS_JSONL)
+
+
+def _by_batch(path: str) -> Dict[str, List[Dict[str, Any]]]:
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except Exception:
+                    continue
+                if isinstance(row, dict) and row.get('batch_ts'):
+                    out.setdefault(row['batch_ts'], []).append(row)
+    return out
+
+
+def rebuild() -> int:
+    """Rewrite postings.jsonl from devices_snapshot.jsonl + cves_snapshot.jsonl."""
+    devices, cves = _by_batch(DEVICES_SNAPSHOT), _by_batch(CVES_SNAPSHOT)
+    os.makedirs(SEARCH_DIR, exist_ok=True)
+    tmp = POSTINGS_JSONL + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        for ts in sorted(devices):
+            cmap = {r['host']: r.get('cves') or {} for r in cves.get(ts, []) if r.get('host')}
+            f.write(json.dumps({'batch_ts': ts, 'fields': postings(devices[ts], cmap)}, ensure_ascii=False) + '\n')
+    os.replace(tmp, POSTINGS_JSONL)
+    return len(devices)
+
+
+def parse(q: str) -> List[Tuple[Optional[str], str, bool]]:
+    """'field:term*' clauses -> [(field or None, term, is_prefix)]."""
+    clauses = []
+    for tok in (q or '').split():
+        field, sep, term = tok.partition(':')
+        if not sep:
+            field, term = None, tok
+        elif field.lower() not in ALL_FIELDS:
+            raise QueryError(f"unknown field '{field}' (one of: {', '.join(ALL_FIELDS)})")
+        prefix = term.endswith('*')
+        term = norm(term.rstrip('*'))
+        if not term:
+            raise QueryError(f"empty term in '{tok}'")
+        clauses.append((field.lower() if field else None, term, prefix))
+    if not clauses:
+        raise QueryError('empty query')
+    return clauses
+
+
+class Index:
+    """In-memory view of postings.jsonl: field -> term -> host -> batches (sorted)."""
+
+    def __init__(self, path: str = POSTINGS_JSONL):
+        self.path = path
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.offset = 0
+        self.inode = None
+        self.terms: Dict[str, Dict[str, Dict[str, List[str]]]] = {f: {} for f in ALL_FIELDS}
+        self._sorted: Dict[str, List[str]] = {}
+        self.batches: List[str] = []
+
+    def refresh(self) -> None:
+        """Load lines appended since the last call (all of them after a rebuild)."""
+        try:
+            st = os.stat(self.path)
+            size, inode = st.st_size, st.st_ino
+        except OSError:
+            size, inode = 0, None
+        with self._lock:
+            if size < self.offset or inode != self.inode:   # rebuilt (replaced) or truncated
+                self._reset()
+                self.inode = inode
+            if size == self.offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    self.offset += len(line)
+                    try:
+                        rec = json.loads(line)
+                    except Exception:
+                        continue
+                    ts = rec.get('batch_ts')
+                    if not ts:
+                        continue
+                    ts = sys.intern(ts)
+                    self.batches.append(ts)
+                    for field, terms in (rec.get('fields') or {}).items():
+                        bucket = self.terms.setdefault(field, {})
+                        for term, hosts in terms.items():
+                            per_host = bucket.setdefault(term, {})
+                            for h in hosts:
+                                per_host.setdefault(h, []).append(ts)
+                        self._sorted.pop(field, None)
+
+    def _matching_terms(self, field: str, term: str, prefix: bool) -> List[str]:
+        bucket = self.terms.get(field) or {}
+        if not prefix:
+            return [term] if term in bucket else []
+        keys = self._sorted.get(field)
+        if keys is None:
+            keys = self._sorted[field] = sorted(bucket)
+        i = bisect.bisect_left(keys, term)
+        out = []
+        while i < len(keys) and keys[i].startswith(term):
+            out.append(keys[i])
+            i += 1
+        return out
+
+    def _clause(self, field: Optional[str], term: str, prefix: bool,
+                since: Optional[str], until: Optional[str]) -> Dict[str, Set[str]]:
+        """host -> batches matching one clause inside the window."""
+        out: Dict[str, Set[str]] = {}
+        for f in ([field] if field else ALL_FIELDS):
+            for t in self._matching_terms(f, term, prefix):
+                for host, stamps in self.terms[f][t].items():
+                    hit = {ts for ts in stamps if timeline_index.in_window(ts, since, until)}
+                    if hit:
+                        out.setdefault(host, set()).update(hit)
+        return out
+
+    def search(self, q: str, since: Optional[str] = None, until: Optional[str] = None,
+               limit: int = 100) -> Dict[str, Any]:
+        clauses = parse(q)
+        self.refresh()
+        with self._lock:
+            matched: Optional[Dict[str, Set[str]]] = None
+            for clause in clauses:
+                hits = self._clause(*clause, since, until)
+                if matched is None:
+                    matched = hits
+                else:
+                    matched = {h: matched[h] & b for h, b in hits.items() if h in matched and matched[h] & b}
+                if not matched:
+                    break
+        results = []
+        for host in sorted(matched or {}):
+            stamps = sorted(matched[host])
+            results.append({'host': host, 'first_seen': stamps[0], 'last_seen': stamps[-1],
+                            'batches': len(stamps)})
+        return {'query': q, 'since': since, 'until': until, 'total': len(results),
+                'results': results[:limit] if limit else results}
+
+
+_default: Optional[Index] = None
+
+
+def default() -> Index:
+    global _default
+    if _default is None or _default.path != POSTINGS_JSONL:
+        _default = Index(POSTINGS_JSONL)
+    return _default
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Fleet-wide search index over history')
+    ap.add_argument('query', nargs='?')
+    ap.add_argument('--rebuild', action='store_true', help='Rebuild search/postings.jsonl from the snapshots')
+    ap.add_argument('--since')
+    ap.add_argument('--until')
+    args = ap.parse_args()
+    if args.rebuild:
+        print(f"[search] indexed {rebuild()} batches into {POSTINGS_JSONL}")
+    elif args.query:
+        print(json.dumps(default().search(args.query, args.since, args.until, limit=0), indent=2))
+    else:
+        ap.print_help()
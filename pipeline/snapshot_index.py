@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Byte ranges of each batch inside the append-only snapshot files.
+
+history_writer.py appends all rows of a batch contiguously, so a batch is one
+[start, end) slice of devices_snapshot.jsonl / cves_snapshot.jsonl. The writer
+records those slices in data/history/snapshot_offsets.jsonl; history written
+before that is indexed by one scan, then only the newly appended tail is read.
+Readers seek straight to a batch and get its lines as raw bytes (or one
+parsed row at a time), without parsing the rest of the file.
+
+  python pipeline/snapshot_index.py --rebuild     # rewrite snapshot_offsets.jsonl from the snapshots
+"""
+from __future__ import annotations
+import os, json, threading
+from typing import Dict, Iterator, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+HIST_DIR = os.path.join(DATA_DIR, 'history')
+OFFSETS_JSONL = os.path.join(HIST_DIR, 'snapshot_offsets.jsonl')
+DEVICES_SNAPSHOT = os.path.join(HIST_DIR, 'devices_snapshot.jsonl')
+CVES_SNAPSHOT = os.path.join(HIST_DIR, 'cves_snapshot.jsonl')
+
+CHUNK_BYTES = 1 << 20
+
+Range = Tuple[int, int, int]   # start, end, rows
+
+_lock = threading.Lock()
+# path -> {'size': indexed up to, 'ranges': {ts: Range}, 'split': {ts whose rows are not contiguous}}
+_cache: Dict[str, Dict] = {}
+
+
+def record(path: str, ts: str, start: int, end: int, rows: int) -> None:
+    """Called by the writer once a batch's rows are appended to path."""
+    with open(OFFSETS_JSONL, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'file': os.path.basename(path), 'batch_ts': ts,
+                            'start': start, 'end': end, 'rows': rows}) + '\n')
+
+
+def _recorded(path: str) -> Dict[str, Range]:
+    out: Dict[str, Range] = {}
+    name = os.path.basename(path)
+    if not os.path.exists(OFFSETS_JSONL):
+        return out
+    with open(OFFSETS_JSONL, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                r = json.loads(line)
+            except Exception:
+                continue
+            if r.get('file') == name and r.get('batch_ts'):
+                out[r['batch_ts']] = (int(r['start']), int(r['end']), int(r.get('rows') or 0))
+    return out
+
+
+def _scan(path: str, start: int, stop: int, ranges: Dict[str, Range], split: set) -> int:
+    """Index complete lines in [start, stop); returns the offset indexed up to."""
+    cur, cur_start, rows, pos = None, start, 0, start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for line in f:
+            if not line.endswith(b'\n') or pos + len(line) > stop:
+                break   # mid-line (writer still appending) or the next recorded range
+            try:
+                ts = json.loads(line).get('batch_ts')
+            except Exception:
+                ts = None
+            if ts != cur:
+                if cur is not None:
+                    _close(ranges, split, cur, cur_start, pos, rows)
+                cur, cur_start, rows = ts, pos, 0
+            rows += 1
+            pos += len(line)
+    if cur is not None:
+        _close(ranges, split, cur, cur_start, pos, rows)
+    return pos
+
+
+def _close(ranges: Dict[str, Range], split: set, ts: str, start: int, end: int, rows: int) -> None:
+    if ts in ranges and ranges[ts][1] != start:
+        split.add(ts)
+    elif ts in ranges:
+        ranges[ts] = (ranges[ts][0], end, ranges[ts][2] + rows)
+    else:
+        ranges[ts] = (start, end, rows)
+
+
+def ranges(path: str) -> Dict[str, Range]:
+    """{batch_ts: (start, end, rows)} for every batch stored contiguously in path."""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return {}
+    with _lock:
+        st = _cache.get(path)
+        if st is None or size < st['size']:
+            st = _cache[path] = {'size': 0, 'ranges': {}, 'split': set()}
+        if size > st['size']:
+            # recorded ranges are taken as-is; anything between them (older history) is scanned
+            recorded = sorted(_recorded(path).items(), key=lambda kv: kv[1][0])
+            while st['size'] < size:
+                pos = st['size']
+                nxt = next(((ts, r) for ts, r in recorded if r[0] >= pos and r[1] <= size), None)
+                if nxt and nxt[1][0] == pos:
+                    _close(st['ranges'], st['split'], nxt[0], *nxt[1])
+                    st['size'] = nxt[1][1]
+                    continue
+                st['size'] = _scan(path, pos, nxt[1][0] if nxt else size, st['ranges'], st['split'])
+                if st['size'] == pos:
+                    break
+        return {ts: r for ts, r in st['ranges'].items() if ts not in st['split']}
+
+
+def lookup(path: str, ts: str) -> Optional[Range]:
+    return ranges(path).get(ts)
+
+
+def iter_lines(path: str, rng: Range, chunk_bytes: int = CHUNK_BYTES) -> Iterator[bytes]:
+    """Raw JSON lines of one batch, a chunk of whole lines at a time (no trailing newline)."""
+    start, end, _ = rng
+    with open(path, 'rb') as f:
+        f.seek(start)
+        left, carry = end - start, b''
+        while left > 0:
+            buf = f.read(min(chunk_bytes, left))
+            if not buf:
+                break
+            left -= len(buf)
+            buf = carry + buf
+            cut = buf.rfind(b'\n') + 1 if left > 0 else len(buf)
+            carry = buf[cut:]
+            lines = [ln for ln in buf[:cut].split(b'\n') if ln.strip()]
+            if lines:
+                yield b'\n'.join(lines)
+
+
+def iter_json_array(path: str, rng: Range, prefix: bytes, suffix: bytes) -> Iterator[bytes]:
+    """prefix + '[' + rows joined by ',' + ']' + suffix, straight from the stored bytes."""
+    yield prefix + b'['
+    first = True
+    for chunk in iter_lines(path, rng):
+        yield (b'' if first else b',') + chunk.replace(b'\n', b',')
+        first = False
+    yield b']' + suffix
+
+
+def iter_rows(path: str, rng: Range) -> Iterator[Tuple[int, Dict]]:
+    """(offset, parsed row) for each line of a range, one line at a time; unparsable lines are skipped."""
+    start, end, _ = rng
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            try:
+                row = json.loads(line)
+            except Exception:
+                row = None
+            if isinstance(row, dict):
+                yield pos, row
+            pos += len(line)
+
+
+def read_rows(path: str, ts: str) -> Optional[list]:
+    """Parsed rows of one batch via its byte range; None when the batch is not indexed."""
+    rng = lookup(path, ts)
+    if rng is None:
+        return None
+    rows = [row for _, row in iter_rows(path, rng)]
+    # the recorded range must still point at this batch (snapshot rewritten by hand)
+    if rows and rows[0].get('batch_ts') != ts:
+        return None
+    return rows
+
+
+def host_offsets(path: str, ts: str) -> Optional[Dict[str, int]]:
+    """host -> offset of its row in one batch, read through the batch's range; None when not indexed."""
+    rng = lookup(path, ts)
+    if rng is None:
+        return None
+    out: Dict[str, int] = {}
+    for off, row in iter_rows(path, rng):
+        if row.get('batch_ts') != ts:
+            return None
+        if row.get('host'):
+            out[row['host']] = off
+    return out
+
+
+def rebuild() -> int:
+    """Rewrite snapshot_offsets.jsonl from a scan of both snapshot files."""
+    tmp = OFFSETS_JSONL + '.tmp'
+    n = 0
+    with open(tmp, 'w', encoding='utf-8') as out:
+        for path in (DEVICES_SNAPSHOT, CVES_SNAPSHOT):
+            if not os.path.exists(path):
+                continue
+            rng: Dict[str, Range] = {}
+            split: set = set()
+            _scan(path, 0, os.path.getsize(path), rng, split)
+            for ts, (start, end, rows) in sorted(rng.items(), key=lambda kv: kv[1][0]):
+                if ts in split:
+                    continue
+                out.write(json.dumps({'file': os.path.basename(path), 'batch_ts': ts,
+                                      'start': start, 'end': end, 'rows': rows}) + '\n')
+                n += 1
+    os.replace(tmp, OFFSETS_JSONL)
+    with _lock:
+        _cache.clear()
+    return n
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Per-batch byte ranges of the history snapshots')
+    ap.add_argument('--rebuild', action='store_true', help='Rewrite snapshot_offsets.jsonl from the snapshot files')
+    args = ap.parse_args()
+    if args.rebuild:
+        print(f"[snapshot-index] recorded {rebuild()} batch ranges in {OFFSETS_JSONL}")
+    else:
+        for path in (DEVICES_SNAPSHOT, CVES_SNAPSHOT):
+            for ts, r in sorted(ranges(path).items()):
+                print(f"{os.path.basename(path)}  {ts}  bytes {r[0]}-{r[1]}  rows {r[2]}")
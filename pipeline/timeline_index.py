@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Per-host timeline store under data/history/timelines/.
+
+history_writer.py appends one condensed entry per host per batch to
+timelines/<host>.jsonl, so a device's history is one small file read instead
+of a scan of devices_snapshot.jsonl across every batch.
+
+  python pipeline/timeline_index.py --rebuild     # (re)build from devices_snapshot.jsonl
+"""
+from __future__ import annotations
+import os, re, json, shutil, hashlib
+from typing import Any, Dict, Iterable, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+HIST_DIR = os.path.join(DATA_DIR, 'history')
+TIMELINES_DIR = os.path.join(HIST_DIR, 'timelines')
+DEVICES_SNAPSHOT = os.path.join(HIST_DIR, 'devices_snapshot.jsonl')
+
+_SAFE = re.compile(r'[^A-Za-z0-9._-]')
+
+
+def host_path(host: str) -> str:
+    """File for a host; names that need escaping get a short hash so they cannot collide."""
+    safe = _SAFE.sub('_', host)
+    if safe != host or safe.startswith('.'):
+        safe = f"{safe}__{hashlib.sha1(host.encode('utf-8')).hexdigest()[:8]}"
+    return os.path.join(TIMELINES_DIR, f"{safe}.jsonl")
+
+
+def entry(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Condensed timeline entry from a devices_snapshot row (shape served by /api/device/{host}/timeline)."""
+    counts = row.get('cve_counts') or {}
+    return {
+        'batch_ts': row.get('batch_ts'),
+        'version': row.get('current_version'),
+        'recommended_version': row.get('recommended_version'),
+        'release_designation': row.get('release_designation'),
+        'upgrade_recommended': row.get('upgrade_recommended'),
+        'recommendation': row.get('recommendation'),
+        'final_url': row.get('final_url'),
+        'critical_cves': counts.get('Critical'),
+        'high_cves': counts.get('High'),
+        'cpu_usage': row.get('cpu_usage'),
+        'status': row.get('status'),
+        'series_release_date': row.get('series_release_date'),
+        'end_of_sale_date': row.get('end_of_sale_date'),
+        'end_of_support_date': row.get('end_of_support_date'),
+    }
+
+
+def exists() -> bool:
+    return os.path.isdir(TIMELINES_DIR)
+
+
+def append(rows: Iterable[Dict[str, Any]]) -> int:
+    """Append the timeline entry of each snapshot row to its host file."""
+    os.makedirs(TIMELINES_DIR, exist_ok=True)
+    n = 0
+    for row in rows:
+        host = row.get('host')
+        if not host:
+            continue
+        with open(host_path(host), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry(row), ensure_ascii=False) + '\n')
+        n += 1
+    return n
+
+
+def _append_lines(dir_: str, pending: Dict[str, List[str]]) -> None:
+    for host, lines in pending.items():
+        with open(os.path.join(dir_, os.path.basename(host_path(host))), 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def rebuild(snapshot: str = DEVICES_SNAPSHOT) -> int:
+    """Rebuild every host file from devices_snapshot.jsonl (written to a temp dir then swapped in).
+
+    The snapshot is streamed one batch at a time: each batch's entries are
+    appended to their host files before the next batch is read, so memory is
+    bounded by one batch rather than the whole history.
+    """
+    tmp = TIMELINES_DIR + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    if os.path.exists(snapshot):
+        pending: Dict[str, List[str]] = {}
+        batch = None
+        with open(snapshot, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except Exception:
+                    continue
+                if not isinstance(row, dict) or not row.get('host'):
+                    continue
+                if row.get('batch_ts') != batch:
+                    _append_lines(tmp, pending)
+                    pending, batch = {}, row.get('batch_ts')
+                pending.setdefault(row['host'], []).append(json.dumps(entry(row), ensure_ascii=False))
+        _append_lines(tmp, pending)
+    hosts = len(os.listdir(tmp))
+    old = TIMELINES_DIR + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.isdir(TIMELINES_DIR):
+        os.rename(TIMELINES_DIR, old)
+    os.rename(tmp, TIMELINES_DIR)
+    shutil.rmtree(old, ignore_errors=True)
+    return hosts
+
+
+def _bound(ts: Optional[str], end: bool) -> Optional[str]:
+    # a bare date as 'until' covers the whole day
+    if ts and end and len(ts) == 10:
+        return ts + 'T23:59:59Z'
+    return ts or None
+
+
+def in_window(batch_ts: Optional[str], since: Optional[str] = None, until: Optional[str] = None) -> bool:
+    since, until = _bound(since, False), _bound(until, True)
+    if not batch_ts:
+        return False
+    return (not since or batch_ts >= since) and (not until or batch_ts <= until)
+
+
+def read(host: str, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Timeline for one host, oldest first, optionally limited to since <= batch_ts <= until."""
+    path = host_path(host)
+    if not os.path.exists(path):
+        return []
+    out = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                e = json.loads(line)
+            except Exception:
+                continue
+            if in_window(e.get('batch_ts'), since, until):
+                out.append(e)
+    out.sort(key=lambda e: e['batch_ts'])
+    return out
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Per-host timeline store')
+    ap.add_argument('--rebuild', action='store_true', help='Rebuild timelines/ from devices_snapshot.jsonl')
+    ap.add_argument('--host', help='Print the timeline of one host')
+    args = ap.parse_args()
+    if args.rebuild:
+        print(f"[timeline] rebuilt {rebuild()} host timelines in {TIMELINES_DIR}")
+    elif args.host:
+        print(json.dumps(read(args.host), indent=2))
+    else:
+        ap.print_help()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Version parsing shared by the pipeline stages and the dashboard.
+
+IOS, IOS-XE and NX-OS version strings become sortable tuple keys:
+
+  15.2(7)E9    -> (15, 2, 7, 'e', 9)       train (15, 2, 7, 'e')
+  17.9.4a      -> (17, 9, 4, 'a')          train (17, 9)
+  10.3(3)      -> (10, 3, 3)               train (10, 3)
+  7.0(3)I7(9)  -> (7, 0, 3, 'i', 7, 9)     train (7, 0, 3, 'i', 7)
+
+(shown simplified: each part is an (int, str) pair so numbers and letters compare).
+A train is the key without its last numeric part (and any letters after it).
+Keys are memoized, so a fleet with few distinct versions parses each only once.
+
+  python pipeline/versions.py 17.9.4 17.12.1 '15.2(7)E9'
+"""
+from __future__ import annotations
+import re, bisect
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+RE_IOS_PAREN = re.compile(r"^(\d+)\.(\d+)\((\d+)\)([A-Za-z]+)?(\d+)?$")
+RE_IOS_DASH = re.compile(r"^(\d+)\.(\d+)\.(\d+)-([A-Za-z]+)(\d+)$")
+RE_IOS_DASH_SHORT = re.compile(r"^(\d+)\.(\d+)\.(\d+)([A-Za-z]+)(\d+)$")
+RE_TOKEN = re.compile(r"\d+|[A-Za-z]+")
+
+IOS_PLATFORMS = ('ios', 'iosxe', 'ios-xe')
+
+Key = Tuple[Tuple[int, str], ...]
+
+
+def to_ios_canonical(v: str) -> str:
+    """Convert common IOS forms like '15.0.2-SE11' or '15.2.7E9' to '15.0(2)SE11'/'15.2(7)E9'.
+    If already canonical, return as-is. Best-effort; returns input on unknowns.
+    """
+    s = (v or "").strip()
+    if not s:
+        return s
+    if RE_IOS_PAREN.match(s):
+        return s
+    m = RE_IOS_DASH.match(s) or RE_IOS_DASH_SHORT.match(s)
+    if m:
+        a, b, c, sfx, n = m.groups()
+        return f"{a}.{b}({c}){sfx}{n}"
+    return s
+
+
+def normalize(v: str, platform: Optional[str]) -> str:
+    if not v:
+        return v
+    if (platform or '').lower() in IOS_PLATFORMS:
+        return to_ios_canonical(v)
+    # NX-OS and others: leave as-is (already standard like 10.3(3))
+    return v
+
+
+def variants(platform: str, v: str) -> List[str]:
+    """Spellings of one version to try against the PSIRT API (canonical first)."""
+    s = (v or '').strip()
+    if not s:
+        return []
+    if (platform or '').lower() not in IOS_PLATFORMS:
+        return [s]
+    can = to_ios_canonical(s)
+    out = [can]
+    m = RE_IOS_PAREN.match(can)
+    if m:
+        a, b, c, sfx, n = m.groups()
+        if sfx and n:
+            out.append(f"{a}.{b}.{c}-{sfx}{n}")  # 15.0.2-SE11
+            out.append(f"{a}.{b}.{c}{sfx}{n}")   # 15.0.2SE11
+    if s not in out:
+        out.append(s)
+    return out
+
+
+@lru_cache(maxsize=8192)
+def key(v: Optional[str], platform: Optional[str] = None) -> Key:
+    """Sortable key; () when v has no digits. Letters sort before numbers at the same position."""
+    s = normalize((v or '').strip(), platform)
+    if not any(ch.isdigit() for ch in s):
+        return ()
+    return tuple((int(t), '') if t.isdigit() else (-1, t.lower()) for t in RE_TOKEN.findall(s))
+
+
+@lru_cache(maxsize=8192)
+def train(v: Optional[str], platform: Optional[str] = None) -> Key:
+    k = key(v, platform)
+    last = max((i for i, (n, _) in enumerate(k) if n >= 0), default=0)
+    return k[:last] if last else k
+
+
+def keys(values: Iterable[Optional[str]], platform: Optional[str] = None) -> List[Key]:
+    """Keys for a whole column of versions; each distinct string is parsed once."""
+    values = list(values)
+    parsed = {v: key(v, platform) for v in set(values)}
+    return [parsed[v] for v in values]
+
+
+def compare(a: Optional[str], b: Optional[str], platform: Optional[str] = None) -> Optional[int]:
+    """-1/0/1 like cmp(a, b); None when either side does not parse."""
+    ka, kb = key(a, platform), key(b, platform)
+    if not ka or not kb:
+        return None
+    return (ka > kb) - (ka < kb)
+
+
+def fleet_trains(devices: Iterable[Dict[str, Any]], extra: Iterable[Tuple[str, str]] = ()) -> Dict[str, List[Key]]:
+    """platform -> sorted trains seen in the fleet (devices.json records; extra (platform, version) pairs)."""
+    seen: Dict[str, set] = {}
+    pairs = [((d.get('platform') or '').lower(), d.get('version') or d.get('current_version'))
+             for d in devices if isinstance(d, dict)]
+    for platform, v in list(pairs) + [((p or '').lower(), v) for p, v in extra]:
+        t = train(v, platform)
+        if t:
+            seen.setdefault(platform, set()).add(t)
+    return {p: sorted(ts) for p, ts in seen.items()}
+
+
+def trains_behind(current: Optional[str], target: Optional[str], platform: Optional[str] = None,
+                  known: Optional[Sequence[Key]] = None) -> Optional[int]:
+    """How many trains lie after current's up to and including target's (0: same train, negative: ahead).
+
+    known is the sorted train catalogue (fleet_trains()); without one, any two
+    different trains count as one apart.
+    """
+    tc, tt = train(current, platform), train(target, platform)
+    if not tc or not tt:
+        return None
+    if tc == tt:
+        return 0
+    lo, hi = min(tc, tt), max(tc, tt)
+    cat = known or ()
+    n = bisect.bisect_right(cat, hi) - bisect.bisect_right(cat, lo)
+    i = bisect.bisect_left(cat, hi)
+    if i == len(cat) or cat[i] != hi:
+        n += 1   # the far end counts even when the catalogue has not seen it
+    return n if tc < tt else -n
+
+
+def position(current: Optional[str], target: Optional[str], platform: Optional[str] = None) -> str:
+    """'behind', 'same', 'ahead' relative to the recommended release, or 'unknown'."""
+    c = compare(current, target, platform)
+    return {None: 'unknown', -1: 'behind', 0: 'same', 1: 'ahead'}[c]
+
+
+def histogram(rows: Iterable[Dict[str, Any]], known: Optional[Dict[str, List[Key]]] = None) -> Dict[str, Any]:
+    """One pass over snapshot rows: versions per platform (sorted by key), position vs recommended,
+    and the trains-behind distribution."""
+    per_platform: Dict[str, Counter] = {}
+    pos: Counter = Counter()
+    behind: Counter = Counter()
+    rows = [r for r in rows if isinstance(r, dict)]
+    if known is None:
+        known = fleet_trains(rows, [(r.get('platform'), r.get('recommended_version')) for r in rows])
+    for r in rows:
+        platform = (r.get('platform') or '').lower()
+        cur, rec = r.get('current_version'), r.get('recommended_version')
+        if cur:
+            per_platform.setdefault(platform, Counter())[normalize(cur, platform)] += 1
+        pos[position(cur, rec, platform)] += 1
+        n = trains_behind(cur, rec, platform, known.get(platform))
+        if n is not None:
+            behind[n] += 1
+    return {
+        'platforms': {
+            p: [{'version': v, 'count': c} for v, c in sorted(cnt.items(), key=lambda kv: key(kv[0], p))]
+            for p, cnt in sorted(per_platform.items())
+        },
+        'position': dict(pos),
+        'trains_behind': {str(n): c for n, c in sorted(behind.items())},
+    }
+
+
+if __name__ == '__main__':
+    import sys
+    vs = sys.argv[1:]
+    for v in sorted(vs, key=key):
+        print(f"{v:<16} key={key(v)}  train={train(v)}")
@@ -0,0 +1,483 @@
+# cisco_http.py
+"""
+HTTP-first fast path for the Cisco download and support sites.
+
+The Angular UIs driven by cisco_url_extractor.py, last_version_extract.py and
+eol_details.py are assumed to be thin shells over JSON/XHR endpoints (product
+search, software types, release tree) and a server-rendered product page
+holding the EoL "birth certificate" table. This module calls those endpoints
+directly with one pooled requests.Session and parses the results in pure Python.
+
+The endpoint paths and payload shapes are NOT verified against the live sites
+yet: the fixtures in scraping/fixtures are synthetic (hand-written, see its
+README), so the fast path is off unless CISCO_HTTP_FASTPATH=1. Record real
+responses with --record before relying on it.
+
+Every public function returns None on any failure so callers can fall back to
+the Selenium flow unchanged.
+
+Environment:
+  CISCO_HTTP_FASTPATH     "1" enables the fast path (default: Selenium only)
+  CISCO_HTTP_TIMEOUT      per-request timeout in seconds (default 15)
+  CISCO_DOWNLOAD_BASE     base URL of the software download site
+  CISCO_DOWNLOAD_API      base URL of its JSON API (defaults under CISCO_DOWNLOAD_BASE)
+  CISCO_SUPPORT_BASE      base URL of the support site
+  CISCO_HTTP_REPLAY_DIR   serve responses from fixture files (offline)
+  CISCO_HTTP_RECORD_DIR   record live responses as fixtures
+"""
+from __future__ import annotations
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+
+from retry_policy import note_blocked, endpoint_of  # type: ignore
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except Exception:  # pragma: no cover
+    requests = None  # type: ignore
+    HTTPAdapter = None  # type: ignore
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+COOKIES_JSON = os.path.join(DATA_DIR, 'cisco_cookies.json')
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+sys.path.insert(0, os.path.join(BASE_DIR, 'pipeline'))
+import run_metrics  # type: ignore
+import atomic_io  # type: ignore
+
+DOWNLOAD_BASE = os.getenv('CISCO_DOWNLOAD_BASE', 'https://software.cisco.com/download').rstrip('/')
+DOWNLOAD_API = os.getenv('CISCO_DOWNLOAD_API', DOWNLOAD_BASE + '/api').rstrip('/')
+SUPPORT_BASE = os.getenv('CISCO_SUPPORT_BASE', 'https://www.cisco.com').rstrip('/')
+
+# XHR endpoints assumed behind the download/support UIs (unverified; see the module docstring)
+PRODUCT_SEARCH_API = DOWNLOAD_API + '/psa/search'                 # ?searchText=<model>
+SOFTWARE_TYPES_API = DOWNLOAD_API + '/mdf/{mdf_id}/softwaretypes'
+RELEASE_TREE_API = DOWNLOAD_API + '/mdf/{mdf_id}/type/{type_id}/releases'
+SUPPORT_SUGGEST_API = SUPPORT_BASE + '/c/en/us/support/search/suggest.json'  # ?q=<alias>
+
+REQ_TIMEOUT = float(os.getenv('CISCO_HTTP_TIMEOUT', '15'))
+COOKIE_TTL_SEC = int(os.getenv('CISCO_COOKIE_TTL', str(6 * 3600)))
+
+# Same preference order as the Selenium flow on /type pages
+PREFERRED_LABELS = ["IOS Software", "IOS XE Software", "NX-OS System Software", "Switch Firmware"]
+
+UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+      "(KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36")
+
+RE_MDF_URL = re.compile(r"/download/home/(\d+)(?:/type(?:/(\d+))?)?")
+
+_session = None
+_cookies_tried = False
+
+
+def enabled() -> bool:
+    return os.getenv('CISCO_HTTP_FASTPATH', '0') == '1' and (requests is not None or _replay_dir() is not None)
+
+
+def _replay_dir() -> Optional[str]:
+    d = os.getenv('CISCO_HTTP_REPLAY_DIR')
+    return d if d and os.path.isdir(d) else None
+
+
+def _fixture_name(url: str, params: Optional[dict]) -> str:
+    """Stable file name for a request: readable path tail + short hash of the full query."""
+    key = url + '?' + '&'.join(f"{k}={params[k]}" for k in sorted(params or {}))
+    tail = re.sub(r'[^A-Za-z0-9]+', '_', url.split('://', 1)[-1]).strip('_')[-60:]
+    return f"{tail}__{hashlib.sha1(key.encode('utf-8')).hexdigest()[:10]}"
+
+
+def _replay(url: str, params: Optional[dict]) -> Optional[str]:
+    d = _replay_dir()
+    if not d:
+        return None
+    path = os.path.join(d, _fixture_name(url, params))
+    if not os.path.exists(path):
+        print(f"[http] replay miss: {url} {params or ''}")
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _record(url: str, params: Optional[dict], text: str) -> None:
+    d = os.getenv('CISCO_HTTP_RECORD_DIR')
+    if not d:
+        return
+    os.makedirs(d, exist_ok=True)
+    with open(os.path.join(d, _fixture_name(url, params)), 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def _load_cookies() -> List[Dict[str, Any]]:
+    try:
+        data = atomic_io.read_json(COOKIES_JSON, {})
+        if time.time() - float(data.get('harvested_at', 0)) > COOKIE_TTL_SEC:
+            return []
+        return data.get('cookies') or []
+    except Exception:
+        return []
+
+
+def harvest_cookies(url: str = DOWNLOAD_BASE + '/home') -> List[Dict[str, Any]]:
+    """Open one real browser session to obtain CDN/consent cookies and cache them on disk."""
+    from last_version_extract import _build_driver  # type: ignore  # lazy: avoids import cycle
+    driver = _build_driver()
+    try:
+        driver.get(url)
+        cookies = driver.get_cookies() or []
+    finally:
+        driver.quit()
+    try:
+        atomic_io.write_json(COOKIES_JSON, {'harvested_at': time.time(), 'cookies': cookies}, indent=None)
+    except Exception:
+        pass
+    print(f"[http] harvested {len(cookies)} cookies from browser")
+    return cookies
+
+
+def _apply_cookies(sess, cookies: List[Dict[str, Any]]) -> None:
+    for c in cookies:
+        try:
+            sess.cookies.set(c['name'], c['value'], domain=c.get('domain'), path=c.get('path') or '/')
+        except Exception:
+            continue
+
+
+def get_session():
+    """Shared pooled session (keep-alive, connection reuse across all hosts of a run)."""
+    global _session
+    if _session is None:
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        s.mount('https://', adapter)
+        s.mount('http://', adapter)
+        s.headers.update({
+            'User-Agent': UA,
+            'Accept': 'application/json, text/plain, */*',
+            'Accept-Language': 'en-US,en;q=0.9',
+        })
+        _apply_cookies(s, _load_cookies())
+        _session = s
+    return _session
+
+
+def _fetch(url: str, params: Optional[dict] = None, accept: Optional[str] = None) -> Optional[str]:
+    """GET a resource as text; one browser cookie harvest is attempted on 401/403."""
+    global _cookies_tried
+    if _replay_dir():
+        return _replay(url, params)
+    sess = get_session()
+    headers = {'Accept': accept} if accept else None
+    for _ in range(2):
+        with run_metrics.span('http', endpoint=endpoint_of(url)) as sp:
+            try:
+                r = sess.get(url, params=params, headers=headers, timeout=REQ_TIMEOUT)
+                sp['status'] = r.status_code
+            except Exception as e:
+                sp['outcome'] = 'error'
+                print(f"[http] request error {url}: {e}")
+                return None
+        if r.status_code in (401, 403) and not _cookies_tried:
+            _cookies_tried = True
+            try:
+                _apply_cookies(sess, harvest_cookies())
+            except Exception as e:
+                print(f"[http] cookie harvest failed: {e}")
+                return None
+            continue
+        if r.status_code != 200 or 'Access Denied' in r.text[:2048]:
+            print(f"[http] {url} -> {r.status_code}")
+            if r.status_code in (403, 429) or 'Access Denied' in r.text[:2048]:
+                note_blocked(endpoint_of(url))
+            return None
+        _record(url, params, r.text)
+        return r.text
+    return None
+
+
+def _fetch_json(url: str, params: Optional[dict] = None) -> Any:
+    text = _fetch(url, params)
+    if text is None:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def _as_list(payload: Any, *keys: str) -> List[Any]:
+    """Unwrap the list from common envelopes ({"data": [...]}, {"results": [...]}, bare list)."""
+    if isinstance(payload, list):
+        return payload
+    if isinstance(payload, dict):
+        for k in keys + ('data', 'results', 'items'):
+            v = payload.get(k)
+            if isinstance(v, list):
+                return v
+            if isinstance(v, dict):
+                inner = _as_list(v, *keys)
+                if inner:
+                    return inner
+    return []
+
+
+def _first(d: Dict[str, Any], *keys: str) -> Any:
+    for k in keys:
+        v = d.get(k)
+        if v not in (None, ''):
+            return v
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Download site: model -> URL, URL -> latest version
+# ---------------------------------------------------------------------------
+
+def find_download_url(model_name: str) -> Optional[str]:
+    """Resolve a marketing model name to its /download/home/<mdfid>/type URL."""
+    payload = _fetch_json(PRODUCT_SEARCH_API, {'searchText': model_name})
+    products = _as_list(payload, 'products', 'suggestions')
+    if not products:
+        return None
+    wanted = model_name.strip().lower()
+    # exact name match first, else the first suggestion (what the UI typeahead picks)
+    best = next((p for p in products if isinstance(p, dict) and
+                 str(_first(p, 'name', 'productName', 'title') or '').strip().lower() == wanted), None)
+    best = best or next((p for p in products if isinstance(p, dict)), None)
+    if not best:
+        return None
+    url = _first(best, 'url', 'href', 'link')
+    if url:
+        return url if url.startswith('http') else DOWNLOAD_BASE.rsplit('/download', 1)[0] + url
+    mdf_id = _first(best, 'mdfId', 'mdf_id', 'id')
+    return f"{DOWNLOAD_BASE}/home/{mdf_id}/type" if mdf_id else None
+
+
+def _pick_software_type(types: List[Dict[str, Any]]) -> Tuple[Optional[str], Optional[str]]:
+    named = []
+    for t in types:
+        if not isinstance(t, dict):
+            continue
+        label = str(_first(t, 'name', 'label', 'softwareTypeName') or '').strip()
+        tid = _first(t, 'id', 'softwareTypeId', 'typeId')
+        if tid:
+            named.append((label, str(tid)))
+    for label in PREFERRED_LABELS:
+        for name, tid in named:
+            if name == label or label in name:
+                return tid, label
+    return None, None
+
+
+def _walk_releases(nodes: List[Any]) -> Optional[Dict[str, Any]]:
+    """Depth-first first leaf, matching tree-node[1] > children > tree-node[1] in the UI."""
+    for n in nodes:
+        if not isinstance(n, dict):
+            continue
+        children = _as_list(n, 'children', 'releases', 'nodes')
+        if children:
+            leaf = _walk_releases(children)
+            if leaf:
+                return leaf
+        elif _first(n, 'version', 'releaseName', 'name', 'label'):
+            return n
+    return None
+
+
+def parse_release_tree(payload: Any) -> Optional[Dict[str, Any]]:
+    """Return {'version', 'designation', 'suggested'} for the first (latest) release node."""
+    leaf = _walk_releases(_as_list(payload, 'releases', 'releaseTree', 'tree'))
+    if not leaf:
+        return None
+    version = str(_first(leaf, 'version', 'releaseName', 'name', 'label')).strip()
+    designation = _first(leaf, 'designation', 'releaseDesignation', 'lifecycle')
+    suggested = bool(_first(leaf, 'suggested', 'isSuggested', 'recommended'))
+    return {'version': version, 'designation': designation, 'suggested': suggested}
+
+
+def format_version_text(rel: Dict[str, Any]) -> str:
+    """Render a release like the UI text the Selenium scraper reads, e.g. '15.2.7E9(MD) (recommended)'."""
+    text = rel['version']
+    desig = (rel.get('designation') or '').strip()
+    if desig and not text.endswith(')'):
+        text = f"{text}({desig})"
+    if rel.get('suggested'):
+        text = f"{text} (recommended)"
+    return text
+
+
+def fetch_latest_version(url: str) -> Optional[dict]:
+    """HTTP equivalent of last_version_extract.scrape_latest_version (no screenshot)."""
+    m = RE_MDF_URL.search(url or '')
+    if not m:
+        return None
+    mdf_id, type_id = m.group(1), m.group(2)
+    selected_label = None
+    switch_type = None
+    if not type_id:
+        payload = _fetch_json(SOFTWARE_TYPES_API.format(mdf_id=mdf_id))
+        type_id, selected_label = _pick_software_type(_as_list(payload, 'softwareTypes', 'types'))
+        if isinstance(payload, dict):
+            switch_type = _first(payload, 'productName', 'mdfName', 'name')
+        if not type_id:
+            return None
+    tree = _fetch_json(RELEASE_TREE_API.format(mdf_id=mdf_id, type_id=type_id))
+    rel = parse_release_tree(tree)
+    if not rel:
+        return None
+    if isinstance(tree, dict):
+        switch_type = _first(tree, 'productName', 'mdfName', 'name') or switch_type
+    return {
+        "switch_type": switch_type or "",
+        "latest_version": format_version_text(rel),
+        "final_url": f"{DOWNLOAD_BASE}/home/{mdf_id}/type/{type_id}/release/{rel['version']}",
+        "selected_label": selected_label,
+        "screenshot_file": None,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Support site: alias -> product page -> EoL fields
+# ---------------------------------------------------------------------------
+
+class _BirthCertParser(HTMLParser):
+    """Collect <th>/<td> pairs from table.birth-cert-table, dropping <a> text inside cells."""
+
+    def __init__(self):
+        super().__init__()
+        self.rows: Dict[str, str] = {}
+        self.title: Optional[str] = None
+        self._in_table = 0
+        self._in_title = False
+        self._cell: Optional[str] = None
+        self._in_a = 0
+        self._th: List[str] = []
+        self._td: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'title':
+            self._in_title = True
+        elif tag == 'table':
+            cls = dict(attrs).get('class') or ''
+            if self._in_table or 'birth-cert-table' in cls.split():
+                self._in_table += 1
+        elif self._in_table:
+            if tag == 'tr':
+                self._th, self._td = [], []
+            elif tag in ('th', 'td'):
+                self._cell = tag
+            elif tag == 'a':
+                self._in_a += 1
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self._in_title = False
+        elif tag == 'table' and self._in_table:
+            self._in_table -= 1
+        elif self._in_table:
+            if tag in ('th', 'td'):
+                self._cell = None
+            elif tag == 'a' and self._in_a:
+                self._in_a -= 1
+            elif tag == 'tr':
+                key = ' '.join(''.join(self._th).split())
+                if key:
+                    self.rows[key] = ' '.join(''.join(self._td).split())
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title = (self.title or '') + data
+        if not self._in_table or self._cell is None:
+            return
+        if self._cell == 'th':
+            self._th.append(data)
+        elif not self._in_a:
+            self._td.append(data)
+
+
+def parse_eol_table(html: str) -> Optional[Dict[str, Any]]:
+    """Extract the EoL fields eol_details.get_eol_details reads from the birth-cert table."""
+    p = _BirthCertParser()
+    try:
+        p.feed(html)
+    except Exception:
+        return None
+    if not p.rows:
+        return None
+    rows = p.rows
+    status = rows.get('Status')
+    return {
+        'end_of_sale_date': rows.get('End-of-Sale Date') or None,
+        'end_of_support_date': rows.get('End-of-Support Date') or rows.get('Last Date of Support') or None,
+        'status': status.replace('EOL Details', '').strip() if status else None,
+        'series_release_date': rows.get('Series Release Date') or None,
+        'nav_title': ' '.join((p.title or '').split()) or None,
+    }
+
+
+def find_support_page(alias: str) -> Optional[Tuple[str, str]]:
+    """First product suggestion for an alias, as (title, absolute_url)."""
+    payload = _fetch_json(SUPPORT_SUGGEST_API, {'q': alias})
+    for s in _as_list(payload, 'suggestions', 'products'):
+        if not isinstance(s, dict):
+            continue
+        url = _first(s, 'url', 'href', 'link')
+        if not url:
+            continue
+        if not url.startswith('http'):
+            url = SUPPORT_BASE + url
+        return str(_first(s, 'title', 'name', 'label') or ''), url
+    return None
+
+
+def fetch_eol_details(alias: str) -> Optional[Dict[str, Any]]:
+    """HTTP equivalent of eol_details.get_eol_details; same result shape."""
+    if not alias:
+        return None
+    hit = find_support_page(alias)
+    if not hit:
+        return None
+    title, url = hit
+    html = _fetch(url, accept='text/html')
+    if not html:
+        return None
+    fields = parse_eol_table(html)
+    if not fields:
+        return None
+    nav_title = fields.pop('nav_title') or title
+    fields.update({
+        'nav_title': nav_title,
+        'nav_url': url,
+        'nav_steps': [f"HTTP suggest: {alias}", f"Matched: {title or '(no text)'}", f"Landed: {nav_title}"],
+    })
+    return fields
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Cisco HTTP fast path (no browser)')
+    parser.add_argument('--model', help='Resolve a download URL and latest version for a model name')
+    parser.add_argument('--eol', help='Fetch EoL details for an alias')
+    parser.add_argument('--replay', nargs='?', const=FIXTURES_DIR,
+                        help='Serve responses from fixture files (default: scraping/fixtures, synthetic)')
+    parser.add_argument('--record', help='Record live responses into this directory')
+    args = parser.parse_args()
+    if args.replay:
+        os.environ['CISCO_HTTP_REPLAY_DIR'] = args.replay
+    if args.record:
+        os.environ['CISCO_HTTP_RECORD_DIR'] = args.record
+    if args.model:
+        u = find_download_url(args.model)
+        print(u)
+        print(fetch_latest_version(u) if u else None)
+    elif args.eol:
+        print(fetch_eol_details(args.eol))
+    else:
+        parser.print_help()
@@ -2,19 +2,28 @@
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
-import time
 import os
+import sys
 
-import os
+import waits  # type: ignore
+from retry_policy import note_blocked, endpoint_of  # type: ignore
+
+try:
+    import cisco_http  # type: ignore
+except Exception:  # fast path is optional
+    cisco_http = None
 
-BASE_URL = 'https://software.cisco.com/download/home'
+# CISCO_DOWNLOAD_BASE as in cisco_http (bench/stand_ins.py serves a local copy)
+BASE_URL = os.getenv('CISCO_DOWNLOAD_BASE', 'https://software.cisco.com/download').rstrip('/') + '/home'
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
 OUTPUT_FILE = os.path.join(DATA_DIR, 'cisco_urls.txt')
 
+sys.path.insert(0, os.path.join(BASE_DIR, 'pipeline'))
+import run_metrics  # type: ignore
+
 # A normal desktop UA helps headless pass CDN checks
 UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
       "(KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36")
@@ -37,40 +46,67 @@ def _build_driver():
     chrome_options.add_experimental_option('excludeSwitches', ['enable-logging'])
     chrome_options.add_argument(f'--user-agent={UA}')   # UA at startup
 
-    driver = webdriver.Chrome(options=chrome_options)
+    with run_metrics.span('driver_startup'):
+        driver = webdriver.Chrome(options=chrome_options)
     # Page-level UA override via CDP (extra insurance)
     try:
         driver.execute_cdp_cmd("Network.enable", {})
         driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": UA})
     except Exception:
         pass
+    waits.install_network_tracker(driver)
     return driver
 
-def _accept_cookies_if_any(driver, wait):
+def _accept_cookies_if_any(driver):
+    # Short fixed cap: the banner is often absent and we must not stall on it
     try:
-        btn = wait.until(EC.element_to_be_clickable((By.ID, "onetrust-accept-btn-handler")))
+        btn = waits.wait_until(driver, EC.element_to_be_clickable((By.ID, "onetrust-accept-btn-handler")),
+                               'download.cookies', timeout=5)
         driver.execute_script("arguments[0].click();", btn)
-        time.sleep(0.2)
+        waits.wait_until(driver, EC.invisibility_of_element_located((By.ID, "onetrust-banner-sdk")),
+                         'download.cookies_closed', timeout=3)
         print("[cookies] accepted")
     except TimeoutException:
         pass
 
+def _save_url(model_name: str, final_url: str) -> None:
+    with open(OUTPUT_FILE, 'a', encoding='utf-8') as f:
+        f.write(f"{model_name}: {final_url}\n")
+    print(f"[saved] {final_url}")
+
 def extract_url_for_model(model_name: str, save_to_file: bool = True) -> str | None:
-    """Return the Cisco download URL for a given model name."""
+    """Return the Cisco download URL for a given model name.
+
+    Tries the HTTP fast path (cisco_http) first and only starts a browser if it fails.
+    """
+    if cisco_http is not None and cisco_http.enabled():
+        try:
+            final_url = cisco_http.find_download_url(model_name)
+        except Exception as e:
+            print(f"[http] fast path error: {e}")
+            final_url = None
+        if final_url:
+            print(f"[http] {model_name} -> {final_url}")
+            if save_to_file:
+                _save_url(model_name, final_url)
+            return final_url
+        print("[http] fast path failed; falling back to browser")
+
     driver = _build_driver()
-    wait = WebDriverWait(driver, 40)
     final_url = None
 
     try:
         print(f"[model] {model_name}")
-        driver.get(BASE_URL)
+        with run_metrics.span('navigate', page='download_home'):
+            driver.get(BASE_URL)
 
         # Basic block check (optional)
         if "Access Denied" in driver.page_source:
             print("[blocked] CDN blocked at home page")
+            note_blocked(endpoint_of(BASE_URL))
             return None
 
-        _accept_cookies_if_any(driver, wait)
+        _accept_cookies_if_any(driver)
 
         # Search box (your original selector kept, with fallbacks)
         search_input = None
@@ -80,7 +116,7 @@ def extract_url_for_model(model_name: str, save_to_file: bool = True) -> str | N
             (By.CSS_SELECTOR, "input[placeholder*='Search']"),
         ]:
             try:
-                search_input = wait.until(EC.element_to_be_clickable((by, sel)))
+                search_input = waits.wait_until(driver, EC.element_to_be_clickable((by, sel)), 'download.search_input')
                 break
             except TimeoutException:
                 continue
@@ -88,23 +124,23 @@ def extract_url_for_model(model_name: str, save_to_file: bool = True) -> str | N
             raise TimeoutException("Search input not found")
 
         search_input.click()
-        time.sleep(0.2)
         search_input.clear()
         search_input.send_keys(model_name)
         print("[search] waiting suggestions…")
 
         # Wait for typeahead container
-        wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "ngb-typeahead-window")))
+        waits.wait_until(driver, EC.presence_of_element_located((By.CSS_SELECTOR, "ngb-typeahead-window")),
+                         'download.typeahead')
         # IMPORTANT: click the BUTTON (not the inner div), and use JS click
-        first_button = wait.until(EC.element_to_be_clickable((
+        first_button = waits.wait_until(driver, EC.element_to_be_clickable((
             By.CSS_SELECTOR, "ngb-typeahead-window button"
-        )))
+        )), 'download.typeahead_button')
         driver.execute_script("arguments[0].click();", first_button)
 
         # Wait for navigation off the home page
-        wait.until(lambda d: (d.current_url != BASE_URL) and
-                            ("/download/" in d.current_url or d.current_url.endswith("/type")))
-        time.sleep(0.4)
+        waits.wait_until(driver, lambda d: (d.current_url != BASE_URL) and
+                         ("/download/" in d.current_url or d.current_url.endswith("/type")), 'download.nav')
+        waits.wait_ready(driver, 'download.landed')
         current_url = driver.current_url
         print(f"[nav] landed on: {current_url}")
 
@@ -113,9 +149,7 @@ def extract_url_for_model(model_name: str, save_to_file: bool = True) -> str | N
         final_url = current_url
 
         if save_to_file and final_url:
-            with open(OUTPUT_FILE, 'a', encoding='utf-8') as f:
-                f.write(f"{model_name}: {final_url}\n")
-            print(f"[saved] {final_url}")
+            _save_url(model_name, final_url)
 
         return final_url
 
@@ -11,22 +11,34 @@ Steps:
 	5) On the opened page, locate the table: /html/body/div[2]/div[2]/div/div/div[1]/table
 	 Then read rows containing "End-of-Sale Date" and "End-of-Support Date" (or "Last Date of Support").
 
-Also supports a batch mode to read devices from data/devices.json and
-PID aliases from data/pid_alias.json, then scrape End-of-Support using the
-alias for each device. Prints navigation whenever a new URL is entered.
+Also supports a batch mode to read devices from the device registry
+(pipeline/device_registry.py) and PID aliases from data/pid_alias.json, then
+scrape End-of-Support using the alias for each device. Prints navigation
+whenever a new URL is entered.
 """
 from __future__ import annotations
-import os, sys, json
+import os, sys
 import time
 from typing import Optional, Dict, Any, List
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 
-SUPPORT_URL = "https://www.cisco.com/c/en/us/support/index.html"
+import waits  # type: ignore
+from retry_policy import RetryPolicy, CircuitOpenError, METRICS, note_blocked, endpoint_of  # type: ignore
+
+try:
+	import cisco_http  # type: ignore
+except Exception:  # fast path is optional
+	cisco_http = None
+
+# CISCO_SUPPORT_BASE as in cisco_http (bench/stand_ins.py serves a local copy)
+SUPPORT_URL = os.getenv('CISCO_SUPPORT_BASE', 'https://www.cisco.com').rstrip('/') + "/c/en/us/support/index.html"
+
+# One attempt plus retries per alias; blocks trip the shared breaker for the support site
+EOL_POLICY = RetryPolicy(max_attempts=int(os.getenv('EOL_MAX_RETRIES', '2')))
 
 UA = (
 	"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
@@ -35,10 +47,17 @@ UA = (
 
 # Paths for batch mode (resolve relative to repo root)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
 DEVICES_JSON = os.path.join(DATA_DIR, 'devices.json')
 PID_ALIAS_JSON = os.path.join(DATA_DIR, 'pid_alias.json')
 
+sys.path.insert(0, os.path.join(BASE_DIR, 'pipeline'))
+import run_metrics  # type: ignore
+import events  # type: ignore
+import scope as run_scope  # type: ignore
+import atomic_io  # type: ignore
+import device_registry  # type: ignore
+
 def _build_driver():
 	proxies = {
  
@@ -61,68 +80,98 @@ def _build_driver():
 	opts.add_argument('--log-level=3')
 	opts.add_experimental_option('excludeSwitches', ['enable-logging'])
 	opts.add_argument(f'--user-agent={UA}')
-	driver = webdriver.Chrome(options=opts)
+	with run_metrics.span('driver_startup'):
+		driver = webdriver.Chrome(options=opts)
 	try:
 		driver.execute_cdp_cmd("Network.enable", {})
 		driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": UA})
 	except Exception:
 		pass
+	waits.install_network_tracker(driver)
 	return driver
 
-def _accept_cookies_if_any(driver, wait):
+def _accept_cookies_if_any(driver):
 	# Use a short wait for cookies so we don't stall long if not present
-	short_wait = WebDriverWait(driver, 5)
 	try:
-		btn = short_wait.until(EC.element_to_be_clickable((By.ID, "onetrust-accept-btn-handler")))
+		btn = waits.wait_until(driver, EC.element_to_be_clickable((By.ID, "onetrust-accept-btn-handler")),
+				'eol.cookies', timeout=5)
 		driver.execute_script("arguments[0].click();", btn)
-		time.sleep(0.2)
+		waits.wait_until(driver, EC.invisibility_of_element_located((By.ID, "onetrust-banner-sdk")),
+				'eol.cookies_closed', timeout=3)
 	except TimeoutException:
 		pass
 
 def get_eol_details(alias: str, timeout: int = 45) -> Dict[str, Any] | None:
 	if not alias:
 		return None
+	# HTTP fast path first (suggest API + product page parse); browser only on failure
+	if cisco_http is not None and cisco_http.enabled():
+		try:
+			res = cisco_http.fetch_eol_details(alias)
+		except Exception as e:
+			print(f"[http] fast path error: {e}")
+			res = None
+		if res:
+			print(f"[http] EoL details for '{alias}' from {res.get('nav_url')}")
+			return res
+		print("[http] fast path failed; falling back to browser")
 	nav_steps: List[str] = []
 	driver = _build_driver()
-	wait = WebDriverWait(driver, timeout)
+
+	def _until(cond, step):
+		# adaptive per-step timeout, never above the caller's overall limit
+		return waits.wait_until(driver, cond, step, cap=timeout)
+
 	try:
 		print(f"[nav] opening: {SUPPORT_URL}")
-		driver.get(SUPPORT_URL)
+		with run_metrics.span('navigate', page='support_index'):
+			driver.get(SUPPORT_URL)
+		if "Access Denied" in driver.page_source:
+			print("[blocked] CDN blocked at support index")
+			note_blocked(endpoint_of(SUPPORT_URL))
+			return None
 		nav_steps.append("Opened Support index")
-		_accept_cookies_if_any(driver, wait)
+		_accept_cookies_if_any(driver)
 
 		# 2) Click the search button per provided XPath
 		x_btn = "/html/body/div[2]/div/div[3]/div[1]/div[2]/div/section/button"
-		btn = wait.until(EC.element_to_be_clickable((By.XPATH, x_btn)))
+		btn = _until(EC.element_to_be_clickable((By.XPATH, x_btn)), 'eol.search_button')
 		driver.execute_script("arguments[0].click();", btn)
 		nav_steps.append("Clicked search button")
 
 		# 3) Type alias in search input per provided XPath
 		x_input = "/html/body/div[2]/div/div[3]/div[1]/div[2]/div/section/div/div/form/div[1]/input"
-		search_input = wait.until(EC.element_to_be_clickable((By.XPATH, x_input)))
-		search_input.click(); time.sleep(0.2)
-		search_input.clear(); time.sleep(0.1)
+		search_input = _until(EC.element_to_be_clickable((By.XPATH, x_input)), 'eol.search_input')
+		search_input.click()
+		search_input.clear()
+		typed_at = waits.request_count(driver)
 		search_input.send_keys(alias)
 		nav_steps.append(f"Typed alias: {alias}")
-		# Wait a moment to allow suggestions to refresh based on the typed alias
-		time.sleep(0.6)
 
-		# 4) Wait suggestions UL and click the first suggestion span[2]
+		# 4) Wait until the suggestions UL is there for the typed alias, then click the first
+		#    suggestion span[2]. The page-load XHRs have long settled, so plain network idle is
+		#    true before the debounced typeahead request fires: require a request started after
+		#    the keystroke to have settled, or the list to show the alias already.
 		x_suggest_ul = "/html/body/div[2]/div/div[3]/div[1]/div[2]/div/section/div/div/div[1]/ul"
-		wait.until(EC.presence_of_element_located((By.XPATH, x_suggest_ul)))
+		settled = waits.network_idle(after=typed_at)
+
+		def _suggestions(d):
+			uls = d.find_elements(By.XPATH, x_suggest_ul)
+			if not uls:
+				return False
+			return settled(d) or alias.lower() in (uls[0].text or '').lower()
+
+		_until(_suggestions, 'eol.suggestions')
 		x_first = "/html/body/div[2]/div/div[3]/div[1]/div[2]/div/section/div/div/div[1]/ul/li[1]/div/ul/li[1]/a/span[2]"
-		el = wait.until(EC.element_to_be_clickable((By.XPATH, x_first)))
+		el = _until(EC.element_to_be_clickable((By.XPATH, x_first)), 'eol.first_suggestion')
 		text = el.text.strip()
 		driver.execute_script("arguments[0].click();", el)
 		nav_steps.append(f"Clicked suggestion: {text or '(no text)'}")
 
 		# 5) On next page, wait for details table and extract dates
 		prev = SUPPORT_URL
-		try:
-			wait.until(lambda d: d.current_url != prev)
-		except TimeoutException:
-			pass
-		time.sleep(0.5)
+		waits.wait_url_change(driver, prev, 'eol.nav', cap=timeout)
+		waits.wait_ready(driver, 'eol.landed', cap=timeout)
 		print(f"[nav] entered: {driver.current_url}")
 		nav_steps.append(f"Landed: {driver.title}")
 
@@ -136,13 +185,17 @@ def get_eol_details(alias: str, timeout: int = 45) -> Dict[str, Any] | None:
 		legacy_table_xpath = "/html/body/div[2]/div[2]/div/div/div[1]/table"
 		table = None
 		try:
-			table = WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.XPATH, birth_table_xpath)))
+			table = waits.wait_until(driver, EC.presence_of_element_located((By.XPATH, birth_table_xpath)),
+					'eol.table', cap=20)
 		except TimeoutException:
 			try:
-				table = WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, legacy_table_xpath)))
+				# page is already idle here; the legacy layout is either present or not
+				table = waits.wait_until(driver, EC.presence_of_element_located((By.XPATH, legacy_table_xpath)),
+						'eol.legacy_table', timeout=3)
 			except TimeoutException:
 				table = None
 
+		t_parse = time.monotonic()
 		if table is None:
 			nav_steps.append("Table not found")
 		else:
@@ -194,6 +247,8 @@ def get_eol_details(alias: str, timeout: int = 45) -> Dict[str, Any] | None:
 			except Exception:
 				series_release_date = None
 
+		run_metrics.record('parse', time.monotonic() - t_parse, page='eol',
+				outcome='ok' if table is not None else 'not_found')
 		return {
 			'end_of_sale_date': end_of_sale,
 			'end_of_support_date': end_of_support,
@@ -209,54 +264,64 @@ def get_eol_details(alias: str, timeout: int = 45) -> Dict[str, Any] | None:
 		driver.quit()
 
 def _load_json(path: str, default):
-	try:
-		with open(path, 'r', encoding='utf-8') as f:
-			return json.load(f)
-	except Exception:
-		return default
+	return atomic_io.read_json(path, default)
 
-def _save_json(path: str, obj) -> None:
-	with open(path, 'w', encoding='utf-8') as f:
-		json.dump(obj, f, indent=2, ensure_ascii=False)
-
-def batch_scrape_devices(write: bool = False, only_missing: bool = False, limit: int | None = None, delay: float = 0.0) -> int:
-	"""Read devices.json and pid_alias.json, scrape End-of-Support per device using alias.
+def batch_scrape_devices(write: bool = False, only_missing: bool = False, limit: int | None = None, delay: float = 0.0,
+		sc: 'run_scope.Scope | None' = None) -> int:
+	"""Read the device registry and pid_alias.json, scrape End-of-Support per device using alias.
 
 	Args:
-		write: If True, write eol_details back into devices.json
+		write: If True, store each device's eol_details in the registry as it is scraped (devices.json is exported at the end)
 		only_missing: If True, only scrape devices missing end_of_support_date
 		limit: Max number of devices to process
 		delay: Sleep between devices (seconds)
+		sc: Hosts to process (default: RUN_SCOPE, else all); other devices are not touched
 
 	Returns number of processed devices.
 	"""
-	devices = _load_json(DEVICES_JSON, {})
-	if not isinstance(devices, dict) or not devices:
-		print(f"[batch] [!] {DEVICES_JSON} missing or empty", flush=True)
+	run_metrics.configure('eol')
+	events.configure('eol')
+	total = device_registry.count()
+	if not total:
+		events.log(f"[!] device registry is empty ({DEVICES_JSON} missing or empty)", level='WARNING')
 		return 0
 	aliases = _load_json(PID_ALIAS_JSON, {})
-	print(f"[batch] devices={len(devices)} aliases={len(aliases)}", flush=True)
+	sc = sc or run_scope.from_env()
+	selected = device_registry.scope_hosts(sc)
+	events.log(f"devices={len(selected)}/{total} ({sc.describe()}) aliases={len(aliases)}")
+	todo = selected
+	if only_missing:
+		done = {h for h, r in device_registry.iter_records(selected, fields=('eol_details',))
+			if (r.get('eol_details') or {}).get('end_of_support_date')}
+		todo = [h for h in selected if h not in done]
+	events.plan(min(len(todo), limit) if limit else len(todo))
+	stage_t0 = time.monotonic()
 	count = 0
-	for host, rec in devices.items():
+	written = 0
+	circuit_open = False
+	for host, rec in device_registry.iter_records(todo):
 		model = (rec.get('model') or '').strip()
 		alias = (aliases.get(model) or model).strip()
-		if only_missing:
-			cur = (rec.get('eol_details') or {}).get('end_of_support_date')
-			if cur:
-				continue
-		print(f"[batch] host={host} model='{model or '-'}' alias='{alias or '-'}'", flush=True)
-		try:
-			res = get_eol_details(alias)
-		except Exception as e:
-			print(f"[batch]   error: {e}", flush=True)
+		print(f"[eol] host={host} model='{model or '-'}' alias='{alias or '-'}'", flush=True)
+		host_t0 = time.monotonic()
+		if circuit_open:
 			res = None
+		else:
+			try:
+				with run_metrics.host_scope(host):
+					res = EOL_POLICY.call(get_eol_details, alias, endpoint=endpoint_of(SUPPORT_URL), label=f"eol {alias}")
+			except CircuitOpenError as e:
+				# support site keeps blocking us: stop hammering it for the rest of this batch
+				events.log(f"{e}; skipping remaining devices", level='ERROR', host=host)
+				circuit_open = True
+				res = None
 		if res:
-			print(f"[batch]   Status: {res.get('status')} | Series Release Date: {res.get('series_release_date')}", flush=True)
-			print(f"[batch]   End-of-Sale: {res.get('end_of_sale_date')} | End-of-Support: {res.get('end_of_support_date')}", flush=True)
-			print(f"[batch]   Page: {res.get('nav_title')} | URL: {res.get('nav_url')}", flush=True)
+			print(f"[eol]   Status: {res.get('status')} | Series Release Date: {res.get('series_release_date')}", flush=True)
+			print(f"[eol]   End-of-Sale: {res.get('end_of_sale_date')} | End-of-Support: {res.get('end_of_support_date')}", flush=True)
+			print(f"[eol]   Page: {res.get('nav_title')} | URL: {res.get('nav_url')}", flush=True)
 			if write:
-				rec.setdefault('eol_details', {})
-				rec['eol_details'].update({
+				details = dict(rec.get('eol_details') or {})
+				details.update({
 					'end_of_sale_date': res.get('end_of_sale_date'),
 					'end_of_support_date': res.get('end_of_support_date'),
 					'status': res.get('status'),
@@ -266,32 +331,42 @@ def batch_scrape_devices(write: bool = False, only_missing: bool = False, limit:
 					'nav_steps': res.get('nav_steps'),
 					'alias_used': alias or None,
 				})
+				device_registry.update(host, {'eol_details': details}, 'eol')
+				written += 1
 		else:
-			print("[batch]   details not found", flush=True)
+			print("[eol]   details not found", flush=True)
+		outcome = 'ok' if res else ('circuit_open' if circuit_open else 'not_found')
+		run_metrics.record('host', time.monotonic() - host_t0, host=host, outcome=outcome)
+		events.host_done(host, time.monotonic() - host_t0, outcome)
 		count += 1
 		if limit and count >= limit:
 			break
 		if delay:
 			time.sleep(delay)
+	events.log(f"upstream: {METRICS.summary_line()}")
+	run_metrics.record_counters('upstream', METRICS.snapshot())
 	if write:
-		_save_json(DEVICES_JSON, devices)
-		print(f"[batch] [✓] wrote updates to {DEVICES_JSON}", flush=True)
+		device_registry.export()
+		events.log(f"[✓] {written} device(s) updated; exported {DEVICES_JSON}")
+	run_metrics.record('stage', time.monotonic() - stage_t0)
 	return count
 
 if __name__ == '__main__':
 	import argparse
 	parser = argparse.ArgumentParser(description='Cisco EoL/EoSupport scraper')
 	parser.add_argument('--single', help='Scrape a single alias or model string')
-	parser.add_argument('--batch', action='store_true', help='Batch scrape using data/devices.json and data/pid_alias.json')
-	parser.add_argument('--write', action='store_true', help='When used with --batch, write results back into devices.json')
+	parser.add_argument('--batch', action='store_true', help='Batch scrape the device registry using data/pid_alias.json')
+	parser.add_argument('--write', action='store_true', help='When used with --batch, write results into the device registry (and devices.json)')
 	parser.add_argument('--only-missing', action='store_true', help='When used with --batch, only process devices missing end_of_support_date')
 	parser.add_argument('--limit', type=int, default=None, help='Limit number of devices to process in batch')
 	parser.add_argument('--delay', type=float, default=0.0, help='Delay between devices in seconds')
+	run_scope.add_arguments(parser)
 	args = parser.parse_args()
 
 	if args.single:
 		print(get_eol_details(args.single))
 	elif args.batch:
-		batch_scrape_devices(write=args.write, only_missing=args.only_missing, limit=args.limit, delay=args.delay)
+		batch_scrape_devices(write=args.write, only_missing=args.only_missing, limit=args.limit, delay=args.delay,
+				sc=run_scope.from_args(args))
 	else:
 		parser.print_help()
@@ -1,16 +1,27 @@
 # last_version_extract.py
 import os
+import sys
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 import time, os
 
+import waits  # type: ignore
+from retry_policy import note_blocked, endpoint_of  # type: ignore
+
+try:
+    import cisco_http  # type: ignore
+except Exception:  # fast path is optional
+    cisco_http = None
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SCREENSHOTS_DIR = os.path.join(BASE_DIR, 'screenshots', 'versions')
 
+sys.path.insert(0, os.path.join(BASE_DIR, 'pipeline'))
+import run_metrics  # type: ignore
+
 # Desktop UA to avoid CDN/headless blocks
 UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
       "(KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36")
@@ -33,21 +44,25 @@ def _build_driver():
     chrome_options.add_experimental_option('excludeSwitches', ['enable-logging'])
     chrome_options.add_argument(f'--user-agent={UA}')   # UA at startup
 
-    driver = webdriver.Chrome(options=chrome_options)
+    with run_metrics.span('driver_startup'):
+        driver = webdriver.Chrome(options=chrome_options)
     # Page-level UA override via CDP (extra insurance)
     try:
         driver.execute_cdp_cmd("Network.enable", {})
         driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": UA})
     except Exception:
         pass
+    waits.install_network_tracker(driver)
     return driver
 
-def _accept_cookies_if_any(driver, wait):
-    # OneTrust is common on Cisco
+def _accept_cookies_if_any(driver):
+    # OneTrust is common on Cisco; short fixed cap since the banner is often absent
     try:
-        btn = wait.until(EC.element_to_be_clickable((By.ID, "onetrust-accept-btn-handler")))
+        btn = waits.wait_until(driver, EC.element_to_be_clickable((By.ID, "onetrust-accept-btn-handler")),
+                               'release.cookies', timeout=5)
         driver.execute_script("arguments[0].click();", btn)
-        time.sleep(0.2)
+        waits.wait_until(driver, EC.invisibility_of_element_located((By.ID, "onetrust-banner-sdk")),
+                         'release.cookies_closed', timeout=3)
         print("[cookies] accepted")
     except TimeoutException:
         pass
@@ -63,16 +78,34 @@ def scrape_latest_version(url: str) -> dict | None:
         "screenshot_file": str
       }
     Saves a screenshot under screenshots/versions/.
+
+    The release tree is fetched over HTTP first (cisco_http, screenshot_file is then None);
+    the browser is only started when that fails.
     """
+    if cisco_http is not None and cisco_http.enabled():
+        try:
+            info = cisco_http.fetch_latest_version(url)
+        except Exception as e:
+            print(f"[http] fast path error: {e}")
+            info = None
+        if info:
+            print(f"[http] {url} -> {info['latest_version']}")
+            return info
+        print("[http] fast path failed; falling back to browser")
+
     os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
 
     driver = _build_driver()
-    wait = WebDriverWait(driver, 40)
 
     try:
         print(f"[open] {url}")
-        driver.get(url)
-        _accept_cookies_if_any(driver, wait)
+        with run_metrics.span('navigate', page='release'):
+            driver.get(url)
+        if "Access Denied" in driver.page_source:
+            print("[blocked] CDN blocked on release page")
+            note_blocked(endpoint_of(url))
+            return None
+        _accept_cookies_if_any(driver)
 
         selected_label = None
 
@@ -81,7 +114,7 @@ def scrape_latest_version(url: str) -> dict | None:
             print("[type] page detected — trying to pick a software family…")
 
             # Ensure the list is present
-            wait.until(EC.presence_of_element_located((By.XPATH, "//*[@id='stos-list']")))
+            waits.wait_until(driver, EC.presence_of_element_located((By.XPATH, "//*[@id='stos-list']")), 'release.type_list')
             preferred_labels = ["IOS Software", "IOS XE Software", "NX-OS System Software", "Switch Firmware"]
 
             for label in preferred_labels:
@@ -98,35 +131,34 @@ def scrape_latest_version(url: str) -> dict | None:
                 driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", target)
                 prev_url = driver.current_url
                 try:
-                    wait.until(EC.element_to_be_clickable((By.XPATH, xpath_anchor if elems and elems[0].tag_name.lower() == "a" else xpath_li)))
+                    waits.wait_until(driver, EC.element_to_be_clickable((By.XPATH, xpath_anchor if elems and elems[0].tag_name.lower() == "a" else xpath_li)),
+                                     'release.type_click')
                     # JS click avoids overlay/interception in headless
                     driver.execute_script("arguments[0].click();", target)
                 except Exception:
                     driver.execute_script("arguments[0].click();", target)
 
                 # Wait for URL change after selecting a family
-                try:
-                    wait.until(lambda d: d.current_url != prev_url)
-                    time.sleep(0.4)
+                if waits.wait_url_change(driver, prev_url, 'release.type_nav'):
+                    waits.wait_ready(driver, 'release.type_landed')
                     selected_label = label
                     print(f"[type] selected: {label}")
                     break
-                except TimeoutException:
-                    print(f"[warn] click on '{label}' did not change URL; trying next…")
-                    continue
+                print(f"[warn] click on '{label}' did not change URL; trying next…")
 
         # Wait for “Latest Release” (or equivalent) to appear
         print("[wait] version info…")
         # Primary indicator
         try:
-            wait.until(EC.presence_of_element_located(
+            waits.wait_until(driver, EC.presence_of_element_located(
                 (By.XPATH, "//span[contains(text(), 'Latest Release')]")
-            ))
+            ), 'release.latest_label')
         except TimeoutException:
-            # Some pages render slightly differently; small grace wait
-            time.sleep(2)
+            # Some pages render slightly differently; wait until the tree has finished loading
+            waits.wait_ready(driver, 'release.tree_idle', timeout=10)
 
         # Pull version text (your original absolute XPath kept)
+        t_parse = time.monotonic()
         version_xpath = ("/html/body/app-root/div/main/div/div/app-release-page/div/div[1]/app-release-details/nav/div[4]/"
                          "tree-root/tree-viewport/div/div/tree-node-collection/div/tree-node[1]/div/tree-node-children/div/"
                          "tree-node-collection/div/tree-node[1]/div/tree-node-wrapper/div/div/tree-node-content/div/div/span")
@@ -154,6 +186,8 @@ def scrape_latest_version(url: str) -> dict | None:
             # Fallback: any H2 inside app-image-details
             switch_type = driver.find_element(By.CSS_SELECTOR, "app-image-details h2").text.strip()
 
+        run_metrics.record('parse', time.monotonic() - t_parse, page='release')
+
         # Save screenshot
         safe_switch_type = "".join(c for c in switch_type if c.isalnum() or c in (' ', '-', '_')).strip()
         screenshot_file = os.path.join(SCREENSHOTS_DIR, f"latest_version_{safe_switch_type}.png")
@@ -0,0 +1,220 @@
+# retry_policy.py
+"""
+Shared retry policy and per-endpoint circuit breaker for upstream Cisco calls.
+
+One RetryPolicy wraps each upstream call (URL resolution, release scrape, EoL
+lookup, PSIRT token/advisories). Backoff is exponential with jitter. Every
+endpoint (host name, e.g. 'software.cisco.com') has a CircuitBreaker that trips
+after CB_THRESHOLD consecutive blocks ("Access Denied", 403/429). While open,
+callers either pause until the cooldown ends (if that is shorter than
+RETRY_MAX_PAUSE_SEC) or fail fast with CircuitOpenError, so the remaining hosts
+of a run don't each burn attempts x backoff against a blocked CDN.
+
+Scrapers that only return None can flag a block with note_blocked(endpoint).
+An exception carrying an HTTP response with a BLOCK_STATUSES code (e.g.
+requests' HTTPError from raise_for_status) counts as a block too.
+Counters (retries, blocks, trips, fast fails, wasted seconds) are kept per
+endpoint in METRICS.
+"""
+from __future__ import annotations
+import os
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+from typing import Any, Callable, Dict, Optional
+
+CB_THRESHOLD = int(os.getenv('CB_THRESHOLD', '3'))
+CB_COOLDOWN_SEC = float(os.getenv('CB_COOLDOWN_SEC', '120'))
+RETRY_MAX_PAUSE_SEC = float(os.getenv('RETRY_MAX_PAUSE_SEC', '300'))
+BLOCK_STATUSES = (403, 429)
+
+
+class CircuitOpenError(Exception):
+    """Raised when an endpoint's breaker is open and the policy does not pause."""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"circuit open for {endpoint} (retry in {retry_in:.0f}s)")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class RetryMetrics:
+    FIELDS = ('calls', 'attempts', 'retries', 'successes', 'failures', 'blocks', 'trips', 'fast_fails',
+              'wasted_sec')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_endpoint: Dict[str, Dict[str, float]] = {}
+
+    def add(self, endpoint: str, field: str, value: float = 1) -> None:
+        with self._lock:
+            row = self._by_endpoint.setdefault(endpoint, {f: 0 for f in self.FIELDS})
+            row[field] += value
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {ep: {k: (round(v, 3) if k == 'wasted_sec' else int(v)) for k, v in row.items()}
+                    for ep, row in self._by_endpoint.items()}
+
+    def summary_line(self) -> str:
+        parts = []
+        for ep, row in sorted(self.snapshot().items()):
+            parts.append(f"{ep}: calls={row['calls']} retries={row['retries']} blocks={row['blocks']} "
+                         f"trips={row['trips']} fast_fails={row['fast_fails']} wasted={row['wasted_sec']}s")
+        return '; '.join(parts) or 'no upstream calls'
+
+
+METRICS = RetryMetrics()
+
+
+class CircuitBreaker:
+    """closed -> (threshold consecutive blocks) -> open -> (cooldown) -> half-open -> closed/open."""
+
+    def __init__(self, endpoint: str, threshold: int = CB_THRESHOLD, cooldown: float = CB_COOLDOWN_SEC):
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.consecutive_blocks = 0
+        self.opened_at: Optional[float] = None
+        self._block_pending = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self.remaining() <= 0 else 'open'
+
+    def remaining(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow(self) -> bool:
+        return self.state != 'open'
+
+    def note_blocked(self) -> None:
+        with self._lock:
+            self._block_pending = True
+
+    def take_pending_block(self) -> bool:
+        with self._lock:
+            pending, self._block_pending = self._block_pending, False
+            return pending
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_blocks = 0
+            self.opened_at = None
+
+    def record_block(self) -> bool:
+        """Count a block; return True if this tripped (or re-tripped) the breaker."""
+        with self._lock:
+            self.consecutive_blocks += 1
+            half_open = self.opened_at is not None
+            if half_open or self.consecutive_blocks >= self.threshold:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def endpoint_of(url: str) -> str:
+    return urlsplit(url).netloc or url
+
+
+def breaker_for(endpoint: str) -> CircuitBreaker:
+    with _breakers_lock:
+        cb = _breakers.get(endpoint)
+        if cb is None:
+            cb = _breakers[endpoint] = CircuitBreaker(endpoint)
+        return cb
+
+
+def note_blocked(endpoint: str) -> None:
+    """Flag that the current attempt against endpoint was blocked by the CDN."""
+    breaker_for(endpoint).note_blocked()
+
+
+def blocked_error(err: Optional[BaseException]) -> bool:
+    """True for an exception raised on a 403/429 response (HTTPError from raise_for_status)."""
+    return getattr(getattr(err, 'response', None), 'status_code', None) in BLOCK_STATUSES
+
+
+class RetryPolicy:
+    """Jittered exponential backoff + circuit breaker around a callable.
+
+    call() returns the first result accepted by ok(); None when attempts are
+    exhausted; raises CircuitOpenError when the breaker is open and the wait
+    would exceed max_pause.
+    """
+
+    def __init__(self, max_attempts: int = 3, base: float = 2.0, cap: float = 30.0, jitter: float = 0.5,
+                 max_pause: float = RETRY_MAX_PAUSE_SEC):
+        self.max_attempts = max(1, max_attempts)
+        self.base = base
+        self.cap = cap
+        self.jitter = jitter
+        self.max_pause = max_pause
+
+    def delay(self, attempt: int) -> float:
+        d = min(self.base ** attempt, self.cap)
+        return d * (1 - self.jitter) + random.uniform(0, d * self.jitter)
+
+    def _sleep(self, endpoint: str, seconds: float) -> None:
+        time.sleep(seconds)
+        METRICS.add(endpoint, 'wasted_sec', seconds)
+
+    def _gate(self, cb: CircuitBreaker) -> None:
+        if cb.allow():
+            return
+        wait = cb.remaining()
+        if wait > self.max_pause:
+            METRICS.add(cb.endpoint, 'fast_fails')
+            raise CircuitOpenError(cb.endpoint, wait)
+        print(f"[retry] circuit open for {cb.endpoint}; pausing {wait:.0f}s")
+        self._sleep(cb.endpoint, wait)
+
+    def call(self, fn: Callable[..., Any], *args, endpoint: str,
+             ok: Callable[[Any], bool] = lambda r: r is not None,
+             blocked: Optional[Callable[[Any], bool]] = None,
+             label: str = '', **kwargs) -> Any:
+        cb = breaker_for(endpoint)
+        METRICS.add(endpoint, 'calls')
+        result = None
+        for attempt in range(1, self.max_attempts + 1):
+            self._gate(cb)
+            cb.take_pending_block()
+            METRICS.add(endpoint, 'attempts')
+            if attempt > 1:
+                METRICS.add(endpoint, 'retries')
+            t0 = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+                err = None
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                result, err = None, e
+            if err is None and ok(result):
+                cb.record_success()
+                METRICS.add(endpoint, 'successes')
+                return result
+            METRICS.add(endpoint, 'wasted_sec', time.monotonic() - t0)
+            was_blocked = (cb.take_pending_block() or blocked_error(err)
+                           or bool(blocked and err is None and blocked(result)))
+            if was_blocked:
+                METRICS.add(endpoint, 'blocks')
+                if cb.record_block():
+                    METRICS.add(endpoint, 'trips')
+                    print(f"[retry] circuit tripped for {endpoint} after {cb.consecutive_blocks} consecutive blocks")
+            print(f"[retry] {label or endpoint} attempt {attempt}/{self.max_attempts} failed"
+                  f"{' (blocked)' if was_blocked else ''}{f': {err}' if err else ''}")
+            if attempt < self.max_attempts and cb.allow():
+                self._sleep(endpoint, self.delay(attempt))
+        METRICS.add(endpoint, 'failures')
+        return None
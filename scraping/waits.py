@@ -0,0 +1,244 @@
+# waits.py
+"""
+Condition-driven waits for the Selenium scrapers.
+
+Replaces fixed time.sleep() grace periods with:
+  - DOM readiness (document.readyState == 'complete')
+  - network idle (no in-flight XHR/fetch for IDLE_MS), tracked by a small script
+    injected into every new document via CDP
+  - adaptive timeouts per step, learned from recent observed latencies
+    (p95 x factor, clamped) and persisted in data/page_latency.json; a timeout
+    records its limit and doubles the step's next timeouts until waits succeed again.
+    Idle waits (wait_ready) are best effort: they are capped at IDLE_CAP_SEC and
+    their timeouts are not learned, since a page that keeps polling never goes idle
+
+Usage:
+    driver = _build_driver(); waits.install_network_tracker(driver)
+    el = waits.wait_until(driver, EC.element_to_be_clickable(...), 'eol.search_button')
+    waits.wait_ready(driver, 'eol.landing')
+"""
+from __future__ import annotations
+import os
+import sys
+import time
+import atexit
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.getenv('RETRIEVOS_DATA_DIR') or os.path.join(BASE_DIR, 'data')
+LATENCY_JSON = os.path.join(DATA_DIR, 'page_latency.json')
+
+sys.path.insert(0, os.path.join(BASE_DIR, 'pipeline'))
+import run_metrics  # type: ignore
+import atomic_io  # type: ignore
+
+POLL_SEC = 0.1
+IDLE_MS = int(os.getenv('SCRAPE_NET_IDLE_MS', '400'))
+TIMEOUT_FLOOR_SEC = float(os.getenv('SCRAPE_TIMEOUT_FLOOR', '3'))
+TIMEOUT_CEILING_SEC = float(os.getenv('SCRAPE_TIMEOUT_CEILING', '40'))
+IDLE_CAP_SEC = float(os.getenv('SCRAPE_IDLE_CAP', '8'))
+
+# Counts in-flight XHR/fetch, how many were ever started, and when the last one settled.
+_TRACKER_JS = r"""
+(function(){
+  if (window.__netTrack) return;
+  var t = window.__netTrack = {pending: 0, started: 0, last: Date.now()};
+  function done(){ t.pending = Math.max(0, t.pending - 1); t.last = Date.now(); }
+  var send = XMLHttpRequest.prototype.send;
+  XMLHttpRequest.prototype.send = function(){
+    t.pending++; t.started++; t.last = Date.now();
+    this.addEventListener('loadend', done);
+    return send.apply(this, arguments);
+  };
+  if (window.fetch) {
+    var f = window.fetch;
+    window.fetch = function(){
+      t.pending++; t.started++; t.last = Date.now();
+      return f.apply(this, arguments).finally(done);
+    };
+  }
+})();
+"""
+
+
+class AdaptiveTimeout:
+    """Per-step timeout learned from a rolling window of observed latencies.
+
+    A timed-out wait is recorded at its limit (the latency was at least that)
+    and doubles the step's backoff, so a timeout learned too short recovers
+    instead of failing every later wait; each successful wait halves it again.
+    """
+
+    def __init__(self, floor: float = TIMEOUT_FLOOR_SEC, ceiling: float = TIMEOUT_CEILING_SEC,
+                 factor: float = 3.0, window: int = 50, min_samples: int = 5):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.factor = factor
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+        self._backoff: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, step: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(step, deque(maxlen=self.window)).append(round(seconds, 3))
+            if step in self._backoff:
+                self._backoff[step] /= 2
+                if self._backoff[step] <= 1:
+                    del self._backoff[step]
+
+    def observe_timeout(self, step: str, limit: float) -> None:
+        with self._lock:
+            self._samples.setdefault(step, deque(maxlen=self.window)).append(round(limit, 3))
+            self._backoff[step] = min(self._backoff.get(step, 1.0) * 2, 16.0)
+
+    def timeout(self, step: str) -> float:
+        with self._lock:
+            samples = sorted(self._samples.get(step) or ())
+            backoff = self._backoff.get(step, 1.0)
+        if len(samples) < self.min_samples:
+            return self.ceiling
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return max(self.floor, min(self.ceiling, p95 * self.factor * backoff))
+
+    def load(self, path: str = LATENCY_JSON) -> None:
+        data = atomic_io.read_json(path, {})
+        if not isinstance(data, dict):
+            return
+        for step, vals in (data or {}).items():
+            for v in (vals or [])[-self.window:]:
+                self.observe(step, float(v))
+
+    def save(self, path: str = LATENCY_JSON) -> None:
+        with self._lock:
+            data = {k: list(v) for k, v in self._samples.items()}
+        if not data:
+            return
+        try:
+            atomic_io.write_json(path, data)
+        except Exception:
+            pass
+
+
+TIMEOUTS = AdaptiveTimeout()
+TIMEOUTS.load()
+atexit.register(TIMEOUTS.save)
+
+
+def install_network_tracker(driver) -> None:
+    """Inject the XHR/fetch tracker into every document the driver opens."""
+    try:
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": _TRACKER_JS})
+    except Exception:
+        pass
+
+
+def wait_until(driver, condition: Callable[[Any], Any], step: str, timeout: Optional[float] = None,
+               cap: Optional[float] = None, learn_timeouts: bool = True):
+    """WebDriverWait with an adaptive timeout (optionally capped); records the latency of each wait.
+
+    A timeout is recorded at its limit and backs the step off, unless learn_timeouts is False.
+    """
+    limit = timeout or TIMEOUTS.timeout(step)
+    if cap:
+        limit = min(limit, cap)
+    t0 = time.monotonic()
+    try:
+        result = WebDriverWait(driver, limit, poll_frequency=POLL_SEC).until(condition)
+    except TimeoutException:
+        if learn_timeouts:
+            TIMEOUTS.observe_timeout(step, limit)
+        run_metrics.record('wait', time.monotonic() - t0, outcome='timeout', step=step)
+        raise
+    elapsed = time.monotonic() - t0
+    TIMEOUTS.observe(step, elapsed)
+    run_metrics.record('wait', elapsed, step=step)
+    return result
+
+
+def dom_ready(driver) -> bool:
+    try:
+        return driver.execute_script("return document.readyState") == 'complete'
+    except Exception:
+        return False
+
+
+def request_count(driver) -> Optional[int]:
+    """XHR/fetch requests started so far in the current document (None without the tracker)."""
+    try:
+        return driver.execute_script("var t=window.__netTrack; return t ? t.started : null;")
+    except Exception:
+        return None
+
+
+def network_idle(idle_ms: int = IDLE_MS, after: Optional[int] = None) -> Callable[[Any], bool]:
+    """Condition: no XHR/fetch in flight for idle_ms (true immediately if the tracker is absent).
+
+    With after=request_count(...) taken before an action, a request must also
+    have started since then: idle right after a keystroke, before a debounced
+    request fires, does not count.
+    """
+    def _cond(driver) -> bool:
+        try:
+            state = driver.execute_script(
+                "var t=window.__netTrack; return t ? [t.pending, Date.now()-t.last, t.started] : null;")
+        except Exception:
+            return False
+        if not state:
+            return True
+        pending, since, started = state
+        if after is not None and started <= after:
+            return False
+        return pending == 0 and since >= idle_ms
+    return _cond
+
+
+def wait_ready(driver, step: str, timeout: Optional[float] = None, cap: Optional[float] = None) -> bool:
+    """Wait for DOM ready then network idle. Returns False on timeout instead of raising.
+
+    Capped at IDLE_CAP_SEC, and a timeout is not learned: pages with background
+    polling or beacons never go idle, and backing the step off for them would
+    only ratchet it up to the ceiling.
+    """
+    idle = network_idle()
+    cap = min(cap, IDLE_CAP_SEC) if cap else IDLE_CAP_SEC
+    try:
+        wait_until(driver, lambda d: dom_ready(d) and idle(d), step, timeout, cap, learn_timeouts=False)
+        return True
+    except TimeoutException:
+        return False
+
+
+def wait_url_change(driver, prev_url: str, step: str, timeout: Optional[float] = None,
+                    cap: Optional[float] = None) -> bool:
+    try:
+        wait_until(driver, lambda d: d.current_url != prev_url, step, timeout, cap)
+        return True
+    except TimeoutException:
+        return False
+
+
+class Pacer:
+    """Minimum interval between consecutive starts; sleeps only for the remainder.
+
+    When the work between two calls already took longer than min_interval
+    (the normal case for a scrape), wait() returns immediately.
+    """
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._last: Optional[float] = None
+
+    def wait(self) -> None:
+        now = time.monotonic()
+        if self._last is not None:
+            remaining = self.min_interval - (now - self._last)
+            if remaining > 0:
+                time.sleep(remaining)
+        self._last = time.monotonic()
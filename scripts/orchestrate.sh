@@ -3,20 +3,26 @@ set -euo pipefail
 
 ROOT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
 ANSIBLE_DIR="$ROOT_DIR/ansible"
-DATA_DIR="$ROOT_DIR/data"
+# RETRIEVOS_DATA_DIR: a job's private data directory (pipeline/jobs.py)
+DATA_DIR="${RETRIEVOS_DATA_DIR:-$ROOT_DIR/data}"
 PIPELINE_DIR="$ROOT_DIR/pipeline"
 MAIL_DIR="$ROOT_DIR/mail"
 SCRAPING_DIR="$ROOT_DIR/scraping"
 
-# One timestamp to correlate entire batch
-export RUN_TS="$(date -u +%Y-%m-%dT%H:%M:%SZ)"
+# One timestamp to correlate entire batch (the job queue assigns one per job)
+export RUN_TS="${RUN_TS:-$(date -u +%Y-%m-%dT%H:%M:%SZ)}"
 echo "[orchestrate] RUN_TS=$RUN_TS"
+# RUN_SCOPE (JSON hosts/groups/pids, see pipeline/scope.py) limits every stage to some hosts
+echo "[orchestrate] RUN_SCOPE=${RUN_SCOPE:-all hosts}"
 
 # Prepare a temporary decrypted inventory for Ansible if values are encrypted
-TMP_INV="$ANSIBLE_DIR/inventory.decrypted.ini"
+# (one file per run: concurrent jobs must not remove each other's copy)
+TMP_INV="$ANSIBLE_DIR/inventory.decrypted.${RUN_TS//:/}.ini"
+# it holds plaintext passwords: remove it however the run ends
+trap 'rm -f "$TMP_INV"' EXIT
 if python3 -c 'import sys,re; s=open(sys.argv[1]).read(); sys.exit(0 if re.search(r"ansible_password=enc\$", s) else 1)' "$ANSIBLE_DIR/inventory.ini"; then
 	echo "[orchestrate] Decrypting inventory passwords -> $TMP_INV"
-	ROOT_DIR="$ROOT_DIR" python3 - <<-'PY'
+	ROOT_DIR="$ROOT_DIR" TMP_INV="$TMP_INV" python3 - <<-'PY'
 	import os, importlib.util
 	root = os.environ.get('ROOT_DIR') or os.getcwd()
 	mod_path = os.path.join(root, 'ansible', 'inventory_crypto.py')
@@ -24,7 +30,7 @@ if python3 -c 'import sys,re; s=open(sys.argv[1]).read(); sys.exit(0 if re.searc
 	mod = importlib.util.module_from_spec(spec)
 	spec.loader.exec_module(mod)  # type: ignore
 	inv = os.path.join(root, 'ansible', 'inventory.ini')
-	out = os.path.join(root, 'ansible', 'inventory.decrypted.ini')
+	out = os.environ['TMP_INV']
 	txt = open(inv, 'r', encoding='utf-8').read()
 	dec = mod.decrypt_inventory_text(txt)
 	open(out, 'w', encoding='utf-8').write(dec)
@@ -35,20 +41,56 @@ else
 	INV_PATH="$ANSIBLE_DIR/inventory.ini"
 fi
 
-echo "=== Running IOS playbook ==="
-ansible-playbook -i "$INV_PATH" "$ANSIBLE_DIR/get_ios_info.yml"
+# run_playbook <inventory group> <playbook>: --limit to the hosts in scope, skip when there are none
+run_playbook() {
+	local limit rc=0
+	limit="$(python3 "$PIPELINE_DIR/scope.py" --limit-for "$1")" || rc=$?
+	if [ "$rc" -eq 3 ]; then
+		echo "[orchestrate] no $1 hosts in scope; skipping $2"
+		return 0
+	elif [ "$rc" -ne 0 ]; then
+		return "$rc"
+	fi
+	ansible-playbook -i "$INV_PATH" "$ANSIBLE_DIR/$2" -e "device_records_dir=$RECORDS_DIR" ${limit:+--limit "$limit"}
+}
 
-echo "=== Running NXOS playbook ==="
-ansible-playbook -i "$INV_PATH" "$ANSIBLE_DIR/get_nxos_info.yml"
+# The playbooks write one record per host; the ansible fields of those hosts are
+# replaced in the device registry (pipeline/device_registry.py), which exports devices.json
+RECORDS_DIR="$DATA_DIR/device_records"
+run_playbooks() {
+	local rc=0
+	rm -rf "$RECORDS_DIR"
+	echo "=== Running IOS playbook ==="
+	run_playbook ios get_ios_info.yml || rc=$?
+	if [ "$rc" -eq 0 ]; then
+		echo "=== Running NXOS playbook ==="
+		run_playbook nxos get_nxos_info.yml || rc=$?
+	fi
+	# hosts a failed playbook did reach are still recorded
+	python3 "$PIPELINE_DIR/device_registry.py" import-records "$RECORDS_DIR" --stage ansible || rc=$?
+	return "$rc"
+}
+
+# Record each stage's start and end (duration, exit code) as pipeline events (pipeline/events.py)
+stage() {
+	local name="$1" rc=0
+	shift
+	python3 "$PIPELINE_DIR/events.py" start "$name" || true
+	"$@" || rc=$?
+	python3 "$PIPELINE_DIR/events.py" end "$name" --rc "$rc" || true
+	return "$rc"
+}
+
+stage ansible run_playbooks
 
 echo "=== Running CVEs check ==="
-python3 "$PIPELINE_DIR/check_cves_from_devices.py"
+stage cves python3 "$PIPELINE_DIR/check_cves_from_devices.py"
 
 echo "=== Checking end of life status ==="
-python3 "$SCRAPING_DIR/eol_details.py" --batch --write --only-missing
+stage eol python3 "$SCRAPING_DIR/eol_details.py" --batch --write --only-missing
 
 echo "=== Running scraping pipeline (recommended versions) ==="
-python3 "$PIPELINE_DIR/run_pipeline.py"
+stage versions python3 "$PIPELINE_DIR/run_pipeline.py"
 
 echo "=== CVE result ==="
 cat "$DATA_DIR/device_cve_check.json" || true
@@ -57,12 +99,9 @@ echo "=== Final devices.json ==="
 cat "$DATA_DIR/devices.json" || true
 
 echo "=== Mail Notification ==="
-python3 "$MAIL_DIR/emailtest.py" || true
+stage mail python3 "$MAIL_DIR/emailtest.py" || true
 
 echo "=== Writing history snapshots ==="
-python3 "$PIPELINE_DIR/history_writer.py" || true
+stage history python3 "$PIPELINE_DIR/history_writer.py" || true
 
 echo "=== Done ==="
-
-# Cleanup tmp inventory
-rm -f "$TMP_INV" 2>/dev/null || true
@@ -4,25 +4,38 @@ set -euo pipefail
 # Orchestrate the pipeline without running IOS/NXOS Ansible playbooks
 
 ROOT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
-DATA_DIR="$ROOT_DIR/data"
+# RETRIEVOS_DATA_DIR: a job's private data directory (pipeline/jobs.py)
+DATA_DIR="${RETRIEVOS_DATA_DIR:-$ROOT_DIR/data}"
 PIPELINE_DIR="$ROOT_DIR/pipeline"
 MAIL_DIR="$ROOT_DIR/mail"
 SCRAPING_DIR="$ROOT_DIR/scraping"
 
-# One timestamp to correlate entire batch
-export RUN_TS="$(date -u +%Y-%m-%dT%H:%M:%SZ)"
+# One timestamp to correlate entire batch (the job queue assigns one per job)
+export RUN_TS="${RUN_TS:-$(date -u +%Y-%m-%dT%H:%M:%SZ)}"
 echo "[orchestrate-no-ansible] RUN_TS=$RUN_TS"
+# RUN_SCOPE (JSON hosts/groups/pids, see pipeline/scope.py) limits every stage to some hosts
+echo "[orchestrate-no-ansible] RUN_SCOPE=${RUN_SCOPE:-all hosts}"
 
 echo "=== Skipping IOS/NXOS Ansible playbooks by request ==="
 
+# Record each stage's start and end (duration, exit code) as pipeline events (pipeline/events.py)
+stage() {
+	local name="$1" rc=0
+	shift
+	python3 "$PIPELINE_DIR/events.py" start "$name" || true
+	"$@" || rc=$?
+	python3 "$PIPELINE_DIR/events.py" end "$name" --rc "$rc" || true
+	return "$rc"
+}
+
 echo "=== Running CVEs check ==="
-python3 "$PIPELINE_DIR/check_cves_from_devices.py"
+stage cves python3 "$PIPELINE_DIR/check_cves_from_devices.py"
 
 echo "=== Checking end of life status ==="
-python3 "$SCRAPING_DIR/eol_details.py" --batch --write --only-missing
+stage eol python3 "$SCRAPING_DIR/eol_details.py" --batch --write --only-missing
 
 echo "=== Running scraping pipeline (recommended versions) ==="
-python3 "$PIPELINE_DIR/run_pipeline.py"
+stage versions python3 "$PIPELINE_DIR/run_pipeline.py"
 
 echo "=== CVE result ==="
 cat "$DATA_DIR/device_cve_check.json" || true
@@ -31,9 +44,9 @@ echo "=== Final devices.json ==="
 cat "$DATA_DIR/devices.json" || true
 
 echo "=== Mail Notification ==="
-python3 "$MAIL_DIR/emailtest.py" || true
+stage mail python3 "$MAIL_DIR/emailtest.py" || true
 
 echo "=== Writing history snapshots ==="
-python3 "$PIPELINE_DIR/history_writer.py" || true
+stage history python3 "$PIPELINE_DIR/history_writer.py" || true
 
 echo "=== Done (no-ansible) ==="
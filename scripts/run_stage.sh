@@ -0,0 +1,57 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+# Run a single pipeline stage (scheduled stage jobs, see pipeline/scheduler.py)
+#   scripts/run_stage.sh cves|eol|versions
+# The stage refreshes its outputs; a history batch is written only with RUN_RECORD_BATCH=1
+# (the job's record_batch, a schedule's "batch": true), so batch diffs stay run-to-run.
+
+STAGE="${1:-}"
+ROOT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
+PIPELINE_DIR="$ROOT_DIR/pipeline"
+SCRAPING_DIR="$ROOT_DIR/scraping"
+
+# One timestamp to correlate entire batch (the job queue assigns one per job)
+export RUN_TS="${RUN_TS:-$(date -u +%Y-%m-%dT%H:%M:%SZ)}"
+echo "[run-stage] STAGE=$STAGE RUN_TS=$RUN_TS"
+# RUN_SCOPE (JSON hosts/groups/pids, see pipeline/scope.py) limits every stage to some hosts
+echo "[run-stage] RUN_SCOPE=${RUN_SCOPE:-all hosts}"
+
+# Record each stage's start and end (duration, exit code) as pipeline events (pipeline/events.py)
+stage() {
+	local name="$1" rc=0
+	shift
+	python3 "$PIPELINE_DIR/events.py" start "$name" || true
+	"$@" || rc=$?
+	python3 "$PIPELINE_DIR/events.py" end "$name" --rc "$rc" || true
+	return "$rc"
+}
+
+case "$STAGE" in
+	cves)
+		echo "=== Running CVEs check ==="
+		stage cves python3 "$PIPELINE_DIR/check_cves_from_devices.py"
+		;;
+	eol)
+		# a scheduled EoL pass refreshes every device, not only those still missing dates
+		echo "=== Checking end of life status ==="
+		stage eol python3 "$SCRAPING_DIR/eol_details.py" --batch --write
+		;;
+	versions)
+		echo "=== Running scraping pipeline (recommended versions) ==="
+		stage versions python3 "$PIPELINE_DIR/run_pipeline.py"
+		;;
+	*)
+		echo "usage: $0 cves|eol|versions" >&2
+		exit 2
+		;;
+esac
+
+if [ "${RUN_RECORD_BATCH:-0}" = "1" ]; then
+	echo "=== Writing history snapshots ==="
+	stage history python3 "$PIPELINE_DIR/history_writer.py" || true
+else
+	echo "=== No history batch (RUN_RECORD_BATCH not set) ==="
+fi
+
+echo "=== Done ($STAGE) ==="
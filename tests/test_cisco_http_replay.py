@@ -0,0 +1,70 @@
+"""Offline replay of scraping/fixtures through the cisco_http fast path (no network)."""
+import os
+import sys
+
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'scraping'))
+
+import cisco_http  # noqa: E402
+
+MODEL = 'Catalyst 2960-48TC-L Switch'
+PID = 'WS-C2960-48TC-L'
+
+
+@pytest.fixture(autouse=True)
+def replay(monkeypatch):
+    monkeypatch.setenv('CISCO_HTTP_REPLAY_DIR', cisco_http.FIXTURES_DIR)
+    monkeypatch.delenv('CISCO_HTTP_RECORD_DIR', raising=False)
+
+    def no_network():
+        raise AssertionError('replay must not open an HTTP session')
+    monkeypatch.setattr(cisco_http, 'get_session', no_network)
+
+
+def test_find_download_url():
+    assert cisco_http.find_download_url(MODEL) == 'https://software.cisco.com/download/home/279963472/type'
+
+
+def test_find_download_url_miss():
+    assert cisco_http.find_download_url('Catalyst 9999 Switch') is None
+
+
+def test_fetch_latest_version():
+    res = cisco_http.fetch_latest_version('https://software.cisco.com/download/home/279963472/type')
+    assert res == {
+        'switch_type': MODEL,
+        'latest_version': '15.2.7E13(MD) (recommended)',
+        'final_url': 'https://software.cisco.com/download/home/279963472/type/280805680/release/15.2.7E13',
+        'selected_label': 'IOS Software',
+        'screenshot_file': None,
+    }
+
+
+def test_fetch_latest_version_bad_url():
+    assert cisco_http.fetch_latest_version('https://example.com/nothing') is None
+
+
+@pytest.mark.parametrize('alias', [MODEL, PID])
+def test_fetch_eol_details(alias):
+    # eol_details.py sends the pid_alias name, or the PID itself when it has no alias
+    res = cisco_http.fetch_eol_details(alias)
+    assert res is not None
+    assert res['end_of_sale_date'] == '31-OCT-2022'
+    assert res['end_of_support_date'] == '31-OCT-2027'
+    assert res['series_release_date'] == '11-APR-2005'
+    assert res['status'] == 'End of Sale'
+    assert res['nav_url'] == 'https://www.cisco.com/c/en/us/support/switches/catalyst-2960-48tc-l-switch/model.html'
+    assert res['nav_steps'][0] == f'HTTP suggest: {alias}'
+
+
+def test_fetch_eol_details_miss():
+    assert cisco_http.fetch_eol_details('WS-C0000-UNKNOWN') is None
+
+
+def test_fast_path_is_opt_in(monkeypatch):
+    monkeypatch.delenv('CISCO_HTTP_FASTPATH', raising=False)
+    assert not cisco_http.enabled()
+    monkeypatch.setenv('CISCO_HTTP_FASTPATH', '1')
+    assert cisco_http.enabled()